@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+"""
+Sends concurrent requests with random 12AX seqs to a running RETURNN inference server,
+e.g. started via::
+
+  rnn.py demos/demo-tf-native-lstm2.12ax.config ++task search_server ++load_epoch 5
+
+and prints the throughput and the server metrics.
+See :mod:`returnn.tf.inference_server`.
+"""
+
+import sys
+import time
+import json
+from argparse import ArgumentParser
+from threading import Thread
+# noinspection PyCompatibility
+from urllib.request import urlopen, Request
+import _setup_returnn_env  # noqa
+from returnn.datasets.generating import Task12AXDataset
+
+
+def main():
+  """
+  Main entry.
+  """
+  arg_parser = ArgumentParser(description=__doc__)
+  arg_parser.add_argument("--http_host", default="http://localhost:12380")
+  arg_parser.add_argument("--num_requests", type=int, default=100)
+  arg_parser.add_argument("--num_parallel", type=int, default=16)
+  args = arg_parser.parse_args()
+
+  dataset = Task12AXDataset(num_seqs=args.num_requests, fixed_random_seed=1)
+  dataset.init_seq_order(epoch=1)
+  dataset.load_seqs(0, args.num_requests)
+  inputs = [dataset.get_data(seq_idx, "data") for seq_idx in range(args.num_requests)]
+  latencies = []
+
+  def worker(worker_idx):
+    """
+    :param int worker_idx:
+    """
+    for seq_idx in range(worker_idx, args.num_requests, args.num_parallel):
+      start_time = time.time()
+      req = Request(
+        args.http_host, data=json.dumps({"data": inputs[seq_idx].tolist()}).encode("utf8"),
+        headers={"Content-Type": "application/json"})
+      result = json.loads(urlopen(req).read().decode("utf8"))
+      assert result["seq_len"] == len(inputs[seq_idx])
+      latencies.append(time.time() - start_time)
+
+  start_time = time.time()
+  threads = [Thread(target=worker, args=(i,)) for i in range(args.num_parallel)]
+  for t in threads:
+    t.start()
+  for t in threads:
+    t.join()
+  duration = time.time() - start_time
+  print("%i requests in %.2f secs, %.1f requests/sec, mean latency %.1f ms." % (
+    args.num_requests, duration, args.num_requests / duration, sum(latencies) * 1000. / len(latencies)))
+  print("Server metrics:", urlopen(args.http_host + "/metrics").read().decode("utf8"))
+
+
+if __name__ == "__main__":
+  from returnn.util import better_exchook
+  better_exchook.install()
+  try:
+    main()
+  except KeyboardInterrupt:
+    print("KeyboardInterrupt")
+    sys.exit(1)
@@ -125,11 +125,12 @@ def make_config_dict(lstm_unit, use_gpu):
     "learning_rate": 0.01}
 
 
-def benchmark(lstm_unit, use_gpu):
+def benchmark(lstm_unit, use_gpu, forward_only=False):
   """
   :param str lstm_unit: e.g. "LSTMBlock", one of LstmCellTypes
   :param bool use_gpu:
-  :return: runtime in seconds of the training itself, excluding initialization
+  :param bool forward_only: only forward the dataset (like in recognition), no training
+  :return: runtime in seconds of the training (or forwarding) itself, excluding initialization
   :rtype: float
   """
   device = {True: "GPU", False: "CPU"}[use_gpu]
@@ -137,15 +138,29 @@ def benchmark(lstm_unit, use_gpu):
   print(">>> Start benchmark for %s." % key)
   config = Config()
   config.update(make_config_dict(lstm_unit=lstm_unit, use_gpu=use_gpu))
+  if forward_only:
+    # Like in recognition: no chunking, and we do not need to load a trained model.
+    config.update({"task": "forward", "allow_random_model_init": True, "chunking": "0"})
   dataset_kwargs = config.typed_value("train")
   Dataset.kwargs_update_from_config(config, dataset_kwargs)
   dataset = init_dataset(dataset_kwargs)
   engine = Engine(config=config)
-  engine.init_train_from_config(config=config, train_data=dataset)
-  print(">>> Start training now for %s." % key)
-  start_time = time.time()
-  engine.train()
-  runtime = time.time() - start_time
+  if forward_only:
+    import os
+    import tempfile
+    engine.init_network_from_config(config=config)
+    output_file = tempfile.mktemp(suffix=".hdf", prefix="demo-tf-lstm-benchmark-")
+    print(">>> Start forwarding now for %s." % key)
+    start_time = time.time()
+    engine.forward_to_hdf(data=dataset, output_file=output_file, batch_size=base_settings["batch_size"])
+    runtime = time.time() - start_time
+    os.remove(output_file)
+  else:
+    engine.init_train_from_config(config=config, train_data=dataset)
+    print(">>> Start training now for %s." % key)
+    start_time = time.time()
+    engine.train()
+    runtime = time.time() - start_time
   print(">>> Runtime of %s: %s" % (key, hms_fraction(runtime)))
   engine.finalize()
   return runtime
@@ -165,6 +180,7 @@ def main():
   arg_parser.add_argument("--no-gpu", action="store_true")
   arg_parser.add_argument("--selected", help="comma-separated list from %r" % LstmCellTypes)
   arg_parser.add_argument("--no-setup-tf-thread-pools", action="store_true")
+  arg_parser.add_argument("--forward-only", action="store_true", help="no training, only forwarding (recognition)")
   args = arg_parser.parse_args()
   for opt in args.cfg:
     key, value = opt.split("=", 1)
@@ -193,12 +209,14 @@ def main():
   benchmarks = {}
   if not args.no_gpu and is_gpu_available():
     for lstm_unit in LstmCellTypes:
-      benchmarks["GPU:" + lstm_unit] = benchmark(lstm_unit=lstm_unit, use_gpu=True)
+      benchmarks["GPU:" + lstm_unit] = benchmark(
+        lstm_unit=lstm_unit, use_gpu=True, forward_only=args.forward_only)
   if not args.no_cpu:
     for lstm_unit in LstmCellTypes:
       if lstm_unit in GpuOnlyCellTypes:
         continue
-      benchmarks["CPU:" + lstm_unit] = benchmark(lstm_unit=lstm_unit, use_gpu=False)
+      benchmarks["CPU:" + lstm_unit] = benchmark(
+        lstm_unit=lstm_unit, use_gpu=False, forward_only=args.forward_only)
 
   print("-" * 20)
   print("Settings:")
@@ -50,6 +50,7 @@ dev_data = None  # type: typing.Optional[Dataset]
 eval_data = None  # type: typing.Optional[Dataset]
 quit_returnn = False
 server = None  # type: typing.Optional[returnn.theano.server.Server]
+main_command_line_options = []  # type: typing.List[str]  # for worker processes, see returnn.tf.sharded_tasks
 
 
 def init_config(config_filename=None, command_line_options=(), default_config=None, extra_updates=None):
@@ -354,11 +355,17 @@ def init_backend_engine():
     tf_session_opts = config.typed_value("tf_session_opts", {})
     assert isinstance(tf_session_opts, dict)
     # This must be done after the Horovod logic, such that we only touch the devices we are supposed to touch.
-    setup_tf_thread_pools(log_file=log.v3, tf_session_opts=tf_session_opts)
+    setup_tf_thread_pools(
+      # In a worker of a sharded task, use the thread budget of the worker, see returnn.tf.sharded_tasks.
+      num_threads=config.int("task_worker_num_threads", 0) or None,
+      log_file=log.v3, tf_session_opts=tf_session_opts)
     # Print available devices. Also make sure that get_tf_list_local_devices uses the correct TF session opts.
     print_available_devices(tf_session_opts=tf_session_opts, file=log.v2)
     from returnn.tf.native_op import OpMaker
     OpMaker.log_stream = log.v3
+    if config.value("native_op_cache_dir", None):
+      from returnn.util.basic import NativeCodeCompiler
+      NativeCodeCompiler.set_cache_base_dir(config.value("native_op_cache_dir", None))
     debug_register_better_repr()
     if config.is_true("distributed_tf"):
       import returnn.tf.distributed
@@ -374,6 +381,8 @@ def init(config_filename=None, command_line_options=(), config_updates=None, ext
   :param dict[str]|None config_updates: see :func:`init_config`
   :param str|None extra_greeting:
   """
+  global main_command_line_options
+  main_command_line_options = ([config_filename] if config_filename else []) + list(command_line_options or ())
   init_better_exchook()
   init_thread_join_hack()
   init_config(config_filename=config_filename, command_line_options=command_line_options, extra_updates=config_updates)
@@ -385,6 +394,8 @@ def init(config_filename=None, command_line_options=(), config_updates=None, ext
     print(extra_greeting, file=log.v1)
   returnn_greeting(config_filename=config_filename, command_line_options=command_line_options)
   init_faulthandler()
+  if is_sharded_task_main_proc():
+    return  # The workers do everything else, see execute_main_task.
   init_backend_engine()
   if BackendEngine.is_theano_selected():
     if config.value('task', 'train') == "theano_graph":
@@ -437,6 +448,15 @@ def need_data():
   return True
 
 
+def is_sharded_task_main_proc():
+  """
+  :return: whether the task is run by multiple worker processes (``task_num_workers``), and we are the main process,
+    i.e. we only start the workers and merge their outputs, see :mod:`returnn.tf.sharded_tasks`
+  :rtype: bool
+  """
+  return config.int("task_num_workers", 1) > 1 and not config.has("task_worker_index")
+
+
 def execute_main_task():
   """
   Executes the main task (via config ``task`` option).
@@ -446,7 +466,10 @@ def execute_main_task():
   task = config.value('task', 'train')
   if config.is_true("dry_run"):
     print("Dry run, will not save anything.", file=log.v1)
-  if task == 'train':
+  if is_sharded_task_main_proc():
+    from returnn.tf.sharded_tasks import run_sharded_task
+    run_sharded_task(config=config, command_line_options=main_command_line_options)
+  elif task == 'train':
     assert train_data.have_seqs(), "no train files specified, check train option: %s" % config.value('train', None)
     engine.init_train_from_config(config, train_data, dev_data, eval_data)
     engine.train()
@@ -492,7 +515,8 @@ def execute_main_task():
       do_eval=config.bool("search_do_eval", True),
       output_layer_names=config.typed_value("search_output_layer", "output"),
       output_file=config.value("search_output_file", ""),
-      output_file_format=config.value("search_output_file_format", "txt"))
+      output_file_format=config.value("search_output_file_format", "txt"),
+      output_file_resume=config.bool("search_output_file_resume", False))
   elif task == 'compute_priors':
     assert train_data is not None, 'train data for priors should be provided'
     engine.init_network_from_config(config)
@@ -619,6 +619,51 @@ class Dataset(object):
     else:
       return self.get_targets(key, seq_idx)
 
+  def get_batch_data(self, seq_idxs, keys, seq_start_frames=None, seq_end_frames=None, out=None):
+    """
+    Gets the data of multiple seqs at once, zero-padded, in the format (batch,time,...),
+    together with the seq lens.
+    The seqs must have been loaded via :func:`load_seqs` before.
+    This copies the data directly into the (maybe preallocated) padded arrays,
+    without the intermediate per-seq arrays you would get via :func:`get_data`.
+    Derived classes can implement :func:`_get_batch_data_for_key` more efficiently.
+
+    :param list[int] seq_idxs: sorted seq idx, one per batch entry
+    :param list[str] keys: data keys with time axis, e.g. ["data", "classes"]
+    :param list[NumbersDict]|None seq_start_frames: per seq. 0 by default. negative means zero padding
+    :param list[NumbersDict]|None seq_end_frames: per seq. seq len by default. behind seq len means zero padding
+    :param dict[str,numpy.ndarray]|None out: preallocated buffers. key -> (batch,time,...),
+      where time can be larger than needed, and "%s_seq_lens" % key -> (batch,).
+      Everything behind the seq lens will be set to zero. Missing buffers will be allocated.
+    :return: key -> (batch,time,...) data, and "%s_seq_lens" % key -> (batch,) seq lens
+    :rtype: dict[str,numpy.ndarray]
+    """
+    res = {}
+    for key in keys:
+      data, seq_lens = self._get_batch_data_for_key(
+        seq_idxs=seq_idxs, key=key,
+        frame_ranges=_get_batch_frame_ranges(seq_idxs, key, seq_start_frames, seq_end_frames),
+        out=out.get(key) if out else None, out_seq_lens=out.get("%s_seq_lens" % key) if out else None)
+      res[key] = data
+      res["%s_seq_lens" % key] = seq_lens
+    return res
+
+  def _get_batch_data_for_key(self, seq_idxs, key, frame_ranges, out=None, out_seq_lens=None):
+    """
+    See :func:`get_batch_data`. This generic implementation uses :func:`get_data`.
+
+    :param list[int] seq_idxs:
+    :param str key:
+    :param list[(int|None,int|None)] frame_ranges: per seq, start/end frame, None means default
+    :param numpy.ndarray|None out: (batch,time,...)
+    :param numpy.ndarray|None out_seq_lens: (batch,)
+    :return: data (batch,time,...), seq lens (batch,)
+    :rtype: (numpy.ndarray, numpy.ndarray)
+    """
+    return fill_padded_batch(
+      [self.get_data(seq_idx, key) for seq_idx in seq_idxs],
+      frame_ranges=frame_ranges, out=out, out_seq_lens=out_seq_lens)
+
   def get_input_data(self, sorted_seq_idx):
     """
     :type sorted_seq_idx: int
@@ -1062,7 +1107,7 @@ class Dataset(object):
                         max_pad_size=None,
                         min_seq_length=0, pruning=0.0,
                         seq_drop=0.0, max_total_num_seqs=-1,
-                        used_data_keys=None):
+                        used_data_keys=None, skip_seq_tags=None, num_shards=1, shard_index=0):
     """
     :param bool recurrent_net: If True, the batch might have a batch seq dimension > 1.
       Otherwise, the batch seq dimension is always 1 and multiple seqs will be concatenated.
@@ -1072,6 +1117,9 @@ class Dataset(object):
     :param int max_total_num_seqs:
     :param int|dict[str,int]|NumbersDict max_seq_length:
     :param set(str)|None used_data_keys:
+    :param set(str)|None skip_seq_tags: seqs with these tags are skipped, e.g. because they are already done
+    :param int num_shards: if > 1, only use the seqs with ``seq_idx % num_shards == shard_index``
+    :param int shard_index:
     """
     if not batch_size:
       batch_size = sys.maxsize
@@ -1105,8 +1153,12 @@ class Dataset(object):
       self.weights[idx][0] *= (1. + pruning)
     for seq_idx, t_start, t_end in self.iterate_seqs(
           chunk_size=chunk_size, chunk_step=chunk_step, used_data_keys=used_data_keys):
+      if seq_idx % num_shards != shard_index:
+        continue
       if not self.sample(seq_idx):
         continue
+      if skip_seq_tags and self.get_tag(seq_idx) in skip_seq_tags:
+        continue
       if total_num_seqs > max_total_num_seqs:
         break
       t_start -= self.ctx_left
@@ -1179,6 +1231,79 @@ class Dataset(object):
       shuffle_batches=shuffle_batches,
       cache_whole_epoch=self.batch_set_generator_cache_whole_epoch())
 
+  def _generate_sorted_batches(self, batch_size, max_seqs=-1, sort_window=1000, length_key=None,
+                               used_data_keys=None, skip_seq_tags=None, num_shards=1, shard_index=0):
+    """
+    Like :func:`_generate_batches` for the recurrent case without chunking,
+    but within windows of ``sort_window`` seqs (in the seq order of the dataset),
+    the seqs are sorted by length (longest first) before they are packed into batches.
+    Thus the batches contain seqs of similar length and there is only little padding.
+    The seqs of a batch are not ordered by seq idx anymore,
+    so the whole window is kept loaded (see :class:`Batch.min_load_start_seq`).
+
+    :param int|dict[str,int]|NumbersDict batch_size: max number of padded frames in one batch
+    :param int max_seqs: max number of seqs per batch
+    :param int sort_window: number of seqs which are sorted together. <=0 means the whole dataset
+    :param str|None length_key: data key to use for the seq lengths for sorting. by default "data"
+    :param set(str)|None used_data_keys: only used to select the default length_key
+    :param set(str)|None skip_seq_tags: seqs with these tags are skipped, e.g. because they are already done
+    :param int num_shards: if > 1, only use the seqs with ``seq_idx % num_shards == shard_index``
+    :param int shard_index:
+    :rtype: typing.Iterator[Batch]
+    """
+    if not batch_size:
+      batch_size = sys.maxsize
+    batch_size = NumbersDict(batch_size)
+    assert not batch_size.any_compare(NumbersDict(0), (lambda a, b: a <= b))
+    if max_seqs == -1:
+      max_seqs = float('inf')
+    assert max_seqs > 0
+    if not length_key:
+      length_key = "data"
+    if used_data_keys and length_key not in used_data_keys:
+      length_key = sorted(used_data_keys)[0]
+    window_start = 0
+    while self.is_less_than_num_seqs(window_start):
+      window_end = window_start + 1
+      while sort_window <= 0 or window_end < window_start + sort_window:
+        if not self.is_less_than_num_seqs(window_end):
+          break
+        window_end += 1
+      self.load_seqs(window_start, window_end)
+      seqs = []  # type: typing.List[typing.Tuple[int,NumbersDict,NumbersDict]]  # seq_idx, start, length
+      for seq_idx in range(window_start, window_end):
+        if seq_idx % num_shards != shard_index:
+          continue
+        if skip_seq_tags and self.get_tag(seq_idx) in skip_seq_tags:
+          continue
+        t_start, t_end = self.get_start_end_frames_full_seq(seq_idx)
+        seqs.append((seq_idx, t_start, t_end - t_start))
+      seqs.sort(key=lambda seq: (-seq[2][length_key], seq[0]))
+      batch = Batch()
+      batch.min_load_start_seq = window_start
+      for seq_idx, t_start, length in seqs:
+        if length.any_compare(batch_size, (lambda a, b: a > b)):
+          print("warning: sequence length (%r) larger than limit (%r)" % (length, batch_size), file=log.v4)
+        dt, ds = batch.try_sequence_as_slice(length)
+        if batch.num_slices >= 1 and ((dt * ds).any_compare(batch_size, (lambda a, b: a > b)) or ds > max_seqs):
+          yield batch
+          batch = Batch()
+          batch.min_load_start_seq = window_start
+        batch.add_sequence_as_slice(seq_idx=seq_idx, seq_start_frame=t_start, length=length)
+      if batch.num_slices >= 1:
+        yield batch
+      window_start = window_end
+
+  def generate_sorted_batches(self, **kwargs):
+    """
+    :param kwargs: will be passed to :func:`_generate_sorted_batches`
+    :rtype: BatchSetGenerator
+    """
+    return BatchSetGenerator(
+      dataset=self,
+      generator=self._generate_sorted_batches(**kwargs),
+      cache_whole_epoch=self.batch_set_generator_cache_whole_epoch())
+
   @classmethod
   def index_shape_for_batches(cls, batches, data_key="data"):
     """
@@ -1395,6 +1520,98 @@ def convert_data_dims(data_dims, leave_dict_as_is=False):
   return data_dims
 
 
+def _get_batch_frame_ranges(seq_idxs, key, seq_start_frames=None, seq_end_frames=None):
+  """
+  :param list[int] seq_idxs:
+  :param str key:
+  :param list[NumbersDict]|None seq_start_frames:
+  :param list[NumbersDict]|None seq_end_frames:
+  :return: per seq (start,end), where None means the default (0 or seq len)
+  :rtype: list[(int|None,int|None)]
+  """
+  if seq_start_frames is not None:
+    assert len(seq_start_frames) == len(seq_idxs)
+  if seq_end_frames is not None:
+    assert len(seq_end_frames) == len(seq_idxs)
+  return [
+    (seq_start_frames[i][key] if seq_start_frames is not None else None,
+     seq_end_frames[i][key] if seq_end_frames is not None else None)
+    for i in range(len(seq_idxs))]
+
+
+def get_padded_batch_buffers(batch_dim, max_len, frame_shape, dtype, out=None, out_seq_lens=None):
+  """
+  :param int batch_dim:
+  :param int max_len:
+  :param tuple[int] frame_shape: shape without batch and time
+  :param str|numpy.dtype dtype:
+  :param numpy.ndarray|None out: preallocated (batch,time,...), time >= max_len. allocated if None
+  :param numpy.ndarray|None out_seq_lens: preallocated (batch,). allocated if None
+  :return: buffers for data and seq lens
+  :rtype: (numpy.ndarray, numpy.ndarray)
+  """
+  if out is None:
+    out = numpy.zeros((batch_dim, max_len) + tuple(frame_shape), dtype=dtype)
+  else:
+    assert out.shape[0] == batch_dim and out.shape[1] >= max_len and out.shape[2:] == tuple(frame_shape), (
+      "buffer shape %r does not match batch %i, max len %i, frame shape %r" % (
+        out.shape, batch_dim, max_len, frame_shape))
+  if out_seq_lens is None:
+    out_seq_lens = numpy.zeros((batch_dim,), dtype="int32")
+  else:
+    assert out_seq_lens.shape == (batch_dim,)
+  return out, out_seq_lens
+
+
+def fill_padded_batch(values, frame_ranges=None, out=None, out_seq_lens=None):
+  """
+  Copies the per-seq data into the padded batch buffer.
+  This is like :func:`slice_pad_zeros` for each seq, but without intermediate arrays.
+
+  :param list[numpy.ndarray] values: per seq, (time,...)
+  :param list[(int|None,int|None)]|None frame_ranges: per seq, start/end frame, None means 0 or seq len
+  :param numpy.ndarray|None out: preallocated (batch,time,...)
+  :param numpy.ndarray|None out_seq_lens: preallocated (batch,)
+  :return: data (batch,time,...), seq lens (batch,). everything behind the seq lens is zero
+  :rtype: (numpy.ndarray, numpy.ndarray)
+  """
+  assert values
+  if frame_ranges is None:
+    frame_ranges = [(None, None)] * len(values)
+  ranges = []
+  for v, (start, end) in zip(values, frame_ranges):
+    assert v.ndim >= 1, "fill_padded_batch: need time axis"
+    ranges.append((start or 0, v.shape[0] if end is None else end))
+  max_len = max([end - start for (start, end) in ranges])
+  out, out_seq_lens = get_padded_batch_buffers(
+    batch_dim=len(values), max_len=max_len, frame_shape=values[0].shape[1:],
+    dtype=out.dtype if out is not None else values[0].dtype, out=out, out_seq_lens=out_seq_lens)
+  for b, (v, (start, end)) in enumerate(zip(values, ranges)):
+    assert end >= start
+    copy_into_padded(out[b], v, start=start, end=end)
+    out_seq_lens[b] = end - start
+  return out, out_seq_lens
+
+
+def copy_into_padded(out, x, start, end):
+  """
+  Basically ``out[:end - start] = x[start:end]; out[end - start:] = 0``,
+  but with zero padding if start < 0 or end > len(x).
+
+  :param numpy.ndarray out: (time,...), time >= end - start
+  :param numpy.ndarray|h5py.Dataset x: (time,...). anything which supports slicing
+  :param int start:
+  :param int end:
+  """
+  src_start, src_end = max(start, 0), max(min(end, x.shape[0]), 0)
+  dst_start = src_start - start
+  dst_end = dst_start + max(src_end - src_start, 0)
+  out[:dst_start] = 0
+  if dst_end > dst_start:
+    out[dst_start:dst_end] = x[src_start:src_end]
+  out[dst_end:] = 0
+
+
 def shapes_for_batches(batches, data_keys, dataset=None, extern_data=None, enforce_min_len1=False):
   """
   :param list[EngineBatch.Batch] batches:
@@ -3,7 +3,8 @@
 Provides :class:`CachedDataset2`.
 """
 
-from .basic import Dataset, DatasetSeq
+from .basic import Dataset, DatasetSeq, fill_padded_batch
+from .shuffle_buffer import ShuffleBuffer, get_shuffle_buffer_kwargs
 from threading import Condition
 import typing
 try:
@@ -26,10 +27,24 @@ class CachedDataset2(Dataset):
   - handle seq ordering by overriding `init_seq_order`
   - you can set `_estimated_num_seqs`
   - you can set `_num_seqs` or `_num_timesteps` if you know them in advance
+
+  With the `shuffle_buffer` option, `_collect_single_seq` is called sequentially (seq_idx = 0, 1, 2, ...),
+  and the seqs are drawn randomly from a :class:`ShuffleBuffer`.
+  This is for datasets which can only be read sequentially, where a random `seq_ordering` is not possible.
   """
 
-  def __init__(self, **kwargs):
+  def __init__(self, shuffle_buffer=None, **kwargs):
+    """
+    :param int|dict[str]|None shuffle_buffer: int means the max number of bytes,
+      otherwise a dict with kwargs for :class:`ShuffleBuffer`, e.g. ``{"max_bytes": 2 ** 30, "background": True}``
+    """
     super(CachedDataset2, self).__init__(**kwargs)
+    self._shuffle_buffer_kwargs = get_shuffle_buffer_kwargs(shuffle_buffer)
+    if self._shuffle_buffer_kwargs:
+      assert self.__class__._load_seqs is CachedDataset2._load_seqs, (
+        "%s: shuffle_buffer needs a dataset which only loads via _collect_single_seq" % self)
+    self._shuffle_buffer = None  # type: typing.Optional[ShuffleBuffer]
+    self._shuffle_buffer_source_seq_idx = 0
     self._num_timesteps = None
     self.epoch = None
     self.reached_final_seq = False
@@ -58,8 +73,47 @@ class CachedDataset2(Dataset):
     self._num_timesteps_accumulated = 0
     self._num_seqs = None
     self.epoch = epoch
+    self._reset_shuffle_buffer()
+    if self._shuffle_buffer_kwargs:
+      self._shuffle_buffer = ShuffleBuffer(
+        source=self._collect_single_seq_for_shuffle_buffer,
+        random_seed=self._get_random_seed_for_epoch(epoch=epoch),
+        name="%s shuffle buffer" % self.name,
+        **self._shuffle_buffer_kwargs)
     return True
 
+  def finish_epoch(self):
+    """
+    This would get called at the end of the epoch.
+    """
+    super(CachedDataset2, self).finish_epoch()
+    self._reset_shuffle_buffer()
+
+  def _reset_shuffle_buffer(self):
+    if self._shuffle_buffer:
+      self._shuffle_buffer.stop()
+      self._shuffle_buffer = None
+    self._shuffle_buffer_source_seq_idx = 0
+
+  def _collect_single_seq_for_shuffle_buffer(self):
+    """
+    Source for the shuffle buffer. This might run in a background thread.
+
+    :rtype: DatasetSeq|None
+    """
+    seq = self._collect_single_seq(seq_idx=self._shuffle_buffer_source_seq_idx)
+    self._shuffle_buffer_source_seq_idx += 1
+    return seq
+
+  def _collect_next_seq(self, seq_idx):
+    """
+    :param int seq_idx:
+    :rtype: DatasetSeq|None
+    """
+    if self._shuffle_buffer:
+      return self._shuffle_buffer.get_next(seq_idx=seq_idx)
+    return self._collect_single_seq(seq_idx=seq_idx)
+
   def _cleanup_old_seqs(self, seq_idx_end):
     """
     :param int seq_idx_end:
@@ -116,7 +170,7 @@ class CachedDataset2(Dataset):
       self.expected_load_seq_start = start
     if self.added_data:
       start = max(self.added_data[-1].seq_idx + 1, start)
-    seqs = [self._collect_single_seq(seq_idx=seq_idx) for seq_idx in range(start, end)]
+    seqs = [self._collect_next_seq(seq_idx=seq_idx) for seq_idx in range(start, end)]
     seqs = list(filter(None, seqs))  # We might not know the num seqs in advance.
     self._num_timesteps_accumulated += sum([seq.num_frames for seq in seqs])
     self.added_data += seqs
@@ -185,6 +239,23 @@ class CachedDataset2(Dataset):
     """
     return self._get_seq(seq_idx).features[key]
 
+  def _get_batch_data_for_key(self, seq_idxs, key, frame_ranges, out=None, out_seq_lens=None):
+    """
+    See :func:`Dataset.get_batch_data`.
+    This looks up all the seqs at once, instead of the linear search in :func:`_get_seq` for every single seq.
+
+    :param list[int] seq_idxs:
+    :param str key:
+    :param list[(int|None,int|None)] frame_ranges:
+    :param numpy.ndarray|None out:
+    :param numpy.ndarray|None out_seq_lens:
+    :rtype: (numpy.ndarray, numpy.ndarray)
+    """
+    seqs_by_idx = {seq.seq_idx: seq for seq in self.added_data}
+    return fill_padded_batch(
+      [seqs_by_idx[seq_idx].features[key] for seq_idx in seq_idxs],
+      frame_ranges=frame_ranges, out=out, out_seq_lens=out_seq_lens)
+
   def get_input_data(self, seq_idx):
     """
     :param int seq_idx:
@@ -1088,6 +1088,29 @@ class ExtractAudioFeatures:
     assert value.shape == (self.get_feature_dimension(),)
     return value.astype("float32")
 
+  @staticmethod
+  def create_norm_files(dataset, output_file_prefix, key="data", epoch=1, num_workers=1):
+    """
+    Collects the mean and std dev over the features of the dataset,
+    and writes them to ``<output_file_prefix>.(mean|std_dev).txt``,
+    which can be used for ``norm_mean`` and ``norm_std_dev``.
+    The dataset itself should be configured without normalization.
+    See :func:`returnn.datasets.normalization_data.collect_dataset_stats`.
+    Also see ``tools/dump-dataset.py --stats``.
+
+    :param Dataset dataset: e.g. :class:`OggZipDataset` with these audio feature options
+    :param str output_file_prefix:
+    :param str key:
+    :param int epoch:
+    :param int num_workers: processes to use, each on a disjoint subset of the seqs
+    :return: the collected stats
+    :rtype: returnn.util.basic.Stats
+    """
+    from returnn.datasets.normalization_data import collect_dataset_stats
+    stats = collect_dataset_stats(dataset, key=key, epoch=epoch, num_workers=num_workers)
+    stats.dump(output_file_prefix=output_file_prefix, stream_prefix="%s %r " % (dataset, key), stream=log.v2)
+    return stats
+
   def get_audio_features_from_raw_bytes(self, raw_bytes, seq_name=None):
     """
     :param io.BytesIO raw_bytes:
@@ -11,7 +11,7 @@ import h5py
 import numpy
 from .cached import CachedDataset
 from .cached2 import CachedDataset2
-from .basic import Dataset, DatasetSeq
+from .basic import Dataset, DatasetSeq, get_padded_batch_buffers
 from returnn.log import log
 
 
@@ -281,6 +281,54 @@ class HDFDataset(CachedDataset):
       data = targets[start_pos[ldx]:end_pos[ldx]]
     return data
 
+  def _get_batch_data_for_key(self, seq_idxs, key, frame_ranges, out=None, out_seq_lens=None):
+    """
+    See :func:`Dataset.get_batch_data`.
+    Without the cache, this reads the data directly from the HDF files into the padded batch buffer.
+
+    :param list[int] seq_idxs:
+    :param str key:
+    :param list[(int|None,int|None)] frame_ranges:
+    :param numpy.ndarray|None out:
+    :param numpy.ndarray|None out_seq_lens:
+    :rtype: (numpy.ndarray, numpy.ndarray)
+    """
+    if self.cache_byte_size_total_limit > 0 or (key == "data" and self.window > 1):
+      return super(HDFDataset, self)._get_batch_data_for_key(
+        seq_idxs=seq_idxs, key=key, frame_ranges=frame_ranges, out=out, out_seq_lens=out_seq_lens)
+    ldx = 0 if key == "data" else (self.target_keys.index(key) + 1)
+    # hdf dataset, offset, seq len, start frame, end frame
+    sources = []  # type: typing.List[typing.Tuple[h5py.Dataset,int,int,int,int]]
+    for seq_idx, (start, end) in zip(seq_idxs, frame_ranges):
+      real_seq_idx = self._seq_index[seq_idx]
+      file_idx = self._get_file_index(real_seq_idx)
+      fin = self.h5_files[file_idx]
+      real_file_seq_idx = real_seq_idx - self.file_start[file_idx]
+      start_pos = self.file_seq_start[file_idx][real_file_seq_idx][ldx]
+      end_pos = self.file_seq_start[file_idx][real_file_seq_idx + 1][ldx]
+      source = fin['inputs'] if key == "data" else fin['targets/data/' + key]
+      seq_len = end_pos - start_pos
+      sources.append((source, start_pos, seq_len, start or 0, seq_len if end is None else end))
+    max_len = max([end - start for (_, _, _, start, end) in sources])
+    first_source = sources[0][0]
+    out, out_seq_lens = get_padded_batch_buffers(
+      batch_dim=len(seq_idxs), max_len=max_len, frame_shape=first_source.shape[1:],
+      dtype=out.dtype if out is not None else self.data_dtype[key], out=out, out_seq_lens=out_seq_lens)
+    for b, (source, offset, seq_len, start, end) in enumerate(sources):
+      src_start, src_end = max(start, 0), max(min(end, seq_len), 0)
+      dst_start = src_start - start
+      dst_end = dst_start + max(src_end - src_start, 0)
+      out[b, :dst_start] = 0
+      if dst_end > dst_start:
+        if source.dtype == out.dtype and out.flags.c_contiguous:
+          source.read_direct(
+            out, source_sel=numpy.s_[offset + src_start:offset + src_end], dest_sel=numpy.s_[b, dst_start:dst_end])
+        else:
+          out[b, dst_start:dst_end] = source[offset + src_start:offset + src_end]
+      out[b, dst_end:] = 0
+      out_seq_lens[b] = end - start
+    return out, out_seq_lens
+
   def get_input_data(self, sorted_seq_idx):
     """
     :param int sorted_seq_idx:
@@ -952,10 +1000,16 @@ class SimpleHDFWriter:
   Intended for a simple interface, to dump data on-the-fly into a HDF file,
   which can be read later by :class:`HDFDataset`.
 
-  Note that we dump to a temp file first, and only at :func:`close` we move it over to the real destination.
+  Note that by default, we dump to a temp file first, and only at :func:`close` we move it over to the real destination.
+  With ``use_tmp_file=False``, we write directly to the destination and flush after every batch,
+  such that an interrupted run can be continued via ``extend_existing_file``, see :func:`get_seq_tags`.
+
+  The datasets grow geometrically and are trimmed to the real size at :func:`close`,
+  such that we do not need to resize them for every seq.
   """
 
-  def __init__(self, filename, dim, labels=None, ndim=None, extra_type=None, swmr=False, extend_existing_file=False):
+  def __init__(self, filename, dim, labels=None, ndim=None, extra_type=None, swmr=False, extend_existing_file=False,
+               use_tmp_file=True):
     """
     :param str filename: Create file, truncate if exists
     :param int|None dim:
@@ -964,6 +1018,7 @@ class SimpleHDFWriter:
     :param dict[str,(int,int,str)]|None extra_type: key -> (dim,ndim,dtype)
     :param bool swmr: see http://docs.h5py.org/en/stable/swmr.html
     :param bool extend_existing_file: True also means we expect that it exists
+    :param bool use_tmp_file: write to a temp file, and only move it to filename in :func:`close`
     """
     from returnn.util.basic import hdf5_strings, unicode
     import tempfile
@@ -980,17 +1035,20 @@ class SimpleHDFWriter:
     if labels:
       assert len(labels) == dim
     self.filename = filename
-    tmp_fd, self.tmp_filename = tempfile.mkstemp(suffix=".hdf")
-    os.close(tmp_fd)
+    self.tmp_filename = None  # type: typing.Optional[str]
+    if use_tmp_file:
+      tmp_fd, self.tmp_filename = tempfile.mkstemp(suffix=".hdf")
+      os.close(tmp_fd)
     self.extend_existing_file = extend_existing_file
     if extend_existing_file:
       assert os.path.exists(self.filename)
-      shutil.copyfile(self.filename, self.tmp_filename)
+      if use_tmp_file:
+        shutil.copyfile(self.filename, self.tmp_filename)
     else:
       # By default, we should not override existing data.
       assert not os.path.exists(self.filename)
     self._file = h5py.File(
-      self.tmp_filename,
+      self.tmp_filename or self.filename,
       "r+" if extend_existing_file else "w",
       libver='latest' if swmr else None)
 
@@ -1022,6 +1080,12 @@ class SimpleHDFWriter:
       # noinspection PyUnresolvedReferences
       dt = h5py.special_dtype(vlen=unicode)
       self._seq_tags = self._file.create_dataset('seqTags', (0,), dtype=dt, maxshape=(None,))
+    if extend_existing_file:
+      # The file might be from an interrupted run, where the data was written only partially.
+      # numSeqs is only increased after a seq was written, thus it is the number of complete seqs.
+      num_seqs = int(self._file.attrs['numSeqs'])
+      self._seq_lengths.resize(num_seqs, axis=0)
+      self._seq_tags.resize(num_seqs, axis=0)
 
     self._extra_num_time_steps = {}  # type: typing.Dict[str,int]  # key -> num-steps
     self._prepared_extra = set()
@@ -1068,7 +1132,8 @@ class SimpleHDFWriter:
       if self.extend_existing_file:
         self._datasets[data_key] = self._file['targets/data'][data_key]
         assert shape[0] is None
-        self._extra_num_time_steps[data_key] = self._datasets[data_key].shape[0]
+        data_key_idx = sorted(self._file['targets/data'].keys()).index(data_key) + 1
+        self._extra_num_time_steps[data_key] = int(numpy.sum(self._seq_lengths[:, data_key_idx]))
       else:
         self._datasets[data_key] = self._file['targets/data'].create_dataset(
           data_key, shape=[d if d else 0 for d in shape], dtype=dtype, maxshape=shape)
@@ -1090,20 +1155,48 @@ class SimpleHDFWriter:
     """
     assert raw_data.ndim >= 1
     name = "inputs"
-    if self.extend_existing_file:
+    if self.extend_existing_file and name in self._file:
       # Just expect that the same dataset already exists.
       self._datasets[name] = self._file[name]
     if name not in self._datasets:
       self._datasets[name] = self._file.create_dataset(
         name, raw_data.shape, raw_data.dtype, maxshape=tuple(None for _ in raw_data.shape))
-    else:
-      old_shape = self._datasets[name].shape
-      self._datasets[name].resize(old_shape[0] + raw_data.shape[0], axis=0)
+    offset = int(self._file.attrs['numTimesteps'])
+    self._reserve(self._datasets[name], offset + raw_data.shape[0])
     # append raw data to dataset
-    self._datasets[name][self._file.attrs['numTimesteps']:] = raw_data
+    self._datasets[name][offset:offset + raw_data.shape[0]] = raw_data
     self._file.attrs['numTimesteps'] += raw_data.shape[0]
     self._file.attrs['numSeqs'] += 1
 
+  @staticmethod
+  def _reserve(hdf_data, size):
+    """
+    Makes sure that the first axis of the dataset has at least the given size.
+    It grows geometrically, to avoid a resize for every seq. See :func:`_trim`.
+
+    :param h5py.Dataset hdf_data:
+    :param int size:
+    """
+    if hdf_data.shape[0] < size:
+      hdf_data.resize(max(size, hdf_data.shape[0] * 2), axis=0)
+
+  def _trim(self):
+    """
+    Resizes all datasets to the real size, i.e. removes the space which was reserved by :func:`_reserve`.
+    """
+    if "inputs" in self._datasets:
+      self._datasets["inputs"].resize(int(self._file.attrs['numTimesteps']), axis=0)
+    for data_key, num_time_steps in self._extra_num_time_steps.items():
+      self._datasets[data_key].resize(num_time_steps, axis=0)
+
+  def get_seq_tags(self):
+    """
+    :return: the tags of all seqs which were written, e.g. to skip them when continuing an interrupted run
+    :rtype: list[str]
+    """
+    seq_tags = self._seq_tags[:int(self._file.attrs['numSeqs'])]
+    return [tag.decode("utf8") if isinstance(tag, bytes) else tag for tag in seq_tags]
+
   def _insert_h5_other(self, data_key, raw_data, dtype=None, add_time_dim=False, dim=None):
     """
     :param str data_key:
@@ -1144,14 +1237,14 @@ class SimpleHDFWriter:
         self._seq_lengths[seq_idx, data_key_idx_0 + 1] = self._extra_num_time_steps[data_key_]
 
     self._extra_num_time_steps[data_key] += raw_data.shape[0]
-    self._datasets[data_key].resize(self._extra_num_time_steps[data_key], axis=0)
+    self._reserve(self._datasets[data_key], self._extra_num_time_steps[data_key])
 
     data_key_idx = sorted(self._prepared_extra).index(data_key) + 1
     self._seq_lengths[seq_idx, data_key_idx] = raw_data.shape[0]
 
     offset = self._extra_num_time_steps[data_key] - raw_data.shape[0]
     hdf_data = self._datasets[data_key]
-    hdf_data[offset:] = raw_data
+    hdf_data[offset:offset + raw_data.shape[0]] = raw_data
 
   def insert_batch(self, inputs, seq_len, seq_tag, extra=None):
     """
@@ -1223,6 +1316,8 @@ class SimpleHDFWriter:
             {key: value.shape if isinstance(value, numpy.ndarray) else repr(value) for (key, value) in extra.items()}),
             file=log.v3)
           raise
+    if not self.tmp_filename:
+      self._file.flush()
 
   def close(self):
     """
@@ -1231,6 +1326,7 @@ class SimpleHDFWriter:
     import os
     import shutil
     if self._file:
+      self._trim()
       self._file.close()
       self._file = None
     if self.tmp_filename:
@@ -1244,6 +1340,72 @@ class SimpleHDFWriter:
       self.tmp_filename = None
 
 
+def merge_simple_hdf_files(in_filenames, out_filename, interleave=False):
+  """
+  Merges HDF files of the same format, as written by :class:`SimpleHDFWriter`, into a single file.
+
+  :param list[str] in_filenames:
+  :param str out_filename:
+  :param bool interleave: take the seqs round-robin from the files,
+    e.g. for shards where shard i has the seqs with ``seq_idx % num_shards == i``.
+    Otherwise, the files are concatenated.
+  """
+  from returnn.util.basic import unicode
+  import os
+  assert in_filenames
+  assert not os.path.exists(out_filename)
+  in_files = [h5py.File(fn, "r") for fn in in_filenames]
+  num_seqs = [int(f.attrs['numSeqs']) for f in in_files]
+  if interleave:
+    seq_order = [(i, j) for j in range(max(num_seqs)) for i in range(len(in_files)) if j < num_seqs[i]]
+  else:
+    seq_order = [(i, j) for i in range(len(in_files)) for j in range(num_seqs[i])]
+  # Column k of seqLengths corresponds to data_keys[k], see SimpleHDFWriter.
+  data_keys = ["inputs"]
+  if "targets/data" in in_files[0]:
+    data_keys += ["targets/data/%s" % key for key in sorted(in_files[0]["targets/data"].keys())]
+  seq_lengths = [f["seqLengths"][:num_seqs[i]] for (i, f) in enumerate(in_files)]
+  # Start offsets per file, per seq, per data key.
+  offsets = [numpy.concatenate([numpy.zeros((1, ls.shape[1]), dtype=ls.dtype), numpy.cumsum(ls, axis=0)])
+             for ls in seq_lengths]
+
+  out_file = h5py.File(out_filename, "w")
+  for key in ['inputPattSize', 'numDims', 'numLabels']:
+    out_file.attrs[key] = in_files[0].attrs[key]
+  in_files[0].copy("labels", out_file)
+  if "targets" in in_files[0]:
+    out_file.create_group("targets/data")
+    in_files[0].copy("targets/size", out_file["targets"])
+    in_files[0].copy("targets/labels", out_file["targets"])
+  out_seq_lengths = numpy.array([seq_lengths[i][j] for (i, j) in seq_order], dtype="int32")
+  out_seq_lengths = out_seq_lengths.reshape((len(seq_order), seq_lengths[0].shape[1]))
+  out_file.create_dataset("seqLengths", data=out_seq_lengths, maxshape=(None, None))
+  # noinspection PyUnresolvedReferences
+  out_seq_tags = out_file.create_dataset(
+    "seqTags", (len(seq_order),), dtype=h5py.special_dtype(vlen=unicode), maxshape=(None,))
+  for k, (i, j) in enumerate(seq_order):
+    seq_tag = in_files[i]["seqTags"][j]
+    out_seq_tags[k] = seq_tag.decode("utf8") if isinstance(seq_tag, bytes) else seq_tag
+  for c, data_key in enumerate(data_keys):
+    in_datas = [f[data_key] if data_key in f else None for f in in_files]
+    template = [d for d in in_datas if d is not None]
+    if not template:
+      continue
+    out_data = out_file.create_dataset(
+      data_key, (int(numpy.sum(out_seq_lengths[:, c])),) + template[0].shape[1:], dtype=template[0].dtype,
+      maxshape=(None,) + template[0].shape[1:])
+    pos = 0
+    for i, j in seq_order:
+      seq_len = int(seq_lengths[i][j, c])
+      out_data[pos:pos + seq_len] = in_datas[i][int(offsets[i][j, c]):int(offsets[i][j, c]) + seq_len]
+      pos += seq_len
+  out_file.attrs['numSeqs'] = len(seq_order)
+  out_file.attrs['numTimesteps'] = int(numpy.sum(out_seq_lengths[:, 0])) if len(seq_order) else 0
+  out_file.close()
+  for f in in_files:
+    f.close()
+
+
 class HDFDatasetWriter:
   """
   Similar as :class:`SimpleHDFWriter`, but is mostly intended to copy an existing dataset,
@@ -1430,22 +1430,38 @@ class ConcatSeqsDataset(CachedDataset2):
 
 class ChunkShuffleDataset(CachedDataset2):
   """
-  This goes through a dataset, caches some recent chunks
+  This goes through a dataset, splits it into chunks (via the batch generator of the dataset, i.e. via `chunking`),
+  and returns the chunks as seqs in a shuffled order.
+  The chunks are streamed through a :class:`ShuffleBuffer`,
+  where the memory is bounded either by the number of chunks (``chunk_shuffle_cache``),
+  or by bytes (``chunk_shuffle_max_bytes``).
   """
 
   def __init__(self, dataset,
-               chunk_shuffle_cache=1000,
+               chunk_shuffle_cache=1000, chunk_shuffle_max_bytes=None, chunk_shuffle_background=False,
                batch_gen_batch_size=5000, batch_gen_max_seqs=1,
                batch_gen_recurrent_net=True,
                **kwargs):
     """
     :param dict[str] dataset: kwargs for init_dataset
-    """
-    super(ChunkShuffleDataset, self).__init__(**kwargs)
+    :param int|None chunk_shuffle_cache: max number of chunks in the shuffle buffer
+    :param int|None chunk_shuffle_max_bytes: max number of bytes in the shuffle buffer
+    :param bool chunk_shuffle_background: fill the shuffle buffer in a background thread
+    :param int batch_gen_batch_size:
+    :param int batch_gen_max_seqs:
+    :param bool batch_gen_recurrent_net:
+    """
+    assert "shuffle_buffer" not in kwargs, "%s: use the chunk_shuffle_* options" % self.__class__.__name__
+    super(ChunkShuffleDataset, self).__init__(
+      shuffle_buffer={
+        "max_seqs": chunk_shuffle_cache, "max_bytes": chunk_shuffle_max_bytes,
+        "background": chunk_shuffle_background},
+      **kwargs)
     self.dataset = init_dataset(dataset)
     assert self.dataset
     self.dataset_last_load_seq_end = None
     self.chunk_shuffle_cache = chunk_shuffle_cache
+    self.chunk_shuffle_max_bytes = chunk_shuffle_max_bytes
     self.batch_gen = None
     self.batch_gen_batch_size = batch_gen_batch_size
     self.batch_gen_max_seqs = batch_gen_max_seqs
@@ -1453,8 +1469,7 @@ class ChunkShuffleDataset(CachedDataset2):
     self.num_inputs = self.dataset.num_inputs
     self.num_outputs = self.dataset.num_outputs
     self.labels = self.dataset.labels
-    self.rng = Random(0)
-    self.load_seqs_end = None
+    self.chunks = []  # type: typing.List[DatasetSeq]  # from the current batch, not yet passed to the shuffle buffer
 
   def init_seq_order(self, epoch=None, seq_list=None, seq_order=None):
     """
@@ -1462,73 +1477,38 @@ class ChunkShuffleDataset(CachedDataset2):
     :param list[str]|None seq_list:
     :param list[int]|None seq_order:
     """
-    need_reinit = self.epoch is None or self.epoch != epoch
     super(ChunkShuffleDataset, self).init_seq_order(epoch=epoch, seq_list=seq_list, seq_order=seq_order)
-    self.load_seqs_end = 0
-    self.dataset_last_load_seq_end = 0
-    self.rng.seed(epoch or 1)
-    if not need_reinit:
-      return False
-
     if seq_list or seq_order:
       raise NotImplementedError("predefined order seq_list")
     if self.seq_ordering != "default":
       raise NotImplementedError("seq_ordering %s" % self.seq_ordering)
 
+    self.dataset_last_load_seq_end = 0
+    self.chunks = []
     self.dataset.init_seq_order(epoch=epoch)
     self.batch_gen = self.dataset.generate_batches(recurrent_net=self.batch_gen_recurrent_net,
                                                    batch_size=self.batch_gen_batch_size,
                                                    max_seqs=self.batch_gen_max_seqs)
     return True
 
-  def _add_data(self, data, original_tag):
-    """
-    :type data: dict[str,numpy.ndarray]
-    :type original_tag: str
-    """
-    features = data["data"]
-    if not self.added_data:
-      seq_idx = 0
-      assert self.expected_load_seq_start == 0
-    else:
-      seq_idx = self.added_data[-1].seq_idx + 1
-    tag = "%s.%i" % (original_tag, seq_idx)
-    seq = DatasetSeq(seq_idx=seq_idx, features=features, targets=data, seq_tag=tag)
-    self._num_timesteps_accumulated += seq.num_frames
-    self.added_data += [seq]
-
-  def _shuffle(self):
-    start_seq_idx = self.added_data[0].seq_idx
-    end_seq_idx = self.added_data[-1].seq_idx
-    assert start_seq_idx < self.load_seqs_end < end_seq_idx
-    start_idx = 0
-    if start_seq_idx < self.load_seqs_end:
-      start_idx = self.load_seqs_end - start_seq_idx
-      assert self.added_data[start_idx].seq_idx == self.load_seqs_end
-      start_seq_idx = self.load_seqs_end
-    sublist = self.added_data[start_idx:]
-    self.rng.shuffle(sublist)
-    for i, seq in enumerate(sublist):
-      seq.seq_idx = i + start_seq_idx
-    assert sublist[-1].seq_idx == end_seq_idx
-    self.added_data[start_idx:] = sublist
-
   def _add_more(self):
     """
-    Adds each chunk/batch seq as a single DatasetSeq.
+    Adds each chunk/batch seq as a single DatasetSeq to self.chunks.
     See EngineUtil.assign_dev_data() for comparison.
+
     :returns whether we added some more
+    :rtype: bool
     """
     if not self.batch_gen.has_more():
       return False
     batches = self.batch_gen.peek_next_n(1)
+    used_data_keys = self.dataset.get_data_keys()
     for batch in batches:
       assert batch.seqs
       if batch.end_seq > self.dataset_last_load_seq_end:
         self.dataset.load_seqs(batch.start_seq, batch.end_seq)
         self.dataset_last_load_seq_end = batch.end_seq
 
-      used_data_keys = self.get_data_keys()
       for seq in batch.seqs:
         res_data = {}
         for k in used_data_keys:
@@ -1536,66 +1516,26 @@ class ChunkShuffleDataset(CachedDataset2):
           if data is not None:
             res_data[k] = data[seq.seq_start_frame[k]:seq.seq_end_frame[k]]
         original_tag = self.dataset.get_tag(seq.seq_idx)
-        self._add_data(data=res_data, original_tag=original_tag)
+        # seq_idx is set properly in _collect_single_seq.
+        self.chunks.append(DatasetSeq(seq_idx=0, features=res_data, seq_tag=original_tag))
 
     self.batch_gen.advance(len(batches))
     return True
 
-  def _add_more_until(self, end, shuffle=False):
-    if self.added_data and end <= self.added_data[-1].seq_idx:
-      return True
-    while self._add_more():
-      assert self.added_data
-      if end <= self.added_data[-1].seq_idx:
-        if shuffle:
-          self._shuffle()
-        return True
-    # We have reached the end.
-    if not self.added_data:
-      self._num_seqs = 0
-      print("warning: empty dataset", file=log.v3)
-    else:
-      self._num_seqs = self.added_data[-1].seq_idx + 1
-    self.reached_final_seq = True
-    return False
-
-  def is_less_than_num_seqs(self, seq_idx):
-    """
-    :type seq_idx: int
-    :rtype: bool
-    :returns whether seq_idx < num_seqs. In case num_seqs is not known in advance, it will wait
-    until it knows that n is behind the end or that we have the seq.
-    """
-    if self._num_seqs is not None:
-      return seq_idx < self._num_seqs
-    if seq_idx < self.expected_load_seq_start:
-      return True
-    if self.added_data and seq_idx <= self.added_data[-1].seq_idx:
-      return True
-    return self._add_more_until(seq_idx)
-
-  def _load_seqs(self, start, end):
-    """
-    :param int start: inclusive seq idx start
-    :param int end: exclusive seq idx end
-    """
-    # We expect that start increase monotonic on each call
-    # for not-yet-loaded data.
-    # This will already be called with _load_seqs_superset indices.
-    assert start >= self.expected_load_seq_start
-    if start > self.expected_load_seq_start:
-      # Cleanup old data.
-      self._cleanup_old_seqs(start)
-      self.expected_load_seq_start = start
-    self.load_seqs_end = end
-    self._add_more_until(end + self.chunk_shuffle_cache, shuffle=True)
-
   def _collect_single_seq(self, seq_idx):
     """
+    This is the source for the shuffle buffer, and called with increasing seq_idx = 0, 1, 2, ...
+
     :type seq_idx: int
-    :rtype: DatasetSeq
-    """
-    assert False, "should not be called"
+    :rtype: DatasetSeq|None
+    """
+    while not self.chunks:
+      if not self._add_more():
+        return None
+    seq = self.chunks.pop(0)
+    seq.seq_idx = seq_idx
+    seq.seq_tag = "%s.%i" % (seq.seq_tag, seq_idx)
+    return seq
 
   def get_target_list(self):
     """
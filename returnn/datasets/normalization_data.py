@@ -1,10 +1,159 @@
+
+"""
+Provides :class:`NormalizationData`,
+and the parallel streaming statistics (mean/variance) collection
+(:func:`collect_hdf_files_stats`, :func:`collect_dataset_stats`),
+which uses :class:`Stats` with pairwise merging (Chan et al.) of the partial statistics.
+"""
+
+from __future__ import print_function
+
 import os
-import six
 import h5py
 import numpy as np
 
 from .bundle_file import BundleFile
-from returnn.util.basic import long
+from returnn.util.basic import Stats
+from returnn.log import log
+
+
+def _collect_hdf_file_stats(args):
+  """
+  Worker function for :func:`collect_hdf_files_stats`, also used in subprocesses.
+
+  :param (str,str,numpy.dtype|str,int) args: file path, group name, dtype, chunk size (in frames)
+  :return: stats, or None if the group is not in the file
+  :rtype: Stats|None
+  """
+  file_path, group_name, dtype, chunk_size = args
+  with h5py.File(file_path, mode='r') as f:
+    if group_name not in f:
+      return None
+    stats = Stats()
+    group = f[group_name]
+    for ds_name in group.keys():
+      dataset = group[ds_name]
+      num_frames = dataset.shape[NormalizationData.DATASET_TIME_DIMENSION_INDEX]
+      for start in range(0, num_frames, chunk_size):
+        stats.collect(dataset[start:start + chunk_size].astype(dtype))
+    return stats
+
+
+def collect_hdf_files_stats(file_paths, group_name, dtype=np.float64, num_workers=None, chunk_size=100000):
+  """
+  Collects the mean and variance over all the datasets in the given group over all the HDF files,
+  where the files are processed in parallel.
+
+  :param list[str] file_paths:
+  :param str group_name: e.g. NormalizationData.GROUP_INPUTS
+  :param numpy.dtype|str dtype: type of data to use during calculations
+  :param int|None num_workers: number of processes. by default the number of CPUs
+  :param int chunk_size: frames per read. this bounds the memory consumption
+  :return: stats, or None if the group was not found in any file
+  :rtype: Stats|None
+  """
+  file_paths = list(file_paths)
+  if num_workers is None:
+    import multiprocessing
+    num_workers = multiprocessing.cpu_count()
+  num_workers = max(min(num_workers, len(file_paths)), 1)
+  worker_args = [(file_path, group_name, dtype, chunk_size) for file_path in file_paths]
+  if num_workers > 1:
+    from multiprocessing import Pool
+    pool = Pool(num_workers)
+    try:
+      partial_stats = pool.map(_collect_hdf_file_stats, worker_args)
+    finally:
+      pool.close()
+      pool.join()
+  else:
+    partial_stats = map(_collect_hdf_file_stats, worker_args)
+  total_stats = None  # type: Stats|None
+  for stats in partial_stats:
+    if stats is None:
+      continue
+    if total_stats is None:
+      total_stats = Stats()
+    total_stats.merge(stats)
+  return total_stats
+
+
+def _collect_dataset_stats_shard(dataset, key, epoch, start_seq, end_seq, shard_idx, num_shards):
+  """
+  :param returnn.datasets.basic.Dataset dataset:
+  :param str key:
+  :param int epoch:
+  :param int start_seq:
+  :param int|float end_seq: inclusive
+  :param int shard_idx:
+  :param int num_shards:
+  :rtype: Stats
+  """
+  stats = Stats()
+  dataset.init_seq_order(epoch=epoch)
+  seq_idx = start_seq + shard_idx
+  while dataset.is_less_than_num_seqs(seq_idx) and seq_idx <= end_seq:
+    dataset.load_seqs(seq_idx, seq_idx + 1)
+    stats.collect(dataset.get_data(seq_idx, key))
+    seq_idx += num_shards
+  return stats
+
+
+def _collect_dataset_stats_worker(conn, **kwargs):
+  """
+  :param multiprocessing.connection.Connection conn:
+  :param kwargs: see :func:`_collect_dataset_stats_shard`
+  """
+  try:
+    conn.send(("ok", _collect_dataset_stats_shard(**kwargs)))
+  except BaseException as exc:
+    conn.send(("error", "%s: %s" % (type(exc).__name__, exc)))
+    raise
+  finally:
+    conn.close()
+
+
+def collect_dataset_stats(dataset, key="data", epoch=1, start_seq=0, end_seq=float("inf"), num_workers=1):
+  """
+  Collects the mean and variance of the data of any dataset.
+  With num_workers > 1, this forks subprocesses, where each one gets a disjoint shard of the seqs
+  (every num_workers-th seq), and the partial stats are merged in the end.
+  The dataset should support random access for this to be efficient.
+
+  :param returnn.datasets.basic.Dataset dataset:
+  :param str key:
+  :param int epoch:
+  :param int start_seq:
+  :param int|float end_seq: inclusive
+  :param int num_workers:
+  :rtype: Stats
+  """
+  shard_kwargs = dict(dataset=dataset, key=key, epoch=epoch, start_seq=start_seq, end_seq=end_seq)
+  if num_workers <= 1:
+    return _collect_dataset_stats_shard(shard_idx=0, num_shards=1, **shard_kwargs)
+  import multiprocessing
+  # We need fork, because the dataset itself is usually not pickleable.
+  # Python 2 does not have get_context, but always uses fork (on Unix).
+  ctx = multiprocessing.get_context("fork") if hasattr(multiprocessing, "get_context") else multiprocessing
+  procs = []
+  for shard_idx in range(num_workers):
+    parent_conn, child_conn = ctx.Pipe(duplex=False)
+    proc = ctx.Process(
+      target=_collect_dataset_stats_worker, name="collect_dataset_stats worker %i" % shard_idx,
+      kwargs=dict(conn=child_conn, shard_idx=shard_idx, num_shards=num_workers, **shard_kwargs))
+    proc.daemon = True
+    proc.start()
+    child_conn.close()
+    procs.append((proc, parent_conn))
+  total_stats = Stats()
+  for shard_idx, (proc, conn) in enumerate(procs):
+    status, res = conn.recv()
+    proc.join()
+    if status != "ok":
+      raise Exception("collect_dataset_stats: worker %i failed: %s" % (shard_idx, res))
+    print("collect_dataset_stats: worker %i: %i seqs" % (shard_idx, res.num_seqs), file=log.v4)
+    total_stats.merge(res)
+  return total_stats
 
 
 class NormalizationData(object):
@@ -27,7 +176,7 @@ class NormalizationData(object):
 
   @staticmethod
   def createNormalizationFile(bundleFilePath, outputFilePath, dtype=np.float64,
-                              flag_includeOutputs=True):
+                              flag_includeOutputs=True, num_workers=None, chunk_size=100000):
     """Calculates means over inputs and outputs of datasets in the HDF files
     described by the given bundle file.
 
@@ -47,6 +196,9 @@ class NormalizationData(object):
     Availability of means and variances depends on whether the corresponding
     groups are available in the input dataset HDF files.
 
+    The files are processed in parallel (:func:`collect_hdf_files_stats`),
+    and read in chunks of chunk_size frames.
+
     !!! IMPORTANT !!!
     General rule of thumb: if one dataset file has both input and output
     groups then you should make sure that all the dataset files have them.
@@ -63,24 +215,27 @@ class NormalizationData(object):
     :type flag_includeOutputs: bool
     :param flag_includeOutputs: if True then normalization data will be
                                 calculated for outputs (targets) as well.
+    :type num_workers: int|None
+    :param num_workers: number of processes. by default the number of CPUs.
+    :type chunk_size: int
+    :param chunk_size: number of frames per read.
     """
-    NormalizationData._calculateNormalizationData(
-      bundleFilePath,
-      outputFilePath,
-      NormalizationData.GROUP_INPUTS,
-      dtype=dtype
-    )
+    groupNames = [NormalizationData.GROUP_INPUTS]
     if flag_includeOutputs:
+      groupNames.append(NormalizationData.GROUP_OUTPUTS)
+    for groupName in groupNames:
       NormalizationData._calculateNormalizationData(
         bundleFilePath,
         outputFilePath,
-        NormalizationData.GROUP_OUTPUTS,
-        dtype=dtype
+        groupName,
+        dtype=dtype,
+        num_workers=num_workers,
+        chunk_size=chunk_size
       )
 
   @staticmethod
   def _calculateNormalizationData(bundleFilePath, outputFilePath, groupName,
-                                  dtype=np.float64):
+                                  dtype=np.float64, num_workers=None, chunk_size=100000):
     """Helper method.
     Calculates and writes into the output HDF file mean, mean of squares,
     variance and total number of frames for the datasets in the given HDF
@@ -98,35 +253,23 @@ class NormalizationData(object):
                       normalization data.
     :type dtype: numpy.dtype
     :param dtype: type of data to use during calculations.
+    :type num_workers: int|None
+    :param num_workers: number of processes
+    :type chunk_size: int
+    :param chunk_size: number of frames per read
     """
-    accumulatedSum = None
-    accumulatedSumOfSqr = None
-    totalFrames = long()
     bundle = BundleFile(bundleFilePath)
-    for filePath in bundle.datasetFilePaths:
-      with h5py.File(filePath, mode='r') as datasetFile:
-        intermSum, intermSumOfSqr, intermTotalFrames = \
-          NormalizationData._accumulateSums(
-            datasetFile,
-            groupName,
-            dtype=dtype
-          )
-        accumulatedSum = NormalizationData._updateTotalSum(
-          accumulatedSum,
-          intermSum
-        )
-        accumulatedSumOfSqr = NormalizationData._updateTotalSum(
-          accumulatedSumOfSqr,
-          intermSumOfSqr
-        )
-        totalFrames += intermTotalFrames
-
-    mean, meanOfSquares, variance = \
-      NormalizationData._calculateMeans(
-        accumulatedSum,
-        accumulatedSumOfSqr,
-        totalFrames
-      )
+    stats = collect_hdf_files_stats(
+      bundle.datasetFilePaths, groupName, dtype=dtype, num_workers=num_workers, chunk_size=chunk_size)
+    mean = None
+    meanOfSquares = None
+    variance = None
+    totalFrames = 0
+    if stats is not None and stats.total_data_len > 0:
+      mean = stats.mean
+      meanOfSquares = stats.mean_sq
+      variance = stats.var
+      totalFrames = stats.total_data_len
 
     with h5py.File(outputFilePath, mode='a') as out:
       NormalizationData._writeData(
@@ -135,106 +278,6 @@ class NormalizationData(object):
         dtype=dtype
       )
 
-  @staticmethod
-  def _accumulateSums(f, groupName, dtype=np.float64):
-    """Helper method.
-    Accumulate sums and sums of squares over feature vectors for a given group.
-
-    :type f: h5py.File
-    :param f: handle to an opened HDF file with datasets
-    :type groupName: str
-    :param groupName: HDF group containing datasets
-    :type dtype: numpy.dtype
-    :param dtype: type of data to use during calculations.
-    :rtype: tuple (numpy.ndarray | None, numpy.ndarray | None, long)
-    :return: tuple (sum, sum of squares, total number of time frames)
-             if they are available
-    """
-    sum = None
-    sumOfSqr = None
-    totalFrames = np.int64(0)
-    if groupName not in f:
-      return sum, sumOfSqr, totalFrames
-    group = f[groupName]
-    datasetNames = group.keys()
-    if len(datasetNames) == 0:
-      return sum, sumOfSqr, totalFrames
-    featDims = group[datasetNames[0]].shape[
-      NormalizationData.DATASET_FEATURE_DIMENSION_INDEX
-    ]
-    sum = np.zeros(featDims, dtype=dtype)
-    sumOfSqr = np.zeros(featDims, dtype=dtype)
-    for dsName in datasetNames:
-      dataset = group[dsName][...]
-      sum += np.sum(
-        dataset,
-        axis=NormalizationData.DATASET_TIME_DIMENSION_INDEX
-      )
-      sumOfSqr += np.sum(
-        np.square(dataset),
-        axis=NormalizationData.DATASET_TIME_DIMENSION_INDEX
-      )
-      totalFrames += dataset.shape[
-        NormalizationData.DATASET_TIME_DIMENSION_INDEX
-      ]
-    return sum, sumOfSqr, totalFrames
-
-  @staticmethod
-  def _updateTotalSum(totalSum, intermediateSum):
-    """Helper method.
-    Updates total sum with intermediate sum if the latter is available.
-
-    :type totalSum: numpy.ndarray | None
-    :param totalSum: total sum
-    :type intermediateSum: numpy.ndarray | None
-    :param intermediateSum: intermediate sum
-    :rtype: numpy.ndarray | None
-    :return: updated total sum if available
-    """
-    if totalSum is None and intermediateSum is None:
-      return None
-    if totalSum is None:
-      return intermediateSum
-    if intermediateSum is None:
-      return totalSum
-    # floating point summation check
-    oldSum = totalSum
-    newSum = np.add(totalSum, intermediateSum)
-    sumErr = np.sum(np.abs(newSum - oldSum - intermediateSum))
-    if sumErr > NormalizationData.SUMMATION_PRECISION:
-      raise FloatingPointError(
-        'sums have very different orders of magnitude.'
-        ' summation error = {}'.format(sumErr)
-      )
-    return newSum
-
-  @staticmethod
-  def _calculateMeans(totalSum, totalSumOfSqr, totalFrames):
-    """Helper method.
-    Calculate mean, mean of squares and variance if they are available.
-
-    :type totalSum: numpy.ndarray | None
-    :param totalSum: total sum of features
-    :type totalSumOfSqr: numpy.ndarray | None
-    :param totalSumOfSqr: total sum of squares of features
-    :type totalFrames: long
-    :param totalFrames: total number of timeframes
-    :rtype: tuple (numpy.ndarray | None, numpy.ndarray | None, numpy.ndarray | None)
-    :return: tuple (mean, mean of squares, variance) if they are available
-    """
-    mean = None
-    meanOfSquares = None
-    variance = None
-    if totalSum is not None:
-      assert totalFrames > 0
-      mean = totalSum / totalFrames
-    if mean is not None and totalSumOfSqr is not None:
-      assert totalFrames > 0
-      meanOfSquares = totalSumOfSqr / totalFrames
-      # Var[X] = E[X ^ 2] - (E[X]) ^ 2
-      variance = meanOfSquares - np.square(mean)
-    return mean, meanOfSquares, variance
-
   @staticmethod
   def _writeData(f, groupName, mean, meanOfSqr, variance, totalFrames,
                  dtype=np.float64):
@@ -1,28 +1,192 @@
 
 """
-Provides :class:`NumpyDumpDataset`.
+Provides :class:`NumpyDumpDataset`,
+and the packed seqs container format (:class:`PackedSeqsWriter`, :class:`PackedSeqsFile`).
 """
 
 from returnn.datasets.basic import Dataset, DatasetSeq
+from returnn.util.basic import NumbersDict
 import os
 import numpy
 import typing
 
 
+class PackedSeqsWriter:
+  """
+  Writes the packed seqs container format:
+  One big data file, where all the (contiguous) arrays of all seqs are just concatenated,
+  and an index file (``<filename>.index.npz``) with the byte offsets, shapes and dtypes of all arrays.
+  This can be read with zero copy via :class:`PackedSeqsFile`.
+  Also see ``tools/pack-seq-files.py``.
+  """
+
+  Alignment = 64  # bytes, for the start of every array
+
+  def __init__(self, filename):
+    """
+    :param str filename: data file. the index will be ``filename + ".index.npz"``
+    """
+    self.filename = filename
+    self.file = open(filename, "wb")
+    self.pos = 0
+    self.keys = None  # type: typing.Optional[typing.List[str]]
+    self.dtypes = {}  # type: typing.Dict[str,str]
+    self.offsets = {}  # type: typing.Dict[str,typing.List[int]]
+    self.shapes = {}  # type: typing.Dict[str,typing.List[typing.Tuple[int,...]]]
+    self.seq_tags = []  # type: typing.List[str]
+
+  def add_seq(self, features, seq_tag=None):
+    """
+    :param dict[str,numpy.ndarray] features: key -> data. all seqs need to have the same keys
+    :param str|None seq_tag:
+    """
+    if self.keys is None:
+      self.keys = sorted(features.keys())
+      for key in self.keys:
+        self.dtypes[key] = str(features[key].dtype)
+        self.offsets[key] = []
+        self.shapes[key] = []
+    assert sorted(features.keys()) == self.keys, "%s: keys mismatch, %r, expected %r" % (
+      self, sorted(features.keys()), self.keys)
+    for key in self.keys:
+      data = numpy.ascontiguousarray(features[key])
+      assert str(data.dtype) == self.dtypes[key], "%s: key %r: dtype %s mismatch, expected %s" % (
+        self, key, data.dtype, self.dtypes[key])
+      assert not self.shapes[key] or data.ndim == len(self.shapes[key][0])
+      if self.pos % self.Alignment:
+        padding = self.Alignment - self.pos % self.Alignment
+        self.file.write(b"\0" * padding)
+        self.pos += padding
+      self.offsets[key].append(self.pos)
+      self.shapes[key].append(data.shape)
+      self.file.write(data.tobytes())
+      self.pos += data.nbytes
+    self.seq_tags.append(seq_tag or ("seq-%i" % len(self.seq_tags)))
+
+  def close(self):
+    """
+    Closes the data file and writes the index.
+    """
+    self.file.close()
+    keys = self.keys or []
+    index = {"keys": numpy.array(keys, dtype="str"), "seq_tags": numpy.array(self.seq_tags, dtype="str")}
+    for i, key in enumerate(keys):
+      index["dtype_%i" % i] = numpy.array(self.dtypes[key], dtype="str")
+      index["offsets_%i" % i] = numpy.array(self.offsets[key], dtype="int64")
+      index["shapes_%i" % i] = numpy.array(self.shapes[key], dtype="int64").reshape((len(self.seq_tags), -1))
+    numpy.savez(PackedSeqsFile.get_index_filename(self.filename), **index)
+
+
+class PackedSeqsFile:
+  """
+  Reads the format written by :class:`PackedSeqsWriter`.
+  The data file is memory mapped once, and :func:`get_data` returns zero-copy slices of it.
+  """
+
+  def __init__(self, filename):
+    """
+    :param str filename: data file
+    """
+    self.filename = filename
+    index = numpy.load(self.get_index_filename(filename))
+    self.keys = [str(key) for key in index["keys"]]
+    self.seq_tags = [str(tag) for tag in index["seq_tags"]]
+    self.dtypes = {}  # type: typing.Dict[str,numpy.dtype]
+    self.offsets = {}  # type: typing.Dict[str,numpy.ndarray]
+    self.shapes = {}  # type: typing.Dict[str,numpy.ndarray]
+    for i, key in enumerate(self.keys):
+      self.dtypes[key] = numpy.dtype(str(index["dtype_%i" % i]))
+      self.offsets[key] = index["offsets_%i" % i]
+      self.shapes[key] = index["shapes_%i" % i]
+      assert self.offsets[key].shape == (self.num_seqs,) and self.shapes[key].shape[0] == self.num_seqs
+    if os.path.getsize(filename) > 0:
+      self.data = numpy.memmap(filename, dtype="uint8", mode="r")
+    else:  # mmap of empty files is not possible
+      self.data = numpy.zeros((0,), dtype="uint8")
+
+  def __repr__(self):
+    return "<%s %r num_seqs=%i keys=%r>" % (self.__class__.__name__, self.filename, self.num_seqs, self.keys)
+
+  @staticmethod
+  def get_index_filename(filename):
+    """
+    :param str filename: data file
+    :rtype: str
+    """
+    return filename + ".index.npz"
+
+  @property
+  def num_seqs(self):
+    """
+    :rtype: int
+    """
+    return len(self.seq_tags)
+
+  def get_shape(self, seq_idx, key):
+    """
+    :param int seq_idx: index in the file
+    :param str key:
+    :rtype: tuple[int]
+    """
+    return tuple([int(d) for d in self.shapes[key][seq_idx]])
+
+  def get_seq_length(self, seq_idx):
+    """
+    :param int seq_idx: index in the file
+    :rtype: NumbersDict
+    """
+    return NumbersDict({
+      key: (int(self.shapes[key][seq_idx][0]) if self.shapes[key].shape[1] >= 1 else 1)
+      for key in self.keys})
+
+  def get_data(self, seq_idx, key):
+    """
+    :param int seq_idx: index in the file
+    :param str key:
+    :return: read-only memmap view, no copy
+    :rtype: numpy.ndarray
+    """
+    shape = self.get_shape(seq_idx, key)
+    dtype = self.dtypes[key]
+    offset = int(self.offsets[key][seq_idx])
+    nbytes = int(numpy.prod(shape)) * dtype.itemsize
+    return self.data[offset:offset + nbytes].view(dtype).reshape(shape)
+
+
 class NumpyDumpDataset(Dataset):
   """
   For ``tools/dump-dataset.py --type=numpy``.
+
+  The per-seq files can be converted via ``tools/pack-seq-files.py`` to the packed format (``packed_file``),
+  which is one single data file plus an index, and which is read via mmap without any per-seq file open.
   """
 
   file_format_data = "%i.data"
   file_format_targets = "%i.targets"
 
-  def __init__(self, prefix, postfix=".txt.gz",
+  def __init__(self, prefix=None, postfix=".txt.gz",
                start_seq=0, end_seq=None,
-               num_inputs=None, num_outputs=None, **kwargs):
+               num_inputs=None, num_outputs=None, packed_file=None, **kwargs):
+    """
+    :param str|None prefix: for the per-seq files
+    :param str postfix: for the per-seq files
+    :param int start_seq:
+    :param int|None end_seq:
+    :param int num_inputs:
+    :param dict[str,(int,int)] num_outputs:
+    :param str|None packed_file: instead of the per-seq files, see :class:`PackedSeqsFile`
+    """
     super(NumpyDumpDataset, self).__init__(**kwargs)
-    self.file_format_data = prefix + self.file_format_data + postfix
-    self.file_format_targets = prefix + self.file_format_targets + postfix
+    self.packed_file = None  # type: typing.Optional[PackedSeqsFile]
+    if packed_file:
+      assert not prefix, "%s: specify either prefix or packed_file" % self
+      self.packed_file = PackedSeqsFile(packed_file)
+      assert "data" in self.packed_file.keys and "classes" in self.packed_file.keys, "%s: unexpected keys in %r" % (
+        self, self.packed_file)
+    else:
+      assert prefix, "%s: specify either prefix or packed_file" % self
+      self.file_format_data = prefix + self.file_format_data + postfix
+      self.file_format_targets = prefix + self.file_format_targets + postfix
     self.start_seq = start_seq
     self._init_num_seqs(end_seq)
     self._seq_index = None
@@ -32,6 +196,13 @@ class NumpyDumpDataset(Dataset):
     assert num_inputs and num_outputs
 
   def _init_num_seqs(self, end_seq=None):
+    if self.packed_file:
+      if end_seq is None:
+        end_seq = self.packed_file.num_seqs
+      assert self.start_seq < end_seq <= self.packed_file.num_seqs, "%s: invalid range for %r" % (
+        self, self.packed_file)
+      self._num_seqs = end_seq - self.start_seq
+      return
     last_seq = None
     i = self.start_seq
     while True:
@@ -56,8 +227,12 @@ class NumpyDumpDataset(Dataset):
     :param int seq_idx:
     """
     real_idx = self._seq_index[seq_idx]
-    features = numpy.loadtxt(self.file_format_data % real_idx)
-    targets = numpy.loadtxt(self.file_format_targets % real_idx)
+    if self.packed_file:
+      features = self.packed_file.get_data(real_idx, "data")
+      targets = self.packed_file.get_data(real_idx, "classes")
+    else:
+      features = numpy.loadtxt(self.file_format_data % real_idx)
+      targets = numpy.loadtxt(self.file_format_targets % real_idx)
     assert features.ndim == 2
     assert features.shape[1] == self.num_inputs
     assert targets.ndim == 1
@@ -121,6 +296,8 @@ class NumpyDumpDataset(Dataset):
     """
     # This is different from the other get_* functions.
     # load_seqs() might not have been called before.
+    if self.packed_file:
+      return self.packed_file.get_seq_length(self._seq_index[seq_idx])
     if not self._have_cache_seq(seq_idx):
       self._load_numpy_seq(seq_idx)
     return self._get_cache_seq(seq_idx).num_frames
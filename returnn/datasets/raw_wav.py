@@ -8,10 +8,12 @@ from __future__ import print_function
 import h5py
 from .cached2 import CachedDataset2
 from returnn.datasets.basic import DatasetSeq
+from returnn.datasets.numpy_dump import PackedSeqsFile
 from returnn.log import log
 import tempfile
 import numpy as np
 import time
+import typing
 
 
 class RawWavDataset(CachedDataset2):
@@ -19,17 +21,20 @@ class RawWavDataset(CachedDataset2):
   This dataset returns the raw waveform information of wav files as sequence input data
   It uses temporary hdf files to buffer the data, to avoid repeatedly reading the
   wav files.
+  Alternatively, the wav files can be converted via ``tools/pack-seq-files.py`` to the packed format
+  (``packed_file``, see :class:`PackedSeqsFile`), which is read via mmap, without any per-file open.
   """
 
   # Need to keep names as-is for compatibility.
   # noinspection PyPep8Naming
-  def __init__(self, listFile, frameLength, frameShift, num_outputs=None, **kwargs):
+  def __init__(self, listFile=None, frameLength=None, frameShift=None, num_outputs=None, packed_file=None, **kwargs):
     """
     constructor
 
-    :type listFile: string
+    :type listFile: string|None
     :param listFile: path to the file containing a list of wav file pathes (on path per line)
                      each line needs to contain exactly one wav file which is considered a sequence
+    :param str|None packed_file: instead of listFile. contains the time signal of each wav file as key "data"
     :type frameLength: int
     :param frameLength: length of one frame in samples
     :type frameShift: int
@@ -41,10 +46,18 @@ class RawWavDataset(CachedDataset2):
     """
     self._flag_buffering = False
     super(RawWavDataset, self).__init__(**kwargs)
+    assert frameLength and frameShift
     self._listFile = listFile
-    with open(self._listFile, 'r') as f:
-      self._wavFiles = f.readlines()
-    self._wavFiles = [l.strip() for l in self._wavFiles]
+    self._packed_file = None  # type: typing.Optional[PackedSeqsFile]
+    if packed_file:
+      assert not listFile, "%s: specify either listFile or packed_file" % self
+      self._packed_file = PackedSeqsFile(packed_file)
+      self._wavFiles = self._packed_file.seq_tags
+    else:
+      assert listFile, "%s: specify either listFile or packed_file" % self
+      with open(self._listFile, 'r') as f:
+        self._wavFiles = f.readlines()
+      self._wavFiles = [l.strip() for l in self._wavFiles]
     self._frameLength = frameLength
     self._frameShift = frameShift
     self._flag_pad = True  # specifies if signal is getting cut or zero padded for last frame
@@ -52,7 +65,9 @@ class RawWavDataset(CachedDataset2):
     self._num_seqs = len(self._wavFiles)
     self._seq_index_list = None
 
-    self._hdfBufferHandler, self._hdfBufferPath = self._open_hdf_buffer()
+    self._hdfBufferHandler, self._hdfBufferPath = None, None
+    if not self._packed_file:
+      self._hdfBufferHandler, self._hdfBufferPath = self._open_hdf_buffer()
 
     self.num_inputs = self._frameLength
     self.num_outputs = self._get_num_outputs(num_outputs)
@@ -66,6 +81,8 @@ class RawWavDataset(CachedDataset2):
     :returns DatasetSeq or None if seq_idx >= num_seqs.
     """
     wav_file_id = self._seq_index_list[seq_idx]
+    if self._packed_file:
+      return self._collect_single_seq_from_buffer(wav_file_id, seq_idx)
     if not self._isInBuffer(wav_file_id):
       self._load_wav_file_id_into_buffer(wav_file_id)
 
@@ -82,7 +99,7 @@ class RawWavDataset(CachedDataset2):
     """
     inputFeatures = self._get_input_features(wav_file_id)
     outputFeatures = self._get_output_features(wav_file_id)
-    inputFeatures = inputFeatures.astype(np.float32)
+    inputFeatures = inputFeatures.astype(np.float32, copy=False)
     if outputFeatures is not None:
       outputFeatures = outputFeatures.astype(np.float32)
     return DatasetSeq(seq_idx, inputFeatures, outputFeatures)
@@ -104,26 +121,27 @@ class RawWavDataset(CachedDataset2):
     :rtype: 2D numpy.ndarray (frames, features)
     :return: the 2d array containing the time signal segment for each frame
     """
-    if not self._isInBuffer(wavFileId):
-      self._load_wav_file_id_into_buffer(wavFileId)
-
-    timeSignal = self._hdfBufferHandler['timeSignal'][str(wavFileId)][...]
+    if self._packed_file:
+      timeSignal = self._packed_file.get_data(wavFileId, "data")  # zero-copy mmap slice
+    else:
+      if not self._isInBuffer(wavFileId):
+        self._load_wav_file_id_into_buffer(wavFileId)
+      timeSignal = self._hdfBufferHandler['timeSignal'][str(wavFileId)][...]
     frameLength = self._frameLength
     frameShift = self._frameShift
     nrOfFrames = int(np.ceil((float(timeSignal.shape[0]-frameLength)/frameShift) + 1))
     if self._flag_pad:
       padLength = (nrOfFrames -1) * frameShift + frameLength - timeSignal.shape[0]
-      timeSignalPad = np.zeros((timeSignal.shape[0] + padLength, ))
+      timeSignalPad = np.zeros((timeSignal.shape[0] + padLength, ), dtype=np.float32)
       timeSignalPad[0:timeSignal.shape[0]] = timeSignal
     else:
       nrOfFrames -= 1
       sigLength = (nrOfFrames -1) * frameShift + frameLength
-      timeSignalPad = np.zeros((sigLength, ))
-      timeSignalPad[:] = timeSignal[0:sigLength]
+      timeSignalPad = timeSignal[0:sigLength]
 
-    inputFeatures = np.zeros((nrOfFrames, frameLength), dtype=np.float32)
-    for i1 in range(nrOfFrames):
-      inputFeatures[i1,:] = timeSignalPad[i1*frameShift:(i1*frameShift+frameLength)]
+    # Gather all (overlapping) frames at once.
+    frameIdxs = np.arange(nrOfFrames)[:, None] * frameShift + np.arange(frameLength)[None, :]
+    inputFeatures = timeSignalPad[frameIdxs].astype(np.float32)
     return inputFeatures
 
   def _get_output_features(self, wav_file_id):
@@ -134,6 +152,8 @@ class RawWavDataset(CachedDataset2):
     :rtype: #TBD !!!
     :return: #TBD !!!
     """
+    if self._packed_file:
+      return None
     if not self._isInBuffer(wav_file_id):
       self._load_wav_file_id_into_buffer(wav_file_id)
     if not str(wav_file_id) in self._hdfBufferHandler['outputs'].keys():
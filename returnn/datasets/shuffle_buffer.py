@@ -0,0 +1,359 @@
+
+"""
+Provides :class:`ShuffleBuffer`, a streaming shuffler with bounded memory,
+for datasets which can only be read sequentially.
+See the ``shuffle_buffer`` option of :class:`CachedDataset2`, and :class:`ChunkShuffleDataset`.
+"""
+
+from __future__ import print_function
+
+import numpy
+import typing
+from random import Random
+from threading import Condition, Thread
+from returnn.log import log
+from .basic import DatasetSeq
+
+
+class _KeyArena:
+  """
+  Preallocated frame storage for one data key.
+  Sequences are appended at the end.
+  When the end is reached, all live sequences are compacted to the front.
+  """
+
+  def __init__(self, key, dtype, frame_shape, capacity):
+    """
+    :param str key:
+    :param numpy.dtype|str dtype:
+    :param tuple[int] frame_shape: shape of a single frame, i.e. the data shape without the time axis
+    :param int capacity: in frames
+    """
+    self.key = key
+    self.dtype = numpy.dtype(dtype)
+    self.frame_shape = frame_shape
+    self.capacity = capacity
+    self.buffer = numpy.empty((capacity,) + frame_shape, dtype=self.dtype)
+    self.end = 0  # frame offset behind the last stored seq
+    self.num_live_frames = 0
+
+  @property
+  def nbytes(self):
+    """
+    :rtype: int
+    """
+    return self.buffer.nbytes
+
+  def can_add(self, num_frames):
+    """
+    :param int num_frames:
+    :rtype: bool
+    """
+    return self.num_live_frames + num_frames <= self.capacity
+
+  def add(self, data, entries):
+    """
+    :param numpy.ndarray data: (time,)+frame_shape
+    :param list[_Entry] entries: all live entries, needed for compaction
+    :return: frame offset
+    :rtype: int
+    """
+    if data.shape[1:] != self.frame_shape:
+      raise Exception("%s: data key %r: frame shape %r does not match first seq %r" % (
+        ShuffleBuffer.__name__, self.key, data.shape[1:], self.frame_shape))
+    num_frames = data.shape[0]
+    assert self.can_add(num_frames)
+    if self.end + num_frames > self.capacity:
+      self._compact(entries)
+    offset = self.end
+    self.buffer[offset:offset + num_frames] = data
+    self.end += num_frames
+    self.num_live_frames += num_frames
+    return offset
+
+  def take(self, offset, num_frames):
+    """
+    :param int offset:
+    :param int num_frames:
+    :return: copy of the data, which is not stored in the arena anymore
+    :rtype: numpy.ndarray
+    """
+    data = self.buffer[offset:offset + num_frames].copy()
+    self.num_live_frames -= num_frames
+    if self.num_live_frames == 0:
+      self.end = 0
+    return data
+
+  def _compact(self, entries):
+    """
+    :param list[_Entry] entries:
+    """
+    pos = 0
+    for entry in sorted(entries, key=lambda e: e.offsets[self.key][0]):
+      offset, num_frames = entry.offsets[self.key]
+      if offset != pos:
+        # Overlapping ranges are fine here as long as we copy to the front.
+        self.buffer[pos:pos + num_frames] = self.buffer[offset:offset + num_frames]
+        entry.offsets[self.key] = (pos, num_frames)
+      pos += num_frames
+    assert pos == self.num_live_frames
+    self.end = pos
+
+
+class _Entry:
+  """
+  A sequence stored in the :class:`ShuffleBuffer`.
+  """
+
+  def __init__(self, seq_tag, ctc_targets=None):
+    """
+    :param str seq_tag:
+    :param numpy.ndarray|None ctc_targets:
+    """
+    self.seq_tag = seq_tag
+    self.ctc_targets = ctc_targets
+    self.offsets = {}  # type: typing.Dict[str,typing.Tuple[int,int]]  # key -> offset, num frames
+    self.scalar_keys = set()  # type: typing.Set[str]  # keys where the original data was 0-dim
+    self.features = None  # type: typing.Optional[typing.Dict[str,numpy.ndarray]]  # only without byte limit
+
+
+class ShuffleBuffer:
+  """
+  Reads sequences from a sequential source and returns them in a random order.
+
+  This works like reservoir sampling:
+  The buffer gets filled until it is full, i.e. the next sequence does not fit anymore,
+  and then a random sequence is drawn from it, which frees the space for the next sequences.
+  The memory is bounded by ``max_bytes``.
+  For every data key, there is one preallocated numpy array (:class:`_KeyArena`),
+  which is allocated for the first sequence, with a share of ``max_bytes`` relative to the bytes of that sequence.
+  Optionally, the buffer can be filled in a background thread.
+
+  The resulting order only depends on the random seed and the source, not on the timing of the background thread,
+  because a sequence is only drawn when the buffer is full or when the source is exhausted.
+  A single sequence which is bigger than the whole buffer is passed through directly.
+  """
+
+  def __init__(self, source, max_bytes=None, max_seqs=None, random_seed=1, background=False, name=None):
+    """
+    :param ()->(DatasetSeq|None) source: returns the next seq, or None at the end
+    :param int|None max_bytes: memory limit for the data
+    :param int|None max_seqs: limit for the number of seqs
+    :param int random_seed:
+    :param bool background: fill the buffer in a background thread
+    :param str|None name: for logging
+    """
+    assert max_bytes or max_seqs, "%s: need max_bytes or max_seqs" % self.__class__.__name__
+    self.source = source
+    self.max_bytes = max_bytes
+    self.max_seqs = max_seqs
+    self.name = name or self.__class__.__name__
+    self.rng = Random(random_seed)
+    self.background = background
+    self.condition = Condition()
+    self.arenas = None  # type: typing.Optional[typing.Dict[str,_KeyArena]]
+    self.entries = []  # type: typing.List[_Entry]
+    self.pending = None  # type: typing.Optional[DatasetSeq]
+    self.finished = False
+    self.stopped = False
+    self.exception = None  # type: typing.Optional[BaseException]
+    self.thread = None  # type: typing.Optional[Thread]
+
+  def __repr__(self):
+    return "<%s %r num_seqs=%i finished=%r>" % (self.__class__.__name__, self.name, len(self.entries), self.finished)
+
+  @property
+  def num_bytes(self):
+    """
+    :return: allocated bytes for the data (not the used bytes)
+    :rtype: int
+    """
+    if not self.arenas:
+      return 0
+    return sum([arena.nbytes for arena in self.arenas.values()])
+
+  def _init_arenas(self, seq):
+    """
+    :param DatasetSeq seq: first seq, used to define the dtypes, shapes, and the share of each key
+    """
+    frame_bytes = {}
+    seq_bytes = {}
+    for key, data in seq.features.items():
+      data = data.reshape((1,)) if data.ndim == 0 else data
+      frame_bytes[key] = max(data.dtype.itemsize * int(numpy.prod(data.shape[1:])), 1)
+      seq_bytes[key] = max(data.nbytes, 1)
+    total_seq_bytes = sum(seq_bytes.values())
+    self.arenas = {}
+    for key, data in seq.features.items():
+      data = data.reshape((1,)) if data.ndim == 0 else data
+      share = self.max_bytes * seq_bytes[key] // total_seq_bytes
+      capacity = max(share // frame_bytes[key], 1)
+      self.arenas[key] = _KeyArena(key=key, dtype=data.dtype, frame_shape=data.shape[1:], capacity=capacity)
+    print("%s: allocated %i bytes for keys %r" % (self.name, self.num_bytes, sorted(self.arenas.keys())), file=log.v4)
+
+  def _can_add(self, seq):
+    """
+    :param DatasetSeq seq:
+    :rtype: bool
+    """
+    if self.max_seqs and len(self.entries) >= self.max_seqs:
+      return False
+    if not self.max_bytes:
+      return True
+    if self.arenas is None:
+      self._init_arenas(seq)
+    for key, data in seq.features.items():
+      if key not in self.arenas:
+        raise Exception("%s: unexpected data key %r in seq %r, expected %r" % (
+          self.name, key, seq.seq_tag, sorted(self.arenas.keys())))
+      if not self.arenas[key].can_add(data.shape[0] if data.ndim >= 1 else 1):
+        return False
+    return True
+
+  def _add(self, seq):
+    """
+    :param DatasetSeq seq:
+    """
+    entry = _Entry(seq_tag=seq.seq_tag, ctc_targets=seq.ctc_targets)
+    if not self.max_bytes:
+      entry.features = seq.features
+    else:
+      for key, data in seq.features.items():
+        if data.ndim == 0:
+          entry.scalar_keys.add(key)
+          data = data.reshape((1,))
+        offset = self.arenas[key].add(data, entries=self.entries)
+        entry.offsets[key] = (offset, data.shape[0])
+    self.entries.append(entry)
+
+  def _take(self, entry, seq_idx):
+    """
+    :param _Entry entry: already removed from self.entries
+    :param int seq_idx:
+    :rtype: DatasetSeq
+    """
+    if entry.features is not None:
+      features = entry.features
+    else:
+      features = {}
+      for key, (offset, num_frames) in entry.offsets.items():
+        data = self.arenas[key].take(offset, num_frames)
+        if key in entry.scalar_keys:
+          data = data.reshape(())
+        features[key] = data
+    return DatasetSeq(seq_idx=seq_idx, features=features, ctc_targets=entry.ctc_targets, seq_tag=entry.seq_tag)
+
+  def _is_full(self):
+    """
+    :rtype: bool
+    """
+    return self.pending is not None and not self._can_add(self.pending)
+
+  def _fill_step(self):
+    """
+    Adds the pending seq, or reads the next seq from the source.
+    Must be called with self.condition held. The source is called without holding it.
+
+    :return: whether we made any progress. False if we are full or finished.
+    :rtype: bool
+    """
+    if self.finished or self.stopped:
+      return False
+    if self.pending is not None:
+      if not self._can_add(self.pending):
+        return False
+      self._add(self.pending)
+      self.pending = None
+      self.condition.notify_all()
+      return True
+    self.condition.release()
+    try:
+      seq = self.source()
+    finally:
+      self.condition.acquire()
+    if seq is None:
+      self.finished = True
+    else:
+      assert isinstance(seq, DatasetSeq)
+      self.pending = seq
+    self.condition.notify_all()
+    return True
+
+  def _thread_main(self):
+    try:
+      with self.condition:
+        while not self.stopped and not self.finished:
+          if not self._fill_step():
+            self.condition.wait()
+    except BaseException as exc:
+      with self.condition:
+        self.exception = exc
+        self.condition.notify_all()
+
+  def _start_thread(self):
+    self.thread = Thread(target=self._thread_main, name="%s fill thread" % self.name)
+    self.thread.daemon = True
+    self.thread.start()
+
+  def get_next(self, seq_idx):
+    """
+    :param int seq_idx: will be set for the returned seq
+    :return: random seq from the buffer, or None if the source is exhausted and the buffer is empty
+    :rtype: DatasetSeq|None
+    """
+    with self.condition:
+      assert not self.stopped
+      if self.background and not self.thread:
+        self._start_thread()
+      while not self.finished and not self._is_full():
+        if self.exception:
+          print("%s: exception in fill thread: %r" % (self.name, self.exception), file=log.v1)
+          raise self.exception
+        if self.background:
+          self.condition.wait()
+        else:
+          self._fill_step()
+      if self.entries:
+        i = self.rng.randrange(len(self.entries))
+        self.entries[i], self.entries[-1] = self.entries[-1], self.entries[i]
+        seq = self._take(self.entries.pop(), seq_idx=seq_idx)
+      elif self.pending is not None:  # bigger than the whole buffer
+        seq = self.pending
+        self.pending = None
+        seq.seq_idx = seq_idx
+      else:
+        assert self.finished
+        return None
+      self.condition.notify_all()
+      return seq
+
+  def stop(self):
+    """
+    Stops the background thread, if there is one. After this, the buffer cannot be used anymore.
+    """
+    with self.condition:
+      self.stopped = True
+      self.condition.notify_all()
+    if self.thread:
+      self.thread.join()
+      self.thread = None
+    self.entries = []
+    self.pending = None
+    self.arenas = None
+
+
+def get_shuffle_buffer_kwargs(opts):
+  """
+  :param int|dict[str]|None opts: from the ``shuffle_buffer`` dataset option.
+    int means the max number of bytes, otherwise a dict with kwargs for :class:`ShuffleBuffer`.
+  :rtype: dict[str]|None
+  """
+  if opts is None:
+    return None
+  if isinstance(opts, int):
+    return {"max_bytes": opts}
+  assert isinstance(opts, dict), "shuffle_buffer option: invalid %r" % (opts,)
+  opts = opts.copy()
+  for key in ["source", "random_seed", "name"]:
+    assert key not in opts, "shuffle_buffer option: %r is set automatically" % key
+  return opts
@@ -63,6 +63,9 @@ class Batch:
     # original data_shape = [0, 0], format (time,batch/slice)
     #          data_shape = [max_num_frames_per_slice, num_slices]
     self.seqs = []  # type: typing.List[BatchSeqCopyPart]
+    # Can be set to a seq idx <= start_seq, to keep earlier seqs loaded in the dataset,
+    # e.g. when the seqs are not ordered by seq idx. See :func:`Dataset.generate_sorted_batches`.
+    self.min_load_start_seq = None  # type: typing.Optional[int]
 
   def __repr__(self):
     return "<Batch start_seq:%r, len(seqs):%i>" % (self.start_seq, len(self.seqs))
@@ -155,6 +158,18 @@ class Batch:
       return None
     return max([s.seq_idx for s in self.seqs]) + 1
 
+  @property
+  def load_start_seq(self):
+    """
+    :return: start seq idx for :func:`Dataset.load_seqs`, i.e. start_seq or min_load_start_seq
+    :rtype: int|None
+    """
+    if not self.seqs:
+      return None
+    if self.min_load_start_seq is not None:
+      return min(self.start_seq, self.min_load_start_seq)
+    return self.start_seq
+
   def get_num_seqs(self):
     """
     :rtype: int
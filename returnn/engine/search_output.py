@@ -0,0 +1,171 @@
+
+"""
+Provides :class:`SearchOutputWriter`.
+This is shared across different backends.
+"""
+
+from __future__ import print_function
+
+import os
+import json
+import typing
+from returnn.log import log
+
+
+class SearchOutputWriter:
+  """
+  Writes the search output of every seq to the file as soon as possible,
+  such that the memory does not grow with the number of seqs,
+  and a crash only loses the seqs which were not written yet.
+
+  Supported file formats:
+
+  * "txt": one line per seq, ordered by the (corpus) seq idx.
+  * "py": a Python dict seq tag -> output, ordered by the (corpus) seq idx.
+  * "jsonl": one JSON object ``{"tag": ..., "seq_idx": ..., "output": ...}`` per line,
+    written in the order in which the seqs are finished.
+
+  For "txt" and "py", the formatted output of every seq is written in the same way to ``<filename>.unsorted.jsonl``
+  (with "text" instead of "output"), and :func:`close` sorts it by the seq idx into the final file.
+  All formats support to resume, i.e. to continue an existing (unsorted) file, see :func:`is_written`.
+  """
+
+  file_formats = ("txt", "py", "jsonl")
+
+  def __init__(self, filename, file_format="txt", resume=False):
+    """
+    :param str filename:
+    :param str file_format: "txt", "py" or "jsonl"
+    :param bool resume: if the (unsorted) file exists, keep all seqs written so far and append the remaining ones
+    """
+    assert file_format in self.file_formats, "%s: invalid file format %r" % (self.__class__.__name__, file_format)
+    self.filename = filename
+    self.file_format = file_format
+    self.written_seq_tags = set()  # type: typing.Set[str]
+    self.num_seqs_written = 0
+    self._unsorted_filename = None if file_format == "jsonl" else "%s.unsorted.jsonl" % filename
+    self._file_filename = self._unsorted_filename or filename
+    if self._unsorted_filename:
+      assert not os.path.exists(filename), "%s: file exists already" % self
+    if resume and os.path.exists(self._file_filename):
+      self._read_existing_file()
+      self._file = open(self._file_filename, "a")
+    else:
+      assert not os.path.exists(filename), "%s: file exists already" % self
+      self._file = open(self._file_filename, "w")
+
+  def __repr__(self):
+    return "<%s %r, format %r>" % (self.__class__.__name__, self.filename, self.file_format)
+
+  def _read_existing_file(self):
+    """
+    Collects the written seq tags, and removes a possibly incomplete last line, e.g. from a crash.
+    """
+    valid_size = 0
+    with open(self._file_filename, "rb") as f:
+      for line in f:
+        if not line.endswith(b"\n"):
+          break
+        try:
+          seq_tag = json.loads(line.decode("utf8"))["tag"]
+        except (ValueError, KeyError):
+          break
+        self.written_seq_tags.add(seq_tag)
+        valid_size += len(line)
+    if valid_size < os.path.getsize(self._file_filename):
+      print("%s: remove incomplete data at the end of the file." % self, file=log.v3)
+      with open(self._file_filename, "rb+") as f:
+        f.truncate(valid_size)
+    print("%s: resume, %i seqs written already." % (self, len(self.written_seq_tags)), file=log.v2)
+
+  def is_written(self, seq_tag):
+    """
+    :param str seq_tag:
+    :return: whether this seq was already written, i.e. can be skipped
+    :rtype: bool
+    """
+    return seq_tag in self.written_seq_tags
+
+  @classmethod
+  def _to_json(cls, output):
+    """
+    :param str|list[(float,str)]|dict[str] output:
+    :return: JSON serializable object
+    """
+    if isinstance(output, dict):
+      return {key: cls._to_json(value) for (key, value) in output.items()}
+    if isinstance(output, (list, tuple)):
+      return [cls._to_json(value) for value in output]
+    if isinstance(output, str):
+      return output
+    return float(output)  # e.g. numpy.float32 score
+
+  @classmethod
+  def from_json(cls, output):
+    """
+    :param str|list|dict[str] output: the "output" of a "jsonl" entry
+    :return: output like for :func:`add`, i.e. the hyps of a beam as tuples (score, str)
+    :rtype: str|list[(float,str)]|dict[str]
+    """
+    if isinstance(output, list):  # beam, list[(score, str)]
+      return [tuple(hyp) for hyp in output]
+    if isinstance(output, dict):  # multiple output layers
+      return {key: cls.from_json(value) for (key, value) in output.items()}
+    return output
+
+  def add(self, seq_idx, seq_tag, output):
+    """
+    :param int seq_idx: (corpus) seq idx. for "txt" and "py", we expect to get every seq idx 0..N-1 in the end
+    :param str seq_tag:
+    :param str|list[(float,str)]|dict[str] output: depending on whether the output is after decision,
+      or a dict in case of multiple output layers
+    """
+    entry = {"tag": seq_tag, "seq_idx": int(seq_idx)}
+    if self.file_format == "jsonl":
+      entry["output"] = self._to_json(output)
+    elif self.file_format == "txt":
+      entry["text"] = "%s\n" % (output,)
+    else:
+      from returnn.util.basic import better_repr
+      entry["text"] = "%r: %s,\n" % (seq_tag, better_repr(output))
+    self._file.write(json.dumps(entry) + "\n")
+    self._file.flush()
+    self.written_seq_tags.add(seq_tag)
+    self.num_seqs_written += 1
+
+  def close(self):
+    """
+    Finishes the file.
+    """
+    if not self._file:
+      return
+    self._file.close()
+    self._file = None
+    if self._unsorted_filename:
+      self._write_sorted()
+
+  def _write_sorted(self):
+    """
+    Writes the final "txt" or "py" file, sorted by the seq idx.
+    Only the file offsets of the entries are kept in memory.
+    """
+    offsets = []  # type: typing.List[typing.Tuple[int,int]]  # (seq_idx, offset)
+    with open(self._unsorted_filename, "rb") as f:
+      offset = 0
+      for line in f:
+        offsets.append((json.loads(line.decode("utf8"))["seq_idx"], offset))
+        offset += len(line)
+    offsets.sort()
+    for i, (seq_idx, _) in enumerate(offsets):
+      assert seq_idx == i, "%s: missing or duplicate seq idx %i" % (self, i)
+    tmp_filename = "%s.tmp-%i" % (self.filename, os.getpid())
+    with open(self._unsorted_filename, "rb") as f_in, open(tmp_filename, "w") as f_out:
+      if self.file_format == "py":
+        f_out.write("{\n")
+      for _, offset in offsets:
+        f_in.seek(offset)
+        f_out.write(json.loads(f_in.readline().decode("utf8"))["text"])
+      if self.file_format == "py":
+        f_out.write("}\n")
+    os.rename(tmp_filename, self.filename)
+    os.remove(self._unsorted_filename)
@@ -1,4 +1,5 @@
 
+#include <algorithm>
 #include <assert.h>
 #include <iostream>
 #include <fstream>
@@ -205,6 +206,14 @@ Ndarray* Ndarray_Copy(const Ndarray* self) {
 
 #include "tensorflow/core/public/version.h"
 
+#if (TF_MAJOR_VERSION == 2 && TF_MINOR_VERSION >= 21) || (TF_MAJOR_VERSION > 2)
+// tensorflow/core/platform/notification.h is empty now.
+#include "absl/synchronization/notification.h"
+#define TF_Notification absl::Notification
+#else
+#define TF_Notification Notification
+#endif
+
 #if (TF_MAJOR_VERSION == 1 && TF_MINOR_VERSION >= 6) || (TF_MAJOR_VERSION > 1)
 #define TF_issue_6602_workaround 0
 #define TWOD_LSTM_SUPPORT 1
@@ -606,6 +615,22 @@ static inline void device_free(void* ptr) { free(ptr); }
 #define start_dev_kernel2(kernel, dim_grid, dim_block, shared_size, args) \
 	{ for(_KernelLoop loop(dim_grid, dim_block, shared_size); !loop.finished(); loop.next()) { kernel args; } }
 
+// Calls work(begin, end) (e.g. a lambda with int64_t args) on sub-ranges covering [0, total).
+// With TF, this runs in parallel in the intra-op thread pool (see intra_op_parallelism_threads).
+// cost_per_unit is the approx number of cycles per unit, used to decide how much to split.
+// The kernel loop vars (threadIdx etc) are thread_local, thus start_dev_kernel can be used in work.
+#if TENSORFLOW
+#include "tensorflow/core/util/work_sharder.h"
+#define cpu_parallel_for(total, cost_per_unit, work) \
+	{ \
+		auto _worker_threads = context->device()->tensorflow_cpu_worker_threads(); \
+		Shard(_worker_threads->num_threads, _worker_threads->workers, total, cost_per_unit, work); \
+	}
+#else
+#define cpu_parallel_for(total, cost_per_unit, work) \
+	{ work(0, total); }
+#endif
+
 struct _int3 {
     int x, y, z;
     _int3(int _x=1, int _y=1, int _z=1) : x(_x), y(_y), z(_z) {}
@@ -995,7 +1020,7 @@ void debug_print(OpKernelContext* context, tensorflow::Tensor* v, const std::str
     std::string full_name = context->op_kernel().name() + ":" + name;
     tensorflow::Tensor cpy(v->dtype(), v->shape());
     if(context->op_device_context()) {  // GPU
-        Notification done_copy;
+        TF_Notification done_copy;
         context->op_device_context()->CopyDeviceTensorToCPU(
             v, name, static_cast<Device*>(context->device()), &cpy,
             [&done_copy](const Status& s) { done_copy.Notify(); });
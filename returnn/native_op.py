@@ -1133,6 +1133,93 @@ class NativeLstm2(NativeOpGenBase):
           idx += gridDim.x * blockDim.x;
         }
       }
+      """,
+    "lstm_cpu_kernels": """
+      #if !CUDA
+      // Same as lstm_kernel, but for the CPU.
+      // We loop over the seqs, and then contiguously over the cells of each gate,
+      // which is cache friendly and allows the compiler to vectorize.
+      static void lstm_cpu_fwd_step(
+        int n_batch, int n_cells, const float* mask,
+        float* h,
+        const float* prev_y,
+        const float* prev_c,
+        float* y,
+        float* c,
+        float* y_prev_out)
+      {
+        for(int b = 0; b < n_batch; ++b) {
+          float mask_b = mask[b];
+          float* cell_in = h + b * 4 * n_cells;
+          float* inp_gate = cell_in + n_cells;
+          float* fgt_gate = cell_in + 2 * n_cells;
+          float* out_gate = cell_in + 3 * n_cells;
+          const float* prev_y_b = prev_y + b * n_cells;
+          const float* prev_c_b = prev_c + b * n_cells;
+          float* y_b = y + b * n_cells;
+          float* c_b = c + b * n_cells;
+          float* y_prev_out_b = y_prev_out + b * n_cells;  // can be the same as prev_y
+          for(int k = 0; k < n_cells; ++k) {
+            float cell_in_k = tanhf(cell_in[k]);
+            float inp_gate_k = 1.f / (1.f + expf(-inp_gate[k]));
+            float fgt_gate_k = 1.f / (1.f + expf(-fgt_gate[k]));
+            float out_gate_k = 1.f / (1.f + expf(-out_gate[k]));
+            cell_in[k] = cell_in_k;
+            inp_gate[k] = inp_gate_k;
+            fgt_gate[k] = fgt_gate_k;
+            out_gate[k] = out_gate_k;
+            float c_k = (prev_c_b[k] * fgt_gate_k + cell_in_k * inp_gate_k) * mask_b
+                      + prev_c_b[k] * (1.f - mask_b);
+            c_b[k] = c_k;
+            float y_k = tanhf(c_k) * out_gate_k * mask_b;
+            y_b[k] = y_k;
+            y_prev_out_b[k] = y_k + prev_y_b[k] * (1.f - mask_b);
+          }
+        }
+      }
+
+      // Same as lstm_bwd_kernel, but for the CPU. See lstm_cpu_fwd_step.
+      static void lstm_cpu_bwd_step(
+        int n_batch, int n_cells, const float* mask,
+        const float* h,
+        const float* prev_c,
+        const float* d_y,
+        float* d_h,
+        float* d_c,
+        float* d_x,
+        float* d_x0)
+      {
+        for(int b = 0; b < n_batch; ++b) {
+          float mask_b = mask[b];
+          const float* cell_in = h + b * 4 * n_cells;
+          const float* inp_gate = cell_in + n_cells;
+          const float* fgt_gate = cell_in + 2 * n_cells;
+          const float* out_gate = cell_in + 3 * n_cells;
+          const float* prev_c_b = prev_c + b * n_cells;
+          const float* d_y_b = d_y + b * n_cells;
+          float* d_h_b = d_h + b * n_cells;
+          float* d_c_b = d_c + b * n_cells;
+          float* d_x_b = d_x + b * 4 * n_cells;
+          float* d_x0_b = d_x0 + b * 4 * n_cells;
+          for(int k = 0; k < n_cells; ++k) {
+            float d_y_k = (d_y_b[k] + d_h_b[k]) * mask_b;
+            float d_c_k = d_c_b[k] * mask_b;
+            float c_k = prev_c_b[k] * fgt_gate[k] + cell_in[k] * inp_gate[k];
+            float gc = tanhf(c_k);
+            float d_c2 = d_c_k + out_gate[k] * d_y_k * (1.f - gc * gc);
+            d_c_b[k] = fgt_gate[k] * d_c2 + d_c_b[k] * (1.f - mask_b);
+            d_x_b[k] = (1.f - cell_in[k] * cell_in[k]) * inp_gate[k] * d_c2;
+            d_x_b[k + n_cells] = (1.f - inp_gate[k]) * inp_gate[k] * cell_in[k] * d_c2;
+            d_x_b[k + 2 * n_cells] = (1.f - fgt_gate[k]) * fgt_gate[k] * prev_c_b[k] * d_c2;
+            d_x_b[k + 3 * n_cells] = (1.f - out_gate[k]) * out_gate[k] * gc * d_y_k;
+            // Reset if used frame, otherwise leave as-is.
+            d_h_b[k] *= (1.f - mask_b);
+          }
+          for(int k = 0; k < 4 * n_cells; ++k)
+            d_x0_b[k] = d_x_b[k] + d_x0_b[k] * (1.f - mask_b);
+        }
+      }
+      #endif
       """
   }
 
@@ -1210,6 +1297,42 @@ class NativeLstm2(NativeOpGenBase):
         end = 0;
         start = T - start - 1;
       }
+      int last_t = start + ((end - start) / step) * step;
+
+    #if !CUDA
+      // The seqs are independent of each other. Thus on CPU, we split the batch into slices,
+      // and each slice goes through all the frames on its own, in parallel.
+      // There is no sync per frame, and the data of a slice stays in the cache of its thread.
+      auto fwd_batch_slice = [&](int64_t b_begin, int64_t b_end) {
+        int n_batch_slice = b_end - b_begin;
+        float* y_prev_slice = y_prev + b_begin * n_cells;
+        int t = start;
+        for(; (step > 0) ? (t <= end) : (t >= end); t += step) {
+          float* h_slice = data_ptr(H, t) + b_begin * n_cells * 4;
+          // H[t] += Y[t-1] * W
+          affine_raw(
+            (t != start) ? y_prev_slice : (Ndarray_DEV_DATA(y0) + b_begin * n_cells), n_batch_slice, n_cells,
+            Ndarray_DEV_DATA(W), n_cells, n_cells * 4,
+            h_slice, n_batch_slice, n_cells * 4,
+            false, false);
+
+          lstm_cpu_fwd_step(
+            n_batch_slice,
+            n_cells,
+            Ndarray_DEV_DATA(i) + t * n_batch + b_begin,
+            h_slice,  // inplace
+            (t != start) ? y_prev_slice : (Ndarray_DEV_DATA(y0) + b_begin * n_cells),
+            ((t != start) ? data_ptr(C, t-step) : Ndarray_DEV_DATA(c0)) + b_begin * n_cells,
+            data_ptr(Y, t) + b_begin * n_cells,  // out
+            data_ptr(C, t) + b_begin * n_cells,  // out
+            y_prev_slice  // out
+          );
+        }
+      };
+      // Cost per seq: the recurrent matrix mult, and the gates.
+      cpu_parallel_for(n_batch, T * n_cells * (n_cells * 8 + 100), fwd_batch_slice);
+
+    #else
       int t = start;
       for(; (step > 0) ? (t <= end) : (t >= end); t += step) {
         // H[t] += Y[t-1] * W
@@ -1231,8 +1354,9 @@ class NativeLstm2(NativeOpGenBase):
           y_prev  // out
         ));
       }
+    #endif
 
-      Ndarray_memcpy(Ndarray_DEV_DATA(d), data_ptr(C, t - step), n_batch * n_cells * sizeof(float));
+      Ndarray_memcpy(Ndarray_DEV_DATA(d), data_ptr(C, last_t), n_batch * n_cells * sizeof(float));
 
       device_free(y_prev);
     }
@@ -1357,6 +1481,41 @@ class NativeLstm2(NativeOpGenBase):
       int end = start + (num_steps - 1) * step;  // inclusive
       assert_cmp(end, >=, 0);
       assert_cmp(end, <, T);
+
+    #if !CUDA
+      // Split the batch into slices, which go through all frames in parallel. See the forward code.
+      auto bwd_batch_slice = [&](int64_t b_begin, int64_t b_end) {
+        int n_batch_slice = b_end - b_begin;
+        float* dy0_slice = Ndarray_DEV_DATA(Dy0) + b_begin * n_cells;
+        int t = end;  // go backwards
+        for(; (step > 0) ? (t >= start) : (t <= start); t -= step) {
+          bool right = (step > 0) ? (t - step >= start) : (t - step <= start);
+          float* dx_slice = data_ptr(DX, t) + b_begin * n_cells * 4;
+
+          lstm_cpu_bwd_step(
+            n_batch_slice,
+            n_cells,
+            Ndarray_DEV_DATA(i) + t * n_batch + b_begin,
+            data_ptr(H, t) + b_begin * n_cells * 4,
+            (right ? data_ptr(C, t-step) : Ndarray_DEV_DATA(c0)) + b_begin * n_cells,
+            data_ptr(DY, t) + b_begin * n_cells,
+            dy0_slice,  // in+out, error from prev frame, excluding DY. reset here, updated below
+            Ndarray_DEV_DATA(Dc0) + b_begin * n_cells,  // in+out, working inplace. initially Dd
+            dx_slice,  // out
+            dx0 + b_begin * n_cells * 4  // out
+          );
+
+          // (Dy0) DY[t-1] += DX[t] * W^T
+          affine_raw(
+            dx_slice, n_batch_slice, n_cells * 4,
+            Ndarray_DEV_DATA(W), n_cells, n_cells * 4,
+            dy0_slice, n_batch_slice, n_cells,
+            false, true);
+        }
+      };
+      cpu_parallel_for(n_batch, num_steps * n_cells * (n_cells * 8 + 100), bwd_batch_slice);
+
+    #else
       int t = end;  // go backwards
       for(; (step > 0) ? (t >= start) : (t <= start); t -= step) {
         bool right = (step > 0) ? (t - step >= start) : (t - step <= start);
@@ -1383,6 +1542,7 @@ class NativeLstm2(NativeOpGenBase):
           Ndarray_DEV_DATA(Dy0), n_batch, n_cells,
           false, true);
       }
+    #endif
 
       //DW = Y[0..T-2]^T * DX[1..T-1]  (if step==1)
       if(num_steps > 1) {
@@ -1394,7 +1554,7 @@ class NativeLstm2(NativeOpGenBase):
             true, false, 0.0f, 1.0f);
         } else {
           // Unfortunately we cannot do efficient striding. Thus loop again.
-          t = end - step;  // one before
+          int t = end - step;  // one before
           for(; (step > 0) ? (t >= start) : (t <= start); t -= step) {
             affine_raw(
               data_ptr(Y, t), n_batch, n_cells,
@@ -5691,6 +5851,44 @@ class NextEditDistanceRowOp(NativeOpGenBase):
           idx += gridDim.x * blockDim.x;
         }
       }
+    """,
+    "002_next_row_cpu": """
+      #if !CUDA
+      // Same as next_row_kernel, for the batch entries [batch_begin, batch_end).
+      static void next_row_cpu(
+            int batch_begin, int batch_end, int n_b_max_len,
+            const int32_t* last_row,
+            const int32_t* a, const int32_t* a_n, const int32_t* a_ended,
+            const int32_t* b, const int32_t* b_len,
+            int32_t* next_row
+      ) {
+        for(int batch_idx = batch_begin; batch_idx < batch_end; ++batch_idx) {
+          const int32_t* last_row_ = last_row + batch_idx * (n_b_max_len + 1);
+          const int32_t* b_ = b + batch_idx * n_b_max_len;
+          int32_t* next_row_ = next_row + batch_idx * (n_b_max_len + 1);
+          int len = b_len[batch_idx];
+          int last_dist;
+          if(!a_ended[batch_idx]) {
+            int32_t a_label = a[batch_idx];
+            last_dist = a_n[batch_idx] + 1;  // Initial deletion error.
+            next_row_[0] = last_dist;
+            for(int t_b = 1; t_b <= len; ++t_b) {
+              int ins_error = last_row_[t_b] + 1;
+              int del_error = last_dist + 1;
+              int sub_error = last_row_[t_b - 1] + (a_label != b_[t_b - 1]);
+              last_dist = std::min(ins_error, std::min(del_error, sub_error));
+              next_row_[t_b] = last_dist;
+            }
+          }
+          else {  // a ended
+            memcpy(next_row_, last_row_, (len + 1) * sizeof(int32_t));
+            last_dist = last_row_[len];
+          }
+          // Repeat last entry.
+          std::fill(next_row_ + len + 1, next_row_ + n_b_max_len + 1, last_dist);
+        }
+      }
+      #endif
     """
   }
 
@@ -5724,6 +5922,18 @@ class NextEditDistanceRowOp(NativeOpGenBase):
     assert_cmp(Ndarray_DIMS(b)[1], ==, n_b_max_len);
     assert_cmp(Ndarray_DIMS(b_len)[0], ==, n_batch);
 
+  #if !CUDA
+    // The batch entries (incl. beam) are independent, thus we can do them in parallel.
+    auto next_row_batch_slice = [&](int64_t batch_begin, int64_t batch_end) {
+      next_row_cpu(
+        batch_begin, batch_end, n_b_max_len,
+        Ndarray_DEV_DATA_int32(last_row),
+        Ndarray_DEV_DATA_int32(a), Ndarray_DEV_DATA_int32(a_n), Ndarray_DEV_DATA_int32(a_ended),
+        Ndarray_DEV_DATA_int32(b), Ndarray_DEV_DATA_int32(b_len),
+        Ndarray_DEV_DATA_int32(out));
+    };
+    cpu_parallel_for(n_batch, (n_b_max_len + 1) * 10, next_row_batch_slice);
+  #else
     start_dev_kernel(next_row_kernel, (
       n_batch, n_b_max_len,
       Ndarray_DEV_DATA_int32(last_row),
@@ -5731,6 +5941,7 @@ class NextEditDistanceRowOp(NativeOpGenBase):
       Ndarray_DEV_DATA_int32(b), Ndarray_DEV_DATA_int32(b_len),
       Ndarray_DEV_DATA_int32(out)
     ));
+  #endif
   """
 
   c_bw_code = None
@@ -5826,6 +6037,87 @@ class NextEditDistanceReduceOp(NativeOpGenBase):
           idx += gridDim.x * blockDim.x;
         }
       }
+    """,
+    "002_calc_result_cpu": """
+      #if !CUDA
+      // Like calc_result_kernel, for a single batch entry and a single label,
+      // which matches the symbols in b only if can_match.
+      static int32_t calc_result_cpu_single(
+            const int32_t* last_row, int32_t a_label, bool can_match, int32_t a_n,
+            const int32_t* b, int32_t b_len, bool optimal_completion
+      ) {
+        int last_dist = a_n + 1;  // Initial deletion error.
+        int total_min_error = last_dist;
+        for(int t_b = 1; t_b <= b_len; ++t_b) {
+          int ins_error = last_row[t_b] + 1;
+          int del_error = last_dist + 1;
+          int sub_error = last_row[t_b - 1] + ((can_match && a_label == b[t_b - 1]) ? 0 : 1);
+          last_dist = std::min(ins_error, std::min(del_error, sub_error));
+          total_min_error = std::min(total_min_error, last_dist);
+        }
+        return optimal_completion ? total_min_error : last_dist;
+      }
+
+      // Same as calc_result_kernel, for the batch entries [batch_begin, batch_end), and all labels.
+      // The result only depends on the label via the matches with b.
+      // Thus all labels which do not occur in b get the same result,
+      // and we only need to calculate it separately for the distinct labels of b,
+      // i.e. O(b_len * (1 + num distinct labels of b)) instead of O(b_len * n_labels) per batch entry.
+      static void calc_result_cpu(
+            int batch_begin, int batch_end, int n_b_max_len, int n_labels,
+            const int32_t* last_row,
+            const int32_t* a, const int32_t* a_n, const int32_t* a_ended,
+            const int32_t* b, const int32_t* b_len,
+            int32_t* result,
+            bool optimal_completion,
+            bool a_broadcast_batch,
+            int32_t a_blank_idx
+      ) {
+        std::vector<std::pair<int32_t, int32_t> > b_label_results;  // sorted distinct labels of b -> result
+        for(int batch_idx = batch_begin; batch_idx < batch_end; ++batch_idx) {
+          const int32_t* last_row_ = last_row + batch_idx * (n_b_max_len + 1);
+          const int32_t* b_ = b + batch_idx * n_b_max_len;
+          const int32_t* a_ = a + (a_broadcast_batch ? 0 : batch_idx) * n_labels;
+          int32_t* result_ = result + batch_idx * n_labels;
+          int len = b_len[batch_idx];
+
+          // a ended or blank: just copy over.
+          int32_t copy_result = last_row_[len];
+          if(optimal_completion)
+            copy_result = *std::min_element(last_row_, last_row_ + len + 1);
+          if(a_ended[batch_idx]) {
+            std::fill(result_, result_ + n_labels, copy_result);
+            continue;
+          }
+
+          int32_t no_match_result = calc_result_cpu_single(
+            last_row_, 0, false, a_n[batch_idx], b_, len, optimal_completion);
+          b_label_results.clear();
+          for(int t_b = 0; t_b < len; ++t_b)
+            b_label_results.push_back(std::make_pair(b_[t_b], 0));
+          std::sort(b_label_results.begin(), b_label_results.end());
+          b_label_results.erase(
+            std::unique(b_label_results.begin(), b_label_results.end()), b_label_results.end());
+          for(auto& label_result : b_label_results)
+            label_result.second = calc_result_cpu_single(
+              last_row_, label_result.first, true, a_n[batch_idx], b_, len, optimal_completion);
+
+          for(int label_idx = 0; label_idx < n_labels; ++label_idx) {
+            int32_t a_label = a_[label_idx];
+            if(a_label == a_blank_idx) {
+              result_[label_idx] = copy_result;
+              continue;
+            }
+            auto it = std::lower_bound(
+              b_label_results.begin(), b_label_results.end(), std::make_pair(a_label, std::numeric_limits<int32_t>::min()));
+            if(it != b_label_results.end() && it->first == a_label)
+              result_[label_idx] = it->second;
+            else
+              result_[label_idx] = no_match_result;
+          }
+        }
+      }
+      #endif
     """
   }
 
@@ -5865,6 +6157,20 @@ class NextEditDistanceReduceOp(NativeOpGenBase):
     assert_cmp(Ndarray_DIMS(b)[1], ==, n_b_max_len);
     assert_cmp(Ndarray_DIMS(b_len)[0], ==, n_batch);
 
+  #if !CUDA
+    // The batch entries (incl. beam) are independent, thus we can do them in parallel.
+    auto calc_result_batch_slice = [&](int64_t batch_begin, int64_t batch_end) {
+      calc_result_cpu(
+        batch_begin, batch_end, n_b_max_len, n_labels,
+        Ndarray_DEV_DATA_int32(last_row),
+        Ndarray_DEV_DATA_int32(a), Ndarray_DEV_DATA_int32(a_n), Ndarray_DEV_DATA_int32(a_ended),
+        Ndarray_DEV_DATA_int32(b), Ndarray_DEV_DATA_int32(b_len),
+        Ndarray_DEV_DATA_int32(out),
+        optimal_completion,
+        a_broadcast_batch, a_blank_idx);
+    };
+    cpu_parallel_for(n_batch, (n_b_max_len + 1) * (n_b_max_len + 1) * 10 + n_labels * 10, calc_result_batch_slice);
+  #else
     start_dev_kernel(calc_result_kernel, (
       n_batch, n_b_max_len, n_labels,
       Ndarray_DEV_DATA_int32(last_row),
@@ -5874,6 +6180,7 @@ class NextEditDistanceReduceOp(NativeOpGenBase):
       optimal_completion,
       a_broadcast_batch, a_blank_idx
     ));
+  #endif
   """
 
   c_bw_code = None
@@ -0,0 +1,212 @@
+
+"""
+Provides :class:`SprintAutomataCache`, a cache for the automata (FSAs) which we get from Sprint per segment,
+e.g. for fast Baum-Welch training (see :func:`returnn.tf.sprint.get_sprint_automata_for_batch_op`).
+"""
+
+from __future__ import print_function
+
+import os
+import hashlib
+import typing
+import numpy
+from collections import OrderedDict
+from threading import RLock
+
+
+class SprintAutomataCache:
+  """
+  Cache for the automata per segment.
+  The automaton of a segment is fixed for a given Sprint config,
+  thus we cache it by the segment name, for one specific Sprint config (see ``config_hash``).
+  The config hash also covers the size and modification time of the files which the Sprint options refer to,
+  e.g. the lexicon, the state tying or the CART file (see :func:`get_referenced_files`).
+  Files which Sprint gets in some other way (e.g. via a path which is composed of Sprint variables) are not covered,
+  thus you must clear ``cache_dir`` by hand when you modify them.
+
+  The automata are kept in memory, up to ``max_bytes`` (least recently used are removed first).
+  Optionally, they are also stored on disk in ``cache_dir``, one ``.npy`` file per segment,
+  which can be loaded via mmap, such that the cache persists across runs.
+
+  This is thread-safe.
+  """
+
+  def __init__(self, config_hash, max_bytes=2 ** 30, cache_dir=None):
+    """
+    :param str config_hash: identifies the Sprint config, see :func:`get_config_hash`
+    :param int max_bytes: memory limit for the in-memory cache. 0 to disable it
+    :param str|None cache_dir: if given, the automata are also stored in this directory
+    """
+    self.config_hash = config_hash
+    self.max_bytes = max_bytes
+    self.cache_dir = os.path.join(cache_dir, config_hash) if cache_dir else None
+    if self.cache_dir:
+      from returnn.util.basic import maybe_make_dirs
+      maybe_make_dirs(self.cache_dir)
+    self.lock = RLock()
+    self._cache = OrderedDict()  # type: typing.Dict[str,typing.Tuple[int,numpy.ndarray,numpy.ndarray]]
+    self._cache_bytes = 0
+    self.num_hits = 0
+    self.num_misses = 0
+
+  def __repr__(self):
+    return "<%s %s, %i segments, %i bytes, %i hits, %i misses>" % (
+      self.__class__.__name__, self.config_hash, len(self._cache), self._cache_bytes, self.num_hits, self.num_misses)
+
+  @classmethod
+  def get_config_hash(cls, sprint_opts):
+    """
+    :param dict[str] sprint_opts: the options of :class:`SprintSubprocessInstance`, e.g. with the Sprint config
+    :return: hash of the options and of the size and modification time of the referenced files,
+      e.g. as ``config_hash``
+    :rtype: str
+    """
+    from returnn.util.basic import make_hashable
+    files = [
+      (filename, os.path.getsize(filename), os.path.getmtime(filename))
+      for filename in cls.get_referenced_files(sprint_opts)]
+    s = repr((sorted(make_hashable(sprint_opts).items()), files))
+    return hashlib.sha1(s.encode("utf8")).hexdigest()[:16]
+
+  @classmethod
+  def get_referenced_files(cls, sprint_opts):
+    """
+    :param dict[str] sprint_opts: see :func:`get_config_hash`
+    :return: existing files in the options, e.g. ``--config=...`` or ``--*.lexicon.file=...`` in ``sprintConfigStr``,
+      and (recursively) the files in the Sprint config files (``key = value`` and ``include ...`` lines)
+    :rtype: list[str]
+    """
+    files = set()
+    queue = []
+
+    def add_file(value):
+      """
+      :param str value: maybe a filename
+      """
+      if not value or not os.path.isfile(value):
+        return
+      filename = os.path.abspath(value)
+      if filename in files:
+        return
+      files.add(filename)
+      if filename.endswith(".config"):
+        queue.append(filename)
+
+    for value in sprint_opts.values():
+      if not isinstance(value, str):
+        continue
+      for token in value.split():
+        add_file(token)
+        if "=" in token:
+          add_file(token.split("=", 1)[1])
+    while queue:
+      config_filename = queue.pop(0)
+      with open(config_filename) as f:
+        for line in f:
+          line = line.split("#", 1)[0].strip()
+          if line.startswith("include "):
+            value = line[len("include "):].strip()
+          elif "=" in line:
+            value = line.split("=", 1)[1].strip()
+          else:
+            continue
+          add_file(os.path.join(os.path.dirname(config_filename), value))
+    return sorted(files)
+
+  def _get_filename(self, segment_name):
+    """
+    :param str segment_name:
+    :rtype: str
+    """
+    return os.path.join(self.cache_dir, "%s.npy" % hashlib.sha1(segment_name.encode("utf8")).hexdigest())
+
+  def get(self, segment_name):
+    """
+    :param str segment_name:
+    :return: (num_states, edges, weights) or None if not cached.
+      edges of shape (3, num_edges), each (from, to, emission-idx), of dtype uint32.
+      weights of shape (num_edges,), of dtype float32.
+    :rtype: (int, numpy.ndarray, numpy.ndarray)|None
+    """
+    with self.lock:
+      if segment_name in self._cache:
+        self._cache[segment_name] = self._cache.pop(segment_name)  # mark as most recently used
+        self.num_hits += 1
+        return self._cache[segment_name]
+    if self.cache_dir:
+      filename = self._get_filename(segment_name)
+      if os.path.exists(filename):
+        # Layout: num_states, num_edges, edges (3 * num_edges), weights (num_edges, float32 as uint32).
+        data = numpy.load(filename, mmap_mode="r")
+        num_states, num_edges = int(data[0]), int(data[1])
+        edges = data[2:2 + 3 * num_edges].reshape((3, num_edges))
+        weights = data[2 + 3 * num_edges:2 + 4 * num_edges].view("float32")
+        with self.lock:
+          self.num_hits += 1
+          self._add_to_memory(segment_name, (num_states, edges, weights))
+        return num_states, edges, weights
+    with self.lock:
+      self.num_misses += 1
+    return None
+
+  def add(self, segment_name, num_states, edges, weights):
+    """
+    :param str segment_name:
+    :param int num_states:
+    :param numpy.ndarray edges: (3, num_edges), each (from, to, emission-idx)
+    :param numpy.ndarray weights: (num_edges,)
+    """
+    edges = numpy.asarray(edges, dtype="uint32")
+    weights = numpy.asarray(weights, dtype="float32")
+    num_edges = weights.shape[0]
+    assert edges.shape == (3, num_edges)
+    if self.cache_dir:
+      data = numpy.concatenate([
+        numpy.array([num_states, num_edges], dtype="uint32"), edges.reshape((-1,)), weights.view("uint32")])
+      filename = self._get_filename(segment_name)
+      tmp_filename = "%s.tmp-%i" % (filename, os.getpid())
+      with open(tmp_filename, "wb") as f:
+        numpy.save(f, data)
+      os.rename(tmp_filename, filename)
+    with self.lock:
+      self._add_to_memory(segment_name, (int(num_states), edges, weights))
+
+  def _add_to_memory(self, segment_name, entry):
+    """
+    :param str segment_name:
+    :param (int,numpy.ndarray,numpy.ndarray) entry:
+    """
+    if segment_name in self._cache:
+      return
+    num_bytes = entry[1].nbytes + entry[2].nbytes
+    if num_bytes > self.max_bytes:
+      return
+    while self._cache_bytes + num_bytes > self.max_bytes:
+      _, (_, old_edges, old_weights) = self._cache.popitem(last=False)
+      self._cache_bytes -= old_edges.nbytes + old_weights.nbytes
+    self._cache[segment_name] = entry
+    self._cache_bytes += num_bytes
+
+  @staticmethod
+  def make_batch_automaton(entries):
+    """
+    Combines the automata of the seqs of a batch into one automaton.
+
+    :param list[(int,numpy.ndarray,numpy.ndarray)] entries: (num_states, edges, weights) per seq
+    :return: (edges, weights, start_end_states). all together in one automaton.
+      edges are of shape (4, num_edges), each (from, to, emission-idx, seq-idx), of dtype uint32.
+      weights are of shape (num_edges,), of dtype float32.
+      start_end_states are of shape (2, batch), each (start,stop) state idx, of dtype uint32.
+    :rtype: (numpy.ndarray, numpy.ndarray, numpy.ndarray)
+    """
+    n_batch = len(entries)
+    num_states = numpy.array([num_states for (num_states, _, _) in entries], dtype="uint32")
+    num_edges = numpy.array([weights.shape[0] for (_, _, weights) in entries], dtype="int64")
+    state_offsets = numpy.cumsum(num_states, dtype="uint32") - num_states  # (batch,)
+    edges = numpy.empty((4, int(num_edges.sum())), dtype="uint32")
+    edges[:3] = numpy.concatenate([edges_ for (_, edges_, _) in entries], axis=1)
+    edges[3] = numpy.repeat(numpy.arange(n_batch, dtype="uint32"), num_edges)
+    edges[0:2] += numpy.repeat(state_offsets, num_edges)[None, :]
+    weights = numpy.concatenate([weights_ for (_, _, weights_) in entries]).astype("float32", copy=False)
+    start_end_states = numpy.stack([state_offsets, state_offsets + num_states - 1])
+    return edges, weights, start_end_states
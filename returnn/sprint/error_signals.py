@@ -16,11 +16,25 @@ import time
 import atexit
 import signal
 import typing
-from threading import RLock, Thread
+from threading import RLock, Condition, Thread
 import returnn.util.task_system as task_system
-from returnn.util.task_system import Pickler, Unpickler, numpy_set_unused
+from returnn.util.task_system import Pickler, Unpickler, numpy_set_unused, SharedMem, SharedNumpyArray
 from returnn.util.basic import eval_shell_str, make_hashable, BackendEngine
 from returnn.log import log
+from returnn.sprint.automata_cache import SprintAutomataCache
+try:
+  # noinspection PyCompatibility
+  from Queue import Queue, Empty
+except ImportError:
+  # noinspection PyCompatibility,PyUnresolvedReferences
+  from queue import Queue, Empty
+
+
+class SprintException(RuntimeError):
+  """
+  Sprint handled a command but reported an exception for it (see :func:`PythonControl.handle_next`).
+  The communication with the Sprint subprocess is still in sync, i.e. the instance can be used further.
+  """
 
 
 class SprintSubprocessInstance:
@@ -35,6 +49,8 @@ class SprintSubprocessInstance:
     "exit" -> (exit)
     "get_loss_and_error_signal", seg_name, seg_len, posteriors -> "ok", loss, error_signal
       Numpy arrays encoded via TaskSystem.Pickler (which is optimized for Numpy).
+      With useSharedMem, the posteriors and error signals are passed via shared memory (SharedNumpyArray),
+      and only the reference to the shared memory goes through the pipe.
   On the Sprint side, we handle this via the SprintControl Sprint interface.
   """
 
@@ -43,7 +59,7 @@ class SprintSubprocessInstance:
   # Keep argument names as is, as these are coming directly from a user config file.
   # noinspection PyPep8Naming
   def __init__(self, sprintExecPath, minPythonControlVersion=2, sprintConfigStr="", sprintControlConfig=None,
-               usePythonSegmentOrder=True):
+               usePythonSegmentOrder=True, useSharedMem=False):
     """
     :param str sprintExecPath: this executable will be called for the sub proc.
     :param int minPythonControlVersion: will be checked in the subprocess. via Sprint PythonControl
@@ -51,6 +67,8 @@ class SprintSubprocessInstance:
       can have "config:" prefix - in that case, looked up in config.
       handled via eval_shell_str(), can thus have lazy content (if it is callable, will be called).
     :param dict[str]|None sprintControlConfig: passed to SprintControl.init().
+    :param bool usePythonSegmentOrder:
+    :param bool useSharedMem: pass the posteriors and error signals via shared memory instead of the pipe
     """
     assert os.path.exists(sprintExecPath)
     self.sprintExecPath = sprintExecPath
@@ -63,6 +81,10 @@ class SprintSubprocessInstance:
     self.sprintConfig = eval_shell_str(sprintConfigStr)
     self.sprintControlConfig = sprintControlConfig
     self.usePythonSegmentOrder = usePythonSegmentOrder
+    if useSharedMem and not SharedMem.is_shmget_functioning():
+      print("SprintSubprocessInstance: shared memory not functioning, will not use it", file=log.v3)
+      useSharedMem = False
+    self.useSharedMem = useSharedMem
     self.child_pid = None  # type: typing.Optional[int]
     self.parent_pid = os.getpid()
     # There is no generic way to see whether Python is exiting.
@@ -180,7 +202,7 @@ class SprintSubprocessInstance:
     config_str = "c2p_fd:%i,p2c_fd:%i" % (
         self.pipe_c2p[1].fileno(), self.pipe_p2c[0].fileno())
     config_str += ",minPythonControlVersion:%i" % self.minPythonControlVersion
-    if task_system.SharedMemNumpyConfig["enabled"]:
+    if task_system.SharedMemNumpyConfig["enabled"] or self.useSharedMem:
       config_str += ",EnableAutoNumpySharedMemPickling:True"
     if self.sprintControlConfig:
       config_str += "," + ",".join(["%s:%s" % (k, v) for (k, v) in sorted(self.sprintControlConfig.items())])
@@ -245,8 +267,15 @@ class SprintSubprocessInstance:
     self._cur_seg_name = seg_name
     assert seg_len == log_posteriors.shape[0]
     self._cur_posteriors_shape = log_posteriors.shape
+    log_posteriors = log_posteriors.astype("float32", copy=False)
+    if self.useSharedMem:
+      # Copy directly into shared memory. The child marks it as unused when it is done with it.
+      try:
+        log_posteriors = SharedNumpyArray.create_copy(log_posteriors).create_numpy_array()
+      except SharedMem.ShmException as exc:
+        print("SprintSubprocessInstance: SharedNumpyArray exception: %s" % exc, file=log.v4)
     try:
-      self._send(("get_loss_and_error_signal", seg_name, seg_len, log_posteriors.astype("float32", copy=False)))
+      self._send(("get_loss_and_error_signal", seg_name, seg_len, log_posteriors))
     except (IOError, EOFError):
       raise
     else:
@@ -295,31 +324,22 @@ class SprintSubprocessInstance:
 
 class ReaderThread(Thread):
   """
-  Sprint reader thread.
+  Sprint worker thread.
+  Takes jobs from a queue and runs them on some free Sprint instance of the pool.
   """
-  def __init__(self, instance, instance_idx, batch_idxs, tags, seq_lengths, log_posteriors,
-               batch_loss, batch_error_signal):
+  def __init__(self, pool, thread_idx, jobs, func):
     """
-    :param SprintSubprocessInstance instance:
-    :param int instance_idx:
-    :param list[int] batch_idxs:
-    :param list[str] tags: seq names, length = batch
-    :param numpy.ndarray seq_lengths: 1d (batch)
-    :param numpy.ndarray log_posteriors: 3d (time,batch,label)
-    :param numpy.ndarray batch_loss: 1d (batch). will write result into it.
-    :param numpy.ndarray batch_error_signal: 3d (time,batch,label). will write results into it.
+    :param SprintInstancePool pool:
+    :param int thread_idx:
+    :param queue.Queue jobs: job args, e.g. the batch idx
+    :param ((SprintSubprocessInstance,T)->None) func: called for each job
     """
     super(ReaderThread, self).__init__(
-      name="SprintErrorSignals reader thread for Sprint instance %i" % instance_idx)
+      name="SprintErrorSignals reader thread %i" % thread_idx)
     self.daemon = True
-    self.instance_idx = instance_idx
-    self.instance = instance
-    self.batch_idxs = batch_idxs
-    self.tags = tags
-    self.seq_lengths = seq_lengths
-    self.log_posteriors = log_posteriors
-    self.batch_loss = batch_loss
-    self.batch_error_signal = batch_error_signal
+    self.pool = pool
+    self.jobs = jobs
+    self.func = func
     self.exception = None
     self.start()
 
@@ -328,15 +348,7 @@ class ReaderThread(Thread):
     Main thread func.
     """
     try:
-      for b in self.batch_idxs:
-        self.instance.get_loss_and_error_signal__send(
-          seg_name=self.tags[b], seg_len=self.seq_lengths[b],
-          log_posteriors=self.log_posteriors[:self.seq_lengths[b], b])
-        seg_name, loss, error_signal = self.instance.get_loss_and_error_signal__read()
-        assert seg_name == self.tags[b]
-        self.batch_loss[b] = loss
-        self.batch_error_signal[:self.seq_lengths[b], b] = error_signal
-        numpy_set_unused(error_signal)
+      self.pool.run_jobs(jobs=self.jobs, func=self.func)
     except Exception as exc:
       self.exception = exc
 
@@ -348,7 +360,10 @@ class SprintInstancePool:
     which can be accessed via get_global_instance.
   Then, this can be used in multiple ways.
     (1) get_batch_loss_and_error_signal.
-    (2) ...
+    (2) get_automata_for_batch.
+  The seqs of a batch are dispatched to free instances, each served by its own thread.
+  The pool grows up to numInstances as needed,
+  and optionally shrinks again when instances are idle for more than instanceIdleTimeout secs.
   """
 
   class_lock = RLock()
@@ -372,24 +387,45 @@ class SprintInstancePool:
     """
     :param dict[str] sprint_opts:
     """
-    # The lock will not be acquired automatically on the public functions here as there is the valid
-    # usage that only one thread will access it anyway.
-    # So, take care of acquiring this lock yourself whenever you call here potentially from multiple threads.
-    # All the code is not thread-safe, so this is important!
+    # get_batch_loss_and_error_signal and get_automata_for_batch are thread-safe (except with Theano),
+    # as each seq is handled by an instance which we exclusively acquire (see acquire_instance).
+    # When you access the instances directly otherwise, take care of acquiring this lock yourself.
     self.lock = RLock()
+    self._cond = Condition(RLock())  # protects the list of (free) instances
+    self._start_lock = RLock()  # we start one instance at a time
     assert isinstance(sprint_opts, dict)
     sprint_opts = sprint_opts.copy()
     self.max_num_instances = int(sprint_opts.pop("numInstances", 1))
+    self.min_num_instances = int(sprint_opts.pop("minNumInstances", 1))
+    self.instance_idle_timeout = sprint_opts.pop("instanceIdleTimeout", None)  # type: typing.Optional[float]
+    automata_cache_max_bytes = int(sprint_opts.pop("automataCacheMaxBytes", 2 ** 30))
+    automata_cache_dir = sprint_opts.pop("automataCacheDir", None)
     self.sprint_opts = sprint_opts
+    self.automata_cache = SprintAutomataCache(
+      config_hash=SprintAutomataCache.get_config_hash(sprint_opts),
+      max_bytes=automata_cache_max_bytes, cache_dir=automata_cache_dir)
     self.instances = []  # type: typing.List[SprintSubprocessInstance]
+    self._free_instances = []  # type: typing.List[SprintSubprocessInstance]
+    self._num_starting_instances = 0
+    self._last_used_time = {}  # type: typing.Dict[SprintSubprocessInstance,float]
+
+  def _create_new_instance(self):
+    """
+    :rtype: SprintSubprocessInstance
+    """
+    with self._start_lock:
+      return SprintSubprocessInstance(**self.sprint_opts)
 
   def _maybe_create_new_instance(self):
     """
     :rtype: SprintSubprocessInstance|None
     """
-    if len(self.instances) < self.max_num_instances:
-      self.instances.append(SprintSubprocessInstance(**self.sprint_opts))
-      return self.instances[-1]
+    with self._cond:
+      if len(self.instances) < self.max_num_instances:
+        instance = self._create_new_instance()
+        self.instances.append(instance)
+        self._free_instances.append(instance)
+        return instance
     return None
 
   def _get_instance(self, i):
@@ -403,6 +439,119 @@ class SprintInstancePool:
       self._maybe_create_new_instance()
     return self.instances[i]
 
+  def acquire_instance(self):
+    """
+    Takes a free instance from the pool, or starts a new one if we have less than numInstances.
+    Otherwise, waits until some instance becomes free.
+    Give it back via :func:`release_instance`.
+
+    :rtype: SprintSubprocessInstance
+    """
+    with self._cond:
+      while True:
+        if self._free_instances:
+          return self._free_instances.pop()
+        if len(self.instances) + self._num_starting_instances < self.max_num_instances:
+          self._num_starting_instances += 1
+          break
+        self._cond.wait()
+    try:
+      instance = self._create_new_instance()
+      with self._cond:
+        self.instances.append(instance)
+      return instance
+    finally:
+      with self._cond:
+        self._num_starting_instances -= 1
+        self._cond.notify_all()
+
+  def release_instance(self, instance, broken=False):
+    """
+    :param SprintSubprocessInstance instance: from :func:`acquire_instance`
+    :param bool broken: e.g. after an exception. it will be removed from the pool and its child will be killed
+    """
+    with self._cond:
+      if broken:
+        self.instances.remove(instance)
+        self._last_used_time.pop(instance, None)
+      else:
+        self._last_used_time[instance] = time.time()
+        self._free_instances.append(instance)
+      self._cond.notify_all()
+    if broken:
+      print("SprintInstancePool: remove broken instance %r" % instance, file=log.v3)
+      instance.exit_handler()
+
+  def _maybe_shrink(self):
+    """
+    Exits the instances which were idle for more than instance_idle_timeout secs, down to min_num_instances.
+    """
+    if self.instance_idle_timeout is None:
+      return
+    instances_to_exit = []
+    with self._cond:
+      for instance in list(self._free_instances):
+        if len(self.instances) <= self.min_num_instances:
+          break
+        if time.time() - self._last_used_time.get(instance, 0) < self.instance_idle_timeout:
+          continue
+        self._free_instances.remove(instance)
+        self.instances.remove(instance)
+        self._last_used_time.pop(instance, None)
+        instances_to_exit.append(instance)
+    for instance in instances_to_exit:
+      print("SprintInstancePool: exit idle instance, %i instances remaining" % len(self.instances), file=log.v4)
+      # noinspection PyProtectedMember
+      instance._exit_child()
+
+  def run_jobs(self, jobs, func):
+    """
+    Acquires a free instance and runs the jobs on it until the queue is empty.
+    Only IO errors on the pipe to the Sprint subprocess (e.g. when it crashed) mark the instance as broken.
+    Other exceptions, e.g. :class:`SprintException`, are passed to the caller, and the instance is reused.
+
+    :param Queue jobs: job args
+    :param ((SprintSubprocessInstance,T)->None) func: called for each job
+    """
+    instance = self.acquire_instance()
+    broken = False
+    try:
+      while True:
+        try:
+          job = jobs.get_nowait()
+        except Empty:
+          break
+        func(instance, job)
+    except (IOError, EOFError):
+      broken = True
+      raise
+    finally:
+      self.release_instance(instance, broken=broken)
+
+  def dispatch(self, jobs, func):
+    """
+    Runs all jobs, in parallel on free instances, each served by its own thread.
+    Jobs are taken in the given order, i.e. put the most expensive ones first.
+
+    :param list[T] jobs: job args, e.g. the batch idx
+    :param ((SprintSubprocessInstance,T)->None) func: called for each job
+    """
+    queue = Queue()
+    for job in jobs:
+      queue.put(job)
+    num_threads = min(self.max_num_instances, len(jobs))
+    if num_threads <= 1:
+      if jobs:
+        self.run_jobs(jobs=queue, func=func)
+    else:
+      threads = [ReaderThread(pool=self, thread_idx=i, jobs=queue, func=func) for i in range(num_threads)]
+      for thread in threads:
+        thread.join()
+      for thread in threads:
+        if thread.exception:
+          raise thread.exception
+    self._maybe_shrink()
+
   def get_batch_loss_and_error_signal(self, log_posteriors, seq_lengths, tags=None):
     """
     :param numpy.ndarray log_posteriors: 3d (time,batch,label)
@@ -432,24 +581,22 @@ class SprintInstancePool:
     batch_loss = numpy.zeros((n_batch,), dtype="float32")
     batch_error_signal = numpy.zeros_like(log_posteriors, dtype="float32")
 
-    # greedy solution to the scheduling problem
-    sorted_length = sorted(enumerate(seq_lengths), key=lambda x: x[1], reverse=True)
-    jobs = [[] for _ in range(self.max_num_instances)]
-    joblen = [0] * self.max_num_instances
-    for i, l in sorted_length:
-      j = min(enumerate(joblen), key=lambda x: x[1])[0]  # noqa
-      jobs[j].append(i)
-      joblen[j] += l
-
-    if not BackendEngine.is_theano_selected() and self.max_num_instances > 1:
-      threads = [
-        ReaderThread(
-          self._get_instance(i), i, jobs[i], tags, seq_lengths, log_posteriors, batch_loss, batch_error_signal)
-        for i in range(self.max_num_instances)]
-      for i, thread in enumerate(threads):
-        thread.join()
-        if thread.exception:
-          raise thread.exception
+    if not BackendEngine.is_theano_selected():
+      def calc_seq(instance, b):
+        """
+        :param SprintSubprocessInstance instance:
+        :param int b: batch idx
+        """
+        instance.get_loss_and_error_signal__send(
+          seg_name=tags[b], seg_len=seq_lengths[b], log_posteriors=log_posteriors[:seq_lengths[b], b])
+        seg_name, loss, error_signal = instance.get_loss_and_error_signal__read()
+        assert seg_name == tags[b]
+        batch_loss[b] = loss
+        batch_error_signal[:seq_lengths[b], b] = error_signal
+        numpy_set_unused(error_signal)
+
+      # Longest seqs first, and each next seq goes to the next free instance.
+      self.dispatch(jobs=sorted(range(n_batch), key=lambda b_: seq_lengths[b_], reverse=True), func=calc_seq)
     else:
       # Very simple parallelism. We must avoid any form of multi-threading
       # because this can be problematic with Theano.
@@ -484,53 +631,59 @@ class SprintInstancePool:
       start_end_states are of shape (2, batch), each (start,stop) state idx, batch = len(tags), of dtype uint32.
     :rtype: (numpy.ndarray, numpy.ndarray, numpy.ndarray)
     """
-    all_num_states = [None] * len(tags)  # type: typing.List[typing.Optional[int]]
-    all_num_edges = [None] * len(tags)  # type: typing.List[typing.Optional[int]]
-    all_edges = [None] * len(tags)  # type: typing.List[typing.Optional[numpy.ndarray]]
-    all_weights = [None] * len(tags)  # type: typing.List[typing.Optional[numpy.ndarray]]
-    for bb in range(0, len(tags), self.max_num_instances):
-      for i in range(self.max_num_instances):
-        b = bb + i
-        if b >= len(tags):
-          break
-        instance = self._get_instance(i)
-        if isinstance(tags[0], str):
-          segment_name = tags[b]
-        else:
-          segment_name = tags[b].view('S%d' % tags.shape[1])[0]
-        assert isinstance(segment_name, str)
-        # noinspection PyProtectedMember
-        instance._send(("export_allophone_state_fsa_by_segment_name", segment_name))
-      for i in range(self.max_num_instances):
-        b = bb + i
-        if b >= len(tags):
-          break
-        instance = self._get_instance(i)
-        # noinspection PyProtectedMember
-        r = instance._read()
-        if r[0] != 'ok':
-          raise RuntimeError(r[1])
-        num_states, num_edges, edges, weights = r[1:]
-        all_num_states[b] = num_states
-        all_num_edges[b] = num_edges
-        all_edges[b] = edges.reshape((3, num_edges))  # (from, to, emission-idx) for each edge, uint32
-        all_weights[b] = weights  # for each edge, float32
-    state_offset = 0
-    for idx in range(len(all_edges)):
-      num_edges = all_num_edges[idx]
-      all_edges[idx][0:2, :] += state_offset
-      state_offset += all_num_states[idx]
-      # add sequence_idx. becomes (from, to, emission-idx, seq-idx) for each edge
-      all_edges[idx] = numpy.vstack((all_edges[idx], numpy.ones((1, num_edges), dtype='uint32') * idx))
-
-    start_end_states = numpy.empty((2, len(all_num_states)), dtype='uint32')
-    state_offset = 0
-    for idx, num_states in enumerate(all_num_states):
-      start_end_states[0, idx] = state_offset
-      start_end_states[1, idx] = state_offset + num_states - 1
-      state_offset += num_states
-
-    return numpy.hstack(all_edges), numpy.hstack(all_weights), start_end_states
+    segment_names = [self._get_segment_name(tags, b) for b in range(len(tags))]
+    entries = [self.automata_cache.get(segment_name) for segment_name in segment_names]
+    missing = sorted(set([segment_name for (segment_name, entry) in zip(segment_names, entries) if entry is None]))
+    if missing:
+      fetched = self._fetch_automata(missing)
+      for segment_name, (num_states, edges, weights) in fetched.items():
+        self.automata_cache.add(segment_name, num_states=num_states, edges=edges, weights=weights)
+      entries = [entry if entry is not None else fetched[segment_name]
+                 for (segment_name, entry) in zip(segment_names, entries)]
+    return SprintAutomataCache.make_batch_automaton(entries)
+
+  @staticmethod
+  def _get_segment_name(tags, b):
+    """
+    :param list[str]|list[bytes]|numpy.ndarray tags:
+    :param int b: batch idx
+    :rtype: str
+    """
+    segment_name = tags[b]
+    if isinstance(segment_name, numpy.ndarray):
+      segment_name = segment_name.view('S%d' % tags.shape[1])[0]
+    if isinstance(segment_name, bytes):
+      segment_name = segment_name.decode("utf8")
+    assert isinstance(segment_name, str)
+    return segment_name
+
+  def _fetch_automata(self, segment_names):
+    """
+    Gets the automata from Sprint, in parallel on free instances, see :func:`dispatch`.
+
+    :param list[str] segment_names:
+    :return: segment name -> (num_states, edges, weights)
+    :rtype: dict[str,(int,numpy.ndarray,numpy.ndarray)]
+    """
+    results = {}  # type: typing.Dict[str,typing.Tuple[int,numpy.ndarray,numpy.ndarray]]
+
+    def fetch(instance, segment_name):
+      """
+      :param SprintSubprocessInstance instance:
+      :param str segment_name:
+      """
+      # noinspection PyProtectedMember
+      instance._send(("export_allophone_state_fsa_by_segment_name", segment_name))
+      # noinspection PyProtectedMember
+      r = instance._read()
+      if r[0] != 'ok':
+        raise SprintException("Sprint failed to export the automaton for segment %r: %s" % (segment_name, r[1]))
+      num_states, num_edges, edges, weights = r[1:]
+      # edges: (from, to, emission-idx) for each edge, uint32. weights: for each edge, float32.
+      results[segment_name] = (num_states, edges.reshape((3, num_edges)), weights)
+
+    self.dispatch(jobs=segment_names, func=fetch)
+    return results
 
   def get_free_instance(self):
     """
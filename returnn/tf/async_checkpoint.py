@@ -0,0 +1,190 @@
+
+"""
+Provides :class:`AsyncCheckpointSaver`, to save the model params in the background.
+
+Enable it via the config option ``save_model_async``.
+"""
+
+from __future__ import print_function
+
+import os
+import time
+import threading
+import typing
+import tensorflow as tf
+import returnn.tf.compat as tf_compat
+from returnn.log import log
+
+
+class AsyncCheckpointSaver:
+  """
+  Saves the model params of a :class:`TFNetwork` in a background thread.
+
+  In :func:`save`, the values of the params are copied to host memory (in the calling thread),
+  such that the training can continue and modify the params while the checkpoint is written.
+  The checkpoint files are written under a temporary name and renamed when complete,
+  such that there is never an incomplete checkpoint under the final name.
+  The number of pending saves is limited by ``max_pending``,
+  i.e. :func:`save` blocks until an earlier save finished, if needed.
+
+  The files are the same as from :func:`TFNetwork.save_params_to_file`,
+  i.e. the index and data files, the meta graph, and the checkpoint state file in the same directory.
+  """
+
+  def __init__(self, network, session, max_pending=1):
+    """
+    :param returnn.tf.network.TFNetwork network:
+    :param tf.compat.v1.Session session: also used in the background thread
+    :param int max_pending: max number of saves which are not finished yet
+    """
+    assert max_pending >= 1
+    self.network = network
+    self.session = session
+    self.max_pending = max_pending
+    self._params = network.get_saveable_params_list()
+    self._prefix_placeholder = None  # type: typing.Optional[tf.Tensor]
+    self._placeholders = None  # type: typing.Optional[typing.List[tf.Tensor]]
+    self._save_op = None  # type: typing.Optional[tf.Operation]
+    self._cond = threading.Condition()
+    self._pending = []  # type: typing.List[threading.Thread]
+    self._exceptions = []  # type: typing.List[BaseException]
+    self._checkpoint_state_lock = threading.Lock()
+
+  def __repr__(self):
+    return "<%s, %i pending>" % (self.__class__.__name__, len(self._pending))
+
+  @classmethod
+  def get_not_supported_reason(cls, network):
+    """
+    :param returnn.tf.network.TFNetwork network:
+    :return: None if supported, otherwise some reason why we cannot save this network asynchronously
+    :rtype: str|None
+    """
+    for param in network.get_saveable_params_list():
+      if not isinstance(param, tf.Variable):
+        return "param %r is not a variable" % (param,)
+    return None
+
+  def _create_save_op(self):
+    """
+    Creates the op which writes the fed values to the checkpoint.
+    """
+    with tf.name_scope("async_saver"):
+      self._prefix_placeholder = tf_compat.v1.placeholder(tf.string, shape=(), name="prefix")
+      self._placeholders = [
+        tf_compat.v1.placeholder(param.dtype.base_dtype, shape=param.get_shape(), name="value_%i" % i)
+        for (i, param) in enumerate(self._params)]
+      self._save_op = tf.raw_ops.SaveV2(
+        prefix=self._prefix_placeholder,
+        tensor_names=[param.name[:-2] for param in self._params],
+        shape_and_slices=[""] * len(self._params),
+        tensors=self._placeholders)
+
+  def save(self, filename):
+    """
+    Copies the current param values to host memory, and writes the checkpoint in the background.
+
+    :param str filename: checkpoint filename (prefix), like for :func:`TFNetwork.save_params_to_file`
+    """
+    from returnn.util.basic import maybe_make_dirs
+    self._check_exceptions()
+    filename = os.path.abspath(filename)  # TF needs absolute path
+    maybe_make_dirs(os.path.dirname(filename))
+    if not self._save_op:
+      self._create_save_op()
+    if not self.network.saver:
+      self.network._create_saver()
+    # The meta graph is exported here, as the graph might be modified by the training thread.
+    meta_graph_def = self.network.saver.export_meta_graph()
+    with self._cond:
+      while len(self._pending) >= self.max_pending:
+        print("%s: waiting for the previous save to finish." % self, file=log.v4)
+        self._cond.wait()
+    start_time = time.time()
+    values = self.session.run(self._params)
+    print("%s: copied params in %.3f secs, saving %r in the background." % (
+      self, time.time() - start_time, filename), file=log.v4)
+    thread = threading.Thread(
+      target=self._save_thread_main, args=(filename, values, meta_graph_def), name="%r save" % self)
+    with self._cond:
+      self._pending.append(thread)
+    thread.start()
+
+  def _save_thread_main(self, filename, values, meta_graph_def):
+    """
+    :param str filename:
+    :param list[numpy.ndarray] values:
+    :param tensorflow.core.protobuf.meta_graph_pb2.MetaGraphDef meta_graph_def:
+    """
+    try:
+      start_time = time.time()
+      self._write_checkpoint(filename=filename, values=values, meta_graph_def=meta_graph_def)
+      print("%s: saved %r in %.3f secs." % (self, filename, time.time() - start_time), file=log.v4)
+    except BaseException as exc:
+      print("%s: exception while saving %r: %r" % (self, filename, exc), file=log.v1)
+      with self._cond:
+        self._exceptions.append(exc)
+    finally:
+      with self._cond:
+        self._pending.remove(threading.current_thread())
+        self._cond.notify_all()
+
+  def _write_checkpoint(self, filename, values, meta_graph_def):
+    """
+    :param str filename:
+    :param list[numpy.ndarray] values:
+    :param tensorflow.core.protobuf.meta_graph_pb2.MetaGraphDef meta_graph_def:
+    """
+    tmp_filename = "%s.tmp-async-save" % filename
+    feed_dict = dict(zip(self._placeholders, values))
+    feed_dict[self._prefix_placeholder] = tmp_filename
+    # We add some extra logic to try again for DiskQuota and other errors, like in TFNetwork.save_params_to_file.
+    try_again_wait_time = 10
+    while True:
+      try:
+        self.session.run(self._save_op, feed_dict=feed_dict)
+        with open(tmp_filename + ".meta", "wb") as f:
+          f.write(meta_graph_def.SerializeToString())
+        break
+      except IOError as e:
+        import errno
+        if e.errno in [errno.EBUSY, errno.EDQUOT, errno.EIO, errno.ENOSPC]:
+          print("%s: exception while saving: %s" % (self, e), file=log.v3)
+          print("Trying again in %s secs." % try_again_wait_time, file=log.v3)
+          time.sleep(try_again_wait_time)
+          continue
+        raise
+    # The index file is renamed last, as it is what marks the checkpoint as existing (see get_existing_models).
+    postfixes = [fn[len(tmp_filename):] for fn in tf_compat.v1.gfile.Glob(tmp_filename + ".*")]
+    for postfix in sorted(postfixes, key=lambda postfix_: postfix_ == ".index"):
+      os.rename(tmp_filename + postfix, filename + postfix)
+    with self._checkpoint_state_lock:
+      save_dir = os.path.dirname(filename)
+      state = tf_compat.v1.train.get_checkpoint_state(save_dir)
+      all_paths = list(state.all_model_checkpoint_paths) if state else []
+      if filename in all_paths:
+        all_paths.remove(filename)
+      tf_compat.v1.train.update_checkpoint_state(
+        save_dir, model_checkpoint_path=filename, all_model_checkpoint_paths=all_paths + [filename])
+
+  def _check_exceptions(self):
+    """
+    Reraises an exception from some background save.
+    """
+    with self._cond:
+      if not self._exceptions:
+        return
+      exc = self._exceptions[0]
+      del self._exceptions[:]
+    raise exc
+
+  def wait(self):
+    """
+    Waits until all pending saves are finished, and reraises any exception from them.
+    """
+    with self._cond:
+      if self._pending:
+        print("%s: waiting for pending saves to finish." % self, file=log.v4)
+      while self._pending:
+        self._cond.wait()
+    self._check_exceptions()
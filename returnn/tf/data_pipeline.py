@@ -114,6 +114,7 @@ It depends on whether the full network is recurrent or not.
 from __future__ import print_function
 
 import sys
+import time
 import typing
 try:
   # noinspection PyCompatibility
@@ -210,6 +211,150 @@ class DataProviderBase(object):
     raise NotImplementedError
 
 
+class FeedDictBufferPool(object):
+  """
+  Reuses the numpy arrays for the padded batches of :class:`FeedDictDataProvider` across batches (and epochs),
+  to avoid the allocation of new zero-filled arrays for every batch.
+  Buffers are keyed by (data key, dtype, shape), where the time dim of the shape can be rounded up to buckets,
+  such that batches with slightly different time dims can share the same buffers.
+
+  A buffer is handed out via :func:`get_buffer` and given back via :func:`release_buffers`
+  when it is not used anymore. The content is not reset, i.e. the user must zero the padded tail.
+  When the time dim was rounded up, only the view up to the real time dim must be fed
+  (see :func:`FeedDictDataProvider.get_feed_dict`), as e.g. the seq mask expects max(seq_lens) as time dim.
+  Thus TF still sees the same shapes as without the buckets,
+  and as this view is not contiguous, feeding it copies the data.
+  """
+
+  def __init__(self, time_buckets=None, max_free_buffers_per_shape=16, max_free_bytes=2 ** 30):
+    """
+    :param int|list[int]|None time_buckets: round up the time dim of the data to the next bucket.
+      int means a multiple of it, a list means the bucket sizes (and longer stays as-is).
+      None means no rounding, i.e. only buffers of the exact same shape are reused.
+    :param int max_free_buffers_per_shape:
+    :param int max_free_bytes: the least recently used free buffers are dropped when this is exceeded
+    """
+    if isinstance(time_buckets, (list, tuple)):
+      time_buckets = sorted(time_buckets)
+    else:
+      assert time_buckets is None or (isinstance(time_buckets, int) and time_buckets > 0)
+    self.time_buckets = time_buckets
+    self.max_free_buffers_per_shape = max_free_buffers_per_shape
+    self.max_free_bytes = max_free_bytes
+    from collections import OrderedDict
+    self._free = OrderedDict()  # type: typing.Dict[typing.Tuple[str,str,typing.Tuple[int,...]],typing.List[numpy.ndarray]]  # nopep8
+    self._free_bytes = 0
+    self._lock = Condition()
+    self.num_hits = 0
+    self.num_misses = 0
+    self.hit_bytes = 0
+    self.alloc_bytes = 0
+    self.alloc_time = 0.0
+
+  def __repr__(self):
+    return "<%s time_buckets=%r, %s>" % (self.__class__.__name__, self.time_buckets, self.get_report_str())
+
+  @classmethod
+  def from_config_opt(cls, opt):
+    """
+    :param bool|int|list[int]|dict[str]|None opt: from the ``feed_dict_buffer_pool`` config option.
+      True means the default settings, int or list means the time buckets, dict means the kwargs.
+    :rtype: FeedDictBufferPool|None
+    """
+    if opt in [None, False]:
+      return None
+    if opt is True:
+      return cls()
+    if isinstance(opt, (int, list, tuple)):
+      return cls(time_buckets=opt)
+    assert isinstance(opt, dict), "feed_dict_buffer_pool: invalid %r" % (opt,)
+    return cls(**opt)
+
+  def get_time_bucket(self, time_dim):
+    """
+    :param int time_dim:
+    :return: time_dim rounded up
+    :rtype: int
+    """
+    if self.time_buckets is None:
+      return time_dim
+    if isinstance(self.time_buckets, int):
+      return -(-time_dim // self.time_buckets) * self.time_buckets
+    for bucket in self.time_buckets:
+      if bucket >= time_dim:
+        return bucket
+    return time_dim
+
+  def get_buffer(self, key, shape, dtype):
+    """
+    :param str key: data key
+    :param tuple[int]|list[int] shape: already rounded up, if this is wanted, see :func:`get_time_bucket`
+    :param str dtype:
+    :return: buffer with undefined content (new buffers are zero)
+    :rtype: numpy.ndarray
+    """
+    pool_key = (key, str(dtype), tuple(shape))
+    with self._lock:
+      buffers = self._free.get(pool_key)
+      if buffers:
+        buf = buffers.pop()
+        self._free_bytes -= buf.nbytes
+        if not buffers:
+          del self._free[pool_key]
+        self.num_hits += 1
+        self.hit_bytes += buf.nbytes
+        return buf
+    start_time = time.time()
+    buf = numpy.zeros(shape, dtype=dtype)
+    with self._lock:
+      self.alloc_time += time.time() - start_time
+      self.num_misses += 1
+      self.alloc_bytes += buf.nbytes
+    return buf
+
+  def release_buffers(self, buffers):
+    """
+    :param dict[str,numpy.ndarray|object] buffers: data key -> buffer from :func:`get_buffer`.
+      Other values (not numpy arrays) are ignored.
+    """
+    with self._lock:
+      for key, buf in buffers.items():
+        if not isinstance(buf, numpy.ndarray):
+          continue
+        pool_key = (key, str(buf.dtype), buf.shape)
+        free = self._free.pop(pool_key, [])  # re-insert to mark as most recently used
+        self._free[pool_key] = free
+        if len(free) >= self.max_free_buffers_per_shape:
+          continue
+        free.append(buf)
+        self._free_bytes += buf.nbytes
+      while self._free_bytes > self.max_free_bytes and self._free:
+        pool_key = next(iter(self._free))
+        free = self._free[pool_key]
+        self._free_bytes -= free.pop(0).nbytes
+        if not free:
+          del self._free[pool_key]
+
+  def get_report_str(self):
+    """
+    :return: stats since the last :func:`reset_stats`
+    :rtype: str
+    """
+    from returnn.util.basic import human_bytes_size
+    return "%i buffers reused (%s), %i allocated (%s, %.3f sec)" % (
+      self.num_hits, human_bytes_size(self.hit_bytes), self.num_misses, human_bytes_size(self.alloc_bytes),
+      self.alloc_time)
+
+  def reset_stats(self):
+    """
+    Resets the stats, e.g. at the end of an epoch.
+    """
+    with self._lock:
+      self.num_hits = self.num_misses = 0
+      self.hit_bytes = self.alloc_bytes = 0
+      self.alloc_time = 0.0
+
+
 class FeedDictDataProvider(DataProviderBase):
   """
   This class will fill all the placeholders used for training or forwarding or evaluation etc.
@@ -218,7 +363,7 @@ class FeedDictDataProvider(DataProviderBase):
   """
 
   def __init__(self, tf_session, dataset, batches, enforce_min_len1=False, capacity=10, tf_queue=None,
-               batch_slice=None, **kwargs):
+               batch_slice=None, buffer_pool=None, **kwargs):
     """
     :param tf.compat.v1.Session|tf.compat.v1.InteractiveSession tf_session:
     :param Dataset dataset:
@@ -229,6 +374,7 @@ class FeedDictDataProvider(DataProviderBase):
     :param int capacity:
     :param TFDataQueues|None tf_queue:
     :param slice|None batch_slice: select a subset of the batches
+    :param FeedDictBufferPool|None buffer_pool: to reuse the batch arrays
     """
     super(FeedDictDataProvider, self).__init__(**kwargs)
     self.tf_session = tf_session
@@ -245,6 +391,11 @@ class FeedDictDataProvider(DataProviderBase):
     self.thread_finished = False
     self.cur_batch_idx = 0
     self.reached_end = False
+    self.buffer_pool = buffer_pool
+    # The outputs of the last get_feed_dict calls are still in use, i.e. their buffers cannot be reused yet.
+    # With pipelining (see Runner), there can be multiple.
+    self.num_outputs_in_use = 1
+    self._outputs_in_use = []  # type: typing.List[typing.Dict[str,numpy.ndarray]]  # see get_feed_dict
 
   def start_threads(self, session):
     """
@@ -266,8 +417,47 @@ class FeedDictDataProvider(DataProviderBase):
       self._flush_all_data()
       self.thread.join()
       self.thread = None
+    self.release_buffers()
+    if self.buffer_pool:
+      print("%s: feed dict buffer pool: %s" % (self.get_dataset_name(), self.buffer_pool.get_report_str()), file=log.v4)
+      self.buffer_pool.reset_stats()
     self.dataset.finish_epoch()
 
+  def _release_output(self, output):
+    """
+    Gives the buffers of a batch (from :func:`get_next_batch`) back to the buffer pool.
+
+    :param dict[str,numpy.ndarray]|None output:
+    """
+    if output is None or not self.buffer_pool:
+      return
+    self.buffer_pool.release_buffers({
+      k: v for (k, v) in output.items()
+      if k not in ["seq_idx", "seq_tag"] and not k.startswith("timing:") and not k.startswith("time_dim:")})
+
+  def release_buffers(self):
+    """
+    Gives the buffers of all batches from :func:`get_feed_dict` back to the buffer pool.
+    Call this when session.run() with the last feed dict has finished and no further batch will be fetched,
+    e.g. for a single batch via ``get_feed_dict(single_threaded=True)``.
+    """
+    for output in self._outputs_in_use:
+      self._release_output(output)
+    self._outputs_in_use = []
+
+  def _get_unpadded_data(self, output, key):
+    """
+    :param dict[str,numpy.ndarray] output: from :func:`get_next_batch`
+    :param str key: data key
+    :return: output[key], without the padding of the time buckets of the buffer pool (a view)
+    :rtype: numpy.ndarray|list[str]
+    """
+    value = output[key]
+    if "time_dim:%s" % key not in output:
+      return value
+    time_dim_axis = self.extern_data.data[key].time_dim_axis
+    return value[(slice(None),) * time_dim_axis + (slice(0, output["time_dim:%s" % key]),)]
+
   def get_next_batch(self, consider_batch_slice):
     """
     This assumes that we have more data, i.e. self.batches.has_more().
@@ -293,23 +483,53 @@ class FeedDictDataProvider(DataProviderBase):
         return None
     from returnn.datasets.basic import Batch, shapes_for_batches
     assert isinstance(batch, Batch)
+    start_time = time.time()
     # In Returnn with Theano, we usually have the shape (time,batch,feature).
     # In TensorFlow, the default is (batch,time,feature).
     # This is also what we use here, i.e. batch_dim_first=True.
     # This must match the Data specification in TFNetwork.ExternData.init_from_config().
     shapes = shapes_for_batches(
       [batch], data_keys=self.data_keys, extern_data=self.extern_data, enforce_min_len1=self.enforce_min_len1)
-    data = {k: numpy.zeros(shape=shapes[k], dtype=self.extern_data.data[k].dtype)
-            for k in self.data_keys if self.extern_data.data[k].dtype != "string"}
+    batch_data_keys = self._get_batch_data_keys(batch)
+    time_dims = {}  # data key -> time dim without the time buckets
+    if self.buffer_pool:
+      for k in self.data_keys:
+        if self.extern_data.data[k].have_time_axis() and self.extern_data.data[k].dtype != "string":
+          time_dim_axis = self.extern_data.data[k].time_dim_axis
+          time_dims[k] = shapes[k][time_dim_axis]
+          shapes[k][time_dim_axis] = self.buffer_pool.get_time_bucket(shapes[k][time_dim_axis])
+      data = {k: self.buffer_pool.get_buffer(key=k, shape=shapes[k], dtype=self.extern_data.data[k].dtype)
+              for k in self.data_keys if self.extern_data.data[k].dtype != "string"}
+      seq_lens = {k: self.buffer_pool.get_buffer(
+                    key="%s_seq_lens" % k, shape=(shapes[k][0],), dtype=self.extern_data.data[k].size_dtype)
+                  for k in self.data_keys if self.extern_data.data[k].have_time_axis()}
+      for k in self.data_keys:
+        # get_batch_data already zeros the padded tail. For the others, the padded tail is zeroed below.
+        if k not in batch_data_keys and k in seq_lens:
+          seq_lens[k].fill(0)
+    else:
+      data = {k: numpy.zeros(shape=shapes[k], dtype=self.extern_data.data[k].dtype)
+              for k in self.data_keys if self.extern_data.data[k].dtype != "string"}
+      seq_lens = {k: numpy.zeros(shape=(shapes[k][0],), dtype=self.extern_data.data[k].size_dtype)
+                  for k in self.data_keys if self.extern_data.data[k].have_time_axis()}
     # Numpy cannot handle "string" dtype. Just make it a list[str], which is what TF can handle.
     data.update({k: [""] * batch.num_slices
                  for k in self.data_keys if self.extern_data.data[k].dtype == "string"})
     data.update({"seq_idx": [-1] * batch.num_slices, "seq_tag": [""] * batch.num_slices})
-    seq_lens = {k: numpy.zeros(shape=(shapes[k][0],), dtype=self.extern_data.data[k].size_dtype)
-                for k in self.data_keys if self.extern_data.data[k].have_time_axis()}
-    self.dataset.load_seqs(batch.start_seq, batch.end_seq)
+    load_seqs_start_time = time.time()
+    self.dataset.load_seqs(batch.load_start_seq, batch.end_seq)
+    load_seqs_time = time.time() - load_seqs_start_time
     from returnn.util.basic import slice_pad_zeros
     with self.dataset.lock:
+      if batch_data_keys:
+        # Fill the padded arrays directly, without intermediate per-seq arrays.
+        seqs = sorted(batch.seqs, key=lambda seq_: seq_.batch_slice)
+        out = {k: data[k] for k in batch_data_keys}
+        out.update({"%s_seq_lens" % k: seq_lens[k] for k in batch_data_keys})
+        self.dataset.get_batch_data(
+          seq_idxs=[seq.seq_idx for seq in seqs], keys=batch_data_keys,
+          seq_start_frames=[seq.seq_start_frame for seq in seqs], seq_end_frames=[seq.seq_end_frame for seq in seqs],
+          out=out)
       for seq in batch.seqs:
         o = seq.batch_frame_offset
         q = seq.batch_slice
@@ -322,6 +542,8 @@ class FeedDictDataProvider(DataProviderBase):
             continue  # handled below. will always be added
           if k in self.extern_data.extra_added_keys:
             continue
+          if k in batch_data_keys:
+            continue  # already handled above
           if self.extern_data.data[k].have_time_axis():
             if length.get(k) in [0, None]:
               continue
@@ -339,10 +561,44 @@ class FeedDictDataProvider(DataProviderBase):
             data[k][q] = v
         data["seq_idx"][q] = seq.seq_idx
         data["seq_tag"][q] = self.dataset.get_tag(seq.seq_idx)
+    if self.buffer_pool:
+      # The reused buffers still contain the data of some earlier batch after the new seq lens.
+      for k in seq_lens.keys():
+        if k in batch_data_keys or k not in data:
+          continue
+        for q in range(seq_lens[k].shape[0]):
+          data[k][q, seq_lens[k][q]:] = 0
     for k in seq_lens.keys():
       data["%s_seq_lens" % k] = seq_lens[k]
+    for k, time_dim in time_dims.items():
+      data["time_dim:%s" % k] = time_dim
+    # For the step timing stats in the Runner.
+    data["timing:load_seqs"] = load_seqs_time
+    data["timing:batch_creation"] = time.time() - start_time - load_seqs_time
     return data
 
+  def _get_batch_data_keys(self, batch):
+    """
+    :param returnn.engine.batch.Batch batch:
+    :return: data keys which can be filled via :func:`Dataset.get_batch_data`.
+      This is possible if every seq is in its own batch slice (the usual recurrent case).
+    :rtype: list[str]
+    """
+    if batch.num_slices != len(batch.seqs):
+      return []
+    if sorted([seq.batch_slice for seq in batch.seqs]) != list(range(batch.num_slices)):
+      return []
+    keys = []
+    for k in self.data_keys:
+      if k in ["seq_idx", "seq_tag"] or k in self.extern_data.extra_added_keys:
+        continue
+      if self.extern_data.data[k].dtype == "string" or not self.extern_data.data[k].have_time_axis():
+        continue
+      if any([seq.frame_length.get(k) is None or seq.batch_frame_offset[k] != 0 for seq in batch.seqs]):
+        continue
+      keys.append(k)
+    return keys
+
   def _thread_main(self):
     try:
       from returnn.util import better_exchook
@@ -354,7 +610,10 @@ class FeedDictDataProvider(DataProviderBase):
           if self.queue:
             self.queue.put(enqueue_args)
           else:
-            self.tf_queue.enqueue(tf_session=self.tf_session, data=enqueue_args)
+            self.tf_queue.enqueue(tf_session=self.tf_session, data={
+              k: (self._get_unpadded_data(enqueue_args, k) if k in self.data_keys else v)
+              for (k, v) in enqueue_args.items() if not k.startswith("time_dim:")})
+            self._release_output(enqueue_args)  # copied by the enqueue op
         with self.state_change_cond:
           self.state_change_cond.notifyAll()
         self.batches.advance(1)
@@ -399,7 +658,7 @@ class FeedDictDataProvider(DataProviderBase):
     """
     while self.have_more_data(None):
       if self.queue:
-        self.queue.get()
+        self._release_output(self.queue.get())
       else:
         raise NotImplementedError
 
@@ -423,9 +682,13 @@ class FeedDictDataProvider(DataProviderBase):
     else:
       output = self.queue.get()
     assert isinstance(output, dict)
+    # The older feed dicts are not used anymore, as session.run() with them has finished.
+    self._outputs_in_use.append(output)
+    while len(self._outputs_in_use) > self.num_outputs_in_use:
+      self._release_output(self._outputs_in_use.pop(0))
     # The data itself.
     d = {
-      self.extern_data.get_data(k).placeholder: output[k]
+      self.extern_data.get_data(k).placeholder: self._get_unpadded_data(output, k)
       for k in self.data_keys
       if k not in self.extern_data.extra_added_keys}
     # And seq lengths info.
@@ -440,7 +703,9 @@ class FeedDictDataProvider(DataProviderBase):
           raise Exception(
             "dataset currently does not support variable shape in other dimensions than the first. "
             "dim=%i, placeholder=%r" % (dim, len_placeholder))
-    return d, {"seq_idx": output["seq_idx"], "seq_tag": output["seq_tag"]}
+    meta = {"seq_idx": output["seq_idx"], "seq_tag": output["seq_tag"]}
+    meta.update({k: v for (k, v) in output.items() if k.startswith("timing:")})
+    return d, meta
 
   def get_dataset_name(self):
     """
@@ -18,26 +18,28 @@ import time
 import typing
 try:
   # noinspection PyCompatibility
-  from Queue import Queue
+  from Queue import Queue, Full
 except ImportError:
   # noinspection PyCompatibility
-  from queue import Queue
+  from queue import Queue, Full
 
 import numpy
 import tensorflow as tf
 from tensorflow.python.client import timeline
 
 from returnn.engine.base import EngineBase
+from returnn.engine.search_output import SearchOutputWriter
 from returnn.datasets.basic import Dataset, Batch, BatchSetGenerator, init_dataset
 from returnn.learning_rate_control import load_learning_rate_control_from_config, LearningRateControl
 from returnn.log import log
 from returnn.pretrain import pretrain_from_config
 import returnn.tf.compat as tf_compat
 from returnn.tf.network import TFNetwork, ExternData, help_on_tf_exception
+from returnn.tf.async_checkpoint import AsyncCheckpointSaver
 from returnn.tf.util.data import Data
 from returnn.tf.layers.base import LayerBase
 from returnn.tf.updater import Updater
-from returnn.tf.data_pipeline import FeedDictDataProvider, DatasetDataProvider
+from returnn.tf.data_pipeline import FeedDictDataProvider, DatasetDataProvider, FeedDictBufferPool
 import returnn.tf.horovod as tf_horovod
 from returnn.util.basic import hms, NumbersDict, BackendEngine
 from pprint import pprint
@@ -49,9 +51,275 @@ class CancelTrainingException(Exception):
   """
 
 
+class StepTimingStats(object):
+  """
+  Low-overhead timing instrumentation for :class:`Runner`.
+  For every step, it records the time spent in the different phases (see :data:`phases`).
+  Every step is written as one line to a JSON-lines file,
+  and at the end of the epoch, the histograms are written to the TF summary writer,
+  and the summary (mean/max per phase) is written as a final line to the JSON-lines file.
+  With this, we can see whether a job is input-bound or compute-bound.
+  Per phase, we only keep running stats and a histogram with fixed buckets, i.e. the memory is bounded.
+  """
+
+  phases = [
+    "feed_dict",  # main thread waiting for the feed dict
+    "load_seqs",  # Dataset.load_seqs, in the data provider thread
+    "batch_creation",  # creating the batch arrays, excluding load_seqs, in the data provider thread
+    "session_run",
+    "horovod",  # Horovod signaling and param sync
+    "eval_info",  # collecting the scores, extra fetches callback
+    "logging",  # process printing, summaries
+  ]
+  # Upper limits of the histogram buckets in secs, from 1 microsec to ~20 min, exponentially spaced.
+  histogram_bucket_limits = 1e-6 * 1.5 ** numpy.arange(52)
+
+  def __init__(self, jsonl_filename=None):
+    """
+    :param str|None jsonl_filename: will be written if given
+    """
+    from threading import Lock
+    self.lock = Lock()
+    self.jsonl_filename = jsonl_filename
+    self.jsonl_file = open(jsonl_filename, "w") if jsonl_filename else None
+    self.steps = {}  # type: typing.Dict[int,typing.Dict[str,float]]  # step -> phase -> duration, unfinished steps
+    # phase -> num, total, sum_squares, min, max
+    self.stats = {
+      phase: {"num": 0, "total": 0.0, "sum_squares": 0.0, "min": float("inf"), "max": 0.0}
+      for phase in self.phases}  # type: typing.Dict[str,typing.Dict[str,float]]
+    # phase -> counts. the last bucket is for everything above the last limit
+    self.histograms = {
+      phase: numpy.zeros((len(self.histogram_bucket_limits) + 1,), dtype="int64")
+      for phase in self.phases}  # type: typing.Dict[str,numpy.ndarray]
+
+  def add(self, step, phase, duration):
+    """
+    :param int step:
+    :param str phase: see :data:`phases`
+    :param float duration: in secs
+    """
+    assert phase in self.stats, "%s: unknown phase %r" % (self.__class__.__name__, phase)
+    with self.lock:
+      timings = self.steps.setdefault(step, {})
+      timings[phase] = timings.get(phase, 0.0) + duration
+
+  def finish_step(self, step):
+    """
+    :param int step: all phases of this step are recorded
+    """
+    import json
+    with self.lock:
+      timings = self.steps.pop(step, {})
+      for phase in self.phases:
+        duration = timings.get(phase, 0.0)
+        stats = self.stats[phase]
+        stats["num"] += 1
+        stats["total"] += duration
+        stats["sum_squares"] += duration ** 2
+        stats["min"] = min(stats["min"], duration)
+        stats["max"] = max(stats["max"], duration)
+        self.histograms[phase][numpy.searchsorted(self.histogram_bucket_limits, duration)] += 1
+      if self.jsonl_file:
+        d = {"step": step}
+        d.update({phase: round(timings.get(phase, 0.0), 6) for phase in self.phases})
+        self.jsonl_file.write(json.dumps(d) + "\n")
+
+  def get_summary(self):
+    """
+    :return: phase -> dict with mean/max/total in secs
+    :rtype: dict[str,dict[str,float]]
+    """
+    with self.lock:
+      return {
+        phase: {"mean": stats["total"] / stats["num"], "max": stats["max"], "total": stats["total"]}
+        for (phase, stats) in self.stats.items() if stats["num"]}
+
+  def get_summary_str(self):
+    """
+    :rtype: str
+    """
+    summary = self.get_summary()
+    return ", ".join([
+      "%s %.2f ms" % (phase, summary[phase]["mean"] * 1000.) for phase in self.phases if phase in summary])
+
+  def write_histograms(self, writer, global_step):
+    """
+    :param tf.compat.v1.summary.FileWriter writer:
+    :param int global_step:
+    """
+    values = []
+    with self.lock:
+      for phase in self.phases:
+        stats = self.stats[phase]
+        if not stats["num"]:
+          continue
+        values.append(tf_compat.v1.Summary.Value(
+          tag="step_timings/%s" % phase,
+          histo=tf_compat.v1.HistogramProto(
+            min=stats["min"], max=stats["max"], num=stats["num"],
+            sum=stats["total"], sum_squares=stats["sum_squares"],
+            bucket_limit=[float(x) for x in self.histogram_bucket_limits] + [sys.float_info.max],
+            bucket=[float(x) for x in self.histograms[phase]])))
+    if values:
+      writer.add_summary(tf_compat.v1.Summary(value=values), global_step)
+
+  def close(self):
+    """
+    Writes the summary to the JSON-lines file and closes it.
+    """
+    import json
+    if self.jsonl_file:
+      self.jsonl_file.write(json.dumps({"summary": self.get_summary()}) + "\n")
+      self.jsonl_file.close()
+      self.jsonl_file = None
+
+
+class _FeedDictPrefetcher(object):
+  """
+  For the pipelined mode of :class:`Runner`:
+  Gets the feed dicts for the next steps from the data provider in a background thread,
+  while the current step is running.
+  """
+
+  def __init__(self, data_provider, session, max_queue_size=1):
+    """
+    :param FeedDictDataProvider data_provider:
+    :param tf.compat.v1.Session session:
+    :param int max_queue_size:
+    """
+    from threading import Thread
+    self.data_provider = data_provider
+    self.session = session
+    self.queue = Queue(maxsize=max_queue_size)
+    self.stopped = False
+    self.exception = None  # type: typing.Optional[BaseException]
+    # The feed dict in the queue, the one which the thread is about to put into the queue,
+    # and the one of the current step.
+    data_provider.num_outputs_in_use = max_queue_size + 2
+    self.thread = Thread(target=self._thread_main, name="Runner feed dict prefetch thread")
+    self.thread.daemon = True
+    self.thread.start()
+
+  def _put(self, item):
+    """
+    :param ((dict,dict)|None) item:
+    :return: whether it was put into the queue, i.e. False if we were stopped
+    :rtype: bool
+    """
+    while not self.stopped:
+      try:
+        self.queue.put(item, timeout=0.1)
+        return True
+      except Full:
+        pass
+    return False
+
+  def _thread_main(self):
+    try:
+      while not self.stopped:
+        if not self.data_provider.have_more_data(session=self.session):
+          self._put(None)
+          return
+        if not self._put(self.data_provider.get_feed_dict()):
+          return
+    except BaseException as exc:
+      self.exception = exc
+      self._put(None)
+
+  def get(self):
+    """
+    :return: feed dict and meta step info, like :func:`DataProviderBase.get_feed_dict`, or None at the end
+    :rtype: (dict[tf.Tensor,numpy.ndarray],dict[str])|None
+    """
+    item = self.queue.get()
+    if item is None:
+      self.queue.put(None)  # maybe we get called again
+      if self.exception:
+        raise self.exception
+    return item
+
+  def stop(self):
+    """
+    Stops the thread. Any prefetched feed dicts are dropped.
+    """
+    self.stopped = True
+    self.thread.join()
+
+
+class _StepPostProcessor(object):
+  """
+  For the pipelined mode of :class:`Runner`:
+  Runs the host-side processing of the step results (accumulating the scores, logging, summaries)
+  in a background thread, in the order of the steps, while the next step is running.
+  """
+
+  def __init__(self, max_queue_size=10):
+    """
+    :param int max_queue_size: the main thread blocks if the post processing cannot keep up
+    """
+    from threading import Thread
+    self.queue = Queue(maxsize=max_queue_size)
+    self.exception = None  # type: typing.Optional[BaseException]
+    self.exc_info = None
+    self.thread = Thread(target=self._thread_main, name="Runner step post processing thread")
+    self.thread.daemon = True
+    self.thread.start()
+
+  def _thread_main(self):
+    while True:
+      func = self.queue.get()
+      try:
+        if func is None:
+          return
+        if self.exception is None:  # after an exception, skip all further steps
+          func()
+      except BaseException as exc:
+        self.exception = exc
+        self.exc_info = sys.exc_info()
+      finally:
+        self.queue.task_done()
+
+  def add(self, func):
+    """
+    :param ()->None func:
+    """
+    self.check()
+    self.queue.put(func)
+
+  def check(self):
+    """
+    Raises the exception of the post processing of some earlier step, if there was any.
+    """
+    if self.exception is not None:
+      exc, self.exception = self.exception, None
+      print("Exception in step post processing:", file=log.v1)
+      sys.excepthook(*self.exc_info)
+      raise exc
+
+  def join(self):
+    """
+    Waits until all added steps are processed.
+    """
+    self.queue.join()
+    self.check()
+
+  def stop(self):
+    """
+    Stops the thread, after all added steps are processed.
+    """
+    self.queue.put(None)
+    self.thread.join()
+
+
 class Runner(object):
   """
   This encapsulates the logic around TF ``session.run``, i.e. iterating over the dataset.
+
+  With the ``runner_pipelining`` option, the feed dict of the next step is prepared in a background thread,
+  and the host-side processing of the step results is done in another background thread
+  (see :class:`_FeedDictPrefetcher` and :class:`_StepPostProcessor`),
+  such that the device does not need to wait for the host between the steps.
+  The post processing is still done in the order of the steps, thus the accumulated scores are exactly the same.
   """
 
   # noinspection PyShadowingBuiltins
@@ -89,6 +357,8 @@ class Runner(object):
     self._should_eval = eval
     self.store_metadata_mod_step = engine.config.int("store_metadata_mod_step", 0)
     self.reset_updater_vars_mod_step = engine.config.int("reset_updater_vars_mod_step", 0)
+    self.pipelining = engine.config.bool("runner_pipelining", False)
+    self.step_timings = None  # type: typing.Optional[StepTimingStats]
     self.finalized = False
     self.cancel_flag = False
     self.run_exception = None
@@ -208,6 +478,37 @@ class Runner(object):
       from returnn.util.basic import progress_bar
       progress_bar(complete, hms(remaining_estimated))
 
+  def _post_process_step(self, step, fetches_results, step_duration, writer, summary_step):
+    """
+    The host-side processing of the step results.
+    With pipelining, this runs in a background thread, in the order of the steps.
+
+    :param int step:
+    :param dict[str,numpy.ndarray|str] fetches_results: results of calculations, see self._get_fetches_dict()
+    :param float step_duration: in secs
+    :param tf.compat.v1.summary.FileWriter|None writer:
+    :param int summary_step:
+    """
+    start_time = time.time()
+    eval_info = self._collect_eval_info(fetches_results=fetches_results)
+    self._maybe_handle_extra_fetches(fetches_results)
+    eval_info_end_time = time.time()
+    if writer and "summary" in fetches_results and not (
+          self.store_metadata_mod_step and step % self.store_metadata_mod_step == 0):  # written already
+      writer.add_summary(fetches_results["summary"], summary_step)
+    self._print_process(report_prefix=self.report_prefix, step=step, step_duration=step_duration, eval_info=eval_info)
+    if self.step_timings:
+      self.step_timings.add(step, "eval_info", eval_info_end_time - start_time)
+      self.step_timings.add(step, "logging", time.time() - eval_info_end_time)
+      self.step_timings.finish_step(step)
+
+    if self.engine.config.bool("stop_on_nonfinite_train_score", True):
+      score_values = self._results_accumulated.values()
+      if any(numpy.isinf(score_values)) or any(numpy.isnan(score_values)):
+        print("Model seems broken, got inf or nan score.", file=log.v1)
+        print("Accumulated scores:", self._results_accumulated, file=log.v1)
+        raise Exception("Inf/nan score in step %i." % step)
+
   def _print_finish_process(self):
     if self._show_interactive_process_bar:
       from returnn.util.basic import progress_bar
@@ -395,6 +696,12 @@ class Runner(object):
     if not self.engine.config.is_true("use_horovod"):
       return
     while True:
+      if (not self._horovod_stopped_runner and tf_horovod.get_ctx().should_sync_every_step()
+              and not self._horovod_is_have_more_data_sync_step(local_step=local_step)):
+        # The other peers only expect the signal in the next sync step. Until then, keep in sync.
+        self._horovod_empty_step(local_step=local_step, is_final=False)
+        local_step += 1
+        continue
       hvd_stop, hvd_error = self._horovod_signal_broadcast(have_more_data=False)
       if hvd_error:
         print("WARNING: Horovod error just after finishing the epoch... (pid %i)" % os.getpid(), file=log.v2)
@@ -424,8 +731,33 @@ class Runner(object):
       # We only need to sync for the param sync.
       if not self._horovod_should_sync_params_now(local_step=local_step):
         return False, False
+    elif not self._horovod_is_have_more_data_sync_step(local_step=local_step):
+      return False, False
     return self._horovod_signal_broadcast(have_more_data=True)
 
+  def _horovod_get_have_more_data_sync_step(self):
+    """
+    :return: every how many steps we signal whether we have more data, when we sync every step.
+      A peer which runs out of data in between does empty steps (:func:`_horovod_empty_step`)
+      until the next signal. This is not possible when we train with reduce type grad,
+      because an empty step cannot take part in the grad allreduce, thus it is always 1 then.
+    :rtype: int
+    """
+    hvd_ctx = tf_horovod.get_ctx()
+    if self._should_train and hvd_ctx.is_reduce_type_grad():
+      return 1
+    sync_step = hvd_ctx.get_have_more_data_sync_step()
+    assert sync_step >= 1
+    return sync_step
+
+  def _horovod_is_have_more_data_sync_step(self, local_step):
+    """
+    :param int local_step:
+    :return: whether we signal in this step whether we have more data. only when we sync every step
+    :rtype: bool
+    """
+    return local_step % self._horovod_get_have_more_data_sync_step() == 0
+
   def _horovod_signal_broadcast(self, have_more_data=True, error=False):
     """
     :param bool have_more_data: whether we have more data in this instance
@@ -473,15 +805,17 @@ class Runner(object):
       self._horovod_stopped_runner = True
     return stop, error_occurred
 
-  def _horovod_empty_step(self, local_step):
+  def _horovod_empty_step(self, local_step, is_final=True):
     """
     Call this if you want to proceed one step without doing anything.
     E.g. when this local rank has finished the dataset but some other rank has not yet.
 
     We assume that _horovod_signal_broadcast was called just before
-    (in any case, even if should_sync_every_step is False).
+    (in any case, even if should_sync_every_step is False),
+    unless is_final is False, which is for the steps between the have-more-data signals.
 
     :param int local_step:
+    :param bool is_final: whether to always sync the params. see :func:`_horovod_sync_params`
     """
     hvd_ctx = tf_horovod.get_ctx()
     if self._horovod_collected_reduce_inputs:
@@ -492,13 +826,13 @@ class Runner(object):
       for key, (tensor_in, tensor_out) in self._horovod_collected_reduce_inputs.items():
         feed_dict[tensor_in] = 0.0  # should be scalar
         fetches[key] = tensor_out
-      self.engine.tf_session.run(fetches)
+      self.engine.tf_session.run(fetches, feed_dict=feed_dict)
     else:
       assert not hvd_ctx.should_sync_every_step()
     # Need to call this to keep communication in sync.
     # Note: If used, sync always (via is_final=True), even if should_sync_every_step is False,
     # because we always called _horovod_signal_broadcast before this.
-    self._horovod_sync_params(local_step=local_step, is_final=True)
+    self._horovod_sync_params(local_step=local_step, is_final=is_final)
 
   def _horovod_should_sync_params_now(self, local_step, is_final=False):
     """
@@ -590,9 +924,17 @@ class Runner(object):
     else:
       writer = None
     print("TF: log_dir: %s" % logdir, file=log.v5)
+    if self.engine.config.bool("runner_step_timings", True):
+      # noinspection PyProtectedMember
+      self.step_timings = StepTimingStats(
+        jsonl_filename=(
+          os.path.join(logdir, "step-timings-ep%03i.jsonl" % self.engine.epoch)
+          if (logdir and self.engine._do_save()) else None))
+    step_timings = self.step_timings
     run_metadata = tf_compat.v1.RunMetadata()
     debug_shell_in_runner = self.engine.config.bool("debug_shell_in_runner", False)
     debug_shell_in_runner_step = self.engine.config.int("debug_shell_in_runner_step", 1)
+    pipelining = self.pipelining and not debug_shell_in_runner
 
     # Not sure if this is the best thing to do for an evaluation but it's ok for now.
     # We could also set it to 0 for non train epochs.
@@ -604,10 +946,14 @@ class Runner(object):
     self.data_provider.start_threads(session=sess)
     self.start_time = time.time()
     elapsed_time_tf = 0.0
+    elapsed_time_idle = 0.0  # time between the session runs, where the device waits for the host
+    last_session_run_end_time = None  # type: typing.Optional[float]
     step = None
     fetches_dict = None
     feed_dict = None
     meta_step_info = None
+    feed_dict_prefetcher = None  # type: typing.Optional[_FeedDictPrefetcher]
+    post_processor = None  # type: typing.Optional[_StepPostProcessor]
     try:
       # step is like mini-batch in our usual terminology
       step = 0
@@ -618,8 +964,21 @@ class Runner(object):
       # Also, add graph to summary here because the updater/optimizer might not have been created before.
       if writer:
         writer.add_graph(sess.graph)
+      if pipelining:
+        if isinstance(self.data_provider, FeedDictDataProvider):
+          feed_dict_prefetcher = _FeedDictPrefetcher(data_provider=self.data_provider, session=sess)
+        post_processor = _StepPostProcessor()
       hvd_stop = hvd_error = False
-      while self.data_provider.have_more_data(session=sess):
+      while True:
+        feed_start_time = time.time()
+        if feed_dict_prefetcher:
+          next_feed = feed_dict_prefetcher.get()
+          if next_feed is None:
+            break
+        else:
+          if not self.data_provider.have_more_data(session=sess):
+            break
+          next_feed = None
         self._step_start_time = time.time()
         hvd_stop, hvd_error = self._horovod_signal_have_more_data(local_step=step)
         if hvd_error:
@@ -627,7 +986,17 @@ class Runner(object):
         if hvd_stop:
           # Some other peer does not have data anymore, but no error occurred.
           break
-        feed_dict, meta_step_info = self.data_provider.get_feed_dict()
+        hvd_signal_duration = time.time() - self._step_start_time
+        if next_feed is not None:
+          feed_dict, meta_step_info = next_feed
+        else:
+          feed_dict, meta_step_info = self.data_provider.get_feed_dict()
+        if step_timings:
+          step_timings.add(step, "feed_dict", time.time() - feed_start_time - hvd_signal_duration)
+          step_timings.add(step, "horovod", hvd_signal_duration)
+          for phase in ["load_seqs", "batch_creation"]:
+            if "timing:%s" % phase in meta_step_info:
+              step_timings.add(step, phase, meta_step_info["timing:%s" % phase])
         if isinstance(self.engine.network.train_flag, tf.Tensor):
           feed_dict[self.engine.network.train_flag] = self._train_flag
         if isinstance(self.engine.network.epoch_step, tf.Tensor):
@@ -661,12 +1030,15 @@ class Runner(object):
               trace_level=tf_compat.v1.RunOptions.FULL_TRACE)
             # We could use tfdbg.add_debug_tensor_watch here.
             session_run_start_time = time.time()
+            if last_session_run_end_time is not None:
+              elapsed_time_idle += session_run_start_time - last_session_run_end_time
             fetches_results = sess.run(
               fetches_dict,
               feed_dict=feed_dict,
               options=run_options,
               run_metadata=run_metadata)  # type: typing.Dict[str,typing.Union[numpy.ndarray,str]]
-            elapsed_time_tf += time.time() - session_run_start_time
+            last_session_run_end_time = time.time()
+            elapsed_time_tf += last_session_run_end_time - session_run_start_time
             writer.add_summary(fetches_results["summary"], step + step_offset)
             writer.add_run_metadata(run_metadata, 'step_{:04d}'.format(step + step_offset))
             tl = timeline.Timeline(run_metadata.step_stats)
@@ -675,11 +1047,12 @@ class Runner(object):
               f.write(tl.generate_chrome_trace_format(show_memory=True))
           else:
             session_run_start_time = time.time()
+            if last_session_run_end_time is not None:
+              elapsed_time_idle += session_run_start_time - last_session_run_end_time
             fetches_results = sess.run(
               fetches_dict, feed_dict=feed_dict)  # type: typing.Dict[str,typing.Union[numpy.ndarray,str]]
-            elapsed_time_tf += time.time() - session_run_start_time
-            if writer and "summary" in fetches_results:
-              writer.add_summary(fetches_results["summary"], step + step_offset)
+            last_session_run_end_time = time.time()
+            elapsed_time_tf += last_session_run_end_time - session_run_start_time
         except tf.errors.OpError as exc:
           if isinstance(exc, tf.errors.OutOfRangeError) and isinstance(self.data_provider, DatasetDataProvider):
             # This means that we got end-of-sequence from the dataset iterator.
@@ -691,23 +1064,29 @@ class Runner(object):
           # Extra info will be printed below.
           raise
 
-        eval_info = self._collect_eval_info(fetches_results=fetches_results)
-        self._maybe_handle_extra_fetches(fetches_results)
-        elapsed_time_tf += self._horovod_sync_params(local_step=step)
+        if step_timings:
+          step_timings.add(step, "session_run", last_session_run_end_time - session_run_start_time)
+        hvd_sync_duration = self._horovod_sync_params(local_step=step)
+        elapsed_time_tf += hvd_sync_duration
+        if step_timings:
+          step_timings.add(step, "horovod", hvd_sync_duration)
         duration = time.time() - start_time
-        self._print_process(report_prefix=report_prefix, step=step, step_duration=duration, eval_info=eval_info)
-
-        if self.engine.config.bool("stop_on_nonfinite_train_score", True):
-          score_values = self._results_accumulated.values()
-          if any(numpy.isinf(score_values)) or any(numpy.isnan(score_values)):
-            print("Model seems broken, got inf or nan score.", file=log.v1)
-            print("Accumulated scores:", self._results_accumulated, file=log.v1)
-            raise Exception("Inf/nan score in step %i." % step)
+        if post_processor:
+          post_processor.add(lambda step_=step, fetches_results_=fetches_results, duration_=duration: (
+            self._post_process_step(
+              step=step_, fetches_results=fetches_results_, step_duration=duration_,
+              writer=writer, summary_step=step_ + step_offset)))
+        else:
+          self._post_process_step(
+            step=step, fetches_results=fetches_results, step_duration=duration,
+            writer=writer, summary_step=step + step_offset)
 
         step += 1
         if self.cancel_flag:
           raise CancelTrainingException("cancel_flag is set")
 
+      if post_processor:
+        post_processor.join()
       self._print_finish_process()
 
       if not hvd_stop and not self.data_provider.have_reached_end():
@@ -730,6 +1109,12 @@ class Runner(object):
       elapsed_tf_percentage = (elapsed_time_tf / elapsed) if (elapsed > 0) else 0.0
       print("%s, finished after %i steps, %s elapsed (%.1f%% computing time)" % (
         report_prefix, step, hms(elapsed), (elapsed_tf_percentage * 100.)), file=log.v3)
+      print("%s, device idle time between steps: %.2f ms per step on average (pipelining: %s)" % (
+        report_prefix, elapsed_time_idle * 1000. / max(step - 1, 1), "on" if pipelining else "off"), file=log.v4)
+      if step_timings:
+        print("%s, step timings (mean): %s" % (report_prefix, step_timings.get_summary_str()), file=log.v4)
+        if writer:
+          step_timings.write_histograms(writer=writer, global_step=step + step_offset)
 
     except KeyboardInterrupt as exc:
       print("KeyboardInterrupt in step %r." % step)
@@ -750,6 +1135,12 @@ class Runner(object):
       # Try and ignore certain exceptions as we anyway should try to clean up as much as possible.
       from returnn.util.basic import try_and_ignore_exception
       from returnn.tf.util.basic import stop_event_writer_thread
+      if feed_dict_prefetcher:
+        try_and_ignore_exception(feed_dict_prefetcher.stop)
+      if post_processor:
+        try_and_ignore_exception(post_processor.stop)
+      if step_timings:
+        try_and_ignore_exception(step_timings.close)
       try_and_ignore_exception(self._horovod_signal_error)  # ignored if _horovod_finish_data was called before
       if writer:
         try_and_ignore_exception(writer.close)
@@ -793,16 +1184,26 @@ class Engine(EngineBase):
     self._merge_all_summaries = None
     self.dataset_batches = {}  # type: typing.Dict[str,BatchSetGenerator]
     self.dataset_provider = None  # type: typing.Optional[DatasetDataProvider]
+    self.feed_dict_buffer_pool = FeedDictBufferPool.from_config_opt(
+      config.typed_value("feed_dict_buffer_pool", None))  # type: typing.Optional[FeedDictBufferPool]
     self.train_data = None  # type: typing.Optional[Dataset]
     self.eval_datasets = {}  # type: typing.Dict[str,Dataset]
     self.start_epoch = None  # type: typing.Optional[int]
     self.use_dynamic_train_flag = False
     self.use_search_flag = config.value("task", None) == "search"
     self.use_eval_flag = config.value("task", None) != "forward"
+    # See returnn.tf.sharded_tasks. In a worker, we only handle the seqs with seq_idx % num_shards == shard_index.
+    self.num_shards = 1
+    self.shard_index = 0
+    if config.has("task_worker_index"):
+      self.num_shards = config.int("task_num_workers", 1)
+      self.shard_index = config.int("task_worker_index", 0)
+      assert 0 <= self.shard_index < self.num_shards
     self.learning_rate = 0.0  # set in init_train_epoch
     self._const_cache = {}  # type: typing.Dict[str,tf.Tensor]
     self.preload_from_files = None  # type: typing.Optional[typing.Dict[str,typing.Dict[str]]]
     self.max_seqs = None  # type: typing.Optional[int]
+    self._async_saver = None  # type: typing.Optional[AsyncCheckpointSaver]
 
   def finalize(self, error_occurred=False):
     """
@@ -854,6 +1255,8 @@ class Engine(EngineBase):
         print("Note: There is a GPU available but you have set device=cpu.", file=log.v2)
 
   def _close_tf_session(self):
+    self.wait_for_pending_saves()
+    self._async_saver = None
     if self.tf_session:
       self.tf_session.close()
     self.tf_session = None
@@ -959,8 +1362,29 @@ class Engine(EngineBase):
     if not filename:
       filename = self.get_epoch_model_filename()
     print("Save model under %s" % (filename,), file=log.v4)
+    if self.config.bool("save_model_async", False):
+      if not self._async_saver or self._async_saver.network is not self.network:
+        self.wait_for_pending_saves()
+        self._async_saver = None
+        reason = AsyncCheckpointSaver.get_not_supported_reason(self.network)
+        if reason:
+          print("save_model_async: not supported (%s), will save synchronously." % reason, file=log.v3)
+        else:
+          self._async_saver = AsyncCheckpointSaver(
+            network=self.network, session=self.tf_session,
+            max_pending=self.config.int("save_model_async_max_pending", 1))
+      if self._async_saver:
+        self._async_saver.save(filename)
+        return
     self.network.save_params_to_file(filename, session=self.tf_session)
 
+  def wait_for_pending_saves(self):
+    """
+    Waits until all model saves in the background are finished (see ``save_model_async``).
+    """
+    if self._async_saver:
+      self._async_saver.wait()
+
   @staticmethod
   def delete_model(filename):
     """
@@ -1276,6 +1700,20 @@ class Engine(EngineBase):
     use_dataset_pipeline = False
     if self.config.is_true("dataset_pipeline"):
       use_dataset_pipeline = True
+    graph_cache, graph_cache_key = None, None
+    if (self.config.value("graph_cache_dir", None) and train_flag is False and not use_dataset_pipeline
+            and not self.config.is_true("use_horovod")):
+      from returnn.tf.graph_cache import GraphCache
+      graph_cache = GraphCache(self.config.value("graph_cache_dir", None))
+      graph_cache_key = graph_cache.get_key(
+        config=self.config, net_dict=net_desc, eval_flag=self.use_eval_flag, search_flag=self.use_search_flag)
+      # This must be imported into the empty graph, such that all the names stay the same.
+      self.network = graph_cache.load(graph_cache_key, net_dict=net_desc, config=self.config)
+      if self.network:
+        self.updater = None
+        self.network.print_network_info()
+        self.network.initialize_params(session=self.tf_session)
+        return
     extern_data = ExternData()
     extern_data.init_from_config(config=self.config, auto_create_placeholders=not use_dataset_pipeline)
     if use_dataset_pipeline:
@@ -1290,6 +1728,8 @@ class Engine(EngineBase):
       train_flag=train_flag, eval_flag=self.use_eval_flag, search_flag=self.use_search_flag,
       initial_learning_rate=getattr(self, "initial_learning_rate", None),
       net_dict=net_desc)
+    if graph_cache:
+      graph_cache.save(graph_cache_key, network=self.network)
     self.network.initialize_params(session=self.tf_session)
     if self.config.is_true("use_horovod"):
       # Note: Might not be needed as it should be deterministic. But just to be sure...
@@ -1547,6 +1987,7 @@ class Engine(EngineBase):
       if trainer.device_crash_batch is not None:  # Otherwise we got an unexpected exception - a bug in our code.
         if self.model_filename:
           self.save_model(self.get_epoch_model_filename() + ".crash_%i" % trainer.device_crash_batch)
+          self.wait_for_pending_saves()
       print("Trainer not finalized, quitting. (pid %i)" % os.getpid(), file=log.v1)
       sys.exit(1)
 
@@ -1555,6 +1996,7 @@ class Engine(EngineBase):
       if self.config.bool("stop_on_nonfinite_train_score", True):
         if self.model_filename:
           self.save_model(self.get_epoch_model_filename() + ".broken")
+          self.wait_for_pending_saves()
         sys.exit(1)
 
     should_call_graph_reset_callbacks = False
@@ -1852,6 +2294,7 @@ class Engine(EngineBase):
     """
     if not self._do_save():
       return
+    self.wait_for_pending_saves()
     from returnn.util.basic import CollectionReadCheckCovered, human_bytes_size, confirm
     from itertools import count
     opts = CollectionReadCheckCovered(self.config.get_of_type("cleanup_old_models", dict, {}))
@@ -1995,6 +2438,7 @@ class Engine(EngineBase):
         data_keys=self.network.get_used_data_keys(),
         dataset=dataset, batches=batches,
         batch_slice=batch_slice,
+        buffer_pool=self.feed_dict_buffer_pool,
         enforce_min_len1=self.config.is_true("enforce_min_len1", False))
       return data_provider
 
@@ -2005,6 +2449,17 @@ class Engine(EngineBase):
     :return: feed_dict for self.tf_session.run()
     :rtype: dict[tf.Tensor,numpy.ndarray]
     """
+    feed_dict, _ = self._get_specific_feed_dict_and_data_provider(dataset=dataset, seq_idx=seq_idx)
+    return feed_dict
+
+  def _get_specific_feed_dict_and_data_provider(self, dataset, seq_idx):
+    """
+    :param Dataset.Dataset dataset:
+    :param int seq_idx: index of sequence, -1 for all sequences in dataset
+    :return: feed_dict for self.tf_session.run(), and the data provider,
+      where you should call :func:`FeedDictDataProvider.release_buffers` after the run
+    :rtype: (dict[tf.Tensor,numpy.ndarray], FeedDictDataProvider)
+    """
     # No Runner instance here but a very simplified version of Runner.run().
     # First we need a custom DataProvider with a custom BatchSetGenerator
     # which will yield only one single batch for the provided sequence idx.
@@ -2018,8 +2473,9 @@ class Engine(EngineBase):
     batch_generator = iter([batch])
     batches = BatchSetGenerator(dataset, generator=batch_generator)
     data_provider = self._get_data_provider(dataset=dataset, batches=batches, feed_dict=True)
+    assert isinstance(data_provider, FeedDictDataProvider)
     feed_dict, _ = data_provider.get_feed_dict(single_threaded=True)
-    return feed_dict
+    return feed_dict, data_provider
 
   def run_single(self, dataset, seq_idx, output_dict, ext_feed_dict=None):
     """
@@ -2030,13 +2486,16 @@ class Engine(EngineBase):
     :return: output_dict but values evaluated
     :rtype: dict[str,numpy.ndarray]
     """
-    feed_dict = self.get_specific_feed_dict(dataset=dataset, seq_idx=seq_idx)
+    feed_dict, data_provider = self._get_specific_feed_dict_and_data_provider(dataset=dataset, seq_idx=seq_idx)
     if ext_feed_dict:
       feed_dict.update(ext_feed_dict)
     self.check_uninitialized_vars()  # Maybe some new uninitialized vars. Last check.
     none_output_values = {k: v for (k, v) in output_dict.items() if v is None}
     output_dict = {k: v for (k, v) in output_dict.items() if v is not None}
-    output_values = self.tf_session.run(output_dict, feed_dict=feed_dict)
+    try:
+      output_values = self.tf_session.run(output_dict, feed_dict=feed_dict)
+    finally:
+      data_provider.release_buffers()
     output_values.update(none_output_values)
     return output_values
 
@@ -2098,15 +2557,28 @@ class Engine(EngineBase):
         labels = None
 
     assert output_file
+    if self.num_shards > 1:
+      from returnn.tf.sharded_tasks import get_shard_filename
+      output_file = get_shard_filename(output_file, shard_index=self.shard_index, num_shards=self.num_shards)
     print("Forwarding to HDF file: %s" % output_file, file=log.v2)
+    # With forward_resume, we write directly to the output file,
+    # and continue it if it exists, e.g. after an interrupted run, skipping all seqs already written.
+    resume = self.config.bool("forward_resume", False)
     if self.config.is_true("forward_override_hdf_output"):
       if os.path.exists(output_file):
         print("HDF file exists, delete now (forward_override_hdf_output).", file=log.v2)
         os.remove(output_file)
-    else:
+    elif not resume:
       assert not os.path.exists(output_file)
     print("Forward output:", output, file=log.v3)
-    writer = SimpleHDFWriter(filename=output_file, dim=output.dim, ndim=output.ndim, labels=labels)
+    extend_existing_file = resume and os.path.exists(output_file)
+    writer = SimpleHDFWriter(
+      filename=output_file, dim=output.dim, ndim=output.ndim, labels=labels,
+      extend_existing_file=extend_existing_file, use_tmp_file=not resume)
+    skip_seq_tags = None
+    if extend_existing_file:
+      skip_seq_tags = set(writer.get_seq_tags())
+      print("Resume forwarding, %i seqs written already." % len(skip_seq_tags), file=log.v2)
 
     def extra_fetches_cb(inputs, seq_tag, **kwargs):
       """
@@ -2133,7 +2605,9 @@ class Engine(EngineBase):
       recurrent_net=True,  # Using non-recurrent batch construction leads to incorrect seqLengths in the HDF
       batch_size=batch_size,
       max_seqs=self.max_seqs,
-      used_data_keys=self.network.get_used_data_keys())
+      used_data_keys=self.network.get_used_data_keys(),
+      skip_seq_tags=skip_seq_tags,
+      num_shards=self.num_shards, shard_index=self.shard_index)
     forwarder = Runner(
       engine=self, dataset=data, batches=batches,
       train=False, eval=False,
@@ -2198,13 +2672,15 @@ class Engine(EngineBase):
       sys.exit(1)
     return analyzer
 
-  def search(self, dataset, do_eval=True, output_layer_names="output", output_file=None, output_file_format="txt"):
+  def search(self, dataset, do_eval=True, output_layer_names="output", output_file=None, output_file_format="txt",
+             output_file_resume=False):
     """
     :param Dataset dataset:
     :param bool do_eval: calculate errors. can only be done if we have the reference target
     :param str|list[str] output_layer_names:
     :param str output_file:
-    :param str output_file_format: "txt" or "py"
+    :param str output_file_format: "txt", "py" or "jsonl". see :class:`SearchOutputWriter`
+    :param bool output_file_resume: skip the seqs which are already in the output file. see :class:`SearchOutputWriter`
     """
     print("Search with network on %r." % dataset, file=log.v1)
     if not self.use_search_flag or not self.network or self.use_dynamic_train_flag:
@@ -2216,10 +2692,23 @@ class Engine(EngineBase):
       if self.network:
         print("Reinit network with search flag.", file=log.v3)
       self.init_network_from_config(self.config)
+    if do_eval and not isinstance(self.network, TFNetwork):
+      print("Search without evaluation, because the network graph is imported from the graph cache.", file=log.v2)
+      do_eval = False
     if do_eval:
       # It's constructed lazily and it will set used_data_keys, so make sure that we have it now.
       self.network.maybe_construct_objective()
-    if output_file:
+    # Sort by length within windows of this many seqs, independent of the dataset seq order.
+    # The outputs are still written in the original order.
+    sort_window = self.config.int("search_sort_window", 0) if self.network.recurrent else 0
+    if output_file and sort_window:
+      print("Search with length-sorted batches within windows of %i seqs." % sort_window, file=log.v3)
+      if dataset.seq_ordering != "default":
+        print(
+          "WARNING: search_sort_window: dataset %r seq_ordering %r is replaced by 'default', "
+          "as the seqs are sorted within the windows." % (dataset.name, dataset.seq_ordering), file=log.v2)
+      dataset.seq_ordering = "default"
+    elif output_file:
       if dataset.have_corpus_seq_idx():
         # We can sort it. Sort it in reverse to make sure that we have enough memory right at the beginning.
         print("Dataset have_corpus_seq_idx == True, i.e. it will be sorted for optimal performance.", file=log.v3)
@@ -2232,14 +2721,6 @@ class Engine(EngineBase):
     assert not max_seq_length, (
       "Set max_seq_length = 0 for search (i.e. no maximal length). We want to keep all source sentences.")
 
-    dataset.init_seq_order(epoch=self.epoch)
-    batches = dataset.generate_batches(
-      recurrent_net=self.network.recurrent,
-      batch_size=self.config.int('batch_size', 1),
-      max_seqs=self.config.int('max_seqs', -1),
-      max_seq_length=max_seq_length,
-      used_data_keys=self.network.get_used_data_keys())
-
     output_is_dict = isinstance(output_layer_names, list)
     if not output_is_dict:
       output_layer_names = [output_layer_names]
@@ -2264,19 +2745,46 @@ class Engine(EngineBase):
       out_beam_sizes.append(out_beam.beam_size if out_beam else None)
       target_keys.append(output_layer.target or self.network.extern_data.default_target)
 
-    out_cache = None
-    seq_idx_to_tag = {}
+    output_writer = None  # type: typing.Optional[SearchOutputWriter]
     if output_file:
-      assert output_file_format in {"txt", "py"}
+      assert output_file_format in SearchOutputWriter.file_formats
       if output_is_dict:
-        assert output_file_format == "py", "Text format not supported in the case of multiple output layers."
+        assert output_file_format != "txt", "Text format not supported in the case of multiple output layers."
+      if self.num_shards > 1:
+        # The main process merges the shards into the final output file, see returnn.tf.sharded_tasks.
+        from returnn.tf.sharded_tasks import get_shard_filename
+        output_file = get_shard_filename(output_file, shard_index=self.shard_index, num_shards=self.num_shards)
+        output_file_format = "jsonl"
       assert all(dataset.can_serialize_data(target_key) for target_key in target_keys)
-      assert not os.path.exists(output_file)
       print("Will write outputs to: %s" % output_file, file=log.v2)
-      output_file = open(output_file, "w")
-      # corpus-seq-idx -> str|list[(float,str)]|dict[str -> str|list[(float,str)]],
-      # depending on output_is_dict and whether output is after decision
-      out_cache = {}
+      output_writer = SearchOutputWriter(
+        filename=output_file, file_format=output_file_format, resume=output_file_resume)
+
+    skip_seq_tags = set(output_writer.written_seq_tags) if output_writer else None
+    dataset.init_seq_order(epoch=self.epoch)
+    if sort_window:
+      # The search memory and time is roughly proportional to the number of padded frames times the beam size.
+      beam_size = max([out_beam_size or 1 for out_beam_size in out_beam_sizes])
+      max_frames_times_beam = self.config.int(
+        "search_max_frames_times_beam", self.config.int('batch_size', 1) * beam_size)
+      batches = dataset.generate_sorted_batches(
+        batch_size=max(max_frames_times_beam // beam_size, 1),
+        max_seqs=self.config.int('max_seqs', -1),
+        sort_window=sort_window,
+        length_key=self.network.extern_data.default_input,
+        used_data_keys=self.network.get_used_data_keys(),
+        skip_seq_tags=skip_seq_tags,
+        num_shards=self.num_shards, shard_index=self.shard_index)
+    else:
+      batches = dataset.generate_batches(
+        recurrent_net=self.network.recurrent,
+        batch_size=self.config.int('batch_size', 1),
+        max_seqs=self.config.int('max_seqs', -1),
+        max_seq_length=max_seq_length,
+        used_data_keys=self.network.get_used_data_keys(),
+        skip_seq_tags=skip_seq_tags,
+        num_shards=self.num_shards, shard_index=self.shard_index)
+
     if not log.verbose[4]:
       print("Set log_verbosity to level 4 or higher to see seq info on stdout.", file=log.v2)
 
@@ -2315,13 +2823,8 @@ class Engine(EngineBase):
           outputs[target_idx] = bytearray(outputs[target_idx]).decode("utf8")
 
       for batch_idx in range(len(seq_idx)):
-        corpus_seq_idx = None
-        if out_cache is not None:
-          corpus_seq_idx = dataset.get_corpus_seq_idx(seq_idx[batch_idx])
-          assert corpus_seq_idx not in out_cache
-          seq_idx_to_tag[corpus_seq_idx] = seq_tag[batch_idx]
-          if output_is_dict:
-            out_cache[corpus_seq_idx] = {}
+        # output layer name -> str|list[(float,str)], depending on whether output is after decision
+        seq_out_data = {}  # type: typing.Dict[str,typing.Union[str,typing.List[typing.Tuple[float,str]]]]
 
         # noinspection PyShadowingNames
         for target_idx in range(num_targets):
@@ -2350,7 +2853,7 @@ class Engine(EngineBase):
                   dataset.serialize_data(key=target_keys[target_idx], data=outputs[target_idx][out_idx + beam_idx]),
                   file=log.v4)
 
-            if out_cache is not None:
+            if output_writer is not None:
               if out_beam_sizes[target_idx] is None:
                   out_data = dataset.serialize_data(key=target_keys[target_idx], data=outputs[target_idx][out_idx])
               else:
@@ -2360,12 +2863,13 @@ class Engine(EngineBase):
                      dataset.serialize_data(key=target_keys[target_idx], data=outputs[target_idx][out_idx + beam_idx]))
                     for beam_idx in range(out_beam_sizes[target_idx])]
 
-              if output_is_dict:
-                assert output_layer_names[target_idx] not in out_cache[corpus_seq_idx]
-                out_cache[corpus_seq_idx][output_layer_names[target_idx]] = out_data
-              else:
-                assert corpus_seq_idx not in out_cache
-                out_cache[corpus_seq_idx] = out_data
+              assert output_layer_names[target_idx] not in seq_out_data
+              seq_out_data[output_layer_names[target_idx]] = out_data
+
+        if output_writer is not None:
+          output_writer.add(
+            seq_idx=dataset.get_corpus_seq_idx(seq_idx[batch_idx]), seq_tag=seq_tag[batch_idx],
+            output=seq_out_data if output_is_dict else seq_out_data[output_layer_names[0]])
 
     train = self._maybe_prepare_train_in_eval(targets_via_search=True)
 
@@ -2374,7 +2878,7 @@ class Engine(EngineBase):
       "seq_tag": self.network.get_extern_data("seq_tag", mark_data_key_as_used=True)}
 
     for target_idx in range(num_targets):
-      extra_fetches["output_" + output_layer_names[target_idx]] = output_layers[target_idx]
+      extra_fetches["output_" + output_layer_names[target_idx]] = output_layers[target_idx].output
       extra_fetches["beam_scores_" + output_layer_names[target_idx]] = output_layer_beam_scores[target_idx]
       # We use target_keys[target_idx] and not output_layer_names[target_idx]
       # for the key to avoid fetching the same target multiple times.
@@ -2391,22 +2895,9 @@ class Engine(EngineBase):
       sys.exit(1)
     print("Search done. Num steps %i, Final: score %s error %s" % (
       runner.num_steps, self.format_score(runner.score), self.format_score(runner.error)), file=log.v1)
-    if output_file:
-      assert out_cache
-      assert 0 in out_cache
-      assert len(out_cache) - 1 in out_cache
-      if output_file_format == "txt":
-        for i in range(len(out_cache)):
-          output_file.write("%s\n" % out_cache[i])
-      elif output_file_format == "py":
-        from returnn.util.basic import better_repr
-        output_file.write("{\n")
-        for i in range(len(out_cache)):
-          output_file.write("%r: %s,\n" % (seq_idx_to_tag[i], better_repr(out_cache[i])))
-        output_file.write("}\n")
-      else:
-        raise Exception("invalid output_file_format %r" % output_file_format)
-      output_file.close()
+    if output_writer is not None:
+      print("Wrote %i seqs to %s." % (output_writer.num_seqs_written, output_writer.filename), file=log.v2)
+      output_writer.close()
 
   def search_single(self, dataset, seq_idx, output_layer_name=None):
     """
@@ -2505,6 +2996,9 @@ class Engine(EngineBase):
     output_layer = self._get_output_layer()
     assert config.has('output_file'), 'output_file for priors numbers should be provided'
     output_file = config.value('output_file', '')
+    if self.num_shards > 1:
+      from returnn.tf.sharded_tasks import get_shard_filename
+      output_file = get_shard_filename(output_file, shard_index=self.shard_index, num_shards=self.num_shards)
     assert not os.path.exists(output_file), "Already existing output file %r." % output_file
     print("Compute priors, using output layer %r, writing to %r." % (output_layer, output_file), file=log.v2)
 
@@ -2547,7 +3041,8 @@ class Engine(EngineBase):
       batch_size=batch_size,
       max_seq_length=max_seq_length,
       max_seqs=max_seqs,
-      used_data_keys=self.network.get_used_data_keys())
+      used_data_keys=self.network.get_used_data_keys(),
+      num_shards=self.num_shards, shard_index=self.shard_index)
     forwarder = Runner(
       engine=self, dataset=dataset, batches=batches,
       train=False, eval=False,
@@ -2560,7 +3055,21 @@ class Engine(EngineBase):
       print("Error happened. Exit now.")
       sys.exit(1)
 
-    average_posterior = accumulator.sum_posteriors / accumulator.seq_len
+    if self.num_shards > 1:
+      # The main process sums the statistics of all shards, see returnn.tf.sharded_tasks.
+      with open(output_file, "wb") as f:
+        numpy.savez(f, sum_posteriors=accumulator.sum_posteriors, seq_len=accumulator.seq_len)
+      return
+    self.save_priors(sum_posteriors=accumulator.sum_posteriors, seq_len=accumulator.seq_len, output_file=output_file)
+
+  @staticmethod
+  def save_priors(sum_posteriors, seq_len, output_file):
+    """
+    :param numpy.ndarray sum_posteriors: shape (dim,)
+    :param int seq_len: total number of frames
+    :param str output_file: the log priors are written to this file
+    """
+    average_posterior = sum_posteriors / seq_len
     avg_sum = numpy.sum(average_posterior)
     assert numpy.isfinite(avg_sum)
     print("Prior sum in std-space (should be close to 1.0):", avg_sum, file=log.v1)
@@ -2573,14 +3082,13 @@ class Engine(EngineBase):
     """
     Starts a web-server with a simple API to forward data through the network
     (or search if the flag is set).
+    Concurrent requests are batched together.
+    See :mod:`returnn.tf.inference_server` for the API.
 
     :param int port: for the http server
     :return:
     """
-    assert sys.version_info[0] >= 3, "only Python 3 supported"
-    # noinspection PyCompatibility
-    from http.server import HTTPServer, BaseHTTPRequestHandler
-    from returnn.datasets.generating import StaticDataset, Vocabulary, BytePairEncoding, ExtractAudioFeatures
+    from returnn.tf.inference_server import InferenceServer
 
     if not self.use_search_flag or not self.network or self.use_dynamic_train_flag:
       self.use_search_flag = True
@@ -2592,131 +3100,15 @@ class Engine(EngineBase):
         print("Reinit network with search flag.", file=log.v3)
       self.init_network_from_config(self.config)
 
-    engine = self
-    soundfile = None
-    input_data = self.network.extern_data.get_default_input_data()
-    input_vocab = input_data.vocab
-    input_audio_feature_extractor = None
-    output_data = self.network.extern_data.get_default_target_data()
-    output_vocab = output_data.vocab
-    if (isinstance(self.config.typed_dict.get("dev", None), dict)
-            and self.config.typed_dict["dev"]["class"] == "LibriSpeechCorpus"):
-      # A bit hacky. Assumes that this is a dataset description for e.g. LibriSpeechCorpus.
-      # noinspection PyPackageRequirements,PyUnresolvedReferences
-      import soundfile  # pip install pysoundfile
-      bpe_opts = self.config.typed_dict["dev"]["bpe"]
-      audio_opts = self.config.typed_dict["dev"]["audio"]
-      bpe = BytePairEncoding(**bpe_opts)
-      assert output_data.sparse
-      assert bpe.num_labels == output_data.dim
-      output_vocab = bpe
-      input_audio_feature_extractor = ExtractAudioFeatures(**audio_opts)
-    else:
-      assert isinstance(input_vocab, Vocabulary)
-    assert isinstance(output_vocab, Vocabulary)
-    num_outputs = {
-      input_data.name: [input_data.dim, input_data.ndim],
-      output_data.name: [output_data.dim, output_data.ndim]}
-
-    output_layer_name = self.config.value("search_output_layer", "output")
-    output_layer = self.network.layers[output_layer_name]
-    output_t = output_layer.output.get_placeholder_as_batch_major()
-    output_seq_lens_t = output_layer.output.get_sequence_lengths()
-    out_beam_size = output_layer.output.beam.beam_size
-    output_layer_beam_scores_t = None
-    if out_beam_size is None:
-      print("Given output %r is after decision (no beam)." % output_layer, file=log.v1)
-    else:
-      print("Given output %r has beam size %i." % (output_layer, out_beam_size), file=log.v1)
-      output_layer_beam_scores_t = output_layer.get_search_choices().beam_scores
-
-    class Handler(BaseHTTPRequestHandler):
-      """
-      Handle POST requests.
-      """
-      # noinspection PyPep8Naming
-      def do_POST(self):
-        """
-        Handle POST request.
-        """
-        try:
-          self._do_post()
-        except Exception:
-          sys.excepthook(*sys.exc_info())
-          raise
-
-      def _do_post(self):
-        import cgi
-        form = cgi.FieldStorage(
-          fp=self.rfile,
-          headers=self.headers,
-          environ={'REQUEST_METHOD': 'POST'})
-        print("HTTP server, got POST.", file=log.v3)
-        from io import BytesIO
-        f = BytesIO(form["file"].file.read())
-        print("Input file size:", len(f.getbuffer().tobytes()), "bytes", file=log.v4)
-        audio_len = None
-        if input_audio_feature_extractor:
-          try:
-            audio, sample_rate = soundfile.read(f)
-          except Exception as exc:
-            print("Error reading audio (%s). Invalid format? Size %i, first few bytes %r." % (
-              exc, len(f.getbuffer().tobytes()), f.getbuffer().tobytes()[:20]), file=log.v2)
-            raise
-          audio_len = float(len(audio)) / sample_rate
-          print("audio len %i (%.1f secs), sample rate %i" % (len(audio), audio_len, sample_rate), file=log.v4)
-          if audio.ndim == 2:  # multiple channels:
-            audio = numpy.mean(audio, axis=1)  # mix together
-          features = input_audio_feature_extractor.get_audio_features(audio=audio, sample_rate=sample_rate)
-        else:
-          sentence = f.read().decode("utf8").strip()
-          print("Input:", sentence, file=log.v4)
-          seq = input_vocab.get_seq(sentence)
-          print("Input seq:", input_vocab.get_seq_labels(seq), file=log.v4)
-          features = numpy.array(seq, dtype="int32")
-        targets = numpy.array([], dtype="int32")  # empty...
-        dataset = StaticDataset(
-          data=[{input_data.name: features, output_data.name: targets}], output_dim=num_outputs)
-        dataset.init_seq_order(epoch=1)
-
-        self.send_response(200)
-        self.send_header('Content-type', 'text/plain')
-        self.end_headers()
-        start_time = time.time()
-        output_d = engine.run_single(dataset=dataset, seq_idx=0, output_dict={
-          "output": output_t,
-          "seq_lens": output_seq_lens_t,
-          "beam_scores": output_layer_beam_scores_t})
-        delta_time = time.time() - start_time
-        print("Took %.3f secs for decoding." % delta_time, file=log.v4)
-        if audio_len:
-          print("Real-time-factor: %.3f" % (delta_time / audio_len), file=log.v4)
-        output = output_d["output"]
-        seq_lens = output_d["seq_lens"]
-        beam_scores = output_d["beam_scores"]
-        assert len(output) == len(seq_lens) == (out_beam_size or 1)
-        if out_beam_size:
-          assert beam_scores.shape == (1, out_beam_size)  # (batch, beam)
-
-        first_best_txt = output_vocab.get_seq_labels(output[0][:seq_lens[0]])
-        print("Best output: %s" % first_best_txt, file=log.v4)
-
-        if out_beam_size:
-          self.wfile.write(b"[\n")
-          for i in range(out_beam_size):
-            txt = output_vocab.get_seq_labels(output[i][:seq_lens[i]])
-            score = beam_scores[0][i]
-            self.wfile.write(("(%r, %r)\n" % (score, txt)).encode("utf8"))
-          self.wfile.write(b"]\n")
-
-        else:
-          self.wfile.write(("%r\n" % first_best_txt).encode("utf8"))
-
-    print("Simple search web server, listening on port %i." % port, file=log.v2)
-    server_address = ('', port)
     # noinspection PyAttributeOutsideInit
-    self.httpd = HTTPServer(server_address, Handler)
-    self.httpd.serve_forever()
+    self.inference_server = InferenceServer(
+      engine=self, port=port,
+      max_batch_size=self.config.int("web_server_max_batch_size", 16),
+      max_batch_frames=self.config.int("web_server_max_batch_frames", 0) or None,
+      max_wait_time=self.config.float("web_server_max_wait_ms", 10.) / 1000.)
+    # noinspection PyAttributeOutsideInit
+    self.httpd = self.inference_server.httpd
+    self.inference_server.serve_forever()
 
 
 def get_global_engine():
@@ -0,0 +1,576 @@
+
+"""
+Cache for the constructed computation graph of a network, to speed up the startup of inference jobs.
+
+The construction of big networks (e.g. with :class:`RecLayer` subnetworks) can take minutes,
+and e.g. recognition jobs pay that for every test set.
+With the config option ``graph_cache_dir``, the :class:`Engine` stores the constructed graph
+as a meta graph (like ``tools/compile_tf_graph.py --output_file ....meta``),
+together with the :class:`ExternData` and the layer output meta information.
+Later runs with the same key (see :func:`GraphCache.get_key`) import the graph instead of constructing it,
+and use a :class:`CachedGraphNetwork` instead of the :class:`TFNetwork`.
+
+This is only used for inference, i.e. without train flag, e.g. for the tasks ``forward`` and ``search``.
+Graphs with native ops refer to the compiled op libraries (see :class:`OpCodeCompiler`).
+If these do not exist anymore (e.g. the cache dir is shared between nodes, or the native op cache was cleaned up),
+this is treated like a cache miss, i.e. the network is constructed again, which compiles the ops.
+"""
+
+from __future__ import print_function
+
+import os
+import json
+import hashlib
+import typing
+import tensorflow as tf
+import returnn.tf.compat as tf_compat
+from returnn.log import log
+from returnn.tf.util.data import Data, SearchBeam
+from returnn.tf.network import ExternData
+
+if typing.TYPE_CHECKING:
+  from returnn.config import Config
+  from returnn.tf.network import TFNetwork
+
+
+class GraphCache(object):
+  """
+  Stores graphs in a directory, where the filenames are given by the key.
+  """
+
+  # These config options do not have an influence on the graph construction.
+  IgnoredConfigKeys = {
+    "task", "train", "dev", "eval", "eval_datasets", "search_data",
+    "load", "load_epoch", "epoch", "model", "num_epochs", "allow_random_model_init",
+    "log", "log_verbosity", "log_file_prefix", "tf_log_dir",
+    "batch_size", "max_seqs", "max_seq_length", "forward_batch_size",
+    "output_file", "forward_override_hdf_output", "forward_resume",
+    "search_output_file", "search_output_file_format", "search_output_file_resume", "search_do_eval",
+    "search_sort_window", "search_max_frames_times_beam",
+    "task_num_workers", "task_worker_index", "task_worker_num_threads", "runner_pipelining", "graph_cache_dir"}
+
+  # Collections which are needed when the graph is imported again. Others might not be serializable.
+  Collections = (
+    tf_compat.v1.GraphKeys.GLOBAL_VARIABLES,
+    tf_compat.v1.GraphKeys.GLOBAL_STEP,
+    tf_compat.v1.GraphKeys.UPDATE_OPS,
+    tf_compat.v1.GraphKeys.WHILE_CONTEXT,
+    tf_compat.v1.GraphKeys.COND_CONTEXT)
+
+  # Ops which call back into Python. These cannot be restored from the meta graph in a new process.
+  NotCacheableOpTypes = {"PyFunc", "PyFuncStateless", "EagerPyFunc"}
+
+  def __init__(self, cache_dir):
+    """
+    :param str cache_dir:
+    """
+    self.cache_dir = cache_dir
+
+  def __repr__(self):
+    return "<%s %r>" % (self.__class__.__name__, self.cache_dir)
+
+  @classmethod
+  def get_key(cls, config, net_dict, eval_flag, search_flag):
+    """
+    :param Config config:
+    :param dict[str,dict[str]] net_dict:
+    :param bool eval_flag:
+    :param bool search_flag:
+    :return: hash of the network, the config and the RETURNN and TF version
+    :rtype: str
+    """
+    from returnn.util.basic import describe_returnn_version, describe_tensorflow_version
+    config_dict = {key: value for (key, value) in config.dict.items() if key not in cls.IgnoredConfigKeys}
+    config_dict.update({
+      key: value for (key, value) in config.typed_dict.items()
+      if key not in cls.IgnoredConfigKeys and key != "network" and not key.startswith("_")})  # e.g. __builtins__
+    parts = [
+      ("net_dict", _hashable_repr(net_dict)),
+      ("config", _hashable_repr(config_dict)),
+      ("flags", (bool(eval_flag), bool(search_flag))),
+      ("returnn_version", describe_returnn_version()),
+      ("tf_version", describe_tensorflow_version())]
+    return hashlib.sha256(repr(parts).encode("utf8")).hexdigest()
+
+  def _get_filenames(self, key):
+    """
+    :param str key:
+    :return: meta graph filename, info json filename
+    :rtype: (str,str)
+    """
+    return "%s/%s.meta" % (self.cache_dir, key), "%s/%s.json" % (self.cache_dir, key)
+
+  def have(self, key):
+    """
+    :param str key:
+    :rtype: bool
+    """
+    # The info file is written last, so if it exists, the graph is complete.
+    return os.path.exists(self._get_filenames(key)[1])
+
+  @classmethod
+  def get_not_cacheable_reason(cls, network):
+    """
+    :param TFNetwork network:
+    :return: None if the network can be cached, otherwise the reason why not
+    :rtype: str|None
+    """
+    from returnn.tf.network import have_custom_post_init
+    if network.train_flag is not False:
+      return "train flag"
+    # noinspection PyProtectedMember
+    for layer in network._get_all_layers():
+      if layer.custom_param_importer:
+        return "layer %r has a custom_param_importer" % layer
+    for param in network.get_saveable_params_list():
+      if not isinstance(param, tf.Variable):
+        return "saveable param %r is not a variable" % param
+      if have_custom_post_init(param):
+        return "param %r has a custom init" % param
+    for key in network.get_used_data_keys():
+      if network.extern_data.data[key].placeholder is None:
+        return "extern data %r has no placeholder" % key
+    for op in tf_compat.v1.get_default_graph().get_operations():
+      if op.type in cls.NotCacheableOpTypes:
+        return "op %r of type %s calls back into Python" % (op.name, op.type)
+    return None
+
+  def save(self, key, network):
+    """
+    Stores the current graph of the network.
+    If the network cannot be cached (see :func:`get_not_cacheable_reason`), this will just print the reason.
+
+    :param str key: see :func:`get_key`
+    :param TFNetwork network:
+    :return: whether the graph was stored
+    :rtype: bool
+    """
+    reason = self.get_not_cacheable_reason(network)
+    if reason:
+      print("%s: cannot store the graph: %s" % (self, reason), file=log.v2)
+      return False
+    from returnn.util.basic import maybe_make_dirs
+    from returnn.tf.util.basic import OpCodeCompiler
+    maybe_make_dirs(self.cache_dir)
+    meta_filename, info_filename = self._get_filenames(key)
+    graph = tf_compat.v1.get_default_graph()
+    fetches = network.get_fetches_dict(should_train=False, should_eval=False, with_summary=False, with_size=False)
+    info = {
+      "eval_flag": bool(network.eval_flag),
+      "search_flag": bool(network.search_flag),
+      "recurrent": network.recurrent,
+      "default_input": network.extern_data.default_input,
+      "default_target": network.extern_data.default_target,
+      "network_default_target": network.get_default_target(),
+      "default_output_layer_name": network.get_default_output_layer_name(),
+      "extern_data": {
+        key: _data_to_json(data) for (key, data) in network.extern_data.data.items() if data.placeholder is not None},
+      "extra_added_keys": sorted(network.extern_data.extra_added_keys),
+      "used_data_keys": sorted(network.used_data_keys),
+      "layers": {
+        name: _layer_to_json(layer)
+        for (name, layer) in network.layers.items() if layer.output.placeholder is not None},
+      "fetches": {
+        key: [op.name for op in value] if isinstance(value, (list, tuple)) else value.name
+        for (key, value) in fetches.items()},
+      "params": [param.name for param in network.get_params_list()],
+      "saveable_params": [param.name for param in network.get_saveable_params_list()],
+      "global_train_step": network.global_train_step.name,
+      "op_libraries": list(OpCodeCompiler.loaded_so_filenames),
+    }
+    collection_list = [key for key in self.Collections if graph.get_collection(key)]
+    tmp_meta_filename = "%s.tmp-%i" % (meta_filename, os.getpid())
+    tf_compat.v1.train.export_meta_graph(filename=tmp_meta_filename, graph=graph, collection_list=collection_list)
+    os.rename(tmp_meta_filename, meta_filename)
+    tmp_info_filename = "%s.tmp-%i" % (info_filename, os.getpid())
+    with open(tmp_info_filename, "w") as f:
+      json.dump(info, f, indent=2, sort_keys=True)
+    os.rename(tmp_info_filename, info_filename)
+    print("%s: stored graph %s." % (self, key), file=log.v2)
+    return True
+
+  def load(self, key, net_dict, config):
+    """
+    Imports the graph into the current default graph, which should be empty.
+
+    :param str key: see :func:`get_key`
+    :param dict[str,dict[str]] net_dict: only for reference, see :class:`CachedGraphNetwork`
+    :param Config config:
+    :return: the network, or None if the key is not in the cache or the op libraries of the graph are missing
+    :rtype: CachedGraphNetwork|None
+    """
+    if not self.have(key):
+      return None
+    meta_filename, info_filename = self._get_filenames(key)
+    with open(info_filename, "r") as f:
+      info = json.load(f)
+    missing_op_libraries = [filename for filename in info["op_libraries"] if not os.path.exists(filename)]
+    if missing_op_libraries:
+      print("%s: graph %s needs op libraries which do not exist (anymore): %s. Construct it again." % (
+        self, key, ", ".join(missing_op_libraries)), file=log.v2)
+      return None
+    for filename in info["op_libraries"]:
+      tf.load_op_library(filename)
+    tf_compat.v1.train.import_meta_graph(meta_filename)
+    print("%s: imported graph %s." % (self, key), file=log.v2)
+    return CachedGraphNetwork(info=info, net_dict=net_dict, config=config)
+
+
+class CachedGraphLayer(object):
+  """
+  Holds the output meta information of a layer of an imported graph, see :class:`CachedGraphNetwork`.
+  """
+
+  def __init__(self, name, output, target=None, beam_scores=None):
+    """
+    :param str name:
+    :param Data output:
+    :param str|None target:
+    :param tf.Tensor|None beam_scores: see :func:`LayerBase.get_search_choices`
+    """
+    self.name = name
+    self.output = output
+    self.target = target
+    self.beam_scores = beam_scores
+    self.stats = {}
+
+  def __repr__(self):
+    return "<%s %r out_type=%s>" % (self.__class__.__name__, self.name, self.output.get_description(with_name=False))
+
+  def get_search_choices(self):
+    """
+    :return: object with the attribute ``beam_scores``, like :class:`SearchChoices`
+    :rtype: CachedGraphLayer|None
+    """
+    if self.beam_scores is None:
+      return None
+    return self
+
+
+class CachedGraphNetwork(object):
+  """
+  Provides the parts of the :class:`TFNetwork` interface which the :class:`Engine` needs for inference,
+  for a graph imported via :class:`GraphCache`.
+  Losses are not available, i.e. this cannot be used for evaluation.
+  """
+
+  def __init__(self, info, net_dict, config):
+    """
+    :param dict[str] info: see :func:`GraphCache.save`
+    :param dict[str,dict[str]] net_dict: the network dict from which the graph was constructed
+    :param Config config:
+    """
+    graph = tf_compat.v1.get_default_graph()
+    self.name = "root"
+    self._config = config
+    self._info = info
+    self.layers_desc = net_dict
+    self.train_flag = False
+    self.eval_flag = info["eval_flag"]
+    self.search_flag = info["search_flag"]
+    self.recurrent = info["recurrent"]
+    self.epoch_step = None
+    self.extern_data = ExternData(default_input=info["default_input"], default_target=info["default_target"])
+    for key, data_info in info["extern_data"].items():
+      self.extern_data.data[key] = _data_from_json(data_info, graph=graph)
+    self.extern_data.extra_added_keys = set(info["extra_added_keys"])
+    self.used_data_keys = set(info["used_data_keys"])
+    self.layers = {
+      name: _layer_from_json(name, layer_info, graph=graph) for (name, layer_info) in info["layers"].items()}
+    self._fetches = {
+      key: [graph.get_operation_by_name(name) for name in value] if isinstance(value, list)
+      else graph.as_graph_element(value)
+      for (key, value) in info["fetches"].items()}
+    variables = {
+      var.name: var
+      for var in tf_compat.v1.global_variables() + tf_compat.v1.get_collection(tf_compat.v1.GraphKeys.GLOBAL_STEP)}
+    self._params = [variables[name] for name in info["params"]]
+    self._saveable_params = [variables[name] for name in info["saveable_params"]]
+    self.global_train_step = variables[info["global_train_step"]]
+    self._saver = None  # type: typing.Optional[tf.compat.v1.train.Saver]
+    self._run_opts = {}  # type: typing.Dict[str]
+
+  def __repr__(self):
+    return "<%s %s>" % (self.__class__.__name__, self.name)
+
+  def get_config(self):
+    """
+    :rtype: Config
+    """
+    return self._config
+
+  def get_root_network(self):
+    """
+    :rtype: CachedGraphNetwork
+    """
+    return self
+
+  def get_absolute_name_scope_prefix(self):
+    """
+    :return: "" as this is always the root network
+    :rtype: str
+    """
+    return ""
+
+  def get_extern_data(self, key, mark_data_key_as_used=True):
+    """
+    Like :func:`TFNetwork.get_extern_data`.
+
+    :param str key: e.g. "data" or "classes"
+    :param bool mark_data_key_as_used:
+    :rtype: Data
+    """
+    if mark_data_key_as_used:
+      self.used_data_keys.add(key)
+    if key == "seq_idx" and key not in self.extern_data.data:
+      self.extern_data.data[key] = Data(
+        name="seq_idx", shape=(), dtype="int32", sparse=False, auto_create_placeholders=True)
+    if key == "seq_tag" and key not in self.extern_data.data:
+      self.extern_data.data[key] = Data(
+        name="seq_tag", shape=(), dtype="string", auto_create_placeholders=True)
+    return self.extern_data.get_data(key)
+
+  def get_used_data_keys(self, exclude_extra_added=True):
+    """
+    :param bool exclude_extra_added:
+    :rtype: set[str]
+    """
+    used_data_keys = self.used_data_keys
+    if exclude_extra_added:
+      used_data_keys = used_data_keys.difference(self.extern_data.extra_added_keys)
+    return used_data_keys
+
+  def get_seq_tags(self, mark_data_key_as_used=True, beam=None):
+    """
+    :param bool mark_data_key_as_used: for extern_data
+    :param SearchBeam|None beam:
+    :return: tensor of shape (batch,) of dtype string, via extern_data
+    :rtype: tf.Tensor
+    """
+    data = self.get_extern_data(key="seq_tag", mark_data_key_as_used=mark_data_key_as_used)
+    if beam:
+      data = data.copy_extend_with_beam(beam)
+    return data.placeholder
+
+  def get_default_target(self):
+    """
+    :return: e.g. "classes", see :func:`TFNetwork.get_default_target`
+    :rtype: str
+    """
+    return self._info["network_default_target"]
+
+  def get_default_output_layer_name(self):
+    """
+    :rtype: str|None
+    """
+    return self._info["default_output_layer_name"]
+
+  def get_layer(self, layer_name):
+    """
+    :param str layer_name:
+    :rtype: CachedGraphLayer
+    """
+    if layer_name not in self.layers:
+      raise KeyError("%s: layer %r not found, available layers: %s" % (self, layer_name, ", ".join(self.layers)))
+    return self.layers[layer_name]
+
+  def maybe_construct_objective(self):
+    """
+    Losses are not supported for an imported graph.
+    """
+    raise NotImplementedError("%s: no losses available. Disable graph_cache_dir for evaluation." % self)
+
+  def get_fetches_dict(self, config=None, should_train=None, should_eval=None,
+                       with_summary=False, with_size=False,
+                       horovod_collected_reduce_inputs=None):
+    """
+    Like :func:`TFNetwork.get_fetches_dict`.
+
+    :param Config|None config:
+    :param bool|None should_train:
+    :param bool|None should_eval:
+    :param bool with_summary: ignored, there are no summaries
+    :param bool with_size:
+    :param dict|None horovod_collected_reduce_inputs: ignored, Horovod is not supported
+    :rtype: dict[str,tf.Tensor|tf.Operation|list[tf.Operation]]
+    """
+    assert not should_train and not should_eval, "%s: only inference supported" % self
+    d = {}
+    if with_size:
+      for key in self.used_data_keys:
+        data = self.extern_data.get_data(key)
+        for dim, v in data.size_placeholder.items():
+          d["size:%s:%i" % (key, dim)] = v
+    d.update(self._fetches)
+    return d
+
+  def get_post_control_dependencies(self):
+    """
+    :rtype: list[tf.Operation]
+    """
+    return self._fetches.get("post_control_dependencies", [])
+
+  def get_params_list(self):
+    """
+    :rtype: list[tf.Variable]
+    """
+    return list(self._params)
+
+  def get_saveable_params_list(self):
+    """
+    :rtype: list[tf.Variable]
+    """
+    return list(self._saveable_params)
+
+  def get_auxiliary_params(self):
+    """
+    :rtype: list[tf.Variable]
+    """
+    return [self.global_train_step]
+
+  def initialize_params(self, session):
+    """
+    :param tf.compat.v1.Session session:
+    """
+    var_list = self.get_params_list() + self.get_auxiliary_params()
+    with tf.name_scope("var_initializer"):
+      initializer_op = tf_compat.v1.variables_initializer(var_list=var_list)
+    session.run(initializer_op)
+
+  def get_global_train_step(self, session):
+    """
+    :param tf.compat.v1.Session session:
+    :rtype: int
+    """
+    return self.global_train_step.eval(session=session)
+
+  def load_params_from_file(self, filename, session):
+    """
+    :param str filename:
+    :param tf.compat.v1.Session session:
+    """
+    if not self._saver:
+      with tf.name_scope("saver"):
+        self._saver = tf_compat.v1.train.Saver(var_list=self.get_saveable_params_list(), max_to_keep=2 ** 31 - 1)
+    self._saver.restore(sess=session, save_path=filename)
+
+  def print_network_info(self, name="Network"):
+    """
+    :param str name:
+    """
+    print("%s (imported graph) layer topology:" % name, file=log.v2)
+    print("  extern data:", self.extern_data.get_data_description(), file=log.v2)
+    print("  used data keys: %s" % list(sorted(self.used_data_keys)), file=log.v2)
+    for layer_name, layer in sorted(self.layers.items()):
+      print("  layer %r: %s" % (layer_name, layer.output.get_description(with_name=False)), file=log.v2)
+
+  @staticmethod
+  def get_graph_reset_callbacks():
+    """
+    :return: nothing, there are no callbacks for an imported graph
+    :rtype: list[()->None]
+    """
+    return []
+
+  def call_graph_reset_callbacks(self):
+    """
+    Nothing to do.
+    """
+
+  def set_run_opts(self, epoch, dataset_name):
+    """
+    :param int epoch:
+    :param str|None dataset_name:
+    """
+    self._run_opts = dict(epoch=epoch, dataset_name=dataset_name)
+
+  def set_run_finished(self, error_occurred=False):
+    """
+    :param bool error_occurred:
+    """
+    self._run_opts.clear()
+
+
+def _hashable_repr(obj):
+  """
+  :param object obj: e.g. net dict, which can contain functions or classes
+  :return: deterministic representation, i.e. independent of object ids
+  :rtype: str
+  """
+  import types
+  if isinstance(obj, dict):
+    return "{%s}" % ", ".join(["%s: %s" % (_hashable_repr(k), _hashable_repr(v)) for (k, v) in sorted(
+      obj.items(), key=lambda item: repr(item[0]))])
+  if isinstance(obj, (list, tuple)):
+    return "%s(%s)" % (type(obj).__name__, ", ".join([_hashable_repr(v) for v in obj]))
+  if isinstance(obj, (set, frozenset)):
+    return "set(%s)" % ", ".join(sorted([_hashable_repr(v) for v in obj]))
+  if isinstance(obj, types.FunctionType):
+    code = obj.__code__
+    return "function(%s.%s, %s, %s)" % (
+      obj.__module__, obj.__qualname__, hashlib.sha256(code.co_code).hexdigest(), _hashable_repr(code.co_consts))
+  if isinstance(obj, types.CodeType):
+    return "code(%s, %s)" % (hashlib.sha256(obj.co_code).hexdigest(), _hashable_repr(obj.co_consts))
+  if isinstance(obj, types.ModuleType):
+    return "module(%s)" % obj.__name__
+  if isinstance(obj, type):
+    return "class(%s.%s)" % (obj.__module__, obj.__qualname__)
+  res = repr(obj)
+  if " at 0x" in res:  # default object repr, e.g. the config itself
+    return "object(%s.%s)" % (type(obj).__module__, type(obj).__qualname__)
+  return res
+
+
+def _data_to_json(data):
+  """
+  :param Data data:
+  :rtype: dict[str]
+  """
+  d = {
+    key: value for (key, value) in data.get_kwargs().items()
+    if key in {"name", "dtype", "sparse", "dim", "batch_dim_axis", "time_dim_axis", "feature_dim_axis",
+               "available_for_inference"}}
+  d["shape"] = list(data.shape)
+  d["placeholder"] = data.placeholder.name
+  d["size_placeholder"] = {str(i): size.name for (i, size) in (data.size_placeholder or {}).items()}
+  if data.beam:
+    d["beam"] = {"beam_size": data.beam.beam_size, "name": data.beam.name}
+  return d
+
+
+def _data_from_json(d, graph):
+  """
+  :param dict[str] d: see :func:`_data_to_json`
+  :param tf.Graph graph:
+  :rtype: Data
+  """
+  d = d.copy()
+  d["shape"] = tuple(d["shape"])
+  d["placeholder"] = graph.get_tensor_by_name(d["placeholder"])
+  d["size_placeholder"] = {int(i): graph.get_tensor_by_name(name) for (i, name) in d["size_placeholder"].items()}
+  if "beam" in d:
+    d["beam"] = SearchBeam(**d["beam"])
+  return Data(**d)
+
+
+def _layer_to_json(layer):
+  """
+  :param returnn.tf.layers.base.LayerBase layer:
+  :rtype: dict[str]
+  """
+  d = {"output": _data_to_json(layer.output), "target": layer.target}
+  if layer.output.beam and layer.get_search_choices():
+    d["beam_scores"] = layer.get_search_choices().beam_scores.name
+  return d
+
+
+def _layer_from_json(name, d, graph):
+  """
+  :param str name:
+  :param dict[str] d: see :func:`_layer_to_json`
+  :param tf.Graph graph:
+  :rtype: CachedGraphLayer
+  """
+  return CachedGraphLayer(
+    name=name, output=_data_from_json(d["output"], graph=graph), target=d["target"],
+    beam_scores=graph.get_tensor_by_name(d["beam_scores"]) if "beam_scores" in d else None)
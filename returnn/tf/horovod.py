@@ -13,6 +13,9 @@ Most importantly:
 * ``horovod_reduce_type``, recommended value ``"param"``, default value ``"grad"``
 * ``horovod_param_sync_step``, recommended value ``100``, default value ``1``
 * ``horovod_param_sync_time_diff``, alternative to ``horovod_param_sync_step``, e.g. ``100.`` (secs), default ``None``
+* ``horovod_grad_bucket_size``, for reduce type ``"grad"``, fuse the grads into buckets of this size (bytes)
+  for the allreduce, e.g. ``2 ** 24``, default ``0`` (one allreduce per grad)
+* ``horovod_have_more_data_sync_step``, signal whether the peers have more data only every N steps, default ``1``
 
 Also see :ref:`multi_gpu`.
 Also see :mod:`TFDistributed`.
@@ -94,6 +97,14 @@ class HorovodContext:
     assert self.is_reduce_type_param()
     return self._config.int("horovod_param_sync_step", 1)
 
+  def get_have_more_data_sync_step(self):
+    """
+    :return: every how many steps we signal whether we have more data, when we sync every step.
+      See :func:`Runner._horovod_signal_have_more_data`.
+    :rtype: int
+    """
+    return self._config.int("horovod_have_more_data_sync_step", 1)
+
   def get_dataset_distribution_type(self):
     """
     :rtype: str
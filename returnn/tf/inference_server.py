@@ -0,0 +1,510 @@
+
+"""
+Inference server (``task = "search_server"``, see :func:`Engine.web_server`).
+
+Concurrent HTTP requests are handled by a threaded HTTP front end,
+and collected by :class:`MicroBatchQueue`, which groups them into batches
+(up to a max number of seqs or padded frames, or until a latency deadline),
+such that there is a single ``session.run`` per batch.
+The outputs are split back per request.
+
+API:
+
+* ``POST /`` with a multipart form with ``file``: text (via the input vocab) or audio.
+  Returns the decoded text (or the n-best list with scores) as plain text.
+* ``POST /`` with a JSON body ``{"data": [...]}``: the input features (or label indices for sparse input).
+  Returns JSON ``{"output": [...], "seq_len": n}``, and with beam search,
+  ``{"output": [[...], ...], "seq_len": [...], "beam_scores": [...]}``.
+  If there is an output vocab, also ``"text"``.
+* ``GET /metrics``: JSON with the queue depth, batch sizes and latencies.
+
+Example, with some 12AX demo config::
+
+  rnn.py demos/demo-tf-native-lstm2.12ax.config ++task search_server ++load_epoch 5
+  demos/demo-inference-server-client.py --num_requests 100
+"""
+
+from __future__ import print_function
+
+import sys
+import time
+import json
+import typing
+import numpy
+from threading import Thread, Condition, Event
+from collections import deque
+from returnn.log import log
+
+
+class InferenceRequest:
+  """
+  A single request, waiting to be processed by the :class:`MicroBatchQueue`.
+  """
+
+  def __init__(self, features, num_frames):
+    """
+    :param numpy.ndarray features: input features (or labels) of a single seq
+    :param int num_frames: used for the max batch frames limit
+    """
+    self.features = features
+    self.num_frames = num_frames
+    self.enqueue_time = time.time()
+    self.start_time = None  # type: typing.Optional[float]  # when the batch was started
+    self.result = None  # type: typing.Optional[typing.Dict[str]]
+    self.exception = None  # type: typing.Optional[BaseException]
+    self.done = Event()
+
+  def wait(self, timeout=None):
+    """
+    :param float|None timeout:
+    :return: result, see :func:`MicroBatchQueue.__init__`
+    :rtype: dict[str]
+    """
+    if not self.done.wait(timeout):
+      raise Exception("%s: timeout after %s secs" % (self.__class__.__name__, timeout))
+    if self.exception is not None:
+      raise self.exception
+    return self.result
+
+
+class MicroBatchQueue:
+  """
+  Collects concurrent requests and processes them in batches, in a single worker thread.
+  A batch is processed as soon as it is full (``max_batch_size`` seqs or ``max_batch_frames`` padded frames),
+  or when the oldest request in it waited ``max_wait_time``.
+  """
+
+  def __init__(self, process_batch, max_batch_size=16, max_batch_frames=None, max_wait_time=0.01,
+               name="MicroBatchQueue"):
+    """
+    :param (list[InferenceRequest])->list[dict[str]] process_batch: returns one result per request
+    :param int max_batch_size: max number of seqs per batch
+    :param int|None max_batch_frames: max number of padded frames (max seq len * num seqs) per batch
+    :param float max_wait_time: in secs. max time a request waits for other requests to join its batch
+    :param str name: for logging
+    """
+    assert max_batch_size >= 1
+    self.process_batch = process_batch
+    self.max_batch_size = max_batch_size
+    self.max_batch_frames = max_batch_frames
+    self.max_wait_time = max_wait_time
+    self.name = name
+    self.cond = Condition()
+    self.pending = deque()  # type: typing.Deque[InferenceRequest]
+    self.stopped = False
+    self.thread = None  # type: typing.Optional[Thread]
+    # Metrics.
+    self.max_queue_depth = 0
+    self.num_requests = 0
+    self.num_batches = 0
+    self.num_errors = 0
+    self.recent_latencies = deque(maxlen=1000)  # type: typing.Deque[float]  # total latency per request
+    self.recent_queue_times = deque(maxlen=1000)  # type: typing.Deque[float]  # time until the batch started
+    self.recent_batch_sizes = deque(maxlen=1000)  # type: typing.Deque[int]
+
+  def start(self):
+    """
+    Starts the worker thread.
+    """
+    assert not self.thread
+    self.thread = Thread(target=self._thread_main, name="%s worker" % self.name)
+    self.thread.daemon = True
+    self.thread.start()
+
+  def stop(self):
+    """
+    Stops the worker thread. Pending requests get an exception.
+    """
+    with self.cond:
+      self.stopped = True
+      self.cond.notify_all()
+    if self.thread:
+      self.thread.join()
+      self.thread = None
+    with self.cond:
+      while self.pending:
+        request = self.pending.popleft()
+        request.exception = Exception("%s: stopped" % self.name)
+        request.done.set()
+
+  def submit(self, features, num_frames=None):
+    """
+    :param numpy.ndarray features:
+    :param int|None num_frames: len(features) by default
+    :rtype: InferenceRequest
+    """
+    request = InferenceRequest(features=features, num_frames=len(features) if num_frames is None else num_frames)
+    with self.cond:
+      assert not self.stopped, "%s: stopped" % self.name
+      self.pending.append(request)
+      self.num_requests += 1
+      self.max_queue_depth = max(self.max_queue_depth, len(self.pending))
+      self.cond.notify_all()
+    return request
+
+  def _batch_fits(self, batch, request):
+    """
+    :param list[InferenceRequest] batch:
+    :param InferenceRequest request:
+    :rtype: bool
+    """
+    if not batch:
+      return True  # always take at least one request, even if it is longer than max_batch_frames
+    if len(batch) + 1 > self.max_batch_size:
+      return False
+    if self.max_batch_frames:
+      max_len = max([r.num_frames for r in batch] + [request.num_frames])
+      if max_len * (len(batch) + 1) > self.max_batch_frames:
+        return False
+    return True
+
+  def _get_next_batch(self):
+    """
+    :return: next batch, or None if stopped
+    :rtype: list[InferenceRequest]|None
+    """
+    with self.cond:
+      while not self.pending and not self.stopped:
+        self.cond.wait()
+      if self.stopped:
+        return None
+      deadline = self.pending[0].enqueue_time + self.max_wait_time
+      while True:
+        num_fitting = 0
+        batch = []
+        for request in self.pending:
+          if not self._batch_fits(batch, request):
+            break
+          batch.append(request)
+          num_fitting += 1
+        full = num_fitting < len(self.pending) or num_fitting >= self.max_batch_size
+        now = time.time()
+        if full or now >= deadline or self.stopped:
+          break
+        self.cond.wait(deadline - now)
+      for _ in range(num_fitting):
+        self.pending.popleft()
+      return batch
+
+  def _thread_main(self):
+    while True:
+      batch = self._get_next_batch()
+      if batch is None:
+        return
+      start_time = time.time()
+      for request in batch:
+        request.start_time = start_time
+      try:
+        results = self.process_batch(batch)
+        assert len(results) == len(batch)
+        for request, result in zip(batch, results):
+          request.result = result
+      except Exception as exc:
+        print("%s: exception while processing batch of %i requests: %r" % (self.name, len(batch), exc), file=log.v2)
+        sys.excepthook(*sys.exc_info())
+        for request in batch:
+          request.exception = exc
+        with self.cond:
+          self.num_errors += 1
+      end_time = time.time()
+      with self.cond:
+        self.num_batches += 1
+        self.recent_batch_sizes.append(len(batch))
+        for request in batch:
+          self.recent_latencies.append(end_time - request.enqueue_time)
+          self.recent_queue_times.append(request.start_time - request.enqueue_time)
+      for request in batch:
+        request.done.set()
+
+  def get_metrics(self):
+    """
+    :return: queue depth, number of requests/batches, batch size and latency stats (over the recent requests)
+    :rtype: dict[str,float|int]
+    """
+    with self.cond:
+      latencies = numpy.array(self.recent_latencies, dtype="float64")
+      queue_times = numpy.array(self.recent_queue_times, dtype="float64")
+      batch_sizes = numpy.array(self.recent_batch_sizes, dtype="float64")
+      d = {
+        "queue_depth": len(self.pending),
+        "max_queue_depth": self.max_queue_depth,
+        "num_requests": self.num_requests,
+        "num_batches": self.num_batches,
+        "num_errors": self.num_errors}
+    if len(batch_sizes):
+      d["mean_batch_size"] = float(numpy.mean(batch_sizes))
+    if len(latencies):
+      d.update({
+        "latency_mean": float(numpy.mean(latencies)),
+        "latency_p50": float(numpy.percentile(latencies, 50)),
+        "latency_p95": float(numpy.percentile(latencies, 95)),
+        "latency_max": float(numpy.max(latencies)),
+        "queue_time_mean": float(numpy.mean(queue_times))})
+    return d
+
+
+class InferenceServer:
+  """
+  Batched inference server for a :class:`returnn.tf.engine.Engine`, see the module docstring.
+  """
+
+  def __init__(self, engine, port, max_batch_size=16, max_batch_frames=None, max_wait_time=0.01):
+    """
+    :param returnn.tf.engine.Engine engine: network already initialized (with search flag)
+    :param int port: for the HTTP server. 0 means some free port, see :data:`port` afterwards
+    :param int max_batch_size:
+    :param int|None max_batch_frames:
+    :param float max_wait_time: in secs
+    """
+    from returnn.datasets.generating import Vocabulary, BytePairEncoding, ExtractAudioFeatures
+    self.engine = engine
+    config = engine.config
+    network = engine.network
+    self.input_data = network.extern_data.get_default_input_data()
+    self.output_data = network.extern_data.get_default_target_data()
+    self.input_vocab = self.input_data.vocab  # type: typing.Optional[Vocabulary]
+    self.output_vocab = self.output_data.vocab  # type: typing.Optional[Vocabulary]
+    self.input_audio_feature_extractor = None  # type: typing.Optional[ExtractAudioFeatures]
+    if (isinstance(config.typed_dict.get("dev", None), dict)
+            and config.typed_dict["dev"]["class"] == "LibriSpeechCorpus"):
+      # A bit hacky. Assumes that this is a dataset description for e.g. LibriSpeechCorpus.
+      bpe_opts = config.typed_dict["dev"]["bpe"]
+      audio_opts = config.typed_dict["dev"]["audio"]
+      bpe = BytePairEncoding(**bpe_opts)
+      assert self.output_data.sparse
+      assert bpe.num_labels == self.output_data.dim
+      self.output_vocab = bpe
+      self.input_audio_feature_extractor = ExtractAudioFeatures(**audio_opts)
+    self.num_outputs = {
+      self.input_data.name: [self.input_data.dim, self.input_data.ndim],
+      self.output_data.name: [self.output_data.dim, self.output_data.ndim]}
+
+    output_layer_name = config.value("search_output_layer", "output")
+    output_layer = network.layers[output_layer_name]
+    self.output_t = output_layer.output.get_placeholder_as_batch_major()
+    self.output_seq_lens_t = (
+      output_layer.output.get_sequence_lengths() if output_layer.output.have_time_axis() else None)
+    self.out_beam_size = output_layer.output.beam.beam_size if output_layer.output.beam else None
+    self.output_layer_beam_scores_t = None
+    if self.out_beam_size is None:
+      print("Given output %r is after decision (no beam)." % output_layer, file=log.v1)
+    else:
+      print("Given output %r has beam size %i." % (output_layer, self.out_beam_size), file=log.v1)
+      self.output_layer_beam_scores_t = output_layer.get_search_choices().beam_scores
+
+    self.queue = MicroBatchQueue(
+      process_batch=self._process_batch,
+      max_batch_size=max_batch_size, max_batch_frames=max_batch_frames, max_wait_time=max_wait_time,
+      name="%s queue" % self.__class__.__name__)
+    self.httpd = self._create_http_server(port)
+    self.port = self.httpd.server_address[1]
+
+  def _process_batch(self, requests):
+    """
+    :param list[InferenceRequest] requests:
+    :return: per request: "output", "seq_len", maybe "beam_scores"
+    :rtype: list[dict[str]]
+    """
+    from returnn.datasets.generating import StaticDataset
+    empty_targets = numpy.zeros((0,) + self.output_data.shape[1:], dtype=self.output_data.dtype)
+    dataset = StaticDataset(
+      data=[{self.input_data.name: request.features, self.output_data.name: empty_targets} for request in requests],
+      output_dim=self.num_outputs)
+    dataset.init_seq_order(epoch=1)
+    start_time = time.time()
+    output_d = self.engine.run_single(dataset=dataset, seq_idx=-1, output_dict={
+      "output": self.output_t,
+      "seq_lens": self.output_seq_lens_t,
+      "beam_scores": self.output_layer_beam_scores_t})
+    print("%s: took %.3f secs for a batch of %i seqs." % (
+      self.__class__.__name__, time.time() - start_time, len(requests)), file=log.v4)
+    output = output_d["output"]
+    seq_lens = output_d["seq_lens"]
+    beam = self.out_beam_size or 1
+    assert len(output) == len(requests) * beam
+    results = []
+    for b in range(len(requests)):
+      if self.out_beam_size and seq_lens is not None:
+        results.append({
+          "output": [output[b * beam + i][:seq_lens[b * beam + i]] for i in range(beam)],
+          "seq_len": [int(seq_lens[b * beam + i]) for i in range(beam)],
+          "beam_scores": [float(x) for x in output_d["beam_scores"][b]]})
+      elif self.out_beam_size:
+        results.append({
+          "output": [output[b * beam + i] for i in range(beam)],
+          "beam_scores": [float(x) for x in output_d["beam_scores"][b]]})
+      elif seq_lens is not None:
+        results.append({"output": output[b][:seq_lens[b]], "seq_len": int(seq_lens[b])})
+      else:
+        results.append({"output": output[b]})
+    return results
+
+  def get_features_from_form_file(self, f):
+    """
+    :param io.BytesIO f: text or audio
+    :rtype: numpy.ndarray
+    """
+    if self.input_audio_feature_extractor:
+      # noinspection PyPackageRequirements,PyUnresolvedReferences
+      import soundfile  # pip install pysoundfile
+      try:
+        audio, sample_rate = soundfile.read(f)
+      except Exception as exc:
+        print("Error reading audio (%s). Invalid format? Size %i, first few bytes %r." % (
+          exc, len(f.getbuffer().tobytes()), f.getbuffer().tobytes()[:20]), file=log.v2)
+        raise
+      print("audio len %i (%.1f secs), sample rate %i" % (
+        len(audio), float(len(audio)) / sample_rate, sample_rate), file=log.v4)
+      if audio.ndim == 2:  # multiple channels:
+        audio = numpy.mean(audio, axis=1)  # mix together
+      return self.input_audio_feature_extractor.get_audio_features(audio=audio, sample_rate=sample_rate)
+    assert self.input_vocab, "%s: need input vocab for text input" % self.__class__.__name__
+    sentence = f.read().decode("utf8").strip()
+    print("Input:", sentence, file=log.v4)
+    seq = self.input_vocab.get_seq(sentence)
+    print("Input seq:", self.input_vocab.get_seq_labels(seq), file=log.v4)
+    return numpy.array(seq, dtype="int32")
+
+  def get_features_from_json(self, d):
+    """
+    :param dict[str] d: {"data": [...]}
+    :rtype: numpy.ndarray
+    """
+    features = numpy.array(d["data"], dtype=self.input_data.dtype)
+    expected_shape = self.input_data.shape  # without batch dim
+    if features.ndim != len(expected_shape) or any(
+          [d_ is not None and d_ != n for (d_, n) in zip(expected_shape, features.shape)]):
+      raise Exception("%s: got input shape %r, expected %r" % (self.__class__.__name__, features.shape, expected_shape))
+    return features
+
+  def result_to_json(self, result):
+    """
+    :param dict[str] result: see :func:`_process_batch`
+    :rtype: dict[str]
+    """
+    d = {k: (v.tolist() if isinstance(v, numpy.ndarray) else v) for (k, v) in result.items()}
+    if self.out_beam_size:
+      d["output"] = [x.tolist() for x in result["output"]]
+    if self.output_vocab and self.output_data.sparse:
+      if self.out_beam_size:
+        d["text"] = [self.output_vocab.get_seq_labels(x) for x in result["output"]]
+      else:
+        d["text"] = self.output_vocab.get_seq_labels(result["output"])
+    return d
+
+  def result_to_text(self, result):
+    """
+    Same format as the old simple web server.
+
+    :param dict[str] result: see :func:`_process_batch`
+    :rtype: str
+    """
+    assert self.output_vocab, "%s: need output vocab for text output" % self.__class__.__name__
+    if self.out_beam_size:
+      lines = ["["]
+      for score, seq in zip(result["beam_scores"], result["output"]):
+        lines.append("(%r, %r)" % (score, self.output_vocab.get_seq_labels(seq)))
+      lines.append("]")
+      return "\n".join(lines) + "\n"
+    return "%r\n" % self.output_vocab.get_seq_labels(result["output"])
+
+  def _create_http_server(self, port):
+    """
+    :param int port:
+    :rtype: http.server.HTTPServer
+    """
+    assert sys.version_info[0] >= 3, "only Python 3 supported"
+    # noinspection PyCompatibility
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    # noinspection PyCompatibility
+    from socketserver import ThreadingMixIn
+    server = self
+
+    class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+      """
+      One thread per request. They all just wait for the batch queue.
+      """
+      daemon_threads = True
+
+    class Handler(BaseHTTPRequestHandler):
+      """
+      Handle GET and POST requests.
+      """
+      # noinspection PyPep8Naming
+      def do_GET(self):
+        """
+        Handle GET request.
+        """
+        if self.path.rstrip("/") != "/metrics":
+          self.send_error(404)
+          return
+        self._send(200, "application/json", json.dumps(server.queue.get_metrics()) + "\n")
+
+      # noinspection PyPep8Naming
+      def do_POST(self):
+        """
+        Handle POST request.
+        """
+        try:
+          self._do_post()
+        except Exception as exc:
+          sys.excepthook(*sys.exc_info())
+          self._send(500, "text/plain", "Error: %r\n" % exc)
+
+      def _send(self, code, content_type, body):
+        """
+        :param int code:
+        :param str content_type:
+        :param str body:
+        """
+        body = body.encode("utf8")
+        self.send_response(code)
+        self.send_header("Content-type", content_type)
+        self.send_header("Content-length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+      def _do_post(self):
+        print("HTTP server, got POST.", file=log.v4)
+        content_type = self.headers.get("Content-Type", "")
+        if content_type.startswith("application/json"):
+          body = self.rfile.read(int(self.headers["Content-Length"]))
+          features = server.get_features_from_json(json.loads(body.decode("utf8")))
+          result = server.queue.submit(features).wait()
+          self._send(200, "application/json", json.dumps(server.result_to_json(result)) + "\n")
+        else:
+          import cgi
+          from io import BytesIO
+          form = cgi.FieldStorage(fp=self.rfile, headers=self.headers, environ={'REQUEST_METHOD': 'POST'})
+          f = BytesIO(form["file"].file.read())
+          print("Input file size:", len(f.getbuffer().tobytes()), "bytes", file=log.v4)
+          features = server.get_features_from_form_file(f)
+          result = server.queue.submit(features).wait()
+          self._send(200, "text/plain", server.result_to_text(result))
+
+      def log_message(self, format_, *args):
+        """
+        :param str format_:
+        :param args:
+        """
+        print("HTTP server: %s" % (format_ % args), file=log.v5)
+
+    return ThreadingHTTPServer(("", port), Handler)
+
+  def serve_forever(self):
+    """
+    Starts the batch queue and serves HTTP requests until :func:`shutdown` is called.
+    """
+    print("Inference server, listening on port %i." % self.port, file=log.v2)
+    self.queue.start()
+    try:
+      self.httpd.serve_forever()
+    finally:
+      self.queue.stop()
+
+  def shutdown(self):
+    """
+    Stops the server (from another thread).
+    """
+    self.httpd.shutdown()
+    self.httpd.server_close()
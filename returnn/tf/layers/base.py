@@ -1695,6 +1695,8 @@ class SearchChoices(object):
     self.src_beams = None  # type: typing.Optional[tf.Tensor]  # src beam index, (batch, beam)
     self.beam_size = beam_size
     self.beam_scores = None  # type: typing.Optional[tf.Tensor]  # (batch, beam)
+    # Hyps which are ended by the search itself, e.g. pruned, see ChoiceLayer. (batch * beam,), bool
+    self.forced_end_flags = None  # type: typing.Optional[tf.Tensor]
     self.is_decided = is_decided
     self.keep_raw = keep_raw
     if not owner.output.beam:
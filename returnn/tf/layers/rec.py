@@ -73,6 +73,9 @@ class RecLayer(_ConcatInputLayer):
   It assumes that those layers behave the same with time-dimension or without time-dimension and used per-step.
   Examples for such layers are :class:`LinearLayer`, :class:`RnnCellLayer`
   or :class:`SelfAttentionLayer` with option `attention_left_only`.
+  When `optimize_move_layers_out` is disabled, the layers which calculate the same in every frame
+  (e.g. a projection of the encoder) are still calculated only once outside the loop.
+  This can be disabled via the option `optimize_loop_invariant`.
 
   This layer can also be inside another RecLayer. In that case, it behaves similar to :class:`RnnCellLayer`.
   (This support is somewhat incomplete yet. It should work for the native units such as NativeLstm.)
@@ -89,6 +92,7 @@ class RecLayer(_ConcatInputLayer):
                max_seq_len=None,
                forward_weights_init=None, recurrent_weights_init=None, bias_init=None,
                optimize_move_layers_out=None,
+               optimize_loop_invariant=None,
                cheating=False,
                unroll=False, back_prop=None,
                use_global_rec_step_offset=False,
@@ -108,6 +112,8 @@ class RecLayer(_ConcatInputLayer):
     :param str recurrent_weights_init: see :func:`TFUtil.get_initializer`
     :param str bias_init: see :func:`TFUtil.get_initializer`
     :param bool|None optimize_move_layers_out: will automatically move layers out of the loop when possible
+    :param bool|None optimize_loop_invariant: if optimize_move_layers_out is disabled,
+      will still move those layers out of the loop which calculate the same in every frame
     :param bool cheating: Unused, is now part of ChoiceLayer
     :param bool unroll: if possible, unroll the loop (implementation detail)
     :param bool|None back_prop: for tf.while_loop. the default will use self.network.train_flag
@@ -144,6 +150,9 @@ class RecLayer(_ConcatInputLayer):
     if optimize_move_layers_out is None:
       optimize_move_layers_out = self.network.get_config().bool("optimize_move_layers_out", True)
     self._optimize_move_layers_out = optimize_move_layers_out
+    if optimize_loop_invariant is None:
+      optimize_loop_invariant = self.network.get_config().bool("optimize_loop_invariant", True)
+    self._optimize_loop_invariant = optimize_loop_invariant
     if cheating:
       print("Warning: cheating is an unused parameter in RecLayer, "
             "to enable cheating set the flag in a ChoiceLayer instead.", file=log.v2)
@@ -996,12 +1005,17 @@ class _SubnetworkRecCell(object):
     self._initial_extra_outputs = None  # type: typing.Optional[typing.Dict[str,typing.Dict[str,typing.Union[tf.Tensor,typing.Tuple[tf.Tensor,...]]]]]  # nopep8
     self.input_layers_moved_out = []  # type: typing.List[str]
     self.output_layers_moved_out = []  # type: typing.List[str]
+    # Subset of input_layers_moved_out which are the same in every frame, used as-is inside the loop.
+    # Only via _move_loop_invariant_outside_loop. See _is_loop_invariant_layer.
+    self.loop_invariant_layers_moved_out = []  # type: typing.List[str]
     self.layers_in_loop = None   # type: typing.Optional[typing.List[str]]
     self.input_layers_net = None  # type: typing.Optional[TFNetwork]
     self.output_layers_net = None  # type: typing.Optional[TFNetwork]
     self.final_acc_tas_dict = None  # type: typing.Optional[typing.Dict[str, tf.TensorArray]]
     self.get_final_rec_vars = None
     self.accumulated_losses = {}  # type: typing.Dict[str,LossHolder]
+    # Upper bound of the number of loop iterations, set in get_output. E.g. see ChoiceLayer prune_threshold.
+    self.max_seq_len = None  # type: typing.Optional[typing.Union[int,tf.Tensor]]
 
   def __repr__(self):
     return "<%s of %r>" % (self.__class__.__name__, self.parent_rec_layer)
@@ -1457,6 +1471,9 @@ class _SubnetworkRecCell(object):
       assert isinstance(self.input_layers_net, TFNetwork)
       layer = self.input_layers_net.layers[layer_name]
       assert isinstance(layer, LayerBase)
+      if layer_name in self.loop_invariant_layers_moved_out:
+        assert not prev, "%s: loop-invariant layer %r used as prev" % (self.parent_rec_layer, layer_name)
+        return layer
       if not self.parent_rec_layer.output.is_same_time_dim(layer.output):
         assert name != "output" and not prev, "Time dim does not match: RecLayer %s (%r) vs sub layer %s (%r)." % (
           self.parent_rec_layer, self.parent_rec_layer.output.get_time_dim_tag(),
@@ -2018,6 +2035,8 @@ class _SubnetworkRecCell(object):
       # noinspection PyProtectedMember
       if self.parent_rec_layer._optimize_move_layers_out:
         self._move_outside_loop(needed_outputs=needed_outputs)
+      elif self.parent_rec_layer._optimize_loop_invariant:
+        self._move_loop_invariant_outside_loop()
       else:
         self.layers_in_loop = sorted(self.layer_data_templates.keys())
 
@@ -2115,12 +2134,15 @@ class _SubnetworkRecCell(object):
       if self.input_layers_moved_out:
         with tf.name_scope("input_layers_moved_out"):
           self._construct_input_layers_moved_out()
+          self._dump_loop_invariant_layers_info()
           for layer_name in self.input_layers_moved_out:
             # Create only Tensor arrays for those which we use inside the loop.
             if not self._input_layer_used_inside_loop(layer_name):
               continue
             layer = self.input_layers_net.get_layer(layer_name)
             assert isinstance(layer, LayerBase)
+            if layer_name in self.loop_invariant_layers_moved_out:
+              continue  # used as-is in every frame
             if layer_name == "output":
               assert layer.output.have_time_axis()
               # If we don't know our own size yet, we can overtake it from this layer.
@@ -2270,6 +2292,12 @@ class _SubnetworkRecCell(object):
         if seq_len_info is not None:
           assert self.net.layers["end"].output.shape == (), "end layer %r unexpected shape" % self.net.layers["end"]
           choices = self.net.layers["end"].get_search_choices()
+          for layer in self.net.layers.values():
+            if layer.search_choices and layer.search_choices.forced_end_flags is not None:
+              # Otherwise the forced end flags would be ignored. See ChoiceLayer prune_threshold/early_exit.
+              assert layer.search_choices is choices, (
+                "%r with prune_threshold/early_exit: end layer %r must depend on it, but has search choices %r" % (
+                  layer, self.net.layers["end"], choices))
           if choices:
             from .basic import SelectSearchSourcesLayer
             cur_end_layer = choices.translate_to_this_search_beam(prev_end_layer)
@@ -2282,6 +2310,8 @@ class _SubnetworkRecCell(object):
             with tf.name_scope("end_flag"):
               end_flag = cur_end_layer.output.placeholder
               end_flag = tf.logical_or(end_flag, self.net.layers["end"].output.placeholder)  # (batch * beam,)
+              if choices.forced_end_flags is not None:  # e.g. ChoiceLayer prune_threshold
+                end_flag = tf.logical_or(end_flag, choices.forced_end_flags)
               end_flag.set_shape([None])
             with tf.name_scope("dyn_seq_len"):
               dyn_seq_len = cur_end_layer.transform_func(dyn_seq_len)
@@ -2353,6 +2383,13 @@ class _SubnetworkRecCell(object):
           res = opt_logical_and(res, any_not_ended)
         return res
 
+    # The layers can use this as the length bound of the loop.
+    if max_seq_len is not None:
+      self.max_seq_len = max_seq_len
+    elif isinstance(rec_layer._max_seq_len, (int, tf.Tensor)):
+      # noinspection PyProtectedMember
+      self.max_seq_len = rec_layer._max_seq_len
+
     from returnn.tf.util.basic import constant_with_shape
     init_loop_vars = (
       tf.constant(0, name="initial_i"),
@@ -2881,7 +2918,73 @@ class _SubnetworkRecCell(object):
         break
 
     self.layers_in_loop = [layer.name for layer in layers_in_loop]
+    self._dump_move_outside_loop_info()
+
+  def _move_loop_invariant_outside_loop(self):
+    """
+    Like :func:`_move_outside_loop` but only moves the loop-invariant layers out of the loop,
+    i.e. the layers which only depend on the base network (e.g. a projection of the encoder), see
+    :func:`_is_loop_invariant_layer`.
+    Used when the rec layer option optimize_move_layers_out is disabled (and optimize_loop_invariant is enabled).
+    These layers calculate the same in every frame, thus moving them out does not change anything,
+    except that they are calculated only once.
+    Inside the loop, they are used as-is (like base layers), i.e. never unstacked per frame,
+    even if their time dim is the same as the rec time dim.
 
+    :return: nothing, will set self.input_layers_moved_out/loop_invariant_layers_moved_out/layers_in_loop
+    """
+    self.input_layers_moved_out = []
+    self.output_layers_moved_out = []
+    self.loop_invariant_layers_moved_out = []
+    while True:
+      moved_out = False
+      for layer_name, layer in sorted(self.layer_data_templates.items()):
+        if layer_name in self.loop_invariant_layers_moved_out:
+          continue
+        if self._is_loop_invariant_layer(layer):
+          self.loop_invariant_layers_moved_out.append(layer_name)
+          moved_out = True
+      if not moved_out:
+        break
+    self.input_layers_moved_out = list(self.loop_invariant_layers_moved_out)
+    self.layers_in_loop = [
+      layer_name for layer_name in sorted(self.layer_data_templates.keys())
+      if layer_name not in self.loop_invariant_layers_moved_out]
+    self._dump_move_outside_loop_info()
+
+  def _is_loop_invariant_layer(self, layer):
+    """
+    :param _TemplateLayer layer:
+    :return: whether the layer calculates the same in every frame,
+      i.e. it only depends on the base network or on other loop-invariant layers
+      (see self.loop_invariant_layers_moved_out), and has no own state, randomness or loss
+    :rtype: bool
+    """
+    assert isinstance(layer, _TemplateLayer)
+    if layer.name in [":i", "end", "output"] or layer.name == "data" or layer.name.startswith("data:"):
+      return False
+    if layer.search_choices or issubclass(layer.layer_class_type, BaseChoiceLayer):
+      return False
+    # E.g. RnnCellLayer, or layers which depend on the rec step (e.g. PositionalEncodingLayer).
+    if layer.layer_class_type.recurrent:
+      return False
+    if getattr(layer.layer_class_type.get_rec_initial_extra_outputs, "__func__", None) is not (
+          LayerBase.get_rec_initial_extra_outputs.__func__):
+      return False  # has its own rec state
+    if layer.collocate_with or layer.kwargs.get("loss") or layer.kwargs.get("target"):
+      return False
+    if layer.kwargs.get("dropout") and self.parent_net.train_flag is not False:
+      return False  # we would use the same dropout mask for every frame
+    for dep in layer.dependencies:
+      if isinstance(dep, _TemplateLayer):
+        if dep.is_prev_time_frame or dep.name not in self.loop_invariant_layers_moved_out:
+          return False
+    return True
+
+  def _dump_move_outside_loop_info(self):
+    """
+    Prints which layers are moved out of the loop, see :func:`_move_outside_loop`.
+    """
     log_stream = log.v3
     print("Rec layer %r (search %s, train %s) sub net:" % (
         self.parent_rec_layer.get_absolute_name(), self.net.search_flag,
@@ -2906,6 +3009,32 @@ class _SubnetworkRecCell(object):
     dump_info("Output layers moved out of loop", self.output_layers_moved_out)
     dump_info("Layers in loop", self.layers_in_loop)
     dump_info("Unused layers", sorted(remaining_layers))
+    if self.loop_invariant_layers_moved_out:
+      print("  Loop-invariant layers (subset of the input layers moved out): %s" % (
+        ", ".join(self.loop_invariant_layers_moved_out),), file=log_stream)
+
+  def _dump_loop_invariant_layers_info(self):
+    """
+    Prints an estimate of the FLOPs which we save per loop step
+    by calculating the loop-invariant layers only once (see :func:`_is_loop_invariant_layer`).
+    This is a rough estimate: 2 FLOPs per weight (multiply-add) and 1 per output element of each layer,
+    per output frame (e.g. per encoder frame) and batch entry.
+    """
+    if not self.loop_invariant_layers_moved_out:
+      return
+    log_stream = log.v3
+    print("Rec layer %r loop-invariant layers, estimated FLOPs saved per step:" % (
+      self.parent_rec_layer.get_absolute_name(),), file=log_stream)
+    total = 0
+    for layer_name in self.loop_invariant_layers_moved_out:
+      layer = self.input_layers_net.layers[layer_name]
+      flops = layer.output.dim or 0
+      for param in layer.params.values():
+        if param.get_shape().ndims >= 2:
+          flops += 2 * param.get_shape().num_elements()
+      total += flops
+      print("  %s: ~%i per batch entry and frame of %s" % (layer_name, flops, layer.output), file=log_stream)
+    print("  total: ~%i per batch entry and frame" % total, file=log_stream)
 
   def _construct_input_layers_moved_out(self):
     """
@@ -4271,6 +4400,7 @@ class ChoiceLayer(BaseChoiceLayer):
                input_type="prob",
                prob_scale=1.0, base_beam_score_scale=1.0, random_sample_scale=0.0,
                length_normalization=True,
+               prune_threshold=None, early_exit=False,
                custom_score_combine=None,
                source_beam_sizes=None, scheduled_sampling=False, cheating=False,
                explicit_search_sources=None,
@@ -4288,6 +4418,15 @@ class ChoiceLayer(BaseChoiceLayer):
     :param float base_beam_score_scale: factor for beam base score (i.e. prev prob scores)
     :param float random_sample_scale: if >0, will add Gumbel scores. you might want to set base_beam_score_scale=0
     :param bool length_normalization: evaluates score_t/len in search
+    :param float|None prune_threshold: in search, unfinished hyps with a score worse than the best hyp
+      (of the same batch entry) minus this threshold are ended, i.e. they are not further expanded
+      and do not keep the rec loop running anymore. They get a score of -1e30.
+    :param bool early_exit: in search, ends all hyps of a batch entry (with score -1e30)
+      once no unfinished hyp can get better than the best ended hyp.
+      This assumes that the scores can only get worse, e.g. log-probs.
+      With length_normalization, this uses the max_seq_len of the rec layer as the length bound.
+      Together with prune_threshold, this lets the rec loop end earlier.
+      The "end" layer must depend on this layer (this is checked in the rec loop).
     :param list[int]|None source_beam_sizes: If there are several sources, they are pruned with these beam sizes
        before combination. If None, 'beam_size' is used for all sources. Has to have same length as number of sources.
     :param dict|None scheduled_sampling:
@@ -4465,6 +4604,10 @@ class ChoiceLayer(BaseChoiceLayer):
           cheating_gold_targets=cheating_gold_targets, cheating_src_beam_idx=cheating_src_beam_idx,
           cheating_exclusive=cheating_exclusive)
         self.search_choices.set_src_beams(src_beams)  # (batch, beam) -> beam_in idx
+        if prune_threshold is not None or early_exit:
+          scores = self._end_search_early(
+            scores=scores, base_search_choices=base_search_choices,
+            prune_threshold=prune_threshold, early_exit=early_exit)
         labels = tf.reshape(labels, [net_batch_dim * beam_size])  # (batch * beam)
         labels = tf.cast(labels, self.output.dtype)
 
@@ -4604,6 +4747,52 @@ class ChoiceLayer(BaseChoiceLayer):
       self.search_scores_combined = scores_comb
       self.search_choices.set_beam_scores(scores_comb)
 
+  def _end_search_early(self, scores, base_search_choices, prune_threshold, early_exit):
+    """
+    Ends hyps (via :attr:`SearchChoices.forced_end_flags`) which we do not need to expand further.
+    See the options prune_threshold and early_exit.
+    The flags are only used via the "end" layer, which is checked in :class:`_SubnetworkRecCell`.
+
+    :param tf.Tensor scores: (batch, beam), beam scores after the top-k
+    :param SearchChoices base_search_choices:
+    :param float|None prune_threshold:
+    :param bool early_exit:
+    :return: scores, (batch, beam), with -1e30 for the hyps which we ended here
+    :rtype: tf.Tensor
+    """
+    from returnn.tf.util.basic import select_src_beams
+    assert self.network.have_rec_step_info(), "%s: prune_threshold/early_exit only in a rec layer" % self
+    score_rem = -1.e30  # like filter_ended_scores
+    with tf.name_scope("end_search_early"):
+      # Hyps which have ended before. We do not know yet about the ones ending in this frame.
+      # (batch * beam_in,) -> (batch, beam)
+      prev_end_flags = self.network.get_rec_step_info().get_end_flag(target_search_choices=base_search_choices)
+      end_flags = tf.reshape(
+        select_src_beams(prev_end_flags, src_beams=self.search_choices.src_beams), tf.shape(scores))
+      not_ended = tf.logical_not(end_flags)
+      forced_end_flags = tf.zeros_like(end_flags)
+      if prune_threshold is not None:
+        best_scores = tf.reduce_max(scores, axis=1, keepdims=True)  # (batch, 1)
+        forced_end_flags = tf.logical_and(not_ended, tf.less(scores, best_scores - prune_threshold))
+      if early_exit:
+        best_ended_scores = tf.reduce_max(tf.where(end_flags, scores, score_rem * tf.ones_like(scores)), axis=1)
+        best_not_ended_scores = tf.reduce_max(
+          tf.where(not_ended, scores, score_rem * tf.ones_like(scores)), axis=1)  # (batch,)
+        if self.length_normalization:
+          # The scores of ended hyps are kept as score/len*(t+1), see above,
+          # and the score of an unfinished hyp can only get worse, so score*(t+1)/max_seq_len is an upper bound.
+          rec_layer = self.network.get_rec_parent_layer()
+          max_seq_len = rec_layer.cell.max_seq_len if rec_layer else None
+          assert max_seq_len is not None, (
+            "%s: early_exit with length_normalization needs the max_seq_len of the rec layer" % self)
+          t = self.network.get_rec_step_index()
+          best_not_ended_scores *= tf.cast(t + 1, tf.float32) / tf.cast(max_seq_len, tf.float32)
+        batch_ended = tf.greater_equal(best_ended_scores, best_not_ended_scores)  # (batch,)
+        forced_end_flags = tf.logical_or(
+          forced_end_flags, tf.logical_and(not_ended, tf.expand_dims(batch_ended, axis=1)))
+      self.search_choices.forced_end_flags = tf.reshape(forced_end_flags, [-1])  # (batch * beam,)
+      return tf.where(forced_end_flags, score_rem * tf.ones_like(scores), scores)
+
   def _get_scores(self, source):
     """
     :param LayerBase source:
@@ -6143,7 +6332,7 @@ class KenLmStateLayer(_ConcatInputLayer):
   recurrent = True
 
   def __init__(self, lm_file, vocab_file=None, vocab_unknown_label="UNK", bpe_merge_symbol=None,
-               input_step_offset=0, dense_output=False,
+               input_step_offset=0, dense_output=False, lm_cache_size=100000,
                debug=False,
                **kwargs):
     """
@@ -6153,6 +6342,8 @@ class KenLmStateLayer(_ConcatInputLayer):
     :param str|None bpe_merge_symbol: e.g. "@@" if you want to apply BPE merging
     :param int input_step_offset: if provided, will consider the input only from this step onwards
     :param bool dense_output: whether we output the score for all possible succeeding tokens
+    :param int lm_cache_size: max number of word prefixes for which the LM state is cached,
+      such that the hyps only need to score their new words each step. 0 disables the cache
     :param bool debug: prints debug info
     """
     if callable(lm_file):
@@ -6165,7 +6356,7 @@ class KenLmStateLayer(_ConcatInputLayer):
       "%s: currently expected to run inside rec layer" % self)
     # Create KenLM handle. Use var scope to explicitly have it outside the loop.
     with self.var_creation_scope():
-      self.lm_handle = tf_ken_lm.ken_lm_load(filename=lm_file)
+      self.lm_handle = tf_ken_lm.ken_lm_load(filename=lm_file, cache_size=lm_cache_size)
     prev_step = self._rec_previous_layer.rec_vars_outputs["step"]
     next_step = prev_step + 1
     self.rec_vars_outputs["step"] = next_step
@@ -13,7 +13,7 @@ try:
   from tensorflow.python.ops.nn import rnn_cell
 except ImportError:
   from tensorflow.python.ops import rnn_cell
-from threading import RLock
+from threading import RLock, Thread
 import typing
 
 import returnn.native_op as native_op
@@ -72,6 +72,8 @@ class OpMaker(object):
   with_cuda = None  # type: typing.Optional[bool]
   # https://github.com/tensorflow/tensorflow/issues/6602
   tf_blas_gemm_workaround = tf_util.tf_version_tuple() < (1, 6, 0)
+  # Status::OK() is removed in newer TF versions (e.g. 2.21). OkStatus() is available since TF 2.10.
+  tf_status_ok = "OkStatus()" if tf_util.tf_version_tuple() >= (2, 10) else "Status::OK()"
   global_lock = RLock()
   mod_cache = {}  # cache_key -> mod
   op_cache = {}  # cache_key -> op
@@ -246,12 +248,13 @@ class OpMaker(object):
       if(c->num_outputs() != %(num_outputs)i)
         return errors::InvalidArgument("wrong number of outputs. required %(num_outputs)i but got ", c->num_outputs());
       %(code_set_out_shape)s
-      return Status::OK();
+      return %(status_ok)s;
     })
     """ % {
       "num_inputs": len(in_info),
       "num_outputs": len(out_info),
-      "code_set_out_shape": code_set_out_shape
+      "code_set_out_shape": code_set_out_shape,
+      "status_ok": self.tf_status_ok,
     }
     code_forward_io = ""
     for in_idx, v in enumerate(in_info):
@@ -464,6 +467,17 @@ class OpMaker(object):
   def _make_mod(self):
     if self.cache_key in self.mod_cache:
       return self.mod_cache[self.cache_key]
+    comp = self._make_op_compiler()
+    mod = comp.load_tf_module()
+    mod._op_compiler = comp
+    self.mod_cache[self.cache_key] = mod
+    return mod
+
+  def _make_op_compiler(self):
+    """
+    :return: the compiler for this op. this does not compile yet
+    :rtype: returnn.tf.util.basic.OpCodeCompiler
+    """
     from returnn.util.basic import find_lib
     # Note about BLAS linkage:
     # TensorFlow (or its Eigen lib) likely has linked against some BLAS lib itself.
@@ -533,10 +547,7 @@ class OpMaker(object):
       use_cuda_if_available=self.with_cuda,
       log_stream=self.log_stream,
       **dict(self.compiler_opts))
-    mod = comp.load_tf_module()
-    mod._op_compiler = comp
-    self.mod_cache[self.cache_key] = mod
-    return mod
+    return comp
 
   def make_op(self, grad_func=None):
     """
@@ -546,7 +557,15 @@ class OpMaker(object):
     with self.global_lock:
       if self.cache_key in self.op_cache:
         return self.op_cache[self.cache_key]
+      grad_compile_thread = None
+      if self.description.is_grad_defined and not grad_func:
+        # Compile the gradient op in the background, while we compile this op.
+        grad_compile_thread = _CompileThread(OpMaker(
+          description=self.description.grad(), compiler_opts=self.compiler_opts,
+          search_for_numpy_blas=self.search_for_numpy_blas, blas_lib=self.blas_lib))
       mod = self._make_mod()
+      if grad_compile_thread:
+        grad_compile_thread.join()  # if there was an exception, we will just get it again below
       op = getattr(mod, camel_case_to_snake_case(self.op_name))
       op._op_maker = self
       op._op_module = mod
@@ -593,6 +612,66 @@ class OpMaker(object):
     return op
 
 
+class _CompileThread(Thread):
+  """
+  Compiles the lib of some op in the background (but does not load it).
+  """
+
+  def __init__(self, maker):
+    """
+    :param OpMaker maker:
+    """
+    super(_CompileThread, self).__init__(name="compile %s" % maker.name)
+    self.daemon = True
+    self.compiler = None
+    if maker.cache_key not in maker.mod_cache:
+      self.compiler = maker._make_op_compiler()
+    self.exception = None
+    self.start()
+
+  def run(self):
+    """
+    Thread main.
+    """
+    if not self.compiler:
+      return
+    try:
+      self.compiler.get_lib_filename()
+    except Exception as exc:
+      self.exception = exc
+
+
+def precompile_ops(op_gens, num_workers=None, **kwargs):
+  """
+  Compiles the libs of the given native ops and their gradient ops in parallel, without loading them.
+  The libs end up in the cache (see :class:`returnn.util.basic.NativeCodeCompiler`),
+  such that later :func:`make_op` calls do not need to compile anything.
+
+  :param list[type[returnn.native_op.NativeOpGenBase]] op_gens:
+  :param int|None num_workers: number of parallel compiler processes. by default the number of CPUs
+  :param kwargs: passed to :class:`OpMaker`
+  :return: the compilers, which have the libs in ``get_lib_filename()``
+  :rtype: list[returnn.tf.util.basic.OpCodeCompiler]
+  """
+  import multiprocessing
+  from multiprocessing.pool import ThreadPool
+  compilers = []
+  for op_gen in op_gens:
+    description = OpDescription.from_gen_base(op_gen)
+    while True:
+      compilers.append(OpMaker(description, **kwargs)._make_op_compiler())
+      if not description.is_grad_defined:
+        break
+      description = description.grad()
+  # The actual work is done by the compiler processes, so threads are fine here.
+  pool = ThreadPool(processes=min(num_workers or multiprocessing.cpu_count(), len(compilers)) or 1)
+  try:
+    pool.map(lambda compiler: compiler.get_lib_filename(), compilers)
+  finally:
+    pool.close()
+  return compilers
+
+
 def load_dump_file(filename):
   """
   See dump_to_file() in NativeOp.cpp.
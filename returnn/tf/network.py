@@ -2636,7 +2636,7 @@ class CustomCheckpointLoader:
 
   def __init__(self, filename, saveable_params, params_prefix="", load_if_prefix="", ignore_missing=False,
                ignore_params=(), ignore_params_prefixes=(),
-               network=None):
+               network=None, num_threads=None, max_group_bytes=2 ** 28):
     """
     :param str filename: filepattern for NewCheckpointReader
     :param list[tf.Variable|tensorflow.python.training.saver.BaseSaverBuilder.SaveableObject] saveable_params:
@@ -2648,9 +2648,19 @@ class CustomCheckpointLoader:
     :param typing.Container[str] ignore_params: these param (by name) will not be loaded
     :param typing.Iterable[str] ignore_params_prefixes: these param (by prefix name) will not be loaded
     :param TFNetwork network:
+    :param int|None num_threads: for reading the tensors in :func:`read_and_assign_grouped`.
+      by default depending on the CPUs
+    :param int max_group_bytes: in :func:`read_and_assign_grouped`, we read and assign the vars in groups
+      of this maximum size, such that we do not need to have all the values in memory at once
     """
     self.filename = filename
     self.network = network
+    if num_threads is None:
+      import multiprocessing
+      num_threads = min(multiprocessing.cpu_count(), 8)
+    self.num_threads = num_threads
+    self.max_group_bytes = max_group_bytes
+    self.load_timings = {}  # type: typing.Dict[str,float]  # var name -> secs, see load_now
     self.ignore_missing = ignore_missing
     self.params_prefix = params_prefix
     self.load_if_prefix = load_if_prefix
@@ -2673,6 +2683,9 @@ class CustomCheckpointLoader:
       self.saveable_params.append(param)
     assert count > 0, "%s: no saveable vars" % self
     self.reader = tf_compat.v1.train.NewCheckpointReader(filename)
+    import threading
+    self._thread_local = threading.local()  # see get_thread_reader
+    self._thread_local.reader = self.reader  # only for the current thread
     self.net_vars = [v for v in self.saveable_params if isinstance(v, tf.Variable)]
     self.net_saveables = [v for v in self.saveable_params if not isinstance(v, tf.Variable)]
     # All variables in the checkpoint:
@@ -2783,30 +2796,48 @@ class CustomCheckpointLoader:
   class VariableValue:
     """
     Helper to assign some variable.
+    The value is only read when needed, such that we do not need to keep all values in memory.
     """
 
-    def __init__(self, value=None, custom_param_importer=None):
+    def __init__(self, value=None, custom_param_importer=None, ckpt_name=None, reader=None, value_getter=None):
       """
       :param numpy.ndarray|None value:
       :param CustomCheckpointLoader.CustomParamImporter|None custom_param_importer:
+      :param str|None ckpt_name: read the tensor of this name from the checkpoint
+      :param tf.compat.v1.train.CheckpointReader|None reader: for ckpt_name
+      :param (()->numpy.ndarray)|None value_getter: e.g. for some conversion
       """
-      assert value is not None or custom_param_importer
+      assert value is not None or custom_param_importer or ckpt_name or value_getter
       self.value = value
       self.custom_param_importer = custom_param_importer
+      self.ckpt_name = ckpt_name
+      self.reader = reader
+      self.value_getter = value_getter
+
+    def get_value(self, reader=None):
+      """
+      :param tf.compat.v1.train.CheckpointReader|None reader: to use for ckpt_name instead of self.reader
+      :rtype: numpy.ndarray
+      """
+      if self.value is not None:
+        return self.value
+      if self.ckpt_name:
+        return (reader or self.reader).get_tensor(self.ckpt_name)
+      return self.value_getter()
 
     def assign_var(self, var, session):
       """
       :param tf.Variable var:
       :param tf.compat.v1.Session session:
       """
-      if self.value is not None:
-        VariableAssigner(var=var).assign(value=self.value, session=session)
-      else:
+      if self.custom_param_importer:
         self.custom_param_importer.assign_var(var=var, session=session)
+      else:
+        VariableAssigner(var=var).assign(value=self.get_value(), session=session)
 
   def get_variable_value_map(self):
     """
-    :return: var -> numpy array
+    :return: var -> value, where the value is read lazily
     :rtype: dict[tf.Variable,CustomCheckpointLoader.VariableValue]
     """
     variable_values = {}
@@ -2815,8 +2846,7 @@ class CustomCheckpointLoader:
       for v in self.saveable_params:
         assert isinstance(v, tf.Variable), "not yet implemented otherwise..."
         v_name = self._get_param_name(v)
-        value = self.reader.get_tensor(v_name)
-        variable_values[v] = self.VariableValue(value=value)
+        variable_values[v] = self.VariableValue(ckpt_name=v_name, reader=self.reader)
       return variable_values
 
     reader = self.reader
@@ -3060,17 +3090,17 @@ class CustomCheckpointLoader:
         if custom_importer:
           variable_values[v] = self.VariableValue(custom_param_importer=custom_importer)
         elif v_name in var_ckpt_names:
-          variable_values[v] = self.VariableValue(value=reader.get_tensor(v_name))
+          variable_values[v] = self.VariableValue(ckpt_name=v_name, reader=reader)
         else:
           if self.ignore_missing and v_name not in var_name_map:
             print(
               "Warning, did not find match for var %r (%r, params_prefix %r, load_if_prefix %r) in checkpoint %r." % (
                 v, v_name, self.params_prefix, self.load_if_prefix, self.filename), file=log.v3)
             continue
-          variable_values[v] = self.VariableValue(value=var_name_map[v_name]())
+          variable_values[v] = self.VariableValue(value_getter=var_name_map[v_name])
       assert variable_values, "no vars to load; saveable vars are %r. load_if_prefix %r." % (
         self.saveable_params, self.load_if_prefix)
-      print("Successfully loaded all variables. Any new save will use the updated variable names.", file=log.v3)
+      print("Found all variables. Any new save will use the updated variable names.", file=log.v3)
       return variable_values
 
     else:
@@ -3106,11 +3136,106 @@ class CustomCheckpointLoader:
 
   def load_now(self, session):
     """
+    The tensors which are directly in the checkpoint are read and assigned via :func:`read_and_assign_grouped`.
+    Conversions and custom param importers are done one by one.
+    The read time per var is stored in :data:`load_timings`.
+
     :param tf.compat.v1.Session session:
     :return: nothing, will assign the variables in the session
     """
-    for var, value in self.get_variable_value_map().items():
+    import time
+    self.load_timings.clear()
+    var_value_map = self.get_variable_value_map()
+    direct = {var: value for (var, value) in var_value_map.items() if value.ckpt_name and value.value is None}
+    others = [(var, value) for (var, value) in var_value_map.items() if var not in direct]
+    del var_value_map
+
+    for var, value in others:
+      t = time.time()
       value.assign_var(var=var, session=session)
+      self.load_timings[var.name] = time.time() - t
+
+    self.read_and_assign_grouped(
+      session=session, variables=list(direct.keys()),
+      read_value=lambda var_: direct[var_].get_value(reader=self.get_thread_reader()))
+
+  def get_thread_reader(self):
+    """
+    The checkpoint reader is not thread-safe, thus we have one per thread.
+
+    :return: reader of our checkpoint for the current thread
+    :rtype: tf.compat.v1.train.CheckpointReader
+    """
+    if not hasattr(self._thread_local, "reader"):
+      self._thread_local.reader = tf_compat.v1.train.NewCheckpointReader(self.filename)
+    return self._thread_local.reader
+
+  def read_and_assign_grouped(self, session, variables, read_value):
+    """
+    Reads the values concurrently by :data:`num_threads` threads,
+    and assigns them in groups of at most :data:`max_group_bytes`, with one session run per group.
+    Thus we only have one group of values in memory at a time.
+    The read time per var is stored in :data:`load_timings`.
+
+    :param tf.compat.v1.Session session:
+    :param list[tf.Variable] variables:
+    :param (tf.Variable)->numpy.ndarray read_value: called in the threads. use :func:`get_thread_reader`
+    """
+    import time
+    from multiprocessing.pool import ThreadPool
+    from returnn.util.basic import human_bytes_size
+    start_time = time.time()
+
+    def read(var_):
+      """
+      :param tf.Variable var_:
+      :return: var, value, read time
+      :rtype: (tf.Variable,numpy.ndarray,float)
+      """
+      t_ = time.time()
+      return var_, read_value(var_), time.time() - t_
+
+    def var_num_bytes(var_):
+      """
+      :param tf.Variable var_:
+      :rtype: int
+      """
+      shape = var_.get_shape().as_list()
+      return int(numpy.prod([d or 1 for d in shape])) * max(var_.dtype.base_dtype.size, 1)
+
+    groups = []  # type: typing.List[typing.List[tf.Variable]]
+    group_bytes = 0
+    for var in sorted(variables, key=lambda v: v.name):
+      num_bytes = var_num_bytes(var)
+      if not groups or group_bytes + num_bytes > self.max_group_bytes:
+        groups.append([])
+        group_bytes = 0
+      groups[-1].append(var)
+      group_bytes += num_bytes
+    total_bytes = sum([var_num_bytes(var) for var in variables])
+    assign_time = 0.
+    pool = ThreadPool(self.num_threads) if self.num_threads > 1 and len(variables) > 1 else None
+    try:
+      for group in groups:
+        results = pool.map(read, group) if pool else [read(var) for var in group]
+        t = time.time()
+        VariableAssigner.assign_multiple(
+          [(VariableAssigner(var=var), value) for (var, value, _) in results], session=session)
+        assign_time += time.time() - t
+        for var, _, read_time in results:
+          self.load_timings[var.name] = read_time
+          print("%s: loaded %s in %.3f secs." % (self, var.name, read_time), file=log.v5)
+        del results
+    finally:
+      if pool:
+        pool.close()
+        pool.join()
+    print("%s: loaded %i vars (%s in %i groups, %i threads) in %.3f secs (assign %.3f secs)." % (
+      self, len(variables), human_bytes_size(total_bytes), len(groups), self.num_threads,
+      time.time() - start_time, assign_time), file=log.v3)
+    slowest = sorted(self.load_timings.items(), key=lambda item: -item[1])[:5]
+    print("%s: slowest vars: %s" % (
+      self, ", ".join(["%s %.3f secs" % (name, secs) for (name, secs) in slowest])), file=log.v4)
 
   def set_as_custom_init(self):
     """
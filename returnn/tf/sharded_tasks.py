@@ -0,0 +1,159 @@
+
+"""
+Runs the tasks ``forward``, ``search`` and ``compute_priors`` in multiple local worker processes,
+each with its own TF session, on a disjoint subset of the seqs,
+and merges their outputs into the same files as the single-process mode.
+
+Enable it via the config option ``task_num_workers``.
+Worker ``i`` gets the seqs with ``seq_idx % task_num_workers == i``
+(see ``num_shards`` in :func:`Dataset._generate_batches`),
+and the number of threads is divided among the workers
+(via ``task_worker_num_threads`` for :func:`setup_tf_thread_pools`, and ``OMP_NUM_THREADS``).
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import numpy
+import typing
+from returnn.log import log
+
+supported_tasks = ("forward", "search", "compute_priors")
+
+
+def get_shard_filename(filename, shard_index, num_shards):
+  """
+  :param str filename: output filename of the task
+  :param int shard_index:
+  :param int num_shards:
+  :return: filename of the output of the worker
+  :rtype: str
+  """
+  return "%s.shard-%i-of-%i" % (filename, shard_index, num_shards)
+
+
+def get_task_output_filename(config):
+  """
+  :param Config config:
+  :return: the output filename of the task, which the workers write in shards. None for search without output file
+  :rtype: str|None
+  """
+  task = config.value("task", "train")
+  if task == "search":
+    return config.value("search_output_file", "") or None
+  assert task in supported_tasks
+  assert config.has("output_file"), "task_num_workers: %s needs the output_file option" % task
+  return config.value("output_file", "")
+
+
+def _start_worker(command_line_options, worker_index, num_threads):
+  """
+  Starts a worker as a new Python process, i.e. it does not inherit any TF state.
+
+  :param list[str] command_line_options: of the main process
+  :param int worker_index:
+  :param int num_threads:
+  :rtype: subprocess.Popen
+  """
+  from subprocess import Popen
+  from returnn.util.basic import returnn_root_dir
+  env = os.environ.copy()
+  env["OMP_NUM_THREADS"] = str(num_threads)  # e.g. for numpy or native ops
+  env["PYTHONPATH"] = os.pathsep.join([returnn_root_dir] + [p for p in [env.get("PYTHONPATH")] if p])
+  args = [sys.executable, "-c", "from returnn.__main__ import main; main()"] + list(command_line_options) + [
+    "++task_worker_index", str(worker_index), "++task_worker_num_threads", str(num_threads)]
+  return Popen(args, env=env)
+
+
+def run_sharded_task(config, command_line_options):
+  """
+  Spawns the workers, waits for them, and merges their outputs.
+
+  :param Config config:
+  :param list[str] command_line_options: of the main process, e.g. ``sys.argv[1:]``
+  """
+  from returnn.util.basic import guess_requested_max_num_threads, hms
+  task = config.value("task", "train")
+  assert task in supported_tasks, "task_num_workers: task %r not supported" % task
+  num_workers = config.int("task_num_workers", 1)
+  assert num_workers > 1
+  output_filename = get_task_output_filename(config)
+  if output_filename:
+    if task == "forward" and config.is_true("forward_override_hdf_output") and os.path.exists(output_filename):
+      print("HDF file exists, delete now (forward_override_hdf_output).", file=log.v2)
+      os.remove(output_filename)
+    assert not os.path.exists(output_filename), "Already existing output file %r." % output_filename
+  num_threads = max((guess_requested_max_num_threads() or 1) // num_workers, 1)
+  print("Run task %s in %i worker processes, with %i threads each." % (task, num_workers, num_threads), file=log.v2)
+  start_time = time.time()
+  procs = [
+    _start_worker(command_line_options=command_line_options, worker_index=i, num_threads=num_threads)
+    for i in range(num_workers)]
+  for proc in procs:
+    proc.wait()
+  failed = ["worker %i (exit code %i)" % (i, proc.returncode) for (i, proc) in enumerate(procs) if proc.returncode != 0]
+  if failed:
+    raise Exception("Task %s: workers failed: %s" % (task, ", ".join(failed)))
+  print("All %i workers finished after %s." % (num_workers, hms(time.time() - start_time)), file=log.v2)
+  if not output_filename:
+    return
+  shard_filenames = [get_shard_filename(output_filename, i, num_workers) for i in range(num_workers)]
+  if task == "forward":
+    from returnn.datasets.hdf import merge_simple_hdf_files
+    merge_simple_hdf_files(shard_filenames, output_filename, interleave=True)
+  elif task == "search":
+    merge_search_output_shards(
+      shard_filenames, output_filename, file_format=config.value("search_output_file_format", "txt"))
+  elif task == "compute_priors":
+    merge_prior_shards(shard_filenames, output_filename)
+  for fn in shard_filenames:
+    os.remove(fn)
+  print("Merged the outputs of the workers into %r." % output_filename, file=log.v2)
+
+
+def merge_search_output_shards(shard_filenames, output_filename, file_format):
+  """
+  :param list[str] shard_filenames: in jsonl format, see :class:`SearchOutputWriter`
+  :param str output_filename:
+  :param str file_format: of the output file
+  """
+  from returnn.engine.search_output import SearchOutputWriter
+  # Only keep the file offsets of the entries in memory.
+  offsets = []  # type: typing.List[typing.Tuple[int,int,int]]  # (seq_idx, shard_idx, offset)
+  for shard_idx, fn in enumerate(shard_filenames):
+    with open(fn, "rb") as f:
+      offset = 0
+      for line in f:
+        offsets.append((json.loads(line.decode("utf8"))["seq_idx"], shard_idx, offset))
+        offset += len(line)
+  offsets.sort()
+  files = [open(fn, "rb") for fn in shard_filenames]
+  try:
+    writer = SearchOutputWriter(filename=output_filename, file_format=file_format)
+    for _, shard_idx, offset in offsets:
+      files[shard_idx].seek(offset)
+      entry = json.loads(files[shard_idx].readline().decode("utf8"))
+      writer.add(seq_idx=entry["seq_idx"], seq_tag=entry["tag"], output=SearchOutputWriter.from_json(entry["output"]))
+    writer.close()
+  finally:
+    for f in files:
+      f.close()
+
+
+def merge_prior_shards(shard_filenames, output_filename):
+  """
+  :param list[str] shard_filenames: see :func:`Engine.compute_priors`
+  :param str output_filename:
+  """
+  from returnn.tf.engine import Engine
+  sum_posteriors = 0
+  seq_len = 0
+  for fn in shard_filenames:
+    with open(fn, "rb") as f:
+      d = numpy.load(f)
+      sum_posteriors = sum_posteriors + d["sum_posteriors"]
+      seq_len += int(d["seq_len"])
+  Engine.save_priors(sum_posteriors=sum_posteriors, seq_len=seq_len, output_file=output_filename)
@@ -17,8 +17,8 @@ def py_get_sprint_automata_for_batch(sprint_opts, tags):
   """
   # Also see :class:`SprintAlignmentAutomataOp`.
   sprint_instance_pool = SprintInstancePool.get_global_instance(sprint_opts=sprint_opts)
-  with sprint_instance_pool.lock:  # We need multi-threading safety.
-    edges, weights, start_end_states = sprint_instance_pool.get_automata_for_batch(tags)
+  # This is thread-safe.
+  edges, weights, start_end_states = sprint_instance_pool.get_automata_for_batch(tags)
   # Note: UnimplementedError: Unsupported numpy type 6 (uint32) -> cast to int32.
   edges = edges.astype("int32")
   start_end_states = start_end_states.astype("int32")
@@ -75,9 +75,9 @@ def py_get_sprint_loss_and_error_signal(sprint_opts, log_posteriors, seq_lengths
   """
   # Also see :class:`SprintErrorSigOp`.
   sprint_instance_pool = SprintInstancePool.get_global_instance(sprint_opts=sprint_opts)
-  with sprint_instance_pool.lock:  # We need multi-threading safety.
-    loss, error_signal = sprint_instance_pool.get_batch_loss_and_error_signal(
-      log_posteriors=log_posteriors, seq_lengths=seq_lengths, tags=seq_tags)
+  # This is thread-safe.
+  loss, error_signal = sprint_instance_pool.get_batch_loss_and_error_signal(
+    log_posteriors=log_posteriors, seq_lengths=seq_lengths, tags=seq_tags)
   return loss, error_signal
 
 
@@ -600,13 +600,16 @@ class WrapOptimizer:
     optimizer = self.optimizers[opt_key]
     assert isinstance(optimizer, Optimizer)
     if accum_grad_multiple_num_steps >= 1:
-      return tf.cond(
-        tf.equal(
-          tf_compat.v1.mod(self.global_train_step, accum_grad_multiple_num_steps),
-          accum_grad_multiple_num_steps - 1),
-        true_fn=lambda: optimizer.apply_gradients(grads_and_vars),
-        false_fn=lambda: tf.no_op(),
-        name="apply_grads/accum_grad_multiple_step")
+      # The grads (i.e. the accumulation) must be done in any case, also when we do not apply them,
+      # before the global train step gets increased (see Updater).
+      with tf.control_dependencies([grad.op for (grad, _) in grads_and_vars]):
+        return tf.cond(
+          tf.equal(
+            tf_compat.v1.mod(self.global_train_step, accum_grad_multiple_num_steps),
+            accum_grad_multiple_num_steps - 1),
+          true_fn=lambda: optimizer.apply_gradients(grads_and_vars),
+          false_fn=lambda: tf.no_op(),
+          name="apply_grads/accum_grad_multiple_step")
     return optimizer.apply_gradients(grads_and_vars)
 
   def get_slot_names_per_optimizer(self):
@@ -789,11 +792,12 @@ class WrapOptimizer:
     assert isinstance(updater_opts, CollectionReadCheckCovered)
     return updater_opts
 
-  def _post_process_grad(self, grad, var, global_info):
+  def _post_process_grad(self, grad, var, global_info, grad_accumulated=False):
     """
     :param tf.Tensor grad:
     :param tf.Variable var:
     :param WrapOptimizer._GetGlobalInfo global_info:
+    :param bool grad_accumulated: whether accum_grad_multiple_step was already applied on grad
     :return: new grad, apply grad opts
     :rtype: tf.Tensor, dict[str]
     """
@@ -801,6 +805,8 @@ class WrapOptimizer:
 
     accum_grad_multiple_num_steps = updater_opts.get(
       "accum_grad_multiple_step", self.config.int("accum_grad_multiple_step", 0))
+    if grad_accumulated:  # see _can_accum_grads_locally
+      assert accum_grad_multiple_num_steps == self.config.int("accum_grad_multiple_step", 0)
     grad_noise = updater_opts.get("gradient_noise", self.config.float("gradient_noise", 0.0))
     grad_clip = updater_opts.get("gradient_clip", self.config.float("gradient_clip", 0.0))
     # E.g. https://github.com/openai/baselines/blob/master/baselines/deepq/simple.py:
@@ -822,7 +828,7 @@ class WrapOptimizer:
       if grad_ext is not None:
         grad += grad_ext
 
-    if accum_grad_multiple_num_steps >= 1:
+    if accum_grad_multiple_num_steps >= 1 and not grad_accumulated:
       grad = accum_grad_multiple_step(
         grad, var, train_step=self.global_train_step, num_accum_steps=accum_grad_multiple_num_steps)
 
@@ -884,14 +890,30 @@ class WrapOptimizer:
       return tf.no_op(name="no_grad_vars_no_op")
 
     grads_and_vars = self._compute_gradients(loss, var_list=var_list)
+    grads_accumulated = False
     if self.config.is_true("use_horovod"):
       import returnn.tf.horovod
       if returnn.tf.horovod.get_ctx().is_reduce_type_grad():
-        # noinspection PyPackageRequirements,PyUnresolvedReferences
-        import horovod.tensorflow as hvd
-        grads_and_vars = [
-          (hvd.allreduce(grad, average=self.config.is_true("horovod_avg_grad")) if grad is not None else None, var)
-          for (grad, var) in grads_and_vars]
+        accum_grad_multiple_num_steps = self.config.int("accum_grad_multiple_step", 0)
+        if accum_grad_multiple_num_steps >= 1 and self._can_accum_grads_locally(var_list):
+          # Accumulate locally, and only allreduce in the step where we apply the grads.
+          grads_and_vars = [
+            (accum_grad_multiple_step(
+              grad, var, train_step=self.global_train_step, num_accum_steps=accum_grad_multiple_num_steps)
+             if grad is not None else None, var)
+            for (grad, var) in grads_and_vars]
+          grads_accumulated = True
+          grads_and_vars_ = [(grad, var) for (grad, var) in grads_and_vars if grad is not None]
+          reduced_grads = tf.cond(
+            tf.equal(
+              tf_compat.v1.mod(self.global_train_step, accum_grad_multiple_num_steps),
+              accum_grad_multiple_num_steps - 1),
+            true_fn=lambda: [grad for (grad, _) in self._horovod_allreduce_grads(grads_and_vars_)],
+            false_fn=lambda: [grad for (grad, _) in grads_and_vars_],
+            name="horovod_allreduce_grads/accum_grad_multiple_step")
+          grads_and_vars = list(zip(reduced_grads, [var for (_, var) in grads_and_vars_]))
+        else:
+          grads_and_vars = self._horovod_allreduce_grads(grads_and_vars)
 
     var_grads = {var: grad for (grad, var) in grads_and_vars if grad is not None}
     if not var_grads:
@@ -904,7 +926,8 @@ class WrapOptimizer:
       assert var in var_list
       if grad is None:
         continue
-      new_grad, apply_grad_opts = self._post_process_grad(grad=grad, var=var, global_info=global_info)
+      new_grad, apply_grad_opts = self._post_process_grad(
+        grad=grad, var=var, global_info=global_info, grad_accumulated=grads_accumulated)
       grads_per_apply_grad_opts.setdefault(make_hashable(apply_grad_opts), []).append((new_grad, var))
 
     all_apply_grads = []
@@ -915,6 +938,86 @@ class WrapOptimizer:
       return all_apply_grads[0]
     return tf.group(*all_apply_grads)
 
+  # These depend on the grads of the single step (see _GetGlobalInfo), not on the accumulated grad.
+  _grad_opts_per_step = ["maximize_grad_norm", "gradient_clip_global_norm", "grad_norm_to_clip_to_zero"]
+
+  def _can_accum_grads_locally(self, var_list):
+    """
+    Horovod reduce type 'grad' with ``accum_grad_multiple_step``:
+    As the allreduce is linear, we can accumulate the grads locally and only allreduce them
+    in the step where we apply them, instead of in every step.
+    The grad post-processing (:func:`_post_process_grad`) comes after the accumulation anyway
+    (gradient noise, clipping, etc.), except for the options in :data:`_grad_opts_per_step`,
+    which use the global grad norm of the single step, and the per-var ``accum_grad_multiple_step``.
+    In those cases, we allreduce in every step, to keep the same semantics as without Horovod.
+
+    :param list[tf.Variable] var_list:
+    :rtype: bool
+    """
+    accum_grad_multiple_num_steps = self.config.int("accum_grad_multiple_step", 0)
+    for opt in self._grad_opts_per_step:
+      if self.config.float(opt, 0.0):
+        print("Horovod: %s is used, thus grads are reduced in every step, not only every %i steps." % (
+          opt, accum_grad_multiple_num_steps), file=log.v2)
+        return False
+    for var in var_list:
+      updater_opts = self._get_updater_opts_from_var(var).collection
+      for opt in self._grad_opts_per_step:
+        if updater_opts.get(opt):
+          print("Horovod: %s is used for var %s, thus grads are reduced in every step, not only every %i steps." % (
+            opt, var.name, accum_grad_multiple_num_steps), file=log.v2)
+          return False
+      if updater_opts.get("accum_grad_multiple_step", accum_grad_multiple_num_steps) != accum_grad_multiple_num_steps:
+        print("Horovod: accum_grad_multiple_step is set for var %s, thus grads are reduced in every step." % (
+          var.name,), file=log.v2)
+        return False
+    return True
+
+  def _horovod_allreduce_grads(self, grads_and_vars):
+    """
+    Horovod reduce type 'grad'.
+    With ``horovod_grad_bucket_size`` (in bytes), the dense grads are fused into buckets of at most that size,
+    and there is one allreduce per bucket instead of one per grad.
+    The buckets are built in reverse order of the vars, as the grads of the last layers are available first
+    in the backprop. Each bucket only depends on its own grads,
+    thus its allreduce can already run while the backprop of the earlier layers is still running.
+
+    :param list[(tf.Tensor|tf.IndexedSlices|None,tf.Variable)] grads_and_vars:
+    :return: grads_and_vars with reduced grads, same order
+    :rtype: list[(tf.Tensor|tf.IndexedSlices|None,tf.Variable)]
+    """
+    # noinspection PyPackageRequirements,PyUnresolvedReferences
+    import horovod.tensorflow as hvd
+    average = self.config.is_true("horovod_avg_grad")
+    bucket_size = self.config.int("horovod_grad_bucket_size", 0)
+    reduced_grads = {}  # type: typing.Dict[int,typing.Union[tf.Tensor,tf.IndexedSlices]]  # idx -> grad
+    buckets = []  # type: typing.List[typing.List[int]]  # list of grad indices
+    bucket_num_bytes = 0
+    for i, (grad, var) in reversed(list(enumerate(grads_and_vars))):
+      if grad is None:
+        continue
+      if bucket_size <= 0 or isinstance(grad, tf.IndexedSlices) or not grad.get_shape().is_fully_defined():
+        reduced_grads[i] = hvd.allreduce(grad, average=average)
+        continue
+      num_bytes = grad.get_shape().num_elements() * grad.dtype.size
+      if (not buckets or bucket_num_bytes + num_bytes > bucket_size
+              or grads_and_vars[buckets[-1][0]][0].dtype != grad.dtype):
+        buckets.append([])
+        bucket_num_bytes = 0
+      buckets[-1].append(i)
+      bucket_num_bytes += num_bytes
+    for bucket_idx, bucket in enumerate(buckets):
+      with tf.name_scope("horovod_grad_bucket_%i" % bucket_idx):
+        grads = [grads_and_vars[i][0] for i in bucket]
+        if len(grads) == 1:
+          reduced_grads[bucket[0]] = hvd.allreduce(grads[0], average=average)
+          continue
+        flat = hvd.allreduce(tf.concat([tf.reshape(grad, [-1]) for grad in grads], axis=0), average=average)
+        parts = tf.split(flat, [grad.get_shape().num_elements() for grad in grads])
+        for i, grad, part in zip(bucket, grads, parts):
+          reduced_grads[i] = tf.reshape(part, grad.get_shape())
+    return [(reduced_grads.get(i), var) for (i, (_, var)) in enumerate(grads_and_vars)]
+
 
 class KerasOptimizer(Optimizer):
   """
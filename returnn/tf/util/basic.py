@@ -2209,6 +2209,20 @@ class VariableAssigner(object):
     """
     session.run(self.assign_op, feed_dict={self.assign_op.inputs[1]: value})
 
+  @staticmethod
+  def assign_multiple(assigners_and_values, session):
+    """
+    Assigns multiple vars in a single session run.
+
+    :param list[(VariableAssigner,numpy.ndarray|int|float|list[str])] assigners_and_values:
+    :param tf.compat.v1.Session session:
+    """
+    if not assigners_and_values:
+      return
+    session.run(
+      [assigner.assign_op for (assigner, _) in assigners_and_values],
+      feed_dict={assigner.assign_op.inputs[1]: value for (assigner, value) in assigners_and_values})
+
 
 def _get_tf_gcc_path(bin_name):
   """
@@ -2217,6 +2231,8 @@ def _get_tf_gcc_path(bin_name):
   """
   gcc_candidates = []
   tf_gcc_version = getattr(tf, "__compiler_version__", None)
+  if tf_gcc_version and not tf_gcc_version[:1].isdigit():
+    tf_gcc_version = None  # not GCC, e.g. "Clang 18.1.8", thus no matching GCC version
   if tf_gcc_version:  # e.g. "4.8.5" or "5.4.0 20160609"
     if " " in tf_gcc_version:
       tf_gcc_version = tf_gcc_version[:tf_gcc_version.find(" ")]  # just "5.4.0"
@@ -2500,6 +2516,7 @@ class OpCodeCompiler(NativeCodeCompiler):
   """
 
   CacheDirName = "returnn_tf_cache/ops"
+  loaded_so_filenames = []  # type: typing.List[str]  # all loaded in this process, e.g. for the graph cache
 
   def __init__(self, use_cuda_if_available=True, cuda_auto_min_compute_capability=True,
                include_paths=(), ld_flags=(), c_macro_defines=None, **kwargs):
@@ -2526,6 +2543,13 @@ class OpCodeCompiler(NativeCodeCompiler):
     # https://github.com/tensorflow/tensorflow/issues/17316
     # https://github.com/tensorflow/tensorflow/issues/22766
     c_macro_defines.setdefault("NDEBUG", 1)
+    # Newer TF versions (e.g. 2.21) do not define these in tensorflow/core/public/version.h anymore.
+    # For older versions, the header defines them to the same values, which is fine.
+    tf_version = tf_version_tuple()
+    c_macro_defines.setdefault("TF_MAJOR_VERSION", tf_version[0])
+    c_macro_defines.setdefault("TF_MINOR_VERSION", tf_version[1])
+    if have_min_tf_version((2, 10)):
+      self._cpp_std = "c++17"  # the TF headers need C++17 since TF 2.10
     ld_flags = list(ld_flags)
     if have_min_tf_version((1, 14)):
       # https://github.com/tensorflow/tensorflow/issues/13607
@@ -2580,6 +2604,8 @@ class OpCodeCompiler(NativeCodeCompiler):
       return self._tf_mod
     self._maybe_compile()
     self._tf_mod = tf.load_op_library(self._so_filename)
+    if self._so_filename not in self.loaded_so_filenames:
+      self.loaded_so_filenames.append(self._so_filename)
     return self._tf_mod
 
 
@@ -2599,6 +2625,13 @@ class TFNativeUtilCompiler(NativeCodeCompiler):
     # https://github.com/tensorflow/tensorflow/issues/17316
     # https://github.com/tensorflow/tensorflow/issues/22766
     c_macro_defines.setdefault("NDEBUG", 1)
+    # Newer TF versions (e.g. 2.21) do not define these in tensorflow/core/public/version.h anymore.
+    # For older versions, the header defines them to the same values, which is fine.
+    tf_version = tf_version_tuple()
+    c_macro_defines.setdefault("TF_MAJOR_VERSION", tf_version[0])
+    c_macro_defines.setdefault("TF_MINOR_VERSION", tf_version[1])
+    if have_min_tf_version((2, 10)):
+      self._cpp_std = "c++17"  # the TF headers need C++17 since TF 2.10
     ld_flags = list(ld_flags)
     if have_min_tf_version((1, 14)):
       # https://github.com/tensorflow/tensorflow/issues/13607
@@ -26,7 +26,10 @@ def kenlm_checked_out():
 # https://github.com/tensorflow/tensorflow/blob/master/tensorflow/core/framework/tensor_types.h
 # https://github.com/tensorflow/tensorflow/blob/master/tensorflow/core/lib/strings/str_util.h
 _src_code = """
+#include <algorithm>
 #include <exception>
+#include <list>
+#include <unordered_map>
 #include "tensorflow/core/framework/op.h"
 #include "tensorflow/core/framework/op_kernel.h"
 #include "tensorflow/core/framework/shape_inference.h"
@@ -50,6 +53,7 @@ using tstring = tensorflow::tstring;
 
 REGISTER_OP("KenLmLoadModel")
 .Attr("filename: string")
+.Attr("cache_size: int = 100000")
 .Attr("container: string = ''")
 .Attr("shared_name: string = ''")
 .Output("handle: resource")
@@ -108,26 +112,75 @@ REGISTER_OP("KenLmAbsScoreBpeStringsDense")
 // https://github.com/kpu/kenlm/blob/master/lm/virtual_interface.hh
 // https://github.com/kpu/kenlm/blob/master/python/kenlm.pyx
 struct KenLmModel : public ResourceBase {
-  explicit KenLmModel(const string& filename)
-      : filename_(filename), model_(filename.c_str()) {}
+  explicit KenLmModel(const string& filename, int64 cache_size)
+      : filename_(filename), cache_size_(cache_size), model_(filename.c_str()) {}
 
   float abs_score(const ::tstring& text) {
-    float total = 0;
     mutex_lock l(mu_);
-    lm::ngram::State state, out_state;
-    model_.BeginSentenceWrite(&state);
-    for(const string& word : tensorflow::str_util::Split(text, ' ')) {
-      if(word.empty()) continue;
-      auto word_idx = model_.BaseVocabulary().Index(word);
-      total += model_.FullScore(state, word_idx, out_state).prob;
-      state = out_state;
-    }
+    std::vector<string> words = tensorflow::str_util::Split(text, ' ');
+    lm::ngram::State state;
+    float total = score_words(words, words.size(), &state);
     // KenLM returns score in +log10 space.
     // We want to return in (natural) +log space.
     // 10 ** x = e ** (x * log(10))
     return total * logf(10.);
   }
 
+  // Scores the first num_words words (empty ones are skipped), starting at the sentence begin.
+  // Returns the score in +log10 space, and the LM state after these words in out_state.
+  // We cache the state and score for the prefixes of full words (least recently used are removed first).
+  // In search, the text of a hyp extends the text of the prev step, and hyps in the beam share prefixes,
+  // so usually we only need to score the last word.
+  // Expects that mu_ is locked.
+  float score_words(const std::vector<string>& words, size_t num_words, lm::ngram::State* out_state) {
+    string key;  // all non-empty words joined by space. the prefixes are the cache keys
+    std::vector<size_t> word_indices, key_ends;
+    for(size_t i = 0; i < num_words; ++i) {
+      if(words[i].empty()) continue;
+      if(!key.empty()) key += ' ';
+      key += words[i];
+      word_indices.push_back(i);
+      key_ends.push_back(key.size());
+    }
+    size_t num_prefix_words = (cache_size_ > 0) ? word_indices.size() : 0;
+    lm::ngram::State state, next_state;
+    float total = 0;
+    for(; num_prefix_words > 0; --num_prefix_words) {
+      auto it = cache_.find(key.substr(0, key_ends[num_prefix_words - 1]));
+      if(it != cache_.end()) {
+        cache_lru_.splice(cache_lru_.begin(), cache_lru_, it->second.lru_it);
+        state = it->second.state;
+        total = it->second.score;
+        break;
+      }
+    }
+    if(num_prefix_words == 0)
+      model_.BeginSentenceWrite(&state);
+    for(size_t i = num_prefix_words; i < word_indices.size(); ++i) {
+      auto word_idx = model_.BaseVocabulary().Index(words[word_indices[i]]);
+      total += model_.FullScore(state, word_idx, next_state).prob;
+      state = next_state;
+      add_to_cache(key.substr(0, key_ends[i]), state, total);
+    }
+    *out_state = state;
+    return total;
+  }
+
+  // Expects that mu_ is locked.
+  void add_to_cache(const string& key, const lm::ngram::State& state, float score) {
+    if(cache_size_ <= 0) return;
+    if(cache_.find(key) != cache_.end()) return;
+    cache_lru_.push_front(key);
+    CacheEntry& entry = cache_[key];
+    entry.state = state;
+    entry.score = score;
+    entry.lru_it = cache_lru_.begin();
+    while((int64) cache_.size() > cache_size_) {
+      cache_.erase(cache_lru_.back());
+      cache_lru_.pop_back();
+    }
+  }
+
   // See comments below.
   // We expect that the text either ends with a space or not, i.e. "... word " or "... subword".
   float abs_score_dense(
@@ -139,19 +192,13 @@ struct KenLmModel : public ResourceBase {
     model_.BeginSentenceWrite(&state);
     // We expect that the text either ends with a space or not, i.e. "... word " or "... subword".
     // We split the text into words. In the first case, we would have an empty word at the end, otherwise not.
-    auto words = tensorflow::str_util::Split(text, ' ');
+    std::vector<string> words = tensorflow::str_util::Split(text, ' ');
     float total_score = 0;
     ::tstring last_word = "";
     if(!words.empty()) {
       last_word = words[words.size() - 1];
       // Only up to the last word, which is either empty or a subword, which we join below.
-      for(int i = 0; i < words.size() - 1; ++i) {
-        auto word = words[i];
-        if(word.empty()) continue;
-        auto word_idx = model_.BaseVocabulary().Index(word);
-        total_score += model_.FullScore(state, word_idx, out_state).prob;
-        state = out_state;
-      }
+      total_score = score_words(words, words.size() - 1, &state);
     }
     for(int i = 0; i < labels.size(); ++i) {
       ::tstring word = last_word + labels(i);
@@ -175,9 +222,18 @@ const
     return strings::StrCat("KenLmModel[", filename_, "]");
   }
 
+  struct CacheEntry {
+    lm::ngram::State state;
+    float score;  // +log10 space
+    std::list<string>::iterator lru_it;
+  };
+
   const string filename_;
+  const int64 cache_size_;
   mutex mu_;
   lm::ngram::ProbingModel model_;
+  std::unordered_map<string, CacheEntry> cache_;  // word prefix -> entry
+  std::list<string> cache_lru_;  // word prefixes, most recently used first
 };
 
 
@@ -188,6 +244,7 @@ class KenLmLoadModelOp : public ResourceOpKernel<KenLmModel> {
   explicit KenLmLoadModelOp(OpKernelConstruction* context)
       : ResourceOpKernel(context) {
     OP_REQUIRES_OK(context, context->GetAttr("filename", &filename_));
+    OP_REQUIRES_OK(context, context->GetAttr("cache_size", &cache_size_));
   }
 
  private:
@@ -196,7 +253,7 @@ class KenLmLoadModelOp : public ResourceOpKernel<KenLmModel> {
 
   Status CreateResource(KenLmModel** ret) override {
     try {
-      *ret = new KenLmModel(filename_);
+      *ret = new KenLmModel(filename_, cache_size_);
     } catch (std::exception& exc) {
       return errors::Internal("Could not load KenLmModel ", filename_, ", exception: ", exc.what());
     }
@@ -213,6 +270,7 @@ class KenLmLoadModelOp : public ResourceOpKernel<KenLmModel> {
   }
 
   string filename_;
+  int64 cache_size_;
 };
 
 REGISTER_KERNEL_BUILDER(Name("KenLmLoadModel").Device(DEVICE_CPU), KenLmLoadModelOp);
@@ -328,12 +386,22 @@ class KenLmAbsScoreBpeStringsDenseOp : public OpKernel {
         TensorShape({input_tensor.NumElements(), labels_tensor.NumElements()})),
       errors::Internal("CopyFrom failed"));
 
+    // Hyps in the beam often have the same text. Score each text only once.
+    std::unordered_map<string, int> first_idx_by_text;
     for(int i = 0; i < input_flat.size(); ++i) {
       ::tstring text = input_flat(i);
       if(!bpe_merge_symbol.empty())
         text = tensorflow::str_util::StringReplace(text, bpe_merge_symbol + " ", "", /* replace_all */ true);
-      output_flat(i) = lm->abs_score_dense(
-        text, bpe_merge_symbol, labels_flat, output_dense_flat_tensor.Slice(i, i + 1).unaligned_flat<float>());
+      auto dense_scores = output_dense_flat_tensor.Slice(i, i + 1).unaligned_flat<float>();
+      auto first = first_idx_by_text.emplace(string(text.data(), text.size()), i);
+      if(!first.second) {
+        int j = first.first->second;
+        output_flat(i) = output_flat(j);
+        auto first_dense_scores = output_dense_flat_tensor.Slice(j, j + 1).unaligned_flat<float>();
+        std::copy_n(first_dense_scores.data(), first_dense_scores.size(), dense_scores.data());
+        continue;
+      }
+      output_flat(i) = lm->abs_score_dense(text, bpe_merge_symbol, labels_flat, dense_scores);
     }
   }
 };
@@ -401,7 +469,7 @@ def get_tf_mod(verbose=False):
   src_code += _src_code
 
   compiler = OpCodeCompiler(
-    base_name="KenLM", code_version=1, code=src_code,
+    base_name="KenLM", code_version=2, code=src_code,
     include_paths=(kenlm_dir, kenlm_dir + "/util/double-conversion"),
     c_macro_defines={"NDEBUG": 1, "KENLM_MAX_ORDER": 6, "HAVE_ZLIB": 1},
     ld_flags=["-l%s" % lib for lib in libs],
@@ -413,13 +481,14 @@ def get_tf_mod(verbose=False):
   return tf_mod
 
 
-def ken_lm_load(filename):
+def ken_lm_load(filename, cache_size=100000):
   """
   :param str filename:
+  :param int cache_size: max number of word prefixes for which we cache the LM state. 0 disables the cache
   :return: TF resource handle
   :rtype: tf.Tensor
   """
-  return get_tf_mod().ken_lm_load_model(filename=filename)
+  return get_tf_mod().ken_lm_load_model(filename=filename, cache_size=cache_size)
 
 
 def ken_lm_abs_score_strings(handle, strings):
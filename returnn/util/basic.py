@@ -3155,10 +3155,17 @@ def should_write_to_disk(config):
 class NativeCodeCompiler(object):
   """
   Helper class to compile native C/C++ code on-the-fly.
+
+  The compiled libs are cached on disk, in a directory per hash of the code (including the dependencies),
+  the compiler (and its version) and the flags.
+  The cache base dir can be set via :func:`set_cache_base_dir` (config option ``native_op_cache_dir``)
+  or via the env var ``RETURNN_NATIVE_CACHE_DIR``, e.g. to share it between multiple nodes.
   """
 
   CacheDirName = "returnn_native"
+  CacheBaseDir = None  # type: typing.Optional[str]  # see get_cache_base_dir
   CollectedCompilers = None  # type: typing.Optional[typing.List[NativeCodeCompiler]]
+  _cpp_std = "c++11"  # for -std, if is_cpp
 
   def __init__(self, base_name, code_version, code,
                is_cpp=True, c_macro_defines=None, ld_flags=None,
@@ -3173,8 +3180,9 @@ class NativeCodeCompiler(object):
     :param dict[str,str|int]|None c_macro_defines: e.g. {"TENSORFLOW": 1}
     :param list[str]|None ld_flags: e.g. ["-lblas"]
     :param list[str]|tuple[str] include_paths:
-    :param list[str]|None include_deps: if provided and an existing lib file, we will check if any dependency is newer
-      and we need to recompile. we could also do it automatically via -MD but that seems overkill and too slow.
+    :param list[str]|None include_deps: files which are included by the code.
+      their content is part of the code hash, i.e. we recompile if any of them changes.
+      we could also do it automatically via -MD but that seems overkill and too slow.
     :param str|None static_version_name: normally, we use .../base_name/hash as the dir
       but this would use .../base_name/static_version_name.
     :param bool should_cleanup_old_all: whether we should look in the cache dir
@@ -3186,7 +3194,7 @@ class NativeCodeCompiler(object):
     if self.CollectedCompilers is not None:
       self.CollectedCompilers.append(self)
     self.verbose = verbose
-    self.cache_dir = "%s/%s" % (get_temp_dir(), self.CacheDirName)
+    self.cache_dir = "%s/%s" % (self.get_cache_base_dir(), self.CacheDirName)
     self._include_paths = list(include_paths)
     self.base_name = base_name
     self.code_version = code_version
@@ -3196,6 +3204,7 @@ class NativeCodeCompiler(object):
     self.ld_flags = ld_flags or []
     self.include_deps = include_deps
     self.static_version_name = static_version_name
+    self.use_cxx11_abi = use_cxx11_abi
     self._code_hash = self._make_code_hash()
     self._info_dict = self._make_info_dict()
     self._hash = self._make_hash()
@@ -3203,7 +3212,6 @@ class NativeCodeCompiler(object):
     if should_cleanup_old_all:
       self._cleanup_old()
     self._should_cleanup_old_mydir = should_cleanup_old_mydir
-    self.use_cxx11_abi = use_cxx11_abi
     self._log_stream = log_stream
     if self.verbose:
       print("%s: %r" % (self.__class__.__name__, self), file=log_stream)
@@ -3211,6 +3219,21 @@ class NativeCodeCompiler(object):
   def __repr__(self):
     return "<%s %r in %r>" % (self.__class__.__name__, self.base_name, self._mod_path)
 
+  @classmethod
+  def get_cache_base_dir(cls):
+    """
+    :return: the base dir for the cache, e.g. "/tmp/$USERNAME"
+    :rtype: str
+    """
+    return cls.CacheBaseDir or os.environ.get("RETURNN_NATIVE_CACHE_DIR") or get_temp_dir()
+
+  @classmethod
+  def set_cache_base_dir(cls, cache_base_dir):
+    """
+    :param str|None cache_base_dir: for all compilers (also the derived classes). None resets to the default
+    """
+    NativeCodeCompiler.CacheBaseDir = cache_base_dir
+
   @property
   def _mod_path(self):
     return "%s/%s/%s" % (self.cache_dir, self.base_name, self.static_version_name or self._hash[:10])
@@ -3282,7 +3305,8 @@ class NativeCodeCompiler(object):
     assert isinstance(res, dict)
     return res
 
-  _relevant_info_keys = ("code_version", "code_hash", "c_macro_defines", "ld_flags", "compiler_bin")
+  _relevant_info_keys = (
+    "code_version", "code_hash", "c_macro_defines", "ld_flags", "compiler_bin", "compiler_version", "use_cxx11_abi")
 
   def _make_info_dict(self):
     """
@@ -3296,12 +3320,36 @@ class NativeCodeCompiler(object):
       "c_macro_defines": self.c_macro_defines,
       "ld_flags": self.ld_flags,
       "compiler_bin": self._get_compiler_bin(),
+      "compiler_version": self._get_compiler_version(self._get_compiler_bin()),
+      "use_cxx11_abi": self.use_cxx11_abi,
     }
 
+  _compiler_versions = {}  # type: typing.Dict[str,typing.Optional[str]]  # compiler bin -> version
+
+  @classmethod
+  def _get_compiler_version(cls, compiler_bin):
+    """
+    :param str compiler_bin:
+    :return: first line of ``compiler_bin --version``, or None if that fails
+    :rtype: str|None
+    """
+    if compiler_bin not in cls._compiler_versions:
+      from subprocess import check_output, CalledProcessError
+      try:
+        out = check_output([compiler_bin, "--version"]).decode("utf8").strip()
+        version = out.splitlines()[0] if out else None
+      except (OSError, CalledProcessError):
+        version = None
+      cls._compiler_versions[compiler_bin] = version
+    return cls._compiler_versions[compiler_bin]
+
   def _make_code_hash(self):
     import hashlib
     h = hashlib.md5()
     h.update(self.code.encode("utf8"))
+    for fn in self.include_deps or ():
+      with open(fn, "rb") as f:
+        h.update(f.read())
     return h.hexdigest()
 
   def _make_hash(self):
@@ -3315,8 +3363,10 @@ class NativeCodeCompiler(object):
 
   def _save_info(self):
     filename = self._info_filename
-    with open(filename, "w") as f:
+    tmp_filename = "%s.tmp-%i" % (filename, os.getpid())
+    with open(tmp_filename, "w") as f:
       f.write("%s\n" % better_repr(self._info_dict))
+    os.rename(tmp_filename, filename)
 
   def _need_recompile(self):
     """
@@ -3324,11 +3374,7 @@ class NativeCodeCompiler(object):
     """
     if not os.path.exists(self._so_filename):
       return True
-    if self.include_deps:
-      so_mtime = os.path.getmtime(self._so_filename)
-      for fn in self.include_deps:
-        if os.path.getmtime(fn) > so_mtime:
-          return True
+    # The include deps are covered by the code hash.
     old_info = self._load_info()
     new_info = self._make_info_dict()
     if not old_info:
@@ -3352,14 +3398,19 @@ class NativeCodeCompiler(object):
       if self.verbose:
         print("%s: No need to recompile: %s" % (self.__class__.__name__, self._so_filename))
       # Touch it so that we can see that we used it recently.
-      os.utime(self._info_filename, None)
+      try:
+        os.utime(self._info_filename, None)
+      except OSError:  # e.g. a shared read-only cache
+        pass
       return
     lock = LockFile(self._mod_path)
     if self._should_cleanup_old_mydir and not lock.is_locked():
       if os.path.exists(self._mod_path):
         self._cleanup_old_path(self._mod_path, reason="need recompile")
     with lock:
-      self._maybe_compile_inner()
+      # Maybe some other process has compiled it in the meantime.
+      if self._need_recompile():
+        self._maybe_compile_inner()
 
   def _get_compiler_bin(self):
     """
@@ -3397,7 +3448,7 @@ class NativeCodeCompiler(object):
       f.write(self.code)
     common_opts = ["-shared", "-O2"]
     if self.is_cpp:
-      common_opts += ["-std=c++11"]
+      common_opts += ["-std=%s" % self._cpp_std]
     if sys.platform == "darwin":
       common_opts += ["-undefined", "dynamic_lookup"]
     for include_path in self._include_paths:
@@ -3407,7 +3458,10 @@ class NativeCodeCompiler(object):
     common_opts += ["-D_GLIBCXX_USE_CXX11_ABI=%i" % (1 if self.use_cxx11_abi else 0)]
     common_opts += ["-D%s=%s" % item for item in sorted(self.c_macro_defines.items())]
     common_opts += ["-g"]
-    opts = common_opts + [self._c_filename, "-o", self._so_filename]
+    # Write to a temporary file first, and rename it when complete,
+    # such that other processes (e.g. with a shared cache dir) never see an incomplete lib.
+    tmp_so_filename = "%s.tmp-%i" % (self._so_filename, os.getpid())
+    opts = common_opts + [self._c_filename, "-o", tmp_so_filename]
     opts += list(map(self._transform_ld_flag, self.ld_flags))
     cmd_bin = self._get_compiler_bin()
     cmd_args = [cmd_bin] + opts
@@ -3428,13 +3482,14 @@ class NativeCodeCompiler(object):
         print("Your GCC version might be too new. This is a problem with some nvcc versions.")
         print()
       raise CalledProcessError(returncode=proc.returncode, cmd=cmd_args)
-    assert os.path.exists(self._so_filename)
+    assert os.path.exists(tmp_so_filename)
     with open("%s/compile.log" % self._mod_path, "wb") as f:
       if self.verbose:
         print("%s: write compile log to: %s" % (self.__class__.__name__, f.name))
       f.write(("+ %s\n" % " ".join(cmd_args)).encode("utf8"))
       f.write(stdout)
     self._save_info()
+    os.rename(tmp_so_filename, self._so_filename)
     assert not self._need_recompile()
 
   def load_lib_ctypes(self):
@@ -3604,6 +3659,35 @@ class Stats:
     self.mean_sq += delta_sq / new_total_data_len
     self.total_data_len = new_total_data_len
 
+  def merge(self, other):
+    """
+    Merges other stats into this one, e.g. which were collected in parallel over another part of the data.
+    This uses the same pairwise update (Chan et al.) as :func:`collect`, and thus is numerically stable.
+
+    :param Stats other:
+    """
+    import numpy
+    if other.total_data_len == 0:
+      return
+    if self.total_data_len == 0:
+      self.mean, self.mean_sq, self.var = other.mean, other.mean_sq, other.var
+      self.min, self.max = other.min, other.max
+      self.total_data_len, self.num_seqs = other.total_data_len, other.num_seqs
+      return
+    new_total_data_len = self.total_data_len + other.total_data_len
+    mean_diff = other.mean - self.mean
+    m_a = self.var * self.total_data_len
+    m_b = other.var * other.total_data_len
+    m2 = m_a + m_b + mean_diff ** 2 * self.total_data_len * other.total_data_len / new_total_data_len
+    self.var = m2 / new_total_data_len
+    self.mean = self.mean + mean_diff * other.total_data_len / new_total_data_len
+    self.mean_sq = (
+      self.mean_sq * self.total_data_len + other.mean_sq * other.total_data_len) / new_total_data_len
+    self.min = numpy.minimum(self.min, other.min)
+    self.max = numpy.maximum(self.max, other.max)
+    self.total_data_len = new_total_data_len
+    self.num_seqs += other.num_seqs
+
   def get_mean(self):
     """
     :return: mean, shape (dim,)
@@ -1058,15 +1058,16 @@ class FastBwFsaShared:
     :rtype: numpy.ndarray
     """
     num_edges = len(self.edges)
-    res = numpy.zeros((4, num_edges * n_batch), dtype="int32")
-    for batch_idx in range(n_batch):
-      for edge_idx, edge in enumerate(self.edges):
-        res[:, batch_idx * num_edges + edge_idx] = (
-          edge.source_state_idx + batch_idx * self.num_states,
-          edge.target_state_idx + batch_idx * self.num_states,
-          edge.label,
-          batch_idx)
-    return res
+    edges = numpy.array(
+      [(edge.source_state_idx, edge.target_state_idx, edge.label) for edge in self.edges],
+      dtype="int32").reshape((num_edges, 3))
+    batch_idxs = numpy.arange(n_batch, dtype="int32")[:, None]  # (batch,1)
+    res = numpy.zeros((4, n_batch, num_edges), dtype="int32")
+    res[0] = edges[None, :, 0] + batch_idxs * self.num_states
+    res[1] = edges[None, :, 1] + batch_idxs * self.num_states
+    res[2] = edges[None, :, 2]
+    res[3] = batch_idxs
+    return res.reshape((4, n_batch * num_edges))
 
   def get_weights(self, n_batch):
     """
@@ -1074,12 +1075,7 @@ class FastBwFsaShared:
     :return weights: (num_edges,), weights of the edges
     :rtype: numpy.ndarray
     """
-    num_edges = len(self.edges)
-    res = numpy.zeros((num_edges * n_batch,), dtype="float32")
-    for batch_idx in range(n_batch):
-      for edge_idx, edge in enumerate(self.edges):
-        res[batch_idx * num_edges + edge_idx] = edge.weight
-    return res
+    return numpy.tile(numpy.array([edge.weight for edge in self.edges], dtype="float32"), n_batch)
 
   def get_start_end_states(self, n_batch):
     """
@@ -1089,12 +1085,8 @@ class FastBwFsaShared:
     """
     start_state_idx = 0
     end_state_idx = self.num_states - 1
-    res = numpy.zeros((2, n_batch), dtype="int32")
-    for batch_idx in range(n_batch):
-      res[:, batch_idx] = (
-        start_state_idx + batch_idx * self.num_states,
-        end_state_idx + batch_idx * self.num_states)
-    return res
+    batch_offsets = numpy.arange(n_batch, dtype="int32") * self.num_states
+    return numpy.stack([start_state_idx + batch_offsets, end_state_idx + batch_offsets]).astype("int32")
 
   def get_fast_bw_fsa(self, n_batch):
     """
@@ -1116,9 +1108,8 @@ def get_ctc_fsa_fast_bw(targets, seq_lens, blank_idx):
   """
   n_batch, n_time = targets.shape
   assert seq_lens.shape == (n_batch,)
-  edges = []  # type: typing.List[typing.Tuple[int,int,int,int]]  # list of (from,to,emission_idx,sequence_idx)
-  start_end_states = []  # type: typing.List[typing.Tuple[int,int]]  # list of (start,end), same len as batch
-  state_idx = 0
+  seq_lens = numpy.asarray(seq_lens, dtype="int32")
+  assert (seq_lens <= n_time).all()
   # Note: We don't use weights on the edges, i.e. they are all set to zero.
   # I.e. we want that all strings for some given length T have the same probability.
   # In a probabilistic interpretation, this means that for some given length T,
@@ -1132,52 +1123,64 @@ def get_ctc_fsa_fast_bw(targets, seq_lens, blank_idx):
   # we need to add some extra handling (see below).
   # It would be a bit simpler if we would have multiple final states,
   # but the current interface does not allow this.
-  for batch_idx in range(n_batch):
-    initial_state_idx = state_idx
-    edges.append((state_idx, state_idx, blank_idx, batch_idx))  # initial blank loop
-    assert seq_lens[batch_idx] <= n_time
-    for i in range(seq_lens[batch_idx]):
-      label_idx = targets[batch_idx, i]
-      is_final_label = i == seq_lens[batch_idx] - 1
-      next_is_final_label = i == seq_lens[batch_idx] - 2
-      next_label_idx = None if is_final_label else targets[batch_idx, i + 1]
-      edges.append((state_idx, state_idx + 1, label_idx, batch_idx))  # label
-      if is_final_label:
-        # Case 1a: no blank at the end, exactly 1 label.
-        # Skip directly to final state (state_idx + 3).
-        edges.append((state_idx, state_idx + 3, label_idx, batch_idx))  # label
-      state_idx += 1
-      edges.append((state_idx, state_idx, label_idx, batch_idx))  # label loop
-      edges.append((state_idx, state_idx + 1, blank_idx, batch_idx))  # blank
-      if not is_final_label and label_idx != next_label_idx:
-        # Skip over blank is allowed in this case.
-        edges.append((state_idx, state_idx + 2, next_label_idx, batch_idx))  # next label
-        if next_is_final_label:
-          # We miss now the case of having: exactly one label, no blank.
-          # Skip directly to the final state (state_idx + 4).
-          edges.append((state_idx, state_idx + 4, next_label_idx, batch_idx))  # next label
-      if is_final_label:
-        # Case 1b: no blank at the end, 2 or more labels.
-        # Skip directly to final state (state_idx + 2).
-        edges.append((state_idx, state_idx + 2, label_idx, batch_idx))  # label
-        # Case 2: exactly one blank at the end, 1 or more labels.
-        # Skip directly to final state (state_idx + 2).
-        edges.append((state_idx, state_idx + 2, blank_idx, batch_idx))  # blank
-      state_idx += 1
-      edges.append((state_idx, state_idx, blank_idx, batch_idx))  # blank loop
-      if is_final_label:
-        # Case 3: 2 or more blank at the end, 1 or more labels.
-        # Go to final state (state_idx + 1).
-        edges.append((state_idx, state_idx + 1, blank_idx, batch_idx))  # blank
-        state_idx += 1  # this is the final state now
-    final_state_idx = state_idx
-    start_end_states.append((initial_state_idx, final_state_idx))
-    state_idx += 1
-  edges_np = numpy.array(edges).transpose()  # (4,n_edges)
-  start_end_states_np = numpy.array(start_end_states).transpose()  # (2,batch)
+  # We build all the edges of the whole batch at once.
+  # Every label position i of a seq has the states s = initial + 2 * i (before the label),
+  # s + 1 (after the label), s + 2 (after a blank), and the final label also has the final state s + 3.
+  # For every label position, there is a fixed list of potential edges (slots), each with a mask,
+  # such that the order of the edges is: per seq, the initial blank loop, then per label position, the slots.
+  num_states = numpy.where(seq_lens > 0, 2 * seq_lens + 2, 1)  # (batch,)
+  initial_states = numpy.cumsum(num_states) - num_states  # (batch,)
+  final_states = initial_states + num_states - 1  # (batch,)
+  targets = targets.astype("int32")
+  pos = numpy.arange(n_time)[None, :]  # (1,time)
+  valid = pos < seq_lens[:, None]  # (batch,time)
+  is_final_label = pos == seq_lens[:, None] - 1  # (batch,time)
+  next_is_final_label = pos == seq_lens[:, None] - 2  # (batch,time)
+  next_labels = numpy.concatenate([targets[:, 1:], numpy.zeros((n_batch, min(n_time, 1)), dtype="int32")], axis=1)
+  # Skip over blank is allowed if the next label is different.
+  skip = valid & ~is_final_label & (targets != next_labels)  # (batch,time)
+  blanks = numpy.full_like(targets, blank_idx)
+  s = initial_states[:, None] + 2 * pos  # (batch,time)
+  slots = [  # (from,to,emission_idx,mask)
+    (s, s + 1, targets, valid),  # label
+    # Case 1a: no blank at the end, exactly 1 label. Skip directly to final state.
+    (s, s + 3, targets, is_final_label),  # label
+    (s + 1, s + 1, targets, valid),  # label loop
+    (s + 1, s + 2, blanks, valid),  # blank
+    (s + 1, s + 3, next_labels, skip),  # next label
+    # We miss now the case of having: exactly one label, no blank. Skip directly to the final state.
+    (s + 1, s + 5, next_labels, skip & next_is_final_label),  # next label
+    # Case 1b: no blank at the end, 2 or more labels. Skip directly to final state.
+    (s + 1, s + 3, targets, is_final_label),  # label
+    # Case 2: exactly one blank at the end, 1 or more labels. Skip directly to final state.
+    (s + 1, s + 3, blanks, is_final_label),  # blank
+    (s + 2, s + 2, blanks, valid),  # blank loop
+    # Case 3: 2 or more blank at the end, 1 or more labels. Go to final state.
+    (s + 2, s + 3, blanks, is_final_label),  # blank
+  ]
+  initial_loop = (initial_states[:, None], initial_states[:, None], numpy.full((n_batch, 1), blank_idx), None)
+
+  def _get_component(idx):
+    """
+    :param int idx: 0 (from), 1 (to), 2 (emission_idx) or 3 (mask)
+    :return: shape (batch,1+time*num_slots), ordered like the edges
+    :rtype: numpy.ndarray
+    """
+    if idx == 3:
+      first = numpy.ones((n_batch, 1), dtype="bool")
+    else:
+      first = initial_loop[idx]
+    values = numpy.stack([slot[idx] for slot in slots], axis=-1).reshape((n_batch, n_time * len(slots)))
+    return numpy.concatenate([first, values], axis=1)
+
+  mask = _get_component(3)
+  batch_idxs = numpy.broadcast_to(numpy.arange(n_batch)[:, None], mask.shape)
+  edges = numpy.stack(
+    [_get_component(0)[mask], _get_component(1)[mask], _get_component(2)[mask], batch_idxs[mask]]).astype("int32")
+  start_end_states = numpy.stack([initial_states, final_states]).astype("int32")  # (2,batch)
   return FastBaumWelchBatchFsa(
-    edges=edges_np, weights=numpy.zeros((len(edges),), dtype="float32"),
-    start_end_states=start_end_states_np)
+    edges=edges, weights=numpy.zeros((edges.shape[1],), dtype="float32"),
+    start_end_states=start_end_states)
 
 
 def fast_bw_fsa_staircase(seq_lens, with_loop=False, max_skip=None, start_max_skip=None, end_max_skip=None):
@@ -1192,68 +1195,77 @@ def fast_bw_fsa_staircase(seq_lens, with_loop=False, max_skip=None, start_max_sk
   :param int|list[int] end_max_skip: per batch if a list
   :rtype: FastBaumWelchBatchFsa
   """
+  seq_lens = numpy.asarray(seq_lens, dtype="int64")
   n_batch = len(seq_lens)
-  if not isinstance(max_skip, list):
-    max_skip = [max_skip] * n_batch
-  if not isinstance(start_max_skip, list):
-    start_max_skip = [start_max_skip] * n_batch
-  if not isinstance(end_max_skip, list):
-    end_max_skip = [end_max_skip] * n_batch
+  assert (seq_lens > 0).all()
+
+  def _per_batch(opt):
+    """
+    :param int|list[int]|None opt:
+    :return: shape (batch,), 0 means not set
+    :rtype: numpy.ndarray
+    """
+    if not isinstance(opt, list):
+      opt = [opt] * n_batch
+    return numpy.array([x or 0 for x in opt], dtype="int64")
+
+  max_skip, start_max_skip, end_max_skip = map(_per_batch, (max_skip, start_max_skip, end_max_skip))
   # numpy.ndarray edges: (4,num_edges), edges of the graph (from,to,emission_idx,sequence_idx)
   # numpy.ndarray weights: (num_edges,), weights of the edges
   # numpy.ndarray start_end_states: (2, batch), (start,end) state idx in automaton.
-  state_idx = 0
-  edges = []
-  start_end_states = []
-  for batch in range(n_batch):
-    seq_len = seq_lens[batch]
-    assert seq_len > 0
-    start_state_idx = state_idx
-    # Conventions:
-    # * create seq_len + 1 states
-    # * state 't': all outgoing edges have emission 't'
-    # * state t=0 is initial/first; state t=seq_len is final.
-    # * need extra handling for first:
-    #   - all outgoing edges can have emissions up to the skip-len
-    for i in range(seq_len):
-      cur_state_idx = state_idx
-      cur_max_skip = None
-      if not cur_max_skip and i == 0:
-        cur_max_skip = start_max_skip[batch]
-      if not cur_max_skip and end_max_skip[batch] and i + end_max_skip[batch] >= seq_len:
-        cur_max_skip = end_max_skip[batch]
-      if not cur_max_skip:
-        cur_max_skip = max_skip[batch]
-      j_max = seq_len
-      if cur_max_skip:
-        j_max = min(j_max, i + cur_max_skip)
-      if with_loop:
-        emission_idx = i
-        target_state_idx = cur_state_idx
-        edges += [(cur_state_idx, target_state_idx, emission_idx, batch)]
-      for j in range(i + 1, j_max + 1):
-        target_state_idx = cur_state_idx + j - i
-        if i > 0:
-          emission_idx = i
-          edges += [(cur_state_idx, target_state_idx, emission_idx, batch)]
-        else:  # see comment above. extra rule for first state
-          for t in range(i, j):
-            if with_loop and i == t and j < seq_len:
-              continue
-            emission_idx = t
-            edges += [(cur_state_idx, target_state_idx, emission_idx, batch)]
-          if with_loop and j < seq_len:
-            emission_idx = j
-            edges += [(cur_state_idx, target_state_idx, emission_idx, batch)]
-      state_idx += 1
-    end_state_idx = state_idx
-    start_end_states += [(start_state_idx, end_state_idx)]
-    state_idx += 1
-  weights = [0.0] * len(edges)
+  # Conventions:
+  # * create seq_len + 1 states
+  # * state 't': all outgoing edges have emission 't'
+  # * state t=0 is initial/first; state t=seq_len is final.
+  # * need extra handling for first:
+  #   - all outgoing edges can have emissions up to the skip-len
+  start_states = numpy.cumsum(seq_lens + 1) - (seq_lens + 1)  # (batch,)
+  end_states = start_states + seq_lens  # (batch,)
+
+  # The states t > 0, for the whole batch at once.
+  # Per state, the edges go to t + k, for k = (0 if with_loop else 1), ..., j_max - t, all with emission t.
+  batch_idxs = numpy.repeat(numpy.arange(n_batch), seq_lens - 1)  # (num_states,)
+  ts = numpy.arange(len(batch_idxs)) - numpy.repeat(numpy.cumsum(seq_lens - 1) - (seq_lens - 1), seq_lens - 1) + 1
+  lens = seq_lens[batch_idxs]
+  cur_max_skip = numpy.where(
+    (end_max_skip[batch_idxs] > 0) & (ts + end_max_skip[batch_idxs] >= lens), end_max_skip[batch_idxs], 0)
+  cur_max_skip = numpy.where(cur_max_skip > 0, cur_max_skip, max_skip[batch_idxs])
+  j_max = numpy.where(cur_max_skip > 0, numpy.minimum(lens, ts + cur_max_skip), lens)
+  min_k = 0 if with_loop else 1
+  counts = j_max - ts + 1 - min_k  # num edges per state
+  edge_states = numpy.repeat(numpy.arange(len(ts)), counts)
+  ks = numpy.arange(len(edge_states)) - numpy.repeat(numpy.cumsum(counts) - counts, counts) + min_k
+  from_states = start_states[batch_idxs] + ts
+  edges_rest = numpy.stack([
+    from_states[edge_states], from_states[edge_states] + ks, ts[edge_states], batch_idxs[edge_states]])
+
+  # The first state t = 0, for the whole batch at once.
+  first_max_skip = numpy.where(
+    (start_max_skip == 0) & (end_max_skip > 0) & (end_max_skip >= seq_lens), end_max_skip, start_max_skip)
+  first_max_skip = numpy.where(first_max_skip > 0, first_max_skip, max_skip)
+  first_j_max = numpy.where(first_max_skip > 0, numpy.minimum(seq_lens, first_max_skip), seq_lens)  # (batch,)
+  # Grid over batch, target j = 1, ..., j_max and emission e = 0, ..., j_max, ordered like that.
+  num_js = int(first_j_max.max())
+  js = numpy.arange(1, num_js + 1)[None, :, None]  # (1,j,1)
+  es = numpy.arange(0, num_js + 1)[None, None, :]  # (1,1,e)
+  with_loop_here = with_loop & (js < seq_lens[:, None, None])  # (batch,j,1)
+  grid_mask = ((es < js) & ~(with_loop_here & (es == 0))) | (with_loop_here & (es == js))  # (batch,j,e)
+  grid_mask &= js <= first_j_max[:, None, None]
+  grid_batch_idxs, grid_js, grid_es = numpy.nonzero(grid_mask)  # ordered by batch, j, e
+  edges_first = numpy.stack([
+    start_states[grid_batch_idxs], start_states[grid_batch_idxs] + grid_js + 1, grid_es, grid_batch_idxs])
+  if with_loop:
+    edges_first = numpy.concatenate([
+      numpy.stack([start_states, start_states, numpy.zeros_like(start_states), numpy.arange(n_batch)]),
+      edges_first], axis=1)
+
+  # Merge, such that per seq, the edges of the first state come before the others.
+  edges = numpy.concatenate([edges_first, edges_rest], axis=1)
+  edges = edges[:, numpy.argsort(edges[3], kind="stable")].astype("int32")
   return FastBaumWelchBatchFsa(
-    edges=numpy.array(edges).transpose(),
-    weights=numpy.array(weights),
-    start_end_states=numpy.array(start_end_states).transpose())
+    edges=edges,
+    weights=numpy.zeros((edges.shape[1],), dtype="float32"),
+    start_end_states=numpy.stack([start_states, end_states]).astype("int32"))
 
 
 def main():
@@ -4,11 +4,16 @@
 This script will emulate a Sprint executable, so that we can use it for SprintDatasetBase.
 This is useful for tests.
 To generate data, we can use the GeneratingDataset code.
+
+With ``--*.python-control-enabled=true``, it emulates Sprint PythonControl instead,
+such that it can be used for :class:`SprintInstancePool` (loss and error signals, automata).
 """
 
 from __future__ import print_function
 
 import sys
+import time
+import numpy
 from importlib import import_module
 
 import _setup_test_env  # noqa
@@ -55,6 +60,53 @@ class ArgParser:
       i += 1
 
 
+def python_control_main(args):
+  """
+  Emulates Sprint PythonControl, e.g. for :class:`SprintInstancePool`.
+  The loss is cross entropy w.r.t. label 0 in every frame.
+  The automaton is a linear chain with one state per char of the segment name.
+  Segment names starting with "unknown" are rejected.
+
+  :param ArgParser args:
+  """
+  sprint_control = import_module(args.get("pymod-name"))
+  seconds_per_frame = float(args.get("dummy-seconds-per-frame", 0))
+
+  def callback(cmd, *cmd_args):
+    """
+    :param str cmd:
+    """
+    if cmd == "version":
+      return "<version>DummySprintExec</version>"
+    if cmd == "get_loss_and_error_signal":
+      seg_name, seg_len, log_posteriors = cmd_args
+      time.sleep(seconds_per_frame * seg_len)
+      loss = -float(numpy.sum(log_posteriors[:, 0]))
+      error_signal = numpy.exp(log_posteriors)
+      error_signal[:, 0] -= 1.
+      return loss, error_signal
+    if cmd == "export_allophone_state_fsa_by_segment_name":
+      segment_name, = cmd_args
+      if segment_name.startswith("unknown"):
+        raise KeyError("segment %r not in corpus" % segment_name)
+      num_states = len(segment_name) + 1
+      num_edges = len(segment_name)
+      edges = numpy.array(
+        [numpy.arange(num_edges), numpy.arange(num_edges) + 1, [ord(c) for c in segment_name]], dtype="uint32")
+      weights = numpy.zeros((num_edges,), dtype="float32")
+      return num_states, num_edges, edges.flatten(), weights
+    raise NotImplementedError("DummySprintExec callback %r" % cmd)
+
+  control = sprint_control.init(
+    name="Sprint.PythonControl", reference=None, config=args.get("pymod-config"),
+    sprint_unit="NnTrainer.pythonControl", version_number=5, callback=callback)
+  try:
+    control.run_control_loop(callback)
+  except SystemExit:  # via exit cmd
+    pass
+  print("DummySprintExec exit")
+
+
 def main(argv):
   """
   Main entry.
@@ -63,6 +115,10 @@ def main(argv):
   args = ArgParser()
   args.parse(argv[1:])
 
+  if args.get("python-control-enabled") == "true":
+    python_control_main(args)
+    return
+
   if args.get("pymod-name"):
     sprint_api = import_module(args.get("pymod-name"))
   else:
@@ -0,0 +1,45 @@
+
+#!rnn.py
+
+def get_data():
+  from returnn.datasets.generating import Task12AXDataset
+  dataset = Task12AXDataset(num_seqs=20)
+  dataset.labels["classes"] = ["0", "1"]  # such that we can serialize the search output
+  return dataset
+
+use_tensorflow = True
+device = "cpu"
+log_verbosity = 3
+batch_size = 100
+max_seqs = 5
+num_outputs = {"classes": 2, "data": 9}
+num_inputs = 9
+train = "config:get_data()"
+search_data = "config:get_data()"
+search_do_eval = False
+search_output_layer = "decision"
+network = {
+  "lstm": {"class": "rec", "unit": "BasicLSTM", "from": "data", "n_out": 5},
+  "output": {
+    "class": "rec", "from": "lstm", "target": "classes",
+    "unit": {
+      "prev_embed": {"class": "linear", "activation": None, "from": "prev:output", "n_out": 3},
+      "prob": {"class": "softmax", "from": "prev_embed", "target": "classes", "loss": "ce"},
+      "output": {"class": "choice", "beam_size": 3, "from": "prob", "target": "classes", "initial_output": 0}
+    }},
+  "decision": {"class": "decide", "from": "output", "target": "classes", "is_output_layer": True},
+  "priors": {"class": "softmax", "from": "lstm", "n_out": 2, "is_output_layer": True}
+}
+
+
+
+# Config-file copied for logging purpose by Returnn.
+# Time: 2026-10-19 02:04:28
+# Call: ['/root/package/rnn.py', '/tmp/tmpwxhqq5nf/config.py', '++task', 'search', '++load', '/tmp/tmpwxhqq5nf/model.001', '++task_num_workers', '1', '++search_output_file', '/tmp/tmpwxhqq5nf/output-search-1-workers.txt', '++search_output_file_format', 'py']
+# Path: /root/package/tests
+# Hostname: vm
+# PID: 19048
+# Returnn: 1.20261019.020345+git.80f69a8
+# TensorFlow: 2.21.0 (v2.21.0-rc1-5-ga481b10260d) (<site-package> in /root/.pyenv/versions/3.11.7/lib/python3.11/site-packages/tensorflow)
+# Config files: ['/tmp/tmpwxhqq5nf/config.py']
+
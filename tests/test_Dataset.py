@@ -6,10 +6,12 @@ from __future__ import print_function
 import sys
 import _setup_test_env  # noqa
 import unittest
-from nose.tools import assert_equal, assert_is_instance, assert_in, assert_not_in, assert_true, assert_false
+from nose.tools import (
+  assert_equal, assert_not_equal, assert_is_instance, assert_in, assert_not_in, assert_true, assert_false)
 from returnn.datasets.generating import GeneratingDataset, DummyDataset, DummyDatasetMultipleSequenceLength
 from returnn.engine.batch import Batch
 from returnn.datasets.basic import DatasetSeq
+from returnn.datasets.cached2 import CachedDataset2
 from returnn.util.basic import NumbersDict
 import numpy as np
 
@@ -324,6 +326,209 @@ def test_task12ax_window():
   assert_equal(list(data2a[-1, 2]), [0] * input_dim)  # zero-padded right
 
 
+class _SequentialDataset(CachedDataset2):
+  """
+  Can only be read sequentially. Seq i has i + 1 frames, all with value i.
+  """
+
+  def __init__(self, num_seqs=20, **kwargs):
+    super(_SequentialDataset, self).__init__(**kwargs)
+    self.num_inputs = 3
+    self.num_outputs = {"data": (3, 2), "classes": (5, 1)}
+    self.total_num_seqs = num_seqs
+    self.collected_seq_idxs = []
+
+  def init_seq_order(self, epoch=None, seq_list=None, seq_order=None):
+    super(_SequentialDataset, self).init_seq_order(epoch=epoch, seq_list=seq_list, seq_order=seq_order)
+    self.collected_seq_idxs = []
+    return True
+
+  def _collect_single_seq(self, seq_idx):
+    if seq_idx >= self.total_num_seqs:
+      return None
+    self.collected_seq_idxs.append(seq_idx)
+    return DatasetSeq(
+      seq_idx=seq_idx, seq_tag="seq-%i" % seq_idx,
+      features={
+        "data": np.full((seq_idx + 1, 3), seq_idx, dtype="float32"),
+        "classes": np.full((seq_idx + 1,), seq_idx % 5, dtype="int32")})
+
+
+def _iterate_dataset_seqs(dataset, epoch=1):
+  """
+  :param returnn.datasets.basic.Dataset dataset:
+  :param int epoch:
+  :return: list of (seq_tag, data, classes)
+  :rtype: list[(str,numpy.ndarray,numpy.ndarray)]
+  """
+  dataset.init_seq_order(epoch=epoch)
+  res = []
+  seq_idx = 0
+  while dataset.is_less_than_num_seqs(seq_idx):
+    dataset.load_seqs(seq_idx, seq_idx + 1)
+    res.append((dataset.get_tag(seq_idx), dataset.get_data(seq_idx, "data"), dataset.get_data(seq_idx, "classes")))
+    seq_idx += 1
+  dataset.finish_epoch()
+  return res
+
+
+def test_shuffle_buffer_cached_dataset2():
+  # Seq i has (i + 1) * (3 * 4 + 4) bytes, thus the 1600 bytes hold about 13 seqs.
+  tags_by_background = {}
+  for background in [False, True]:
+    dataset = _SequentialDataset(shuffle_buffer={"max_bytes": 1600, "background": background})
+    dataset.initialize()
+    seqs = _iterate_dataset_seqs(dataset)
+    tags = [tag for (tag, _, _) in seqs]
+    print("background:", background, "tags:", tags)
+    assert_equal(sorted(tags), sorted(["seq-%i" % i for i in range(20)]))
+    assert_not_equal(tags, ["seq-%i" % i for i in range(20)])
+    assert_equal(dataset.collected_seq_idxs, list(range(20)))
+    for tag, data, classes in seqs:
+      i = int(tag.split("-")[1])
+      assert_equal(data.shape, (i + 1, 3))
+      assert_true((data == i).all())
+      assert_equal(classes.shape, (i + 1,))
+      assert_true((classes == i % 5).all())
+    assert_equal([tag for (tag, _, _) in _iterate_dataset_seqs(dataset)], tags)
+    assert_not_equal([tag for (tag, _, _) in _iterate_dataset_seqs(dataset, epoch=2)], tags)
+    tags_by_background[background] = tags
+  # The order only depends on the epoch, not on the timing of the background thread.
+  assert_equal(tags_by_background[False], tags_by_background[True])
+
+
+def test_shuffle_buffer_seq_bigger_than_buffer():
+  dataset = _SequentialDataset(num_seqs=5, shuffle_buffer=100)
+  dataset.initialize()
+  seqs = _iterate_dataset_seqs(dataset)
+  assert_equal(sorted([tag for (tag, _, _) in seqs]), ["seq-%i" % i for i in range(5)])
+
+
+def test_ChunkShuffleDataset():
+  from returnn.datasets.meta import ChunkShuffleDataset
+  for opts in [{"chunk_shuffle_cache": 5}, {"chunk_shuffle_cache": None, "chunk_shuffle_max_bytes": 2000}]:
+    dataset = ChunkShuffleDataset(
+      dataset={
+        "class": "DummyDataset", "input_dim": 2, "output_dim": 3, "num_seqs": 4, "seq_len": 20,
+        "chunking": "10:10"},
+      **opts)
+    dataset.initialize()
+    seqs = _iterate_dataset_seqs(dataset)
+    tags = [tag for (tag, _, _) in seqs]
+    print(opts, "tags:", tags)
+    assert_equal(len(seqs), 8)
+    assert_equal(len(set(tags)), 8)
+    for _, data, classes in seqs:
+      assert_equal(data.shape, (10, 2))
+      assert_equal(classes.shape, (10,))
+
+
+def test_NumpyDumpDataset_packed_file():
+  import tempfile
+  import shutil
+  from returnn.datasets.numpy_dump import NumpyDumpDataset, PackedSeqsWriter, PackedSeqsFile
+  tmp_dir = tempfile.mkdtemp()
+  try:
+    prefix = "%s/seq" % tmp_dir
+    rnd = np.random.RandomState(42)
+    writer = PackedSeqsWriter("%s/packed.data" % tmp_dir)
+    for seq_idx in range(5):
+      features = rnd.normal(size=(seq_idx + 3, 2))
+      targets = rnd.randint(0, 3, size=(seq_idx + 3,)).astype("float64")
+      np.savetxt("%s%i.data.txt" % (prefix, seq_idx), features)
+      np.savetxt("%s%i.targets.txt" % (prefix, seq_idx), targets)
+      writer.add_seq({"data": features, "classes": targets}, seq_tag="seq-%i" % seq_idx)
+    writer.close()
+    packed = PackedSeqsFile("%s/packed.data" % tmp_dir)
+    assert_equal(packed.num_seqs, 5)
+    assert_true(isinstance(packed.get_data(1, "data"), np.memmap))
+
+    kwargs = dict(num_inputs=2, num_outputs={"data": [2, 2], "classes": [3, 1]}, end_seq=5)
+    dataset1 = NumpyDumpDataset(prefix=prefix, postfix=".txt", **kwargs)
+    dataset2 = NumpyDumpDataset(packed_file="%s/packed.data" % tmp_dir, **kwargs)
+    for dataset in [dataset1, dataset2]:
+      dataset.initialize()
+      dataset.init_seq_order(epoch=1)
+    assert_equal(dataset1.num_seqs, dataset2.num_seqs)
+    dataset1.load_seqs(0, dataset1.num_seqs)
+    dataset2.load_seqs(0, dataset2.num_seqs)
+    for seq_idx in range(dataset1.num_seqs):
+      assert_equal(dataset1.get_seq_length(seq_idx), dataset2.get_seq_length(seq_idx))
+      for key in ["data", "classes"]:
+        np.testing.assert_almost_equal(dataset1.get_data(seq_idx, key), dataset2.get_data(seq_idx, key))
+  finally:
+    shutil.rmtree(tmp_dir)
+
+
+def test_get_batch_data():
+  from returnn.util.basic import slice_pad_zeros
+  dataset = _SequentialDataset(num_seqs=5)
+  dataset.initialize()
+  dataset.init_seq_order(epoch=1)
+  dataset.load_seqs(0, 5)
+  seq_idxs = [1, 2, 4]
+  starts = [NumbersDict(0), NumbersDict(-2), NumbersDict(1)]
+  ends = [NumbersDict(2), NumbersDict(3), NumbersDict(7)]
+  # Preallocated buffer with larger time dim and garbage content.
+  out = {"data": np.full((3, 10, 3), 42., dtype="float32"), "data_seq_lens": np.zeros((3,), dtype="int32")}
+  res = dataset.get_batch_data(
+    seq_idxs, keys=["data", "classes"], seq_start_frames=starts, seq_end_frames=ends, out=out)
+  assert res["data"] is out["data"]
+  assert_equal(res["data_seq_lens"].tolist(), [2, 5, 6])
+  assert_equal(res["classes"].shape, (3, 6))
+  for b, seq_idx in enumerate(seq_idxs):
+    for key in ["data", "classes"]:
+      v = slice_pad_zeros(dataset.get_data(seq_idx, key), begin=starts[b][key], end=ends[b][key])
+      np.testing.assert_array_equal(res[key][b, :v.shape[0]], v)
+      assert_true((res[key][b, v.shape[0]:] == 0).all())
+  res = dataset.get_batch_data(seq_idxs, keys=["data"])
+  assert_equal(res["data_seq_lens"].tolist(), [2, 3, 5])
+  np.testing.assert_array_equal(res["data"][1, :3], dataset.get_data(2, "data"))
+
+
+def test_generate_sorted_batches():
+  dataset = _SequentialDataset(num_seqs=10)
+  dataset.initialize()
+  dataset.init_seq_order(epoch=1)
+  batch_gen = dataset.generate_sorted_batches(batch_size=12, sort_window=4)
+  batches = []
+  while batch_gen.has_more():
+    batch, = batch_gen.peek_next_n(1)
+    # Like FeedDictDataProvider. This would fail if the seqs of the window were not kept loaded.
+    dataset.load_seqs(batch.load_start_seq, batch.end_seq)
+    for seq in batch.seqs:
+      assert_equal(dataset.get_data(seq.seq_idx, "data")[0, 0], seq.seq_idx)
+    batches.append([seq.seq_idx for seq in batch.seqs])
+    batch_gen.advance(1)
+  # Windows [0..3], [4..7], [8,9], each sorted longest first, max 12 padded frames per batch.
+  assert_equal(batches, [[3, 2, 1], [0], [7], [6], [5, 4], [9], [8]])
+  assert_equal(dataset.collected_seq_idxs, list(range(10)))
+
+
+def test_generate_batches_shards():
+  num_shards = 3
+  for sort_window in [0, 4]:
+    shards = []
+    for shard_index in range(num_shards):
+      dataset = _SequentialDataset(num_seqs=10)
+      dataset.initialize()
+      dataset.init_seq_order(epoch=1)
+      kwargs = dict(batch_size=12, num_shards=num_shards, shard_index=shard_index)
+      if sort_window:
+        batch_gen = dataset.generate_sorted_batches(sort_window=sort_window, **kwargs)
+      else:
+        batch_gen = dataset.generate_batches(recurrent_net=True, **kwargs)
+      seq_idxs = []
+      while batch_gen.has_more():
+        batch, = batch_gen.peek_next_n(1)
+        dataset.load_seqs(batch.load_start_seq, batch.end_seq)
+        seq_idxs.extend([seq.seq_idx for seq in batch.seqs])
+        batch_gen.advance(1)
+      assert_equal(sorted(seq_idxs), list(range(shard_index, 10, num_shards)))
+      shards.extend(seq_idxs)
+    assert_equal(sorted(shards), list(range(10)))
+
+
 if __name__ == "__main__":
   better_exchook.install()
   if len(sys.argv) <= 1:
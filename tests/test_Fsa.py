@@ -12,6 +12,7 @@ import datetime
 import unittest
 import time
 import numpy
+import numpy.testing
 import tensorflow as tf
 
 print("TF version:", tf.__version__)
@@ -346,6 +347,215 @@ def test_fast_bw_fsa_staircase():
   check_fast_bw_fsa_staircase(3, 3, with_loop=True)
 
 
+def _get_ctc_fsa_fast_bw_loop(targets, seq_lens, blank_idx):
+  """
+  Reference implementation of :func:`fsa_util.get_ctc_fsa_fast_bw`, via Python loops.
+
+  :param numpy.ndarray targets: shape (batch,time)
+  :param numpy.ndarray seq_lens: shape (batch)
+  :param int blank_idx:
+  :rtype: fsa_util.FastBaumWelchBatchFsa
+  """
+  n_batch, n_time = targets.shape
+  assert seq_lens.shape == (n_batch,)
+  edges = []  # list of (from,to,emission_idx,sequence_idx)
+  start_end_states = []  # list of (start,end), same len as batch
+  state_idx = 0
+  for batch_idx in range(n_batch):
+    initial_state_idx = state_idx
+    edges.append((state_idx, state_idx, blank_idx, batch_idx))  # initial blank loop
+    assert seq_lens[batch_idx] <= n_time
+    for i in range(seq_lens[batch_idx]):
+      label_idx = targets[batch_idx, i]
+      is_final_label = i == seq_lens[batch_idx] - 1
+      next_is_final_label = i == seq_lens[batch_idx] - 2
+      next_label_idx = None if is_final_label else targets[batch_idx, i + 1]
+      edges.append((state_idx, state_idx + 1, label_idx, batch_idx))  # label
+      if is_final_label:
+        # Case 1a: no blank at the end, exactly 1 label.
+        # Skip directly to final state (state_idx + 3).
+        edges.append((state_idx, state_idx + 3, label_idx, batch_idx))  # label
+      state_idx += 1
+      edges.append((state_idx, state_idx, label_idx, batch_idx))  # label loop
+      edges.append((state_idx, state_idx + 1, blank_idx, batch_idx))  # blank
+      if not is_final_label and label_idx != next_label_idx:
+        # Skip over blank is allowed in this case.
+        edges.append((state_idx, state_idx + 2, next_label_idx, batch_idx))  # next label
+        if next_is_final_label:
+          # We miss now the case of having: exactly one label, no blank.
+          # Skip directly to the final state (state_idx + 4).
+          edges.append((state_idx, state_idx + 4, next_label_idx, batch_idx))  # next label
+      if is_final_label:
+        # Case 1b: no blank at the end, 2 or more labels.
+        # Skip directly to final state (state_idx + 2).
+        edges.append((state_idx, state_idx + 2, label_idx, batch_idx))  # label
+        # Case 2: exactly one blank at the end, 1 or more labels.
+        # Skip directly to final state (state_idx + 2).
+        edges.append((state_idx, state_idx + 2, blank_idx, batch_idx))  # blank
+      state_idx += 1
+      edges.append((state_idx, state_idx, blank_idx, batch_idx))  # blank loop
+      if is_final_label:
+        # Case 3: 2 or more blank at the end, 1 or more labels.
+        # Go to final state (state_idx + 1).
+        edges.append((state_idx, state_idx + 1, blank_idx, batch_idx))  # blank
+        state_idx += 1  # this is the final state now
+    final_state_idx = state_idx
+    start_end_states.append((initial_state_idx, final_state_idx))
+    state_idx += 1
+  edges_np = numpy.array(edges).transpose()  # (4,n_edges)
+  start_end_states_np = numpy.array(start_end_states).transpose()  # (2,batch)
+  return fsa_util.FastBaumWelchBatchFsa(
+    edges=edges_np, weights=numpy.zeros((len(edges),), dtype="float32"),
+    start_end_states=start_end_states_np)
+
+
+def _fast_bw_fsa_staircase_loop(seq_lens, with_loop=False, max_skip=None, start_max_skip=None, end_max_skip=None):
+  """
+  Reference implementation of :func:`fsa_util.fast_bw_fsa_staircase`, via Python loops.
+  The emissions are indices [0, ..., seq_len - 1].
+
+  :param list[int]|numpy.ndarray seq_lens:
+  :param bool with_loop:
+  :param int|list[int] max_skip: per batch if a list
+  :param int|list[int] start_max_skip: per batch if a list
+  :param int|list[int] end_max_skip: per batch if a list
+  :rtype: fsa_util.FastBaumWelchBatchFsa
+  """
+  n_batch = len(seq_lens)
+  if not isinstance(max_skip, list):
+    max_skip = [max_skip] * n_batch
+  if not isinstance(start_max_skip, list):
+    start_max_skip = [start_max_skip] * n_batch
+  if not isinstance(end_max_skip, list):
+    end_max_skip = [end_max_skip] * n_batch
+  # numpy.ndarray edges: (4,num_edges), edges of the graph (from,to,emission_idx,sequence_idx)
+  # numpy.ndarray weights: (num_edges,), weights of the edges
+  # numpy.ndarray start_end_states: (2, batch), (start,end) state idx in automaton.
+  state_idx = 0
+  edges = []
+  start_end_states = []
+  for batch in range(n_batch):
+    seq_len = seq_lens[batch]
+    assert seq_len > 0
+    start_state_idx = state_idx
+    # Conventions:
+    # * create seq_len + 1 states
+    # * state 't': all outgoing edges have emission 't'
+    # * state t=0 is initial/first; state t=seq_len is final.
+    # * need extra handling for first:
+    #   - all outgoing edges can have emissions up to the skip-len
+    for i in range(seq_len):
+      cur_state_idx = state_idx
+      cur_max_skip = None
+      if not cur_max_skip and i == 0:
+        cur_max_skip = start_max_skip[batch]
+      if not cur_max_skip and end_max_skip[batch] and i + end_max_skip[batch] >= seq_len:
+        cur_max_skip = end_max_skip[batch]
+      if not cur_max_skip:
+        cur_max_skip = max_skip[batch]
+      j_max = seq_len
+      if cur_max_skip:
+        j_max = min(j_max, i + cur_max_skip)
+      if with_loop:
+        emission_idx = i
+        target_state_idx = cur_state_idx
+        edges += [(cur_state_idx, target_state_idx, emission_idx, batch)]
+      for j in range(i + 1, j_max + 1):
+        target_state_idx = cur_state_idx + j - i
+        if i > 0:
+          emission_idx = i
+          edges += [(cur_state_idx, target_state_idx, emission_idx, batch)]
+        else:  # see comment above. extra rule for first state
+          for t in range(i, j):
+            if with_loop and i == t and j < seq_len:
+              continue
+            emission_idx = t
+            edges += [(cur_state_idx, target_state_idx, emission_idx, batch)]
+          if with_loop and j < seq_len:
+            emission_idx = j
+            edges += [(cur_state_idx, target_state_idx, emission_idx, batch)]
+      state_idx += 1
+    end_state_idx = state_idx
+    start_end_states += [(start_state_idx, end_state_idx)]
+    state_idx += 1
+  weights = [0.0] * len(edges)
+  return fsa_util.FastBaumWelchBatchFsa(
+    edges=numpy.array(edges).transpose(),
+    weights=numpy.array(weights),
+    start_end_states=numpy.array(start_end_states).transpose())
+
+
+def _check_fast_bw_fsa_equal(fsa, ref):
+  """
+  :param fsa_util.FastBaumWelchBatchFsa fsa:
+  :param fsa_util.FastBaumWelchBatchFsa ref:
+  """
+  numpy.testing.assert_array_equal(fsa.edges, ref.edges)
+  numpy.testing.assert_array_equal(fsa.weights, ref.weights)
+  numpy.testing.assert_array_equal(fsa.start_end_states, ref.start_end_states)
+
+
+def test_get_ctc_fsa_fast_bw_same_as_loop():
+  rnd = numpy.random.RandomState(42)
+  for _ in range(100):
+    n_batch, n_time = rnd.randint(1, 6), rnd.randint(1, 9)
+    seq_lens = rnd.randint(0, n_time + 1, size=(n_batch,))
+    targets = rnd.randint(0, 3, size=(n_batch, n_time))
+    _check_fast_bw_fsa_equal(
+      fsa_util.get_ctc_fsa_fast_bw(targets=targets, seq_lens=seq_lens, blank_idx=3),
+      _get_ctc_fsa_fast_bw_loop(targets=targets, seq_lens=seq_lens, blank_idx=3))
+
+
+def test_fast_bw_fsa_staircase_same_as_loop():
+  rnd = numpy.random.RandomState(42)
+  for _ in range(100):
+    n_batch = rnd.randint(1, 6)
+    seq_lens = [int(x) for x in rnd.randint(1, 8, size=(n_batch,))]
+    opts = {}
+    for key in ["max_skip", "start_max_skip", "end_max_skip"]:
+      choice = rnd.randint(0, 3)
+      if choice == 1:
+        opts[key] = int(rnd.randint(1, 5))
+      elif choice == 2:
+        opts[key] = [int(x) or None for x in rnd.randint(0, 5, size=(n_batch,))]
+    for with_loop in [False, True]:
+      _check_fast_bw_fsa_equal(
+        fsa_util.fast_bw_fsa_staircase(seq_lens, with_loop=with_loop, **opts),
+        _fast_bw_fsa_staircase_loop(seq_lens, with_loop=with_loop, **opts))
+
+
+def test_FastBwFsaShared_get_fast_bw_fsa():
+  fsa = fsa_util.FastBwFsaShared()
+  fsa.add_inf_loop(state_idx=0, num_emission_labels=2)
+  fsa.add_edge(source_state_idx=0, target_state_idx=1, emission_idx=1, weight=0.5)
+  fast_bw_fsa = fsa.get_fast_bw_fsa(n_batch=2)
+  numpy.testing.assert_array_equal(
+    fast_bw_fsa.edges, [[0, 0, 0, 2, 2, 2], [0, 0, 1, 2, 2, 3], [0, 1, 1, 0, 1, 1], [0, 0, 0, 1, 1, 1]])
+  numpy.testing.assert_array_equal(fast_bw_fsa.weights, [0., 0., 0.5, 0., 0., 0.5])
+  numpy.testing.assert_array_equal(fast_bw_fsa.start_end_states, [[0, 2], [1, 3]])
+
+
+def test_fast_bw_fsa_builders_benchmark():
+  # Microbenchmark of the vectorized builders against the reference loop implementations.
+  # The builders run in tf.py_func in every training step (e.g. CTC via fast Baum-Welch).
+  import timeit
+  rnd = numpy.random.RandomState(42)
+  n_batch, n_time = 32, 50
+  seq_lens = rnd.randint(n_time // 2, n_time + 1, size=(n_batch,))
+  targets = rnd.randint(0, 50, size=(n_batch, n_time))
+  for name, func, ref_func, kwargs in [
+        ("ctc", fsa_util.get_ctc_fsa_fast_bw, _get_ctc_fsa_fast_bw_loop,
+         dict(targets=targets, seq_lens=seq_lens, blank_idx=50)),
+        ("staircase", fsa_util.fast_bw_fsa_staircase, _fast_bw_fsa_staircase_loop,
+         dict(seq_lens=list(seq_lens), with_loop=True, max_skip=3))]:
+    _check_fast_bw_fsa_equal(func(**kwargs), ref_func(**kwargs))
+    number = 10
+    t = timeit.timeit(lambda: func(**kwargs), number=number) / number
+    t_ref = timeit.timeit(lambda: ref_func(**kwargs), number=number) / number
+    print("%s, batch %i, time %i: vectorized %.3f ms, loop %.3f ms, speedup %.1fx" % (
+      name, n_batch, n_time, t * 1000., t_ref * 1000., t_ref / t))
+
+
 if __name__ == "__main__":
   from returnn.util import better_exchook
   better_exchook.install()
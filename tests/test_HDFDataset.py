@@ -433,6 +433,74 @@ def test_SimpleHDFWriter_extend_existing_file():
     assert reader.seq_lens[i]["data"] == seq_len
 
 
+def test_SimpleHDFWriter_no_tmp_file_resume():
+  fn = get_test_tmp_file(suffix=".hdf")
+  os.remove(fn)  # SimpleHDFWriter expects that the file does not exist
+  n_dim = 3
+  rnd = numpy.random.RandomState(42)
+  seq_lens = [2, 3, 1, 4, 2]
+  data = [rnd.normal(size=(seq_len, n_dim)).astype("float32") for seq_len in seq_lens]
+
+  def insert(writer_, seq_idxs):
+    """
+    :param SimpleHDFWriter writer_:
+    :param list[int] seq_idxs:
+    """
+    inputs = numpy.zeros((len(seq_idxs), max([seq_lens[i] for i in seq_idxs]), n_dim), dtype="float32")
+    for b, i in enumerate(seq_idxs):
+      inputs[b, :seq_lens[i]] = data[i]
+    writer_.insert_batch(
+      inputs=inputs, seq_len=[seq_lens[i] for i in seq_idxs], seq_tag=["seq-%i" % i for i in seq_idxs])
+
+  writer = SimpleHDFWriter(filename=fn, dim=n_dim, labels=None, use_tmp_file=False)
+  insert(writer, [0, 1])
+  insert(writer, [2])
+  # Interrupted, without close().
+  del writer
+
+  writer = SimpleHDFWriter(filename=fn, dim=n_dim, labels=None, extend_existing_file=True, use_tmp_file=False)
+  assert_equal(writer.get_seq_tags(), ["seq-0", "seq-1", "seq-2"])
+  insert(writer, [3, 4])
+  writer.close()
+
+  dataset = HDFDataset(files=[fn])
+  reader = DatasetTestReader(dataset=dataset)
+  reader.read_all()
+  assert_equal(reader.num_seqs, len(seq_lens))
+  for i, seq_len in enumerate(seq_lens):
+    assert_equal(reader.seq_lens[i]["data"], seq_len)
+    numpy.testing.assert_array_equal(reader.data["data"][i], data[i])
+
+
+def test_merge_simple_hdf_files():
+  n_dim = 3
+  num_shards = 2
+  rnd = numpy.random.RandomState(42)
+  seq_lens = [2, 3, 1, 4, 2]
+  data = [rnd.normal(size=(seq_len, n_dim)).astype("float32") for seq_len in seq_lens]
+  shard_fns = []
+  for shard_idx in range(num_shards):
+    fn = get_test_tmp_file(suffix=".hdf")
+    os.remove(fn)  # SimpleHDFWriter expects that the file does not exist
+    shard_fns.append(fn)
+    writer = SimpleHDFWriter(filename=fn, dim=n_dim, labels=None)
+    for i in range(shard_idx, len(seq_lens), num_shards):
+      writer.insert_batch(inputs=data[i][None], seq_len=[seq_lens[i]], seq_tag=["seq-%i" % i])
+    writer.close()
+  fn = get_test_tmp_file(suffix=".hdf")
+  os.remove(fn)
+  merge_simple_hdf_files(shard_fns, fn, interleave=True)
+
+  dataset = HDFDataset(files=[fn])
+  reader = DatasetTestReader(dataset=dataset)
+  reader.read_all()
+  assert_equal(reader.num_seqs, len(seq_lens))
+  assert_equal(reader.seq_tags, ["seq-%i" % i for i in range(len(seq_lens))])
+  for i, seq_len in enumerate(seq_lens):
+    assert_equal(reader.seq_lens[i]["data"], seq_len)
+    numpy.testing.assert_array_equal(reader.data["data"][i], data[i])
+
+
 @unittest.skip("unfinished...")
 def test_SimpleHDFWriter_swmr():
   fn = get_test_tmp_file(suffix=".hdf")
@@ -556,6 +624,28 @@ def test_hdf_no_cache_iter():
   assert not dataset._preload_seqs.was_called
 
 
+def test_HDFDataset_get_batch_data():
+  hdf_fn = generate_hdf_from_dummy()
+  dataset = HDFDataset(files=[hdf_fn])
+  dataset.initialize()
+  assert dataset.cache_byte_size_total_limit == 0
+  dataset.init_seq_order(epoch=1)
+  dataset.load_seqs(0, 5)
+  seq_idxs = [0, 2, 4]
+  starts = [util.NumbersDict(0), util.NumbersDict(-3), util.NumbersDict(5)]
+  ends = [util.NumbersDict(17), util.NumbersDict(10), util.NumbersDict(20)]
+  out = {"data": np.full((3, 20, 13), 42., dtype="float32")}
+  res = dataset.get_batch_data(
+    seq_idxs, keys=["data", "classes"], seq_start_frames=starts, seq_end_frames=ends, out=out)
+  assert res["data"] is out["data"]
+  assert_equal(res["data_seq_lens"].tolist(), [17, 13, 15])
+  for b, seq_idx in enumerate(seq_idxs):
+    for key in ["data", "classes"]:
+      v = util.slice_pad_zeros(dataset.get_data(seq_idx, key), begin=starts[b][key], end=ends[b][key])
+      np.testing.assert_array_equal(res[key][b, :v.shape[0]], v)
+      assert (res[key][b, v.shape[0]:] == 0).all()
+
+
 def test_hdf_data_short_int_dtype():
   from returnn.datasets.generating import StaticDataset
   dataset = StaticDataset([
@@ -752,6 +842,56 @@ def test_siamese_collect_single_seq():
   print("Done.")
 
 
+def test_NormalizationData_createNormalizationFile():
+  from returnn.datasets.normalization_data import NormalizationData
+  rnd = np.random.RandomState(42)
+  all_inputs = []
+  hdf_fns = []
+  for i in range(3):
+    fn = get_test_tmp_file()
+    with h5py.File(fn, "w") as f:
+      group = f.create_group(NormalizationData.GROUP_INPUTS)
+      for j in range(2):
+        data = rnd.normal(loc=5., scale=2., size=(rnd.randint(10, 50), 4)).astype("float32")
+        group.create_dataset("seq-%i" % j, data=data)
+        all_inputs.append(data)
+    hdf_fns.append(fn)
+  bundle_fn = get_test_tmp_file(suffix=".bundle")
+  with open(bundle_fn, "w") as f:
+    f.write("\n".join(hdf_fns) + "\n")
+  all_inputs = np.concatenate(all_inputs, axis=0).astype("float64")
+  for num_workers in [1, 2]:
+    norm_fn = get_test_tmp_file()
+    os.remove(norm_fn)
+    NormalizationData.createNormalizationFile(bundle_fn, norm_fn, num_workers=num_workers, chunk_size=7)
+    with h5py.File(norm_fn, "r") as f:
+      group = f[NormalizationData.GROUP_INPUTS]
+      np.testing.assert_allclose(group[NormalizationData.DATASET_MEAN][...], np.mean(all_inputs, axis=0))
+      np.testing.assert_allclose(
+        group[NormalizationData.DATASET_MEAN_OF_SQUARES][...], np.mean(np.square(all_inputs), axis=0))
+      np.testing.assert_allclose(group[NormalizationData.DATASET_VARIANCE][...], np.var(all_inputs, axis=0))
+      assert_equal(group[NormalizationData.DATASET_TOTAL_FRAMES][()], all_inputs.shape[0])
+      assert NormalizationData.GROUP_OUTPUTS in f
+    norm_data = NormalizationData(norm_fn)
+    np.testing.assert_allclose(norm_data.inputMean, np.mean(all_inputs, axis=0))
+    assert norm_data.outputMean is None
+
+
+def test_collect_dataset_stats():
+  from returnn.datasets.normalization_data import collect_dataset_stats
+  from returnn.datasets.generating import DummyDataset
+  dataset = DummyDataset(input_dim=3, output_dim=2, num_seqs=7, seq_len=5)
+  dataset.initialize()
+  dataset.init_seq_order(epoch=1)
+  dataset.load_seqs(0, 7)
+  all_data = np.concatenate([dataset.get_data(i, "data") for i in range(7)], axis=0)
+  for num_workers in [1, 3]:
+    stats = collect_dataset_stats(dataset, num_workers=num_workers)
+    assert_equal(stats.num_seqs, 7)
+    np.testing.assert_allclose(stats.get_mean(), np.mean(all_data, axis=0), rtol=1e-5)
+    np.testing.assert_allclose(stats.get_std_dev(), np.std(all_data, axis=0), rtol=1e-5)
+
+
 if __name__ == "__main__":
   better_exchook.install()
   if len(sys.argv) <= 1:
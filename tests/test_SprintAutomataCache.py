@@ -0,0 +1,154 @@
+
+from __future__ import print_function
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+import _setup_test_env  # noqa
+import numpy
+from numpy.testing import assert_array_equal
+from nose.tools import assert_equal, assert_is_none
+from returnn.sprint.automata_cache import SprintAutomataCache
+from returnn.util import better_exchook
+
+
+def _make_automaton(num_states, num_edges, seed):
+  """
+  :param int num_states:
+  :param int num_edges:
+  :param int seed:
+  :rtype: (int,numpy.ndarray,numpy.ndarray)
+  """
+  rnd = numpy.random.RandomState(seed)
+  edges = numpy.stack([
+    rnd.randint(0, num_states, size=num_edges),
+    rnd.randint(0, num_states, size=num_edges),
+    rnd.randint(0, 10, size=num_edges)]).astype("uint32")
+  weights = rnd.uniform(-1, 1, size=num_edges).astype("float32")
+  return num_states, edges, weights
+
+
+def _make_batch_automaton_loop(entries):
+  """
+  Reference implementation, like the former code in :func:`SprintInstancePool.get_automata_for_batch`.
+  """
+  all_edges = []
+  start_end_states = numpy.empty((2, len(entries)), dtype='uint32')
+  state_offset = 0
+  for idx, (num_states, edges, weights) in enumerate(entries):
+    edges = edges.copy()
+    edges[0:2, :] += state_offset
+    all_edges.append(numpy.vstack((edges, numpy.ones((1, edges.shape[1]), dtype='uint32') * idx)))
+    start_end_states[0, idx] = state_offset
+    start_end_states[1, idx] = state_offset + num_states - 1
+    state_offset += num_states
+  return numpy.hstack(all_edges), numpy.hstack([weights for (_, _, weights) in entries]), start_end_states
+
+
+def test_SprintAutomataCache_make_batch_automaton():
+  entries = [_make_automaton(num_states=5, num_edges=7, seed=1),
+             _make_automaton(num_states=3, num_edges=0, seed=2),
+             _make_automaton(num_states=11, num_edges=20, seed=3)]
+  edges, weights, start_end_states = SprintAutomataCache.make_batch_automaton(entries)
+  ref_edges, ref_weights, ref_start_end_states = _make_batch_automaton_loop(entries)
+  assert_equal(edges.dtype, numpy.uint32)
+  assert_equal(weights.dtype, numpy.float32)
+  assert_equal(start_end_states.dtype, numpy.uint32)
+  assert_array_equal(edges, ref_edges)
+  assert_array_equal(weights, ref_weights)
+  assert_array_equal(start_end_states, ref_start_end_states)
+  assert_array_equal(start_end_states, [[0, 5, 8], [4, 7, 18]])
+
+
+def test_SprintAutomataCache_memory_limit():
+  entry_bytes = 4 * 4 * 10  # edges (3,10) uint32 + weights (10,) float32
+  cache = SprintAutomataCache(config_hash="test", max_bytes=entry_bytes * 2)
+  for i in range(3):
+    cache.add("seq-%i" % i, *_make_automaton(num_states=4, num_edges=10, seed=i))
+  print(cache)
+  assert_is_none(cache.get("seq-0"))  # least recently used one was removed
+  num_states, edges, weights = cache.get("seq-1")
+  ref_num_states, ref_edges, ref_weights = _make_automaton(num_states=4, num_edges=10, seed=1)
+  assert_equal(num_states, ref_num_states)
+  assert_array_equal(edges, ref_edges)
+  assert_array_equal(weights, ref_weights)
+  cache.add("seq-3", *_make_automaton(num_states=4, num_edges=10, seed=3))
+  assert_is_none(cache.get("seq-2"))  # seq-1 was used more recently
+  assert cache.get("seq-1") is not None
+  assert cache.get("seq-3") is not None
+  assert_equal((cache.num_hits, cache.num_misses), (3, 2))
+
+
+def test_SprintAutomataCache_disk():
+  tmp_dir = tempfile.mkdtemp()
+  try:
+    config_hash = SprintAutomataCache.get_config_hash({"sprintExecPath": "sprint", "sprintConfigStr": "--foo"})
+    assert_equal(
+      config_hash, SprintAutomataCache.get_config_hash({"sprintConfigStr": "--foo", "sprintExecPath": "sprint"}))
+    cache = SprintAutomataCache(config_hash=config_hash, cache_dir=tmp_dir)
+    ref = _make_automaton(num_states=6, num_edges=13, seed=42)
+    cache.add("corpus/rec/1", *ref)
+    assert_equal(len(os.listdir(os.path.join(tmp_dir, config_hash))), 1)
+    # A new cache, e.g. in a new process, without any memory, but the same dir.
+    cache = SprintAutomataCache(config_hash=config_hash, max_bytes=0, cache_dir=tmp_dir)
+    assert_is_none(cache.get("corpus/rec/2"))
+    num_states, edges, weights = cache.get("corpus/rec/1")
+    assert_equal(num_states, ref[0])
+    assert_array_equal(edges, ref[1])
+    assert_equal(weights.dtype, numpy.float32)
+    assert_array_equal(weights, ref[2])
+    # Another Sprint config does not see this.
+    cache = SprintAutomataCache(config_hash="other", cache_dir=tmp_dir)
+    assert_is_none(cache.get("corpus/rec/1"))
+  finally:
+    shutil.rmtree(tmp_dir)
+
+
+def test_SprintAutomataCache_config_hash_referenced_files():
+  tmp_dir = tempfile.mkdtemp()
+  try:
+    with open(os.path.join(tmp_dir, "lexicon.xml"), "w") as f:
+      f.write("<lexicon/>\n")
+    with open(os.path.join(tmp_dir, "state-tying"), "w") as f:
+      f.write("a{#+#}.0 0\n")
+    with open(os.path.join(tmp_dir, "crnn.config"), "w") as f:
+      f.write("[*.model-combination.lexicon]\nfile = lexicon.xml  # relative to the config\n")
+    sprint_opts = {
+      "sprintExecPath": "sprint",
+      "sprintConfigStr": "--config=%s/crnn.config --*.state-tying.file=%s/state-tying" % (tmp_dir, tmp_dir)}
+    assert_equal(
+      SprintAutomataCache.get_referenced_files(sprint_opts),
+      [os.path.join(tmp_dir, fn) for fn in ["crnn.config", "lexicon.xml", "state-tying"]])
+    config_hash = SprintAutomataCache.get_config_hash(sprint_opts)
+    assert_equal(config_hash, SprintAutomataCache.get_config_hash(sprint_opts))
+    with open(os.path.join(tmp_dir, "lexicon.xml"), "w") as f:
+      f.write("<lexicon><lemma/></lexicon>\n")
+    assert config_hash != SprintAutomataCache.get_config_hash(sprint_opts)
+  finally:
+    shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+  better_exchook.install()
+  if len(sys.argv) <= 1:
+    for k, v in sorted(globals().items()):
+      if k.startswith("test_"):
+        print("-" * 40)
+        print("Executing: %s" % k)
+        try:
+          v()
+        except unittest.SkipTest as exc:
+          print("SkipTest:", exc)
+        print("-" * 40)
+    print("Finished all tests.")
+  else:
+    assert len(sys.argv) >= 2
+    for arg in sys.argv[1:]:
+      print("Executing: %s" % arg)
+      if arg in globals():
+        globals()[arg]()  # assume function and execute
+      else:
+        eval(arg)  # assume Python expression and execute
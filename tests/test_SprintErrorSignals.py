@@ -0,0 +1,167 @@
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+import unittest
+
+import _setup_test_env  # noqa
+import numpy
+from numpy.testing import assert_allclose, assert_array_equal
+from nose.tools import assert_equal, assert_less_equal
+from returnn.util.basic import BackendEngine
+from returnn.sprint.error_signals import SprintInstancePool, SprintException
+from returnn.util import better_exchook
+
+
+BackendEngine.select_engine(engine=BackendEngine.TensorFlow)
+sprintExecPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), "DummySprintExec.py")
+
+
+def _make_pool(**opts):
+  """
+  :param opts: sprint opts, for :class:`SprintInstancePool`
+  :rtype: SprintInstancePool
+  """
+  sprint_opts = dict(sprintExecPath=sprintExecPath, usePythonSegmentOrder=False)
+  sprint_opts.update(opts)
+  return SprintInstancePool(sprint_opts=sprint_opts)
+
+
+def _exit_pool(pool):
+  """
+  :param SprintInstancePool pool:
+  """
+  for instance in pool.instances:
+    # noinspection PyProtectedMember
+    instance._exit_child()
+
+
+def _make_log_posteriors(n_time, n_batch, n_dim, seed=1):
+  """
+  :rtype: numpy.ndarray
+  """
+  rnd = numpy.random.RandomState(seed)
+  x = rnd.randn(n_time, n_batch, n_dim).astype("float32")
+  return x - numpy.log(numpy.sum(numpy.exp(x), axis=-1, keepdims=True))
+
+
+def test_SprintInstancePool_get_batch_loss_and_error_signal():
+  seq_lengths = numpy.array([7, 13, 2, 11, 5], dtype="int32")
+  n_batch = len(seq_lengths)
+  log_posteriors = _make_log_posteriors(n_time=max(seq_lengths), n_batch=n_batch, n_dim=5)
+  tags = ["seq-%i" % b for b in range(n_batch)]
+  pool = _make_pool(numInstances=3)
+  try:
+    loss, error_signal = pool.get_batch_loss_and_error_signal(
+      log_posteriors=log_posteriors, seq_lengths=seq_lengths, tags=tags)
+    assert_less_equal(len(pool.instances), 3)
+  finally:
+    _exit_pool(pool)
+  assert_equal(loss.shape, (n_batch,))
+  assert_equal(error_signal.shape, log_posteriors.shape)
+  for b in range(n_batch):  # see DummySprintExec, CE w.r.t. label 0
+    seq_len = seq_lengths[b]
+    assert_allclose(loss[b], -numpy.sum(log_posteriors[:seq_len, b, 0]), rtol=1e-5)
+    assert_allclose(error_signal[:seq_len, b, 1:], numpy.exp(log_posteriors[:seq_len, b, 1:]), rtol=1e-5)
+    assert_allclose(error_signal[:seq_len, b, 0], numpy.exp(log_posteriors[:seq_len, b, 0]) - 1., rtol=1e-5)
+    assert_array_equal(error_signal[seq_len:, b], 0.)
+
+
+def test_SprintInstancePool_get_automata_for_batch():
+  pool = _make_pool(numInstances=2)
+  try:
+    edges, weights, start_end_states = pool.get_automata_for_batch([b"ab", b"c", b"ab"])
+    assert_equal(pool.automata_cache.num_misses, 3)
+    assert_equal(len(pool.automata_cache._cache), 2)
+    edges2, weights2, start_end_states2 = pool.get_automata_for_batch(["ab", "c", "ab"])
+    assert_equal(pool.automata_cache.num_hits, 3)
+  finally:
+    _exit_pool(pool)
+  # See DummySprintExec, linear chain with one state per char.
+  assert_array_equal(edges, [[0, 1, 3, 5, 6], [1, 2, 4, 6, 7], [97, 98, 99, 97, 98], [0, 0, 1, 2, 2]])
+  assert_array_equal(start_end_states, [[0, 3, 5], [2, 4, 7]])
+  assert_equal(weights.shape, (5,))
+  assert_array_equal(edges2, edges)
+  assert_array_equal(weights2, weights)
+  assert_array_equal(start_end_states2, start_end_states)
+
+
+def test_SprintInstancePool_sprint_exception():
+  pool = _make_pool(numInstances=1)
+  try:
+    pool.get_automata_for_batch(["ab"])
+    instance, = pool.instances
+    try:
+      pool.get_automata_for_batch(["unknown-seg"])
+    except SprintException as exc:
+      print("Expected exception: %s" % exc)
+      assert "unknown-seg" in str(exc)
+    else:
+      assert False, "expected SprintException"
+    # The instance is not broken, it is reused.
+    assert_equal(pool.instances, [instance])
+    edges, _, _ = pool.get_automata_for_batch(["c"])
+    assert_array_equal(edges, [[0], [1], [99], [0]])
+    assert_equal(pool.instances, [instance])
+  finally:
+    _exit_pool(pool)
+
+
+def test_SprintInstancePool_shrink():
+  seq_lengths = numpy.array([3, 4, 5, 6], dtype="int32")
+  log_posteriors = _make_log_posteriors(n_time=6, n_batch=4, n_dim=3)
+  pool = _make_pool(numInstances=3, minNumInstances=1, instanceIdleTimeout=0)
+  try:
+    pool.get_batch_loss_and_error_signal(
+      log_posteriors=log_posteriors, seq_lengths=seq_lengths, tags=["a", "b", "c", "d"])
+    assert_equal(len(pool.instances), 1)
+    pool.get_batch_loss_and_error_signal(
+      log_posteriors=log_posteriors[:, :1], seq_lengths=seq_lengths[:1], tags=["a"])
+    assert_equal(len(pool.instances), 1)
+  finally:
+    _exit_pool(pool)
+
+
+def test_SprintInstancePool_parallel_benchmark():
+  seq_lengths = numpy.array([50, 45, 40, 35, 30, 25, 20, 15], dtype="int32")
+  n_batch = len(seq_lengths)
+  log_posteriors = _make_log_posteriors(n_time=max(seq_lengths), n_batch=n_batch, n_dim=10)
+  tags = ["seq-%i" % b for b in range(n_batch)]
+  results = {}
+  for num_instances in [1, 4]:
+    pool = _make_pool(numInstances=num_instances, sprintConfigStr="--*.dummy-seconds-per-frame=0.002")
+    try:
+      pool.get_batch_loss_and_error_signal(log_posteriors=log_posteriors, seq_lengths=seq_lengths, tags=tags)
+      start_time = time.time()
+      results[num_instances] = pool.get_batch_loss_and_error_signal(
+        log_posteriors=log_posteriors, seq_lengths=seq_lengths, tags=tags)
+      print("num instances %i: %.3f secs" % (num_instances, time.time() - start_time))
+    finally:
+      _exit_pool(pool)
+  assert_allclose(results[4][0], results[1][0])
+  assert_allclose(results[4][1], results[1][1])
+
+
+if __name__ == "__main__":
+  better_exchook.install()
+  if len(sys.argv) <= 1:
+    for k, v in sorted(globals().items()):
+      if k.startswith("test_"):
+        print("-" * 40)
+        print("Executing: %s" % k)
+        try:
+          v()
+        except unittest.SkipTest as exc:
+          print("SkipTest:", exc)
+        print("-" * 40)
+    print("Finished all tests.")
+  else:
+    assert len(sys.argv) >= 2
+    for arg in sys.argv[1:]:
+      print("Executing: %s" % arg)
+      if arg in globals():
+        globals()[arg]()  # assume function and execute
+      else:
+        eval(arg)  # assume Python expression and execute
@@ -132,6 +132,48 @@ def test_FeedDictDataProvider():
   assert_equal(classes.tolist(), [[1, 2, 0, 1, 2]])
 
 
+def test_FeedDictDataProvider_buffer_pool_concat_seqs():
+  # Multiple seqs in one batch slice, i.e. not via Dataset.get_batch_data.
+  # The second batch reuses the buffers of the first batch, thus the padded tail must be zeroed.
+  from returnn.datasets.generating import DummyDataset
+  from returnn.tf.data_pipeline import FeedDictDataProvider, FeedDictBufferPool
+  from returnn.util.basic import NumbersDict
+  dataset = DummyDataset(input_dim=2, output_dim=3, num_seqs=2, seq_len=5)
+  dataset.init_seq_order(epoch=1)
+  extern_data = ExternData()
+  extern_data.init_from_dataset(dataset)
+
+  batch1 = Batch()
+  batch1.add_frames(seq_idx=0, seq_start_frame=0, length=NumbersDict(5))
+  batch1.add_frames(seq_idx=1, seq_start_frame=0, length=NumbersDict(3))
+  batch1.add_sequence_as_slice(seq_idx=1, seq_start_frame=0, length=NumbersDict(5))
+  batch2 = Batch()
+  batch2.add_frames(seq_idx=0, seq_start_frame=0, length=NumbersDict(2))
+  batch2.add_frames(seq_idx=1, seq_start_frame=0, length=NumbersDict(2))
+  batch2.add_sequence_as_slice(seq_idx=0, seq_start_frame=0, length=NumbersDict(3))
+  pool = FeedDictBufferPool(time_buckets=8)
+  data_provider = FeedDictDataProvider(
+    tf_session=session, extern_data=extern_data, data_keys=["data", "classes"],
+    dataset=dataset, batches=BatchSetGenerator(dataset, generator=iter([batch1, batch2])), buffer_pool=pool)
+
+  feed_dict, _ = data_provider.get_feed_dict(single_threaded=True)
+  assert_equal(feed_dict[extern_data.data["data"].placeholder].shape, (2, 8, 2))
+  data_provider.release_buffers()  # like after session.run()
+  data_provider.batches.advance(1)
+  feed_dict, _ = data_provider.get_feed_dict(single_threaded=True)
+  assert_equal(pool.num_hits, 4)  # data, classes and their seq lens
+  data = feed_dict[extern_data.data["data"].placeholder]
+  classes = feed_dict[extern_data.data["classes"].placeholder]
+  assert_equal(data.shape, (2, 4, 2))
+  assert_equal(list(feed_dict[extern_data.data["data"].size_placeholder[0]]), [4, 3])
+  dataset.load_seqs(0, 2)
+  numpy.testing.assert_almost_equal(data[0], numpy.concatenate(
+    [dataset.get_data(0, "data")[:2], dataset.get_data(1, "data")[:2]]))
+  numpy.testing.assert_almost_equal(data[1, :3], dataset.get_data(0, "data")[:3])
+  numpy.testing.assert_almost_equal(data[1, 3:], 0)
+  assert_equal(classes[1].tolist(), dataset.get_data(0, "classes")[:3].tolist() + [0])
+
+
 def test_DatasetDataProvider():
   from returnn.datasets.generating import DummyDataset
   seq_len = 5
@@ -226,6 +268,295 @@ def test_engine_train():
   engine.finalize()
 
 
+def test_engine_train_feed_dict_buffer_pool():
+  from returnn.datasets.generating import DummyDatasetMultipleSequenceLength
+  train_data = DummyDatasetMultipleSequenceLength(
+    input_dim=2, output_dim=3, num_seqs=10, seq_len={"data": 7, "classes": 7})
+  train_data.init_seq_order(epoch=1)
+
+  config = Config()
+  config.update({
+    "model": "%s/model" % _get_tmp_dir(),
+    "num_outputs": 3,
+    "num_inputs": 2,
+    "network": {"output": {"class": "softmax", "loss": "ce"}},
+    "feed_dict_buffer_pool": {"time_buckets": 4},
+    "max_seqs": 3,
+    "start_epoch": 1,
+    "num_epochs": 2
+  })
+  _cleanup_old_models(config)
+  engine = Engine(config=config)
+  engine.init_train_from_config(config=config, train_data=train_data)
+  pool = engine.feed_dict_buffer_pool
+  assert pool and pool.time_buckets == 4
+  engine.train()
+  # The buffers of the last batches are given back to the pool.
+  assert pool._free
+  for (key, _, shape), _ in pool._free.items():
+    if not key.endswith("_seq_lens"):
+      assert shape[1] % 4 == 0
+
+  engine.finalize()
+
+
+def test_engine_train_feed_dict_buffer_pool_seq_mask():
+  from returnn.datasets.generating import DummyDatasetMultipleSequenceLength
+  train_data = DummyDatasetMultipleSequenceLength(
+    input_dim=2, output_dim=3, num_seqs=10, seq_len={"data": 7, "classes": 7})
+  train_data.init_seq_order(epoch=1)
+
+  config = Config()
+  config.update({
+    "model": "%s/model" % _get_tmp_dir(),
+    "num_outputs": 3,
+    "num_inputs": 2,
+    "network": {
+      # The max over time uses the seq mask, which must match the time dim of the fed data.
+      "red": {"class": "reduce", "mode": "max", "axis": "T", "from": "data"},  # (B,D)
+      "comb": {"class": "combine", "kind": "add", "from": ["data", "red"]},  # (B,T,D)
+      "output": {"class": "softmax", "loss": "ce", "from": "comb"}},
+    "feed_dict_buffer_pool": {"time_buckets": 4},
+    "max_seqs": 3,
+    "start_epoch": 1,
+    "num_epochs": 1
+  })
+  _cleanup_old_models(config)
+  engine = Engine(config=config)
+  engine.init_train_from_config(config=config, train_data=train_data)
+  pool = engine.feed_dict_buffer_pool
+  engine.train()
+
+  # A single batch, e.g. for forwarding one seq. The buffers are given back after the run.
+  pool._free.clear()
+  pool._free_bytes = 0
+  train_data.init_seq_order(epoch=1)
+  out = engine.run_single(
+    dataset=train_data, seq_idx=0, output_dict={"red": engine.network.get_layer("red").output.placeholder})
+  data = train_data.get_data(0, "data")
+  numpy.testing.assert_almost_equal(out["red"], numpy.max(data, axis=0, keepdims=True))
+  assert pool._free
+  assert_equal(pool._free_bytes, sum([buf.nbytes for bufs in pool._free.values() for buf in bufs]))
+
+  engine.finalize()
+
+
+def test_engine_train_runner_pipelining():
+  from returnn.datasets.generating import DummyDataset
+  train_data = DummyDataset(input_dim=2, output_dim=3, num_seqs=10, seq_len=5)
+  cv_data = DummyDataset(input_dim=2, output_dim=3, num_seqs=4, seq_len=5)
+  score_results = {}  # pipelining -> epoch -> error key -> score
+  for pipelining in [False, True]:
+    config = Config()
+    config.update({
+      "model": "%s/model" % _get_tmp_dir(),
+      "num_outputs": 3,
+      "num_inputs": 2,
+      "network": {"output": {"class": "softmax", "loss": "ce"}},
+      "runner_pipelining": pipelining,
+      "feed_dict_buffer_pool": True,
+      "max_seqs": 2,
+      "adam": True,
+      "learning_rate": 0.01,
+      "start_epoch": 1,
+      "num_epochs": 2
+    })
+    _cleanup_old_models(config)
+    engine = Engine(config=config)
+    engine.init_train_from_config(config=config, train_data=train_data, dev_data=cv_data, eval_data=None)
+    engine.train()
+    score_results[pipelining] = {ep: d.error for (ep, d) in engine.learning_rate_control.epoch_data.items()}
+    engine.finalize()
+  pprint(score_results)
+  assert_equal(sorted(score_results[False].keys()), sorted(score_results[True].keys()))
+  for ep, error_dict in sorted(score_results[False].items()):
+    assert_equal(sorted(error_dict.keys()), sorted(score_results[True][ep].keys()))
+    for error_key, error_value in sorted(error_dict.items()):
+      numpy.testing.assert_almost_equal(error_value, score_results[True][ep][error_key])
+
+
+def test_engine_train_save_model_async():
+  from glob import glob
+  from returnn.datasets.generating import DummyDataset
+  train_data = DummyDataset(input_dim=2, output_dim=3, num_seqs=4, seq_len=5)
+  train_data.init_seq_order(epoch=1)
+  config = Config()
+  config.update({
+    "model": "%s/model" % _get_tmp_dir(),
+    "num_outputs": 3,
+    "num_inputs": 2,
+    "network": {"output": {"class": "softmax", "loss": "ce"}},
+    "save_model_async": True,
+    "adam": True,
+    "start_epoch": 1,
+    "num_epochs": 2
+  })
+  _cleanup_old_models(config)
+  engine = Engine(config=config)
+  engine.init_train_from_config(config=config, train_data=train_data)
+  engine.train()
+  assert engine._async_saver
+  params = engine.network.get_params_serialized(engine.tf_session).values_dict["output"]
+  engine.finalize()
+  model_filename = engine.get_epoch_model_filename(epoch=2)
+  assert not glob(model_filename + ".tmp-async-save*")
+  reader = tf_compat.v1.train.NewCheckpointReader(model_filename)
+  for param_name in ["W", "b"]:
+    numpy.testing.assert_array_equal(reader.get_tensor("output/" + param_name), params[param_name])
+  state = tf.train.get_checkpoint_state(os.path.dirname(model_filename))
+  assert_equal(state.model_checkpoint_path, os.path.abspath(model_filename))
+  assert_equal(len(state.all_model_checkpoint_paths), 2)
+
+
+def test_engine_train_step_timings():
+  import json
+  from glob import glob
+  from returnn.datasets.generating import DummyDataset
+  train_data = DummyDataset(input_dim=2, output_dim=3, num_seqs=4, seq_len=5)
+  train_data.init_seq_order(epoch=1)
+  tmp_dir = _get_tmp_dir()
+  config = Config()
+  config.update({
+    "model": "%s/model" % tmp_dir,
+    "num_outputs": 3,
+    "num_inputs": 2,
+    "network": {"output": {"class": "softmax", "loss": "ce"}},
+    "max_seqs": 2,
+    "start_epoch": 1,
+    "num_epochs": 2
+  })
+  engine = Engine(config=config)
+  engine.init_train_from_config(config=config, train_data=train_data)
+  engine.train()
+  engine.finalize()
+  fns = sorted(glob("%s/*/step-timings-ep*.jsonl" % tmp_dir))
+  assert_equal([os.path.basename(fn) for fn in fns], ["step-timings-ep001.jsonl", "step-timings-ep002.jsonl"])
+  for fn in fns:
+    with open(fn) as f:
+      lines = [json.loads(line) for line in f.read().splitlines()]
+    assert len(lines) >= 2
+    for i, d in enumerate(lines[:-1]):
+      assert_equal(d["step"], i)
+      assert_equal(set(d.keys()), {"step"} | set(StepTimingStats.phases))
+      assert d["session_run"] > 0
+    summary = lines[-1]["summary"]
+    assert "session_run" in summary and "feed_dict" in summary
+
+
+def test_MicroBatchQueue():
+  from returnn.tf.inference_server import MicroBatchQueue
+  batches = []
+
+  def process_batch(requests):
+    batches.append(len(requests))
+    return [{"output": request.features * 2} for request in requests]
+
+  queue = MicroBatchQueue(process_batch=process_batch, max_batch_size=3, max_batch_frames=12, max_wait_time=0.05)
+  requests = [queue.submit(numpy.arange(n)) for n in [2, 3, 4, 5, 1]]
+  assert_equal(queue.get_metrics()["queue_depth"], 5)
+  queue.start()
+  for n, request in zip([2, 3, 4, 5, 1], requests):
+    numpy.testing.assert_array_equal(request.wait(timeout=10)["output"], numpy.arange(n) * 2)
+  # 3 seqs max, and max len * num seqs <= 12 frames.
+  assert_equal(batches, [3, 2])
+  metrics = queue.get_metrics()
+  assert_equal(metrics["num_requests"], 5)
+  assert_equal(metrics["num_batches"], 2)
+  assert_equal(metrics["queue_depth"], 0)
+  queue.stop()
+
+
+def test_InferenceServer_12ax():
+  import json
+  from threading import Thread
+  from returnn.datasets.generating import StaticDataset
+  from returnn.tf.inference_server import InferenceServer
+  try:
+    # noinspection PyCompatibility
+    from urllib.request import urlopen, Request
+  except ImportError:
+    raise unittest.SkipTest("only Python 3 supported")
+  # Input/output dims as in the 12AX demo configs.
+  config = Config()
+  config.update({
+    "num_outputs": 2,
+    "num_inputs": 9,
+    "network": {"output": {"class": "softmax", "loss": "ce", "from": "data"}}
+  })
+  engine = Engine(config=config)
+  engine.start_epoch = 1
+  engine.use_search_flag = True
+  engine.init_network_from_config(config)
+  server = InferenceServer(engine=engine, port=0, max_batch_size=8, max_wait_time=0.5)
+  server_thread = Thread(target=server.serve_forever)
+  server_thread.daemon = True
+  server_thread.start()
+  rnd = numpy.random.RandomState(42)
+  inputs = [rnd.uniform(size=(n, 9)).astype("float32") for n in [3, 7, 5, 1]]
+  results = {}
+
+  def send(i):
+    req = Request(
+      "http://localhost:%i/" % server.port, data=json.dumps({"data": inputs[i].tolist()}).encode("utf8"),
+      headers={"Content-Type": "application/json"})
+    results[i] = json.loads(urlopen(req, timeout=30).read().decode("utf8"))
+
+  try:
+    threads = [Thread(target=send, args=(i,)) for i in range(len(inputs))]
+    for t in threads:
+      t.start()
+    for t in threads:
+      t.join()
+    metrics = json.loads(urlopen("http://localhost:%i/metrics" % server.port, timeout=30).read().decode("utf8"))
+  finally:
+    server.shutdown()
+    server_thread.join()
+  print("metrics:", metrics)
+  assert_equal(metrics["num_requests"], len(inputs))
+  assert metrics["num_batches"] < len(inputs)
+  for i, x in enumerate(inputs):
+    dataset = StaticDataset(
+      data=[{"data": x, "classes": numpy.zeros((0,), dtype="int32")}], output_dim=server.num_outputs)
+    dataset.init_seq_order(epoch=1)
+    expected = engine.run_single(dataset=dataset, seq_idx=0, output_dict={"output": server.output_t})["output"][0]
+    assert_equal(results[i]["seq_len"], len(x))
+    numpy.testing.assert_allclose(numpy.array(results[i]["output"]), expected[:len(x)], rtol=1e-5)
+  engine.finalize()
+
+
+def test_InferenceServer_process_batch_beam_no_time_axis():
+  from returnn.tf.util.data import Data
+  from returnn.tf.inference_server import InferenceServer, InferenceRequest
+  beam_size = 3
+
+  class _DummyEngine:
+    # noinspection PyUnusedLocal
+    @staticmethod
+    def run_single(dataset, seq_idx, output_dict):
+      assert output_dict["seq_lens"] is None
+      return {
+        "output": numpy.arange(dataset.num_seqs * beam_size * 2).reshape((dataset.num_seqs * beam_size, 2)),
+        "seq_lens": None, "beam_scores": -numpy.ones((dataset.num_seqs, beam_size))}
+
+  # Without the network construction and the HTTP server.
+  server = InferenceServer.__new__(InferenceServer)
+  server.engine = _DummyEngine()
+  server.input_data = Data(name="data", shape=(None, 2))
+  server.output_data = Data(name="classes", shape=(2,))
+  server.num_outputs = {"data": (2, 2), "classes": (2, 1)}
+  server.output_t = server.output_seq_lens_t = server.output_layer_beam_scores_t = None
+  server.out_beam_size = beam_size
+  # noinspection PyProtectedMember
+  results = server._process_batch([
+    InferenceRequest(numpy.zeros((n, 2), dtype="float32"), num_frames=n) for n in [2, 5]])
+  assert_equal(len(results), 2)
+  for b, result in enumerate(results):
+    assert "seq_len" not in result
+    assert_equal(len(result["output"]), beam_size)
+    assert_equal(result["output"][0].tolist(), [b * beam_size * 2, b * beam_size * 2 + 1])
+    assert_equal(result["beam_scores"], [-1.0] * beam_size)
+
+
 def test_engine_train_newbob():
   from returnn.datasets.generating import DummyDataset
   seq_len = 5
@@ -688,6 +1019,50 @@ def test_engine_forward_to_hdf():
   os.remove(output_file)
 
 
+def test_engine_forward_to_hdf_resume():
+  from returnn.datasets.generating import DummyDataset
+  from returnn.datasets.hdf import SimpleHDFWriter, HDFDataset
+  import tempfile
+  output_file = tempfile.mktemp(suffix=".hdf", prefix="nose-tf-forward")
+  seq_len = 5
+  n_classes_dim = 3
+  num_seqs = 20
+  dataset = DummyDataset(input_dim=2, output_dim=n_classes_dim, num_seqs=num_seqs, seq_len=seq_len)
+  dataset.init_seq_order(epoch=1)
+
+  # Output of an interrupted run, which has written the first seqs.
+  num_seqs_written = 7
+  writer = SimpleHDFWriter(filename=output_file, dim=n_classes_dim, use_tmp_file=False)
+  writer.insert_batch(
+    inputs=numpy.full((num_seqs_written, seq_len, n_classes_dim), -1., dtype="float32"),
+    seq_len=[seq_len] * num_seqs_written, seq_tag=["seq-%i" % i for i in range(num_seqs_written)])
+  del writer
+
+  config = Config()
+  config.update({
+    "model": "%s/model" % _get_tmp_dir(),
+    "num_outputs": n_classes_dim,
+    "num_inputs": 2,
+    "network": {"output": {"class": "softmax", "loss": "ce"}},
+    "forward_resume": True,
+  })
+  _cleanup_old_models(config)
+  engine = Engine(config=config)
+  engine.init_train_from_config(config=config, train_data=dataset)
+  engine.forward_to_hdf(data=dataset, output_file=output_file, batch_size=5)
+  engine.finalize()
+
+  ds = HDFDataset(files=[output_file])
+  ds.init_seq_order(epoch=1)
+  assert_equal(ds.num_seqs, num_seqs)
+  ds.load_seqs(0, num_seqs)
+  for seq_idx in range(num_seqs):
+    assert_equal(ds.get_tag(seq_idx), "seq-%i" % seq_idx)
+    # The seqs from the interrupted run are kept, and the others are the softmax output.
+    assert_equal(bool((ds.get_data(seq_idx, "data") < 0).all()), seq_idx < num_seqs_written)
+  os.remove(output_file)
+
+
 def test_engine_rec_subnet_count():
   from returnn.datasets.generating import DummyDataset
   seq_len = 5
@@ -871,6 +1246,265 @@ def test_engine_search():
   check_engine_search()
 
 
+def _get_search_12ax_engine(extra_config=None):
+  """
+  :param dict[str]|None extra_config:
+  :return: engine with a random network for search, and a dataset which can serialize the search output
+  :rtype: (Engine,returnn.datasets.generating.Task12AXDataset)
+  """
+  from returnn.datasets.generating import Task12AXDataset
+  dataset = Task12AXDataset(num_seqs=20)
+  dataset.labels["classes"] = ["0", "1"]  # such that we can serialize the search output
+  config = Config()
+  config.update({
+    "model": "%s/model" % _get_tmp_dir(),
+    "batch_size": 100,
+    "max_seqs": 5,
+    "num_outputs": dataset.num_outputs,
+    "num_inputs": dataset.num_inputs,
+    "network": {
+      "lstm": {"class": "rec", "unit": "BasicLSTM", "from": "data", "n_out": 5},
+      "output": {
+        "class": "rec", "from": "lstm", "target": "classes",
+        "unit": {
+          "prev_embed": {"class": "linear", "activation": None, "from": "prev:output", "n_out": 3},
+          "prob": {"class": "softmax", "from": ["data:source", "prev_embed"], "target": "classes", "loss": "ce"},
+          "output": {"class": "choice", "beam_size": 3, "from": "prob", "target": "classes", "initial_output": 0}
+        }},
+      "decision": {"class": "decide", "from": "output", "target": "classes", "is_output_layer": True}
+    }
+  })
+  if extra_config:
+    config.update(extra_config)
+  _cleanup_old_models(config)
+  engine = Engine(config=config)
+  engine.start_epoch = 1
+  engine.use_dynamic_train_flag = False
+  engine.use_search_flag = True
+  engine.init_network_from_config(config)
+  return engine, dataset
+
+
+def test_engine_search_sort_window():
+  engine, dataset = _get_search_12ax_engine()
+  output_files = []
+  for sort_window in [0, 8]:
+    engine.config.set("search_sort_window", sort_window)
+    output_file = "%s/search-output-sort-window-%i.txt" % (_get_tmp_dir(), sort_window)
+    engine.search(dataset=dataset, do_eval=False, output_layer_names="decision", output_file=output_file)
+    output_files.append(output_file)
+  outputs = [open(fn).read().splitlines() for fn in output_files]
+  assert_equal(len(outputs[0]), dataset.num_seqs)
+  assert_equal(outputs[0], outputs[1])
+  dataset.init_seq_order(epoch=1)
+  dataset.load_seqs(0, dataset.num_seqs)
+  for seq_idx, line in enumerate(outputs[0]):
+    assert_equal(len(line), dataset.get_seq_length(seq_idx)["data"])
+  engine.finalize()
+
+
+def test_engine_search_output_jsonl_resume():
+  import json
+  engine, dataset = _get_search_12ax_engine()
+  output_file = "%s/search-output.jsonl" % _get_tmp_dir()
+  engine.search(
+    dataset=dataset, do_eval=False, output_layer_names="output", output_file=output_file, output_file_format="jsonl")
+  lines = open(output_file).read().splitlines()
+  assert_equal(len(lines), dataset.num_seqs)
+  outputs = {d["tag"]: d["output"] for d in map(json.loads, lines)}
+  assert_equal(set(outputs.keys()), {"seq-%i" % i for i in range(dataset.num_seqs)})
+  assert all(len(hyps) == 3 for hyps in outputs.values())  # beam
+
+  # Simulate an interrupted run, with an incomplete last line.
+  resume_output_file = "%s/search-output-resume.jsonl" % _get_tmp_dir()
+  with open(resume_output_file, "w") as f:
+    f.write("".join([line + "\n" for line in lines[:7]]) + lines[7][:10])
+  engine.search(
+    dataset=dataset, do_eval=False, output_layer_names="output", output_file=resume_output_file,
+    output_file_format="jsonl", output_file_resume=True)
+  resume_lines = open(resume_output_file).read().splitlines()
+  assert_equal(resume_lines[:7], lines[:7])
+  assert_equal(len(resume_lines), dataset.num_seqs)
+  resume_outputs = {d["tag"]: d["output"] for d in map(json.loads, resume_lines)}
+  assert_equal(resume_outputs, outputs)
+  engine.finalize()
+
+
+def test_engine_search_output_py_resume():
+  from returnn.engine.search_output import SearchOutputWriter
+  engine, dataset = _get_search_12ax_engine()
+  output_file = "%s/search-output.py" % _get_tmp_dir()
+  engine.config.set("search_sort_window", 8)  # finish the seqs in a different order than the seq idx
+  engine.search(
+    dataset=dataset, do_eval=False, output_layer_names="decision", output_file=output_file, output_file_format="py")
+  assert not os.path.exists("%s.unsorted.jsonl" % output_file)
+  text = open(output_file).read()
+  outputs = eval(text)
+  assert_equal(list(outputs.keys()), ["seq-%i" % i for i in range(dataset.num_seqs)])
+
+  # Simulate an interrupted run, which only wrote some of the seqs to the unsorted file.
+  resume_output_file = "%s/search-output-resume.py" % _get_tmp_dir()
+  writer = SearchOutputWriter(filename=resume_output_file, file_format="py")
+  for seq_idx in [5, 2, 11]:
+    writer.add(seq_idx=seq_idx, seq_tag="seq-%i" % seq_idx, output=outputs["seq-%i" % seq_idx])
+  writer._file.close()
+  assert not os.path.exists(resume_output_file)
+  engine.search(
+    dataset=dataset, do_eval=False, output_layer_names="decision", output_file=resume_output_file,
+    output_file_format="py", output_file_resume=True)
+  assert_equal(open(resume_output_file).read(), text)
+  engine.finalize()
+
+
+_sharded_task_12ax_config = """
+#!rnn.py
+
+def get_data():
+  from returnn.datasets.generating import Task12AXDataset
+  dataset = Task12AXDataset(num_seqs=20)
+  dataset.labels["classes"] = ["0", "1"]  # such that we can serialize the search output
+  return dataset
+
+use_tensorflow = True
+device = "cpu"
+log_verbosity = 3
+batch_size = 100
+max_seqs = 5
+num_outputs = {"classes": 2, "data": 9}
+num_inputs = 9
+train = "config:get_data()"
+search_data = "config:get_data()"
+search_do_eval = False
+search_output_layer = "decision"
+network = {
+  "lstm": {"class": "rec", "unit": "BasicLSTM", "from": "data", "n_out": 5},
+  "output": {
+    "class": "rec", "from": "lstm", "target": "classes",
+    "unit": {
+      "prev_embed": {"class": "linear", "activation": None, "from": "prev:output", "n_out": 3},
+      "prob": {"class": "softmax", "from": "prev_embed", "target": "classes", "loss": "ce"},
+      "output": {"class": "choice", "beam_size": 3, "from": "prob", "target": "classes", "initial_output": 0}
+    }},
+  "decision": {"class": "decide", "from": "output", "target": "classes", "is_output_layer": True},
+  "priors": {"class": "softmax", "from": "lstm", "n_out": 2, "is_output_layer": True}
+}
+"""
+
+
+def _run_rnn_sharded_task_12ax(task, *args):
+  """
+  Runs ``rnn.py`` with :data:`_sharded_task_12ax_config` and a fresh random model,
+  once in a single process, and once via ``task_num_workers`` with 2 workers (see :mod:`returnn.tf.sharded_tasks`).
+
+  :param str task: "search" or "compute_priors"
+  :param str args: further command line options
+  :return: output filename of the single process run, output filename of the sharded run
+  :rtype: (str,str)
+  """
+  from subprocess import check_call
+  from returnn.util.basic import returnn_root_dir
+  tmp_dir = _get_tmp_dir()
+  config_filename = "%s/config.py" % tmp_dir
+  with open(config_filename, "w") as f:
+    f.write(_sharded_task_12ax_config)
+  model_filename = "%s/model.001" % tmp_dir
+  rnn_py = [sys.executable, "%s/rnn.py" % returnn_root_dir, config_filename]
+  check_call(rnn_py + ["++task", "initialize_model", "++model", model_filename])
+  output_filenames = []
+  for num_workers in [1, 2]:
+    output_filename = "%s/output-%s-%i-workers.txt" % (tmp_dir, task, num_workers)
+    check_call(rnn_py + [
+      "++task", task, "++load", model_filename, "++task_num_workers", str(num_workers),
+      "++search_output_file" if task == "search" else "++output_file", output_filename] + list(args))
+    assert os.path.exists(output_filename)
+    assert not [fn for fn in os.listdir(tmp_dir) if ".shard-" in fn]
+    output_filenames.append(output_filename)
+  return output_filenames[0], output_filenames[1]
+
+
+def test_sharded_task_search():
+  single_output_file, sharded_output_file = _run_rnn_sharded_task_12ax("search", "++search_output_file_format", "py")
+  single_output = eval(open(single_output_file).read())
+  sharded_output = eval(open(sharded_output_file).read())
+  assert_equal(len(single_output), 20)
+  assert_equal(list(single_output.keys()), list(sharded_output.keys()))  # same order, see merge_search_output_shards
+  assert_equal(single_output, sharded_output)
+
+
+def test_sharded_task_compute_priors():
+  single_output_file, sharded_output_file = _run_rnn_sharded_task_12ax(
+    "compute_priors", "++forward_output_layer", "priors")
+  single_priors = numpy.loadtxt(single_output_file)
+  sharded_priors = numpy.loadtxt(sharded_output_file)
+  assert_equal(single_priors.shape, (2,))
+  numpy.testing.assert_allclose(sharded_priors, single_priors, rtol=1e-5)
+
+
+def test_engine_search_graph_cache():
+  from returnn.tf.graph_cache import CachedGraphNetwork
+  graph_cache_dir = "%s/graph-cache" % _get_tmp_dir()
+  engine, dataset = _get_search_12ax_engine(extra_config={"graph_cache_dir": graph_cache_dir})
+  assert isinstance(engine.network, TFNetwork)
+  assert_equal(len([fn for fn in os.listdir(graph_cache_dir) if fn.endswith(".json")]), 1)
+  model_filename = "%s/model-graph-cache" % _get_tmp_dir()
+  engine.network.save_params_to_file(model_filename, session=engine.tf_session)
+  output_files = []
+  for name in ["constructed", "imported"]:
+    if name == "imported":
+      engine.finalize()
+      # Same config, so now the graph is imported from the cache.
+      engine, dataset = _get_search_12ax_engine(extra_config={"graph_cache_dir": graph_cache_dir})
+      assert isinstance(engine.network, CachedGraphNetwork)
+      engine.network.load_params_from_file(model_filename, session=engine.tf_session)
+    output_file = "%s/search-output-graph-cache-%s.py" % (_get_tmp_dir(), name)
+    engine.search(
+      dataset=dataset, do_eval=True, output_layer_names="output", output_file=output_file, output_file_format="py")
+    output_files.append(output_file)
+  engine.finalize()
+  outputs = [eval(open(fn).read()) for fn in output_files]
+  assert_equal(len(outputs[0]), dataset.num_seqs)
+  for seq_tag, hyps in outputs[0].items():
+    assert_equal([hyp for (_, hyp) in outputs[1][seq_tag]], [hyp for (_, hyp) in hyps])
+    numpy.testing.assert_allclose([score for (score, _) in outputs[1][seq_tag]], [score for (score, _) in hyps])
+
+
+def test_engine_search_graph_cache_missing_op_library():
+  import json
+  from returnn.tf.graph_cache import CachedGraphNetwork
+  graph_cache_dir = "%s/graph-cache-missing-op-library" % _get_tmp_dir()
+  engine, dataset = _get_search_12ax_engine(extra_config={"graph_cache_dir": graph_cache_dir})
+  engine.finalize()
+  info_filenames = ["%s/%s" % (graph_cache_dir, fn) for fn in os.listdir(graph_cache_dir) if fn.endswith(".json")]
+  assert_equal(len(info_filenames), 1)
+  # Like a graph cache which is shared between nodes, where the op libraries were compiled into a local dir.
+  missing_op_library = "%s/not-existing-op-library.so" % _get_tmp_dir()
+  info = json.load(open(info_filenames[0]))
+  info["op_libraries"].append(missing_op_library)
+  with open(info_filenames[0], "w") as f:
+    json.dump(info, f)
+  # This is a cache miss now, so the network is constructed again, and the graph is stored again.
+  engine, dataset = _get_search_12ax_engine(extra_config={"graph_cache_dir": graph_cache_dir})
+  assert isinstance(engine.network, TFNetwork)
+  assert missing_op_library not in json.load(open(info_filenames[0]))["op_libraries"]
+  engine.finalize()
+  engine, dataset = _get_search_12ax_engine(extra_config={"graph_cache_dir": graph_cache_dir})
+  assert isinstance(engine.network, CachedGraphNetwork)
+  engine.finalize()
+
+
+def test_graph_cache_py_func_not_cacheable():
+  from returnn.tf.graph_cache import GraphCache
+  with make_scope():
+    config = Config({"extern_data": {"data": {"dim": 3}}})
+    network = TFNetwork(config=config, train_flag=False)
+    network.construct_from_dict({"output": {"class": "copy", "from": "data"}})
+    assert_equal(GraphCache.get_not_cacheable_reason(network), None)
+    tf_compat.v1.py_func(lambda x: x, [network.get_default_output_layer().output.placeholder], tf.float32)
+    reason = GraphCache.get_not_cacheable_reason(network)
+    print("Reason:", reason)
+    assert reason and "PyFunc" in reason
+
+
 def check_engine_search_attention(extra_rec_kwargs=None):
   """
   :param dict[str] extra_rec_kwargs:
@@ -2959,6 +3593,41 @@ def test_preload_from_files_ignore_missing():
 
 
 # Test `init_network_from_config` for eval when both `model_epoch_filename` and `preload_from_files` are not None.
+def test_CustomCheckpointLoader_load_now_grouped():
+  import tempfile
+  from returnn.tf.network import CustomCheckpointLoader
+  model_tmp_dir = tempfile.mkdtemp("tmp-checkpoint")
+  model_filename = model_tmp_dir + "/model"
+  config = Config({
+    "extern_data": {"data": {"dim": 3}},
+    "network": {
+      "l1": {"class": "linear", "activation": None, "n_out": 7, "bias_init": 1.0},
+      "l2": {"class": "linear", "activation": None, "n_out": 5, "from": "l1"},
+      "output": {"class": "linear", "activation": None, "n_out": 4, "from": "l2"}
+    }})
+  with make_scope() as session:
+    network = TFNetwork(config=config, train_flag=True)
+    network.construct_from_dict(config.typed_dict["network"])
+    network.initialize_params(session)
+    params_orig_dump = network.get_params_serialized(session)
+    network.save_params_to_file(filename=model_filename, session=session)
+
+  with make_scope() as session:
+    network = TFNetwork(config=config, train_flag=True)
+    network.construct_from_dict(config.typed_dict["network"])
+    network.initialize_params(session)
+    # Small max_group_bytes, to get multiple groups.
+    loader = CustomCheckpointLoader(
+      filename=model_filename, saveable_params=network.get_params_list(), num_threads=3, max_group_bytes=100)
+    loader.load_now(session=session)
+    assert_equal(set(loader.load_timings.keys()), {v.name for v in network.get_params_list()})
+    params_dump = network.get_params_serialized(session)
+    for layer_name in ["l1", "l2", "output"]:
+      for param_name in ["W", "b"]:
+        numpy.testing.assert_array_equal(
+          params_orig_dump.values_dict[layer_name][param_name], params_dump.values_dict[layer_name][param_name])
+
+
 def test_init_network_from_config_preload_from_files_eval():
   import tempfile
   model_tmp_dir = tempfile.mkdtemp("-tmp-checkpoint")
@@ -2892,6 +2892,41 @@ def test_next_edit_distance_reduce_optimal_completion():
   print()
 
 
+def test_next_edit_distance_reduce_many_labels():
+  # Covers the CPU code path which handles the labels which do not occur in b all at once.
+  rnd = numpy.random.RandomState(42)
+  n_batch = 12
+  n_a_max_len = 5
+  n_b_max_len = 9
+  num_classes = 50
+  blank_idx = 3
+  a_np = rnd.randint(0, 7, size=(n_batch, n_a_max_len), dtype="int32")
+  b_np = rnd.randint(0, 7, size=(n_batch, n_b_max_len), dtype="int32")
+  a_len_np = rnd.randint(0, n_a_max_len + 1, size=(n_batch,), dtype="int32")
+  b_len_np = rnd.randint(0, n_b_max_len + 1, size=(n_batch,), dtype="int32")
+  a_ended_np = rnd.randint(0, 2, size=(n_batch,)).astype("bool")
+  b = tf.constant(b_np)
+  b_len = tf.constant(b_len_np)
+  last_row = edit_distance_via_next_edit_distance_row(
+    tf.constant(a_np), tf.constant(a_len_np), b, b_len, full_row_output=True)
+  labels = tf.expand_dims(tf.range(num_classes), axis=0)  # (1,n_labels)
+  for optimal_completion in [False, True]:
+    res = next_edit_distance_reduce(
+      last_row, a=labels, a_n=tf.constant(a_len_np), a_ended=tf.constant(a_ended_np), b=b, b_len=b_len,
+      optimal_completion=optimal_completion, a_blank_idx=blank_idx)
+    next_rows = [
+      next_edit_distance_row(
+        last_row, a=tf.fill([n_batch], label), a_n=tf.constant(a_len_np),
+        a_ended=tf.constant(a_ended_np | (label == blank_idx)), b=b, b_len=b_len)
+      for label in range(num_classes)]
+    res_np, next_rows_np = session.run((res, next_rows))
+    assert_equal(res_np.shape, (n_batch, num_classes))
+    for i in range(n_batch):
+      for label in range(num_classes):
+        row = next_rows_np[label][i, :b_len_np[i] + 1]
+        assert_equal(res_np[i, label], min(row) if optimal_completion else row[-1])
+
+
 #@unittest.skipIf(not is_gpu_available(), "no gpu on this system")
 #@unittest.skipIf(is_gpu_available() and get_available_gpu_min_compute_capability() < 3.5, "too low compute capability")
 @unittest.skipIf(not have_blocksparse_requirements(), "do not have Blocksparse requirements")
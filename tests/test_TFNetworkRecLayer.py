@@ -8,7 +8,7 @@ import logging
 import tensorflow as tf
 import sys
 import os
-from nose.tools import assert_equal, assert_not_equal, assert_is_instance
+from nose.tools import assert_equal, assert_not_equal, assert_is_instance, assert_less, assert_raises
 from numpy.testing.utils import assert_almost_equal, assert_allclose
 import unittest
 import numpy.testing
@@ -3554,6 +3554,58 @@ def test_reclayer_optimize_out_masked_computation_unmask():
     })
 
 
+def test_reclayer_move_out_loop_invariant():
+  # With optimize_move_layers_out disabled, layers which only depend on the base network
+  # (here enc_ctx, a projection of the encoder) are still calculated only once, outside the loop.
+  # The encoder has the same time dim as the rec layer, but enc_ctx must not be unstacked per frame.
+  n_in, n_out, n_batch, n_time = 5, 7, 3, 4
+  rec_layer_dict = {
+    "class": "rec", "from": "data", "n_out": n_out, "is_output_layer": True,
+    "unit": {
+      "enc_ctx": {"class": "linear", "activation": "tanh", "from": "base:encoder", "n_out": 6},  # (B, enc-T, D)
+      "s": {"class": "linear", "activation": None, "with_bias": False, "from": "data:source", "n_out": 6},  # (B, D)
+      "energy": {"class": "dot", "red1": "F", "red2": "F", "var1": "T", "var2": "T?",
+                 "from": ["enc_ctx", "s"]},  # (B, enc-T)
+      "att_weights": {"class": "softmax_over_spatial", "from": "energy"},  # (B, enc-T)
+      "att": {"class": "generic_attention", "weights": "att_weights", "base": "base:encoder"},  # (B, n_in)
+      "output": {"class": "linear", "activation": None, "from": ["att", "data:source"], "n_out": n_out}}}
+  config = Config({"debug_print_layer_output_template": True, "num_inputs": n_in, "num_outputs": n_out})
+  from returnn.tf.layers.rec import _SubnetworkRecCell
+  with make_scope() as session:
+    nets = []
+    for optimize_loop_invariant in [True, False]:
+      net = TFNetwork(
+        config=config, extern_data=nets[0].extern_data if nets else None, train_flag=True,
+        name="<root_opt_%s>" % optimize_loop_invariant)
+      net.construct_from_dict({
+        "encoder": {"class": "copy", "from": "data"},
+        "output": dict(
+          rec_layer_dict, optimize_move_layers_out=False, optimize_loop_invariant=optimize_loop_invariant)})
+      nets.append(net)
+    cell = nets[1].layers["output"].cell
+    assert isinstance(cell, _SubnetworkRecCell)
+    assert_equal(cell.loop_invariant_layers_moved_out, [])
+    assert_equal(cell.input_layers_moved_out, [])
+    assert "enc_ctx" in cell.layers_in_loop
+    cell = nets[0].layers["output"].cell
+    assert isinstance(cell, _SubnetworkRecCell)
+    assert_equal(cell.loop_invariant_layers_moved_out, ["enc_ctx"])
+    assert_equal(cell.input_layers_moved_out, ["enc_ctx"])
+    assert_equal(cell.output_layers_moved_out, [])
+    assert "enc_ctx" not in cell.layers_in_loop and "att" in cell.layers_in_loop
+    assert_equal(cell.layer_data_templates["enc_ctx"].output.dim, 6)
+    nets[0].initialize_params(session=session)
+    nets[1].layers["output"].set_param_values_by_dict(
+      values_dict=nets[0].layers["output"].get_param_values_dict(session=session), session=session)
+    feed_dict = {
+      nets[0].extern_data.data["data"].placeholder: numpy.random.RandomState(42).normal(size=(n_batch, n_time, n_in)),
+      nets[0].extern_data.data["data"].size_placeholder[0]: [n_time, n_time - 1, n_time - 2]}
+    y1, y2 = session.run(
+      [net.layers["output"].output.get_placeholder_as_batch_major() for net in nets], feed_dict=feed_dict)
+    assert_equal(y1.shape, (n_batch, n_time, n_out))
+    numpy.testing.assert_allclose(y1, y2, rtol=1e-5)
+
+
 def test_reclayer_enc_time_dim_eval():
   """
     line: assert self.placeholder.shape[i].value == self.batch_shape[i]
@@ -3873,6 +3925,83 @@ def test_reclayer_optimize_out_transformer():
   print("Both are equal!")
 
 
+def test_ChoiceLayer_prune_threshold_early_exit_search():
+  n_batch, n_tgt_dim, beam_size, max_seq_len = 3, 7, 12, 20
+  # The output distribution only depends on the prev label. EOS (label 0) is likely as the first label,
+  # but afterwards, the hyps go on with label 1 for a long time.
+  probs = numpy.zeros((n_tgt_dim, n_tgt_dim), dtype="float32")  # prev label -> label
+  probs[0] = [0.6] + [0.4 / (n_tgt_dim - 1)] * (n_tgt_dim - 1)
+  probs[1:] = [1e-4, 0.99] + [(0.01 - 1e-4) / (n_tgt_dim - 2)] * (n_tgt_dim - 2)
+
+  def run_search(length_normalization, **choice_opts):
+    """
+    :param bool length_normalization:
+    :return: (decision labels, num of steps in the rec loop)
+    :rtype: (numpy.ndarray, int)
+    """
+    with make_scope() as session:
+      config = Config({
+        "extern_data": {
+          "data": {"dim": 2, "sparse": True},
+          "classes": {"dim": n_tgt_dim, "sparse": True, "available_for_inference": False}},
+        "debug_print_layer_output_template": True})
+      net = TFNetwork(config=config, search_flag=True, train_flag=False, eval_flag=False)
+      net.construct_from_dict({
+        "output": {
+          "class": "rec", "from": [], "target": "classes", "max_seq_len": max_seq_len, "include_eos": True, "unit": {
+            "output_prob": {"class": "softmax", "from": "prev:output", "target": "classes", "with_bias": False},
+            "output": dict(
+              {"class": "choice", "target": "classes", "beam_size": beam_size, "from": "output_prob",
+               "initial_output": 0, "length_normalization": length_normalization}, **choice_opts),
+            "end": {"class": "compare", "from": "output", "value": 0}}},
+        "decision": {"class": "decide", "from": "output", "is_output_layer": True}})
+      net.initialize_params(session=session)
+      out_prob_layer = net.get_layer("output").cell.net.layers["output_prob"]
+      out_prob_layer.params["W"].load(numpy.log(probs), session=session)
+      out = net.get_layer("decision").output
+      decision, num_steps = session.run(
+        (out.get_placeholder_as_batch_major(), tf.shape(net.get_layer("output").output.placeholder)[0]),
+        feed_dict={
+          net.extern_data.data["data"].placeholder: numpy.zeros((n_batch, 1)),
+          net.extern_data.data["data"].size_placeholder[0]: [1] * n_batch})
+      return decision, num_steps
+
+  for length_normalization in [False, True]:
+    decision, num_steps = run_search(length_normalization=length_normalization)
+    for opts in [{"prune_threshold": 1.5}, {"early_exit": True}, {"prune_threshold": 1.5, "early_exit": True}]:
+      decision_, num_steps_ = run_search(length_normalization=length_normalization, **opts)
+      print("length_normalization %r, %r: %i steps, plain search: %i steps" % (
+        length_normalization, opts, num_steps_, num_steps))
+      if length_normalization and "prune_threshold" not in opts:
+        # With length normalization, the long hyps could still become the best.
+        assert_equal(num_steps_, num_steps)
+      else:
+        assert_less(num_steps_, num_steps)
+      if "prune_threshold" not in opts:
+        # early_exit is exact, i.e. we get the same best hyp. The plain search output is longer, but only padded.
+        numpy.testing.assert_array_equal(decision_, decision[:, :decision_.shape[1]])
+        numpy.testing.assert_array_equal(decision[:, decision_.shape[1]:], 0)
+
+
+def test_ChoiceLayer_early_exit_end_not_dependent():
+  with make_scope():
+    config = Config({
+      "extern_data": {
+        "data": {"dim": 2, "sparse": True},
+        "classes": {"dim": 7, "sparse": True, "available_for_inference": False}}})
+    net = TFNetwork(config=config, search_flag=True, train_flag=False, eval_flag=False)
+    # The end layer only depends on the prev choice, thus the forced end flags would be ignored.
+    net_dict = {
+      "output": {"class": "rec", "from": [], "target": "classes", "max_seq_len": 10, "unit": {
+        "output_prob": {"class": "softmax", "from": "prev:output", "target": "classes"},
+        "output": {
+          "class": "choice", "target": "classes", "beam_size": 4, "from": "output_prob", "initial_output": 0,
+          "early_exit": True},
+        "end": {"class": "compare", "from": "prev:output", "value": 0}}},
+      "decision": {"class": "decide", "from": "output"}}
+    assert_raises(AssertionError, lambda: net.construct_from_dict(net_dict))
+
+
 def test_reclayer_move_out_input_train_and_search():
   from returnn.tf.layers.rec import _SubnetworkRecCell
   n_src_dim = 5
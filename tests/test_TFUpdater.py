@@ -322,6 +322,119 @@ def test_Updater_multiple_optimizers_and_opts():
     session.run(optim_op, feed_dict=feed_dict)
 
 
+@contextlib.contextmanager
+def _fake_horovod_scope():
+  """
+  Horovod with a single instance, where the allreduce is the identity.
+  This is enough to check the graph construction and the grad accumulation logic.
+  """
+  import types
+  import returnn.tf.horovod
+  hvd = types.ModuleType("horovod.tensorflow")
+  hvd.allreduce_outputs = []
+
+  # noinspection PyUnusedLocal
+  def allreduce(tensor, average=None):
+    hvd.allreduce_outputs.append(tf.identity(tensor, name="fake_allreduce"))
+    return hvd.allreduce_outputs[-1]
+
+  hvd.allreduce = allreduce
+  hvd.init = lambda: None
+  hvd.rank = hvd.local_rank = lambda: 0
+  hvd.size = hvd.local_size = lambda: 1
+  horovod = types.ModuleType("horovod")
+  horovod.tensorflow = hvd
+  old_modules = {name: sys.modules.get(name) for name in ["horovod", "horovod.tensorflow"]}
+  sys.modules.update({"horovod": horovod, "horovod.tensorflow": hvd})
+  # noinspection PyProtectedMember
+  old_ctx = (returnn.tf.horovod._is_set_up, returnn.tf.horovod._ctx)
+  returnn.tf.horovod._is_set_up, returnn.tf.horovod._ctx = False, None
+  try:
+    yield hvd
+  finally:
+    returnn.tf.horovod._is_set_up, returnn.tf.horovod._ctx = old_ctx
+    for name, mod in old_modules.items():
+      if mod is None:
+        sys.modules.pop(name, None)
+      else:
+        sys.modules[name] = mod
+
+
+def _train_horovod_accum_grads(use_horovod, num_steps=4, **config_opts):
+  """
+  :param bool use_horovod:
+  :param int num_steps:
+  :return: params after training, and the outputs of the allreduce calls
+  :rtype: (dict[str,dict[str,numpy.ndarray]], list[tf.Tensor])
+  """
+  from returnn.tf.network import TFNetwork, ExternData
+  from returnn.config import Config
+  from returnn.datasets.generating import Task12AXDataset
+  from returnn.tf.data_pipeline import FeedDictDataProvider
+  import returnn.tf.horovod
+  config = Config({
+    "use_horovod": use_horovod, "horovod_reduce_type": "grad", "horovod_grad_bucket_size": 16 * 13 * 4,
+    "accum_grad_multiple_step": 2, "deterministic_train": True})  # plain SGD
+  config.update(config_opts)
+  with make_scope() as session, _fake_horovod_scope() as hvd:
+    assert_equal(bool(returnn.tf.horovod.get_ctx(config=config)), use_horovod)
+    dataset = Task12AXDataset(num_seqs=num_steps)
+    dataset.init_seq_order(epoch=1)
+    extern_data = ExternData()
+    extern_data.init_from_dataset(dataset)
+    network = TFNetwork(extern_data=extern_data, train_flag=True, config=config)
+    network.construct_from_dict({
+      "layer1": {"class": "linear", "activation": "tanh", "n_out": 13},
+      "layer2": {"class": "linear", "activation": "tanh", "n_out": 13, "from": "layer1"},
+      "output": {"class": "softmax", "loss": "ce", "target": "classes", "from": "layer2"}})
+    tf_compat.v1.set_random_seed(42)
+    numpy_rnd = numpy.random.RandomState(42)
+    for param in network.get_params_list():
+      param.load(numpy_rnd.uniform(-0.1, 0.1, size=param.get_shape().as_list()).astype("float32"), session=session)
+    updater = Updater(config=config, network=network)
+    updater.set_learning_rate(0.1, session=session)
+    updater.set_trainable_vars(network.get_trainable_params())
+    updater.init_optimizer_vars(session=session)
+    optim_op = updater.get_optim_op()
+    network.initialize_params(session=session)  # e.g. the accumulation vars
+    batches = dataset.generate_batches(
+      recurrent_net=True, batch_size=100, max_seqs=1, max_seq_length=sys.maxsize,
+      used_data_keys=network.used_data_keys)
+    data_provider = FeedDictDataProvider(
+      tf_session=session, extern_data=extern_data, data_keys=network.used_data_keys, dataset=dataset, batches=batches)
+    for step in range(num_steps):
+      feed_dict, _ = data_provider.get_feed_dict(single_threaded=True)
+      batches.advance(1)
+      session.run(optim_op, feed_dict=feed_dict)
+      network.set_global_train_step(step + 1, session=session)
+    params = {name: layer.get_param_values_dict(session=session) for (name, layer) in network.layers.items()}
+    return params, list(hvd.allreduce_outputs)
+
+
+def test_Updater_horovod_accum_grad_multiple_step():
+  # The grad clipping is on the accumulated grad in both cases.
+  ref_params, _ = _train_horovod_accum_grads(use_horovod=False, gradient_clip=0.05)
+  params, allreduce_outputs = _train_horovod_accum_grads(use_horovod=True, gradient_clip=0.05)
+  # 6 grads (float32), in reverse order, with bucket size 832 bytes:
+  # output b+W and layer2 b (164 bytes), layer2 W and layer1 b (728 bytes), layer1 W (468 bytes).
+  assert_equal(len(allreduce_outputs), 3)
+  assert all(["horovod_allreduce_grads/accum_grad_multiple_step" in x.name for x in allreduce_outputs])
+  for layer_name, layer_params in ref_params.items():
+    for param_name, value in layer_params.items():
+      numpy.testing.assert_allclose(params[layer_name][param_name], value, rtol=1e-5, atol=1e-7)
+
+
+def test_Updater_horovod_accum_grad_multiple_step_global_norm():
+  # The global norm is of the single step, thus the allreduce is done in every step, like without accumulation.
+  ref_params, _ = _train_horovod_accum_grads(use_horovod=False, gradient_clip_global_norm=0.01)
+  params, allreduce_outputs = _train_horovod_accum_grads(use_horovod=True, gradient_clip_global_norm=0.01)
+  assert allreduce_outputs
+  assert not any(["accum_grad_multiple_step" in x.name for x in allreduce_outputs])
+  for layer_name, layer_params in ref_params.items():
+    for param_name, value in layer_params.items():
+      numpy.testing.assert_allclose(params[layer_name][param_name], value, rtol=1e-5, atol=1e-7)
+
+
 if __name__ == "__main__":
   better_exchook.install()
   if len(sys.argv) <= 1:
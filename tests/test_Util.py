@@ -180,6 +180,50 @@ def test_NativeCodeCompiler():
   assert_equal(lib.get_magic(), 42)
 
 
+def test_NativeCodeCompiler_cache_base_dir():
+  import tempfile
+  import shutil
+  tmp_dir = tempfile.mkdtemp()
+  try:
+    NativeCodeCompiler.set_cache_base_dir(tmp_dir)
+    dep_filename = "%s/magic.h" % tmp_dir
+    with open(dep_filename, "w") as f:
+      f.write("#define MAGIC 13\n")
+    code = """
+    #include "magic.h"
+    extern "C" int get_magic() { return MAGIC; }
+    """
+    opts = dict(
+      base_name="test_NativeCodeCompiler_cache", code_version=1, code=code,
+      include_paths=[tmp_dir], include_deps=[dep_filename])
+    native = NativeCodeCompiler(**opts)
+    lib_filename = native.get_lib_filename()
+    assert lib_filename.startswith(tmp_dir + "/")
+    assert_equal(sorted(os.listdir(os.path.dirname(lib_filename))), [
+      "compile.log", "info.py", "test_NativeCodeCompiler_cache.cc", "test_NativeCodeCompiler_cache.so"])
+    lib_mtime = os.path.getmtime(lib_filename)
+    # Same code, e.g. in another process: Use the existing lib, even if the dependency has a newer mtime.
+    os.utime(dep_filename, (lib_mtime + 10, lib_mtime + 10))
+    native = NativeCodeCompiler(**opts)
+    assert not native._need_recompile()
+    assert_equal(native.get_lib_filename(), lib_filename)
+    assert_equal(os.path.getmtime(lib_filename), lib_mtime)
+    # Changed dependency: New hash, thus a new lib.
+    with open(dep_filename, "w") as f:
+      f.write("#define MAGIC 42\n")
+    native = NativeCodeCompiler(**opts)
+    assert native._need_recompile()
+    lib_filename2 = native.get_lib_filename()
+    assert lib_filename2 != lib_filename
+    import ctypes
+    lib = ctypes.cdll.LoadLibrary(lib_filename2)
+    lib.get_magic.restype = ctypes.c_int
+    assert_equal(lib.get_magic(), 42)
+  finally:
+    NativeCodeCompiler.set_cache_base_dir(None)
+    shutil.rmtree(tmp_dir)
+
+
 def test_Stats():
   rnd = numpy.random.RandomState(42)
   m = rnd.uniform(-2., 10., (1000, 3))
@@ -217,6 +261,26 @@ def test_Stats():
   assert_almost_equal(stddev1, 1.)
 
 
+def test_Stats_merge():
+  rnd = numpy.random.RandomState(42)
+  m = rnd.uniform(-2., 10., (1000, 3)) + 1000.
+  stats_parts = [Stats() for _ in range(3)]
+  t = 0
+  while t < len(m):
+    s = int(rnd.uniform(10, 100))
+    stats_parts[rnd.randint(0, 3)].collect(m[t:t + s])
+    t += s
+  stats = Stats()
+  for stats_part in stats_parts:
+    stats.merge(stats_part)
+  stats.merge(Stats())  # empty
+  assert_equal(stats.total_data_len, len(m))
+  assert_almost_equal(stats.get_mean(), numpy.mean(m, axis=0))
+  assert_almost_equal(stats.get_std_dev(), numpy.std(m, axis=0))
+  assert_almost_equal(stats.min, numpy.min(m, axis=0))
+  assert_almost_equal(stats.max, numpy.max(m, axis=0))
+
+
 def test_deepcopy():
   deepcopy({"a": 1, "b": 2, "c": [3, {}, (), [42, True]]})
 
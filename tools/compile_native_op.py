@@ -5,12 +5,17 @@ This explicitly compiles some of the native ops, and will tell you the so-filena
 Normally all native ops (e.g. NativeLstm2 etc) are compiled on-the-fly within RETURNN.
 When you export the computation graph (e.g. via ``compile_tf_graph.py``),
 you explicitly must load these native ops.
+
+This can also be used to fill the native op cache ahead of time,
+e.g. a cache dir shared by multiple nodes (``--cache_dir`` or config option ``native_op_cache_dir``).
+Multiple ops (``--native_op`` with a comma-separated list, or ``--all``) are compiled in parallel.
 """
 
 from __future__ import print_function
 
 import os
 import sys
+import time
 import typing
 
 import _setup_returnn_env  # noqa
@@ -69,7 +74,12 @@ def main(argv):
 
   argparser = argparse.ArgumentParser(description='Compile some op')
   argparser.add_argument('--config', help="filename to config-file")
-  argparser.add_argument('--native_op', help="op name. e.g. 'LstmGenericBase'")
+  argparser.add_argument('--native_op', help="op name. e.g. 'LstmGenericBase'. can be a comma-separated list")
+  argparser.add_argument('--all', action="store_true", help="compile all native ops")
+  argparser.add_argument('--num_workers', type=int, default=None,
+                         help="number of ops to compile in parallel. number of CPUs by default")
+  argparser.add_argument('--cache_dir', default=None,
+                         help="base dir of the native op cache (overwrites the config option native_op_cache_dir)")
   argparser.add_argument('--blas_lib', default=None,
                          help="specify which blas lib to use (path to .so or file name to search for)")
   argparser.add_argument('--search_for_numpy_blas', dest='search_for_numpy_blas', action='store_true',
@@ -79,16 +89,32 @@ def main(argv):
   argparser.add_argument("--verbosity", default=4, type=int, help="5 for all seqs (default: 4)")
   argparser.add_argument("--output_file", help='if given, will write the list of libs to this file')
   args = argparser.parse_args(argv[1:])
+  if args.cache_dir:
+    NativeCodeCompiler.set_cache_base_dir(args.cache_dir)
   init(config_filename=args.config, log_verbosity=args.verbosity)
+  if args.cache_dir:  # the config might have overwritten it
+    NativeCodeCompiler.set_cache_base_dir(args.cache_dir)
 
   import returnn.native_op as native_op
-  from returnn.tf.native_op import make_op, OpMaker
-  if args.native_op:
-    print("Loading native op %r" % args.native_op)
-    op_gen = getattr(native_op, args.native_op)
-    assert issubclass(op_gen, native_op.NativeOpGenBase)
-    make_op(op_gen, compiler_opts={"verbose": True},
-            search_for_numpy_blas=args.search_for_numpy_blas, blas_lib=args.blas_lib)
+  from returnn.tf.native_op import precompile_ops, OpMaker
+  op_gens = []
+  if args.all:
+    op_gens = [
+      op_gen for (_, op_gen) in sorted(vars(native_op).items())
+      if isinstance(op_gen, type) and issubclass(op_gen, native_op.NativeOpGenBase)
+      and op_gen is not native_op.NativeOpGenBase]
+  elif args.native_op:
+    for op_name in args.native_op.split(","):
+      op_gen = getattr(native_op, op_name)
+      assert issubclass(op_gen, native_op.NativeOpGenBase)
+      op_gens.append(op_gen)
+  if op_gens:
+    print("Compiling native ops %s" % ", ".join([op_gen.__name__ for op_gen in op_gens]))
+    start_time = time.time()
+    precompile_ops(
+      op_gens, num_workers=args.num_workers, compiler_opts={"verbose": True},
+      search_for_numpy_blas=args.search_for_numpy_blas, blas_lib=args.blas_lib)
+    print("Compiling took %.1f secs." % (time.time() - start_time))
 
   libs = []
   if OpMaker.with_cuda and OpMaker.tf_blas_gemm_workaround:
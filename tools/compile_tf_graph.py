@@ -668,8 +668,13 @@ def main(argv):
   argparser.add_argument("--output_file", help='allowed extensions: pb, pbtxt, meta, metatxt, logdir')
   argparser.add_argument("--output_file_model_params_list", help="line-based, names of model params")
   argparser.add_argument("--output_file_state_vars_list", help="line-based, name of state vars")
+  argparser.add_argument(
+    "--graph_cache_dir",
+    help="store the graph in this graph cache (see config option graph_cache_dir), e.g. for later search jobs."
+         " use --eval 1 --search 1 for the search task, and --eval 0 for forward")
   args = argparser.parse_args(argv[1:])
   assert args.train in [0, 1, -1] and args.eval in [0, 1] and args.search in [0, 1]
+  assert not (args.graph_cache_dir and (args.train or args.rec_step_by_step)), "graph cache only for inference"
   init(config_filename=args.config, log_verbosity=args.verbosity)
   assert 'network' in config.typed_dict
   net_dict = config.typed_dict["network"]
@@ -689,6 +694,13 @@ def main(argv):
     search_flag = bool(args.search)
     network = create_graph(train_flag=train_flag, eval_flag=eval_flag, search_flag=search_flag, net_dict=net_dict)
 
+    if args.graph_cache_dir:
+      from returnn.tf.graph_cache import GraphCache
+      graph_cache = GraphCache(args.graph_cache_dir)
+      graph_cache.save(
+        graph_cache.get_key(config=config, net_dict=net_dict, eval_flag=eval_flag, search_flag=search_flag),
+        network=network)
+
     if args.rec_step_by_step:
       RecStepByStepLayer.post_compile(
         rec_layer_name=args.rec_step_by_step, network=network, output_file_name=args.rec_step_by_step_output_file)
@@ -69,6 +69,20 @@ def dump_dataset(dataset, options):
     print("Done.")
     return
 
+  if options.stats_num_workers > 1:
+    assert options.type == "null" and (options.stats or options.dump_stats), (
+      "--stats_num_workers only with --type null and --stats or --dump_stats")
+    from returnn.datasets.normalization_data import collect_dataset_stats
+    print("Collect stats with %i workers." % options.stats_num_workers, file=log.v3)
+    start_time = time.time()
+    stats = collect_dataset_stats(
+      dataset, key=options.key, epoch=options.epoch,
+      start_seq=options.startseq, end_seq=options.endseq if options.endseq >= 0 else float("inf"),
+      num_workers=options.stats_num_workers)
+    print("Done. Total time %s." % hms_fraction(time.time() - start_time), file=log.v2)
+    stats.dump(output_file_prefix=options.dump_stats, stream_prefix="Data %r " % options.key, stream=log.v1)
+    return
+
   dump_file = None
   if options.type == "numpy":
     print("Dump files: %r*%r" % (options.dump_prefix, options.dump_postfix), file=log.v3)
@@ -260,6 +274,9 @@ def main():
   argparser.add_argument("--key", default="data", help="data-key, e.g. 'data' or 'classes'. (default: 'data')")
   argparser.add_argument('--stats', action="store_true", help="calculate mean/stddev stats")
   argparser.add_argument('--dump_stats', help="file-prefix to dump stats to")
+  argparser.add_argument(
+    '--stats_num_workers', type=int, default=1,
+    help="collect stats in parallel over disjoint subsets of the seqs (only with --type null)")
   args = argparser.parse_args()
   init(config_str=args.returnn_config, config_dataset=args.dataset, verbosity=args.verbosity)
   try:
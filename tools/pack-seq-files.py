@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+"""
+Converts datasets which are stored as one file per seq
+into the packed seqs container format (see :class:`PackedSeqsFile`),
+i.e. one big data file plus an index, which can then be read via mmap.
+
+Supported input layouts:
+
+* ``numpy_dump``: the files of :class:`NumpyDumpDataset` (``<prefix>%i.data<postfix>``, ``<prefix>%i.targets<postfix>``)
+* ``raw_wav``: the list file of :class:`RawWavDataset` (one wav file per line)
+
+Afterwards, use the dataset with the ``packed_file`` option.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+from argparse import ArgumentParser
+import numpy
+import _setup_returnn_env  # noqa
+from returnn.datasets.numpy_dump import NumpyDumpDataset, PackedSeqsWriter
+from returnn.util.basic import hms
+
+
+def iter_numpy_dump(prefix, postfix, start_seq=0):
+  """
+  :param str prefix:
+  :param str postfix:
+  :param int start_seq:
+  :return: yields (seq_tag, features)
+  :rtype: typing.Iterator[(str,dict[str,numpy.ndarray])]
+  """
+  seq_idx = start_seq
+  while True:
+    data_fn = prefix + NumpyDumpDataset.file_format_data % seq_idx + postfix
+    targets_fn = prefix + NumpyDumpDataset.file_format_targets % seq_idx + postfix
+    if not os.path.exists(data_fn) or not os.path.exists(targets_fn):
+      break
+    features = numpy.loadtxt(data_fn, ndmin=2)
+    targets = numpy.loadtxt(targets_fn, ndmin=1)
+    yield "seq-%i" % seq_idx, {"data": features, "classes": targets}
+    seq_idx += 1
+
+
+def iter_raw_wav(list_file):
+  """
+  :param str list_file:
+  :return: yields (seq_tag, features), where the seq tag is the wav filename
+  :rtype: typing.Iterator[(str,dict[str,numpy.ndarray])]
+  """
+  import scipy.io.wavfile
+  with open(list_file, "r") as f:
+    for line in f:
+      wav_filename = line.strip()
+      if not wav_filename:
+        continue
+      _, signal = scipy.io.wavfile.read(wav_filename)
+      yield wav_filename, {"data": signal.astype(numpy.float32)}
+
+
+def main():
+  """
+  Main entry.
+  """
+  arg_parser = ArgumentParser(description=__doc__)
+  arg_parser.add_argument("--type", required=True, help="numpy_dump or raw_wav")
+  arg_parser.add_argument("--prefix", help="numpy_dump: file prefix")
+  arg_parser.add_argument("--postfix", default=".txt.gz", help="numpy_dump: file postfix")
+  arg_parser.add_argument("--start_seq", type=int, default=0, help="numpy_dump: first seq idx")
+  arg_parser.add_argument("--list_file", help="raw_wav: file with one wav file per line")
+  arg_parser.add_argument("--out", required=True, help="packed data file. the index will be <out>.index.npz")
+  args = arg_parser.parse_args()
+
+  if args.type == "numpy_dump":
+    assert args.prefix, "need --prefix"
+    seqs = iter_numpy_dump(prefix=args.prefix, postfix=args.postfix, start_seq=args.start_seq)
+  elif args.type == "raw_wav":
+    assert args.list_file, "need --list_file"
+    seqs = iter_raw_wav(list_file=args.list_file)
+  else:
+    raise Exception("unknown --type %r" % args.type)
+
+  start_time = time.time()
+  writer = PackedSeqsWriter(args.out)
+  for seq_tag, features in seqs:
+    writer.add_seq(features=features, seq_tag=seq_tag)
+    if len(writer.seq_tags) % 1000 == 0:
+      print("%i seqs, %i bytes, %s" % (len(writer.seq_tags), writer.pos, hms(time.time() - start_time)))
+  writer.close()
+  print("Done. Wrote %i seqs, %i bytes, to %r." % (len(writer.seq_tags), writer.pos, args.out))
+
+
+if __name__ == "__main__":
+  from returnn.util import better_exchook
+  better_exchook.install()
+  try:
+    main()
+  except KeyboardInterrupt:
+    print("KeyboardInterrupt")
+    sys.exit(1)
@@ -34,6 +34,7 @@ import tensorflow as tf
 
 import _setup_returnn_env  # noqa
 import returnn.tf.compat as tf_compat
+from returnn.tf.network import CustomCheckpointLoader
 from returnn.util import better_exchook
 
 better_exchook.install()
@@ -53,6 +54,12 @@ flags.DEFINE_string(
 flags.DEFINE_string(
   "output_path", "/tmp/averaged.ckpt",
   "Path to output the averaged checkpoint to.")
+flags.DEFINE_integer(
+  "num_threads", 8,
+  "Number of threads to read the variables concurrently.")
+flags.DEFINE_integer(
+  "max_group_bytes", 2 ** 28,
+  "The averaged tensors are assigned in groups of at most this size, to bound the memory consumption.")
 
 
 def checkpoint_exists(path):
@@ -96,43 +103,45 @@ def main(_):
       raise ValueError("Could not find checkpoints at %s" % os.path.dirname(FLAGS.prefix))
 
   # Read variables from all checkpoints and average them.
+  # We go tensor by tensor, and the CustomCheckpointLoader reads them concurrently (one reader per thread)
+  # and assigns the averaged values in groups of at most max_group_bytes,
+  # such that we never have the whole model in memory.
   tf_compat.v1.logging.info("Reading variables and averaging checkpoints:")
   for c in checkpoints:
     tf_compat.v1.logging.info("%s ", c)
   var_list = tf.train.list_variables(checkpoints[0])
-  var_values, var_dtypes = {}, {}
-  for (name, shape) in var_list:
-    var_values[name] = numpy.zeros(shape)
-  for checkpoint in checkpoints:
-    reader = tf.train.load_checkpoint(checkpoint)
-    for name in var_values:
-      tensor = reader.get_tensor(name)
-      if not isinstance(tensor, numpy.ndarray):  # e.g. int (scalar)
-        tensor = numpy.array(tensor)
-      assert isinstance(tensor, numpy.ndarray)
-      var_dtypes[name] = tensor.dtype
-      if isinstance(tensor.dtype, numpy.integer):
-        var_values[name] = tensor  # just take last
-      else:
-        var_values[name] += tensor
-    tf_compat.v1.logging.info("Read from checkpoint %s", checkpoint)
-  for name in var_values:  # Average.
-    if not isinstance(var_dtypes[name], numpy.integer):
-      var_values[name] /= len(checkpoints)
+  var_dtypes = tf.train.load_checkpoint(checkpoints[0]).get_variable_to_dtype_map()
 
   with tf_compat.v1.variable_scope(tf_compat.v1.get_variable_scope(), reuse=tf_compat.v1.AUTO_REUSE):
     tf_vars = [
-      tf_compat.v1.get_variable(v, shape=var_values[v].shape, dtype=var_dtypes[v])
-      for v in var_values]
-  placeholders = [tf_compat.v1.placeholder(v.dtype, shape=v.shape) for v in tf_vars]
-  assign_ops = [tf_compat.v1.assign(v, p) for (v, p) in zip(tf_vars, placeholders)]
+      tf_compat.v1.get_variable(name, shape=shape, dtype=var_dtypes[name])
+      for (name, shape) in var_list]
+  var_names = {tf_var.name: name for (tf_var, (name, _)) in zip(tf_vars, var_list)}
   saver = tf_compat.v1.train.Saver(tf_compat.v1.all_variables())
+  loaders = [
+    CustomCheckpointLoader(
+      filename=c, saveable_params=tf_vars, num_threads=FLAGS.num_threads, max_group_bytes=FLAGS.max_group_bytes)
+    for c in checkpoints]
+
+  def get_averaged_value(tf_var):
+    """
+    :param tf.Variable tf_var:
+    :rtype: numpy.ndarray
+    """
+    name = var_names[tf_var.name]
+    last = numpy.asarray(loaders[-1].get_thread_reader().get_tensor(name))  # e.g. int (scalar)
+    if not numpy.issubdtype(last.dtype, numpy.floating):
+      return last  # just take last, e.g. global_step
+    value = last.astype("float64")
+    for loader in loaders[:-1]:
+      value += loader.get_thread_reader().get_tensor(name)
+    value /= len(loaders)
+    return value.astype(last.dtype)
 
   # Build a model consisting only of variables, set them to the average values.
   with tf_compat.v1.Session() as sess:
     sess.run(tf_compat.v1.global_variables_initializer())
-    for p, assign_op, (name, value) in zip(placeholders, assign_ops, var_values.items()):
-      sess.run(assign_op, {p: value})
+    loaders[-1].read_and_assign_grouped(session=sess, variables=tf_vars, read_value=get_averaged_value)
     # Use the built saver to save the averaged checkpoint.
     saver.save(sess, FLAGS.output_path)
 